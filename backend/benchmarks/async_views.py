@@ -0,0 +1,147 @@
+"""
+Concurrency of the sync DRF data views vs. the async views under ASGI.
+
+Fires --concurrency simultaneous requests per round at EEGDataView /
+SPECDataView / PredictEEG (patient_id path) over synthetic recordings. The sync
+views are driven the way Django's ASGI handler drives them (sync_to_async with
+thread_sensitive=True); the async views are awaited directly.
+
+--io-latency-ms adds a sleep to every array load to stand in for cold-cache
+or network storage, where the single sync thread hurts most.
+
+Run from backend/:
+    python -m benchmarks.async_views [--concurrency 100] [--rounds 2] [--io-latency-ms 0 10]
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hms_backend.settings")
+
+import argparse
+import asyncio
+import contextlib
+import logging
+import tempfile
+import time
+from unittest import mock
+
+import django
+
+django.setup()
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.test import AsyncRequestFactory
+
+from benchmarks.fixtures import stub_model
+from eeg_app import async_views, views
+from eeg_app.http_cache import ResponseCache
+from intelligence import storage
+from intelligence.feature_store import FeatureStore
+
+
+def make_fixtures(root, n_patients, rng):
+    eeg_dir, spec_dir = os.path.join(root, "eeg"), os.path.join(root, "spec")
+    os.makedirs(eeg_dir)
+    os.makedirs(spec_dir)
+    for pid in range(n_patients):
+        np.save(os.path.join(eeg_dir, f"{pid}.npy"), rng.standard_normal((19, 2500)).astype(np.float32) * 50)
+        np.save(os.path.join(spec_dir, f"{pid}.npy"), rng.random((128, 256, 4), dtype=np.float32))
+    return eeg_dir, spec_dir
+
+
+def sync_caller(view_class):
+    view = view_class.as_view()
+
+    def call(request, **kwargs):
+        response = view(request, **kwargs)
+        return response.render() if hasattr(response, "render") else response
+    return sync_to_async(call, thread_sensitive=True)
+
+
+def async_caller(view_class):
+    return view_class.as_view()
+
+
+async def run_round(call, make_request, concurrency):
+    latencies = []
+
+    async def one(i):
+        request, kwargs = make_request(i)
+        start = time.perf_counter()
+        response = await call(request, **kwargs)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.content[:200]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+
+async def bench(name, call, make_request, concurrency, rounds):
+    await run_round(call, make_request, min(concurrency, 8))  # warm-up
+    walls, latencies = [], []
+    for _ in range(rounds):
+        wall, lat = await run_round(call, make_request, concurrency)
+        walls.append(wall)
+        latencies.extend(lat)
+    total = concurrency * rounds
+    lat_ms = np.array(latencies) * 1e3
+    print(f"{name:<28}{total / sum(walls):>10.1f} req/s{np.percentile(lat_ms, 50):>10.1f}"
+          f"{np.percentile(lat_ms, 99):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--io-latency-ms", type=float, nargs="+", default=[0.0, 10.0])
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    factory = AsyncRequestFactory()
+    n = args.patients
+    endpoints = [
+        ("eeg", views.EEGDataView, async_views.AsyncEEGDataView,
+         lambda i: (factory.get(f"/eeg/data/{i % n}/"), {"patient_id": str(i % n)})),
+        ("spec", views.SPECDataView, async_views.AsyncSPECDataView,
+         lambda i: (factory.get(f"/eeg/spec/{i % n}/"), {"patient_id": str(i % n)})),
+        ("predict", views.PredictEEG, async_views.AsyncPredictEEG,
+         lambda i: (factory.post("/eeg/predict/", {"patient_id": str(i % n)}, content_type="application/json"), {})),
+    ]
+
+    with tempfile.TemporaryDirectory() as root:
+        rng = np.random.default_rng(0)
+        eeg_dir, spec_dir = make_fixtures(root, n, rng)
+        manager = stub_model(rng)
+        real_load = storage.load_array
+
+        for latency in args.io_latency_ms:
+            def slow_load(path, mmap=False):
+                if latency:
+                    time.sleep(latency / 1e3)
+                return real_load(path, mmap=mmap)
+
+            # Fresh feature store each time so the predict path extracts features once per patient
+            store = FeatureStore(os.path.join(root, f"features-{latency}"))
+            with contextlib.ExitStack() as stack:
+                stack.enter_context(mock.patch.object(views, "EEG_DATA_PATH", eeg_dir))
+                stack.enter_context(mock.patch.object(views, "SPEC_DATA_PATH", spec_dir))
+                stack.enter_context(mock.patch.object(views, "load_array", slow_load))
+                stack.enter_context(mock.patch.object(views, "feature_store", store))
+                stack.enter_context(mock.patch.object(views, "xgb_model_manager", manager))
+                stack.enter_context(mock.patch.object(views, "response_cache",
+                                                      ResponseCache(os.path.join(root, f"responses-{latency}"))))
+
+                print(f"\nconcurrency {args.concurrency}, io latency {latency:g} ms, "
+                      f"executor {async_views.executor._max_workers} threads")
+                print(f"{'endpoint':<28}{'throughput':>14}{'p50 ms':>10}{'p99 ms':>10}")
+                for name, sync_view, async_view, make_request in endpoints:
+                    asyncio.run(bench(f"{name} sync", sync_caller(sync_view), make_request,
+                                      args.concurrency, args.rounds))
+                    asyncio.run(bench(f"{name} async", async_caller(async_view), make_request,
+                                      args.concurrency, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
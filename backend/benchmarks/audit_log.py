@@ -0,0 +1,122 @@
+"""
+Cost of persisting predictions: per-row inserts vs. the buffered audit log.
+
+On a SQLite file (a temp test database, never db.sqlite3), in the rollback
+journal mode SQLite defaults to and in the WAL mode SQLITE_WAL=1 configures:
+
+1. request path: one PredictionRecord.objects.create per prediction (what a
+   synchronous audit would cost each request) vs. AuditLog.record_prediction;
+2. writer: rows per second through AuditLog.flush (bulk_create);
+3. history: a page of prediction_history_payload for one patient among
+   --patients, first page and --depth rows deep, with SQLite's query plan.
+
+Run from backend/:
+    python -m benchmarks.audit_log [--rows 20000] [--per-row 500] [--patients 100] [--depth 150]
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hms_backend.settings")
+
+import django
+
+django.setup()
+
+import argparse
+import logging
+import tempfile
+import time
+
+from django.db import connection
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+
+from eeg_app.audit import AuditLog
+from eeg_app.models import PredictionRecord
+from eeg_app.views import prediction_history_payload
+
+MODES = {
+    "delete/full": "PRAGMA journal_mode=DELETE; PRAGMA synchronous=FULL;",
+    "wal/normal": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;",
+}
+PAYLOAD = {"model": "XGBoost", "input_method": "patient_id",
+           "result": {"predicted_class": "Seizure", "confidence": 0.91,
+                      "probabilities": {"Seizure": 0.91, "LPD": 0.03, "GPD": 0.02, "LRDA": 0.02, "GRDA": 0.01,
+                                        "Other": 0.01}}}
+
+
+def use_mode(init_command):
+    connection.close()
+    connection.settings_dict["OPTIONS"]["init_command"] = init_command
+    connection.ensure_connection()
+
+
+def per_row(n, patients):
+    start = time.perf_counter()
+    for i in range(n):
+        result = PAYLOAD["result"]
+        PredictionRecord.objects.create(patient_id=f"p{i % patients}", model="XGBoost", input_method="patient_id",
+                                        predicted_class=result["predicted_class"], confidence=result["confidence"],
+                                        probabilities=result["probabilities"], created_at=timezone.now())
+    return (time.perf_counter() - start) / n
+
+
+def buffered(n, patients):
+    log = AuditLog(flush_interval=3600, batch_size=10 ** 9, max_pending=10 ** 9)
+    start = time.perf_counter()
+    for i in range(n):
+        log.record_prediction(PAYLOAD, f"p{i % patients}")
+    record = (time.perf_counter() - start) / n
+    start = time.perf_counter()
+    written = log.flush()
+    rate = written / (time.perf_counter() - start)
+    log.close()
+    return record, rate
+
+
+def history(patient_id, depth, repeat=50):
+    query = {"limit": "50"}
+    if depth:
+        before = PredictionRecord.objects.filter(patient_id=patient_id).order_by("-id") \
+            .values_list("id", flat=True)[min(depth, PredictionRecord.objects.filter(patient_id=patient_id).count() - 1)]
+        query["before"] = str(before)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        prediction_history_payload(patient_id, query)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="rows written through the audit log")
+    parser.add_argument("--per-row", type=int, default=500, help="rows inserted one by one")
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=150, help="rows into one patient's history for the deep page")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    setup_test_environment()
+    directory = tempfile.mkdtemp()
+    connection.settings_dict["TEST"]["NAME"] = os.path.join(directory, "audit.sqlite3")
+    old_db = connection.creation.create_test_db(verbosity=0)
+    try:
+        print(f"{'journal':<13}{'create() us':>12}{'record() us':>12}{'bulk rows/s':>13}"
+              f"{'page 1 ms':>11}{'deep page ms':>14}")
+        for name, init_command in MODES.items():
+            use_mode(init_command)
+            PredictionRecord.objects.all().delete()
+            create = per_row(args.per_row, args.patients)
+            record, rate = buffered(args.rows, args.patients)
+            first, deep = history("p7", 0), history("p7", args.depth)
+            print(f"{name:<13}{create * 1e6:>12.0f}{record * 1e6:>12.1f}{rate:>13,.0f}{first * 1e3:>11.3f}{deep * 1e3:>14.3f}")
+
+        rows = PredictionRecord.objects.filter(patient_id="p7", id__lt=10 ** 9).order_by("-id")[:50]
+        with connection.cursor() as cursor:
+            sql, params = rows.query.sql_with_params()
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            print("\nhistory page plan:", "; ".join(row[-1] for row in cursor.fetchall()))
+    finally:
+        connection.creation.destroy_test_db(old_db, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
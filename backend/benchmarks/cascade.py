@@ -0,0 +1,33 @@
+"""
+The prediction cascade on synthetic data: a stub booster trained on labelled
+synthetic EEG, calibrated on held-out recordings with
+intelligence.models.XGBoost.cascade, reporting the share answered by the
+screening stage, agreement with the full model and predict throughput.
+
+Run from backend/:
+    python -m benchmarks.cascade [--rounds-total 200] [--recordings 1000] [--agreement 0.995]
+"""
+import argparse
+import logging
+
+from benchmarks.fixtures import labelled_eeg, trained_stub_manager
+from intelligence.models.XGBoost.cascade import evaluate, print_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds-total", type=int, default=200, help="boosting rounds of the stub model")
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--recordings", type=int, default=1000, help="held-out recordings to calibrate on")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[5, 10, 20, 50])
+    parser.add_argument("--agreement", type=float, default=0.995)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    manager = trained_stub_manager(args.rounds_total, args.depth, n_train=600)
+    recordings, _ = labelled_eeg(args.recordings, seed=1)
+    print_rows(evaluate(manager, recordings, args.rounds, args.agreement), args.rounds_total)
+
+
+if __name__ == "__main__":
+    main()
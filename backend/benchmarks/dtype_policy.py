@@ -0,0 +1,85 @@
+"""
+float32 vs float64 on the dense paths: feature extraction, EEG serialization
+for EEGDataView and spectrogram generation.
+
+Run from backend/:
+    python -m benchmarks.dtype_policy [--repeat 50]
+
+Reports mean time per call and peak traced memory (tracemalloc) per call.
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from eeg_app.spectrogram_generator import spectrogram_from_eeg_npy
+from intelligence.models.XGBoost.xgboost import XGBoostModelManager
+
+CHANNELS = ["Fp1", "Fp2", "Fz", "Cz", "Pz", "F3", "F4", "F7", "F8", "C3", "C4", "P3", "P4", "T3", "T4", "T5", "T6", "O1", "O2"]
+
+
+def serialize_boxed(eeg):
+    """EEGDataView before the float32 policy: one float() per sample and channel"""
+    return [{CHANNELS[i]: float(sample[i]) for i in range(len(CHANNELS))} for sample in eeg.T]
+
+
+def serialize_tolist(eeg):
+    return [dict(zip(CHANNELS, sample)) for sample in eeg.T.tolist()]
+
+
+def measure(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    eeg64 = rng.standard_normal((19, 10000)) * 80 + rng.uniform(-300, 300, (19, 1))
+    eeg32 = eeg64.astype(np.float32)
+    manager = XGBoostModelManager(load=False)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {}
+        for name, eeg in (("float64", eeg64), ("float32", eeg32)):
+            paths[name] = os.path.join(tmp, f"{name}.npy")
+            np.save(paths[name], eeg)
+
+        def spectrogram(path):
+            with contextlib.redirect_stdout(io.StringIO()):
+                spectrogram_from_eeg_npy(path, output_dir=os.path.join(tmp, "spec"))
+
+        cases = [
+            ("extract_features", "float64", lambda: manager.extract_features(eeg64, dtype=np.float64)),
+            ("extract_features", "float32", lambda: manager.extract_features(eeg32)),
+            ("eeg serialization", "boxed f64", lambda: serialize_boxed(eeg64)),
+            ("eeg serialization", "tolist f32", lambda: serialize_tolist(eeg32)),
+            ("spectrogram", "float64 file", lambda: spectrogram(paths["float64"])),
+            ("spectrogram", "float32 file", lambda: spectrogram(paths["float32"])),
+        ]
+
+        print(f"array in memory: float64 {eeg64.nbytes / 1024:.0f} KiB, float32 {eeg32.nbytes / 1024:.0f} KiB")
+        print(f"{'path':<20}{'variant':<14}{'time/call':>12}{'peak':>14}")
+        for path, variant, fn in cases:
+            elapsed, peak = measure(fn, args.repeat)
+            print(f"{path:<20}{variant:<14}{elapsed * 1e3:>9.2f} ms{peak / 1024:>10.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
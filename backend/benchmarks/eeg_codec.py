@@ -0,0 +1,86 @@
+"""
+EEG archive encodings: float32 .npy vs. the int16 chunked codec.
+
+For a one-hour and a standard 2500-sample synthetic recording, reports the
+compression ratio, encode time, full decode time and throughput (float32
+bytes out per second) warm and cold (page cache dropped with
+POSIX_FADV_DONTNEED before each read, where supported), the time to read a
+10 s window, and the measured max abs error against the codec's bound.
+
+Run from backend/:
+    python -m benchmarks.eeg_codec [--repeat 5] [--hours 1]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fixtures import SAMPLE_RATE, synthetic_eeg
+from intelligence import eeg_codec
+from intelligence.storage import load_array, load_range, save_array
+
+VARIANTS = [
+    ("float32 .npy", None),
+    ("int16", {}),
+    ("int16 zlib", {"compressor": "zlib"}),
+    ("int16 <=0.05uV zlib", {"compressor": "zlib", "max_error": 0.05}),
+    ("int16 <=0.5uV zlib", {"compressor": "zlib", "max_error": 0.5}),
+]
+
+
+def drop_cache(path):
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def timed(fn, repeat, before=None):
+    times = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def run(eeg, path, repeat):
+    window = (eeg.shape[1] // 2, eeg.shape[1] // 2 + 10 * SAMPLE_RATE)
+    print(f"\n{eeg.shape[0]} x {eeg.shape[1]} recording ({eeg.nbytes / 2 ** 20:.1f} MiB as float32)")
+    print(f"{'encoding':<22}{'ratio':>7}{'encode ms':>11}{'warm ms':>10}{'warm MB/s':>11}{'cold ms':>10}"
+          f"{'10s ms':>9}{'max err':>11}{'bound':>11}")
+    for name, options in VARIANTS:
+        start = time.perf_counter()
+        save_array(path, eeg, compress=options is not None, **(options or {}))
+        encode = time.perf_counter() - start
+        decoded = load_array(path)
+        error = float(np.abs(decoded - eeg).max())
+        bound = eeg_codec.CompressedArray(path).max_error if options is not None else 0.0
+        warm = timed(lambda: load_array(path), repeat)
+        cold = timed(lambda: load_array(path), repeat, before=lambda: drop_cache(path))
+        ranged = timed(lambda: load_range(path, *window), repeat)
+        print(f"{name:<22}{eeg.nbytes / os.path.getsize(path):>7.2f}{encode * 1e3:>11.1f}{warm * 1e3:>10.2f}"
+              f"{eeg.nbytes / warm / 1e6:>11.0f}{cold * 1e3:>10.2f}{ranged * 1e3:>9.3f}{error:>11.2e}{bound:>11.2e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--hours", type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "0.npy")
+        for length in (int(args.hours * 3600 * SAMPLE_RATE), 2500):
+            run(synthetic_eeg(0, length=length), path, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Planned (lazy) vs. full feature extraction on the predict path.
+
+For the shipped model when xgboost_model.pkl loads, and for stub boosters of
+different sparsity, reports how many of the 251 features the trees split on,
+extract_features time with the full and the compiled plan, and predict time,
+and checks that the probabilities are bit-identical.
+
+Run from backend/:
+    python -m benchmarks.feature_plan [--repeat 100] [--recordings 50]
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from benchmarks.fixtures import stub_model, synthetic_eeg, trained_stub_manager
+from intelligence.models.XGBoost.xgboost import FULL_PLAN, XGBoostModelManager
+
+
+def per_call(fn, repeat, trials=5):
+    """Best of ``trials`` mean times, which filters out scheduler noise"""
+    fn()
+    best = float("inf")
+    for _ in range(trials):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--recordings", type=int, default=50, help="recordings checked for identical output")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    models = []
+    shipped = XGBoostModelManager()
+    if shipped.is_loaded:
+        models.append(("xgboost_model.pkl", shipped))
+    models += [
+        ("stub 3 rounds depth 2", trained_stub_manager(3, 2)),
+        ("stub 10 rounds depth 3", trained_stub_manager(10, 3)),
+        ("stub 30 rounds depth 4", trained_stub_manager(30, 4)),
+        ("stub random 100 x d6", stub_model(np.random.default_rng(0))),
+    ]
+    recordings = [synthetic_eeg(1000 + i) for i in range(args.recordings)]
+    eeg = recordings[0]
+
+    print(f"{'model':<26}{'features':>9}{'channels':>9}{'full ms':>9}{'plan ms':>9}{'saved':>8}"
+          f"{'predict ms':>12}{'(full)':>9}{'identical':>11}")
+    for name, manager in models:
+        plan = manager.feature_plan()
+        full = per_call(lambda: manager.extract_features(eeg), args.repeat)
+        planned = per_call(lambda: manager.extract_features(eeg, plan=plan), args.repeat)
+        predict = per_call(lambda: manager.predict(eeg), args.repeat)
+        manager._plan = FULL_PLAN  # the model object is unchanged, so feature_plan() keeps this
+        predict_full = per_call(lambda: manager.predict(eeg), args.repeat)
+        reference = [manager.predict(x)["probabilities"] for x in recordings]
+        manager._plan = plan
+        identical = all(manager.predict(x)["probabilities"] == ref for x, ref in zip(recordings, reference))
+        print(f"{name:<26}{len(plan):>9}{len(plan.channels):>9}{full * 1e3:>9.3f}{planned * 1e3:>9.3f}"
+              f"{(full - planned) / full * 100:>7.0f}%{predict * 1e3:>12.3f}{predict_full * 1e3:>9.3f}"
+              f"{'yes' if identical else 'NO':>11}")
+
+
+if __name__ == "__main__":
+    main()
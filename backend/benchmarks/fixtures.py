@@ -0,0 +1,108 @@
+"""
+Deterministic synthetic inputs for the benchmarks: 19-channel EEG, raw
+recordings for the preprocessing chains, (128, 256, 4) spectrograms and a small
+stub booster standing in for xgboost_model.pkl.
+
+Everything is a function of the seed, so two runs (and two machines) time the
+same data.
+"""
+import os
+from typing import Tuple
+
+import numpy as np
+import polars as pl
+import xgboost as xgb
+from sklearn.preprocessing import LabelEncoder
+
+from intelligence.dataset import CLASSES
+from intelligence.models.XGBoost.xgboost import XGBoostModelManager
+
+SAMPLE_RATE = 200
+CHANNELS = ["Fp1", "Fp2", "Fz", "Cz", "Pz", "F3", "F4", "F7", "F8", "C3", "C4", "P3", "P4", "T3", "T4", "T5", "T6", "O1", "O2"]
+BANDS_HZ = (2.0, 6.0, 10.0, 20.0)  # delta, theta, alpha, beta
+
+
+def synthetic_eeg(seed: int, channels: int = 19, length: int = 2500, fs: int = SAMPLE_RATE) -> np.ndarray:
+    """(channels, length) float32 in microvolts: band rhythms with random phases plus noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(length) / fs
+    amplitudes = rng.uniform(5, 40, (channels, len(BANDS_HZ), 1))
+    phases = rng.uniform(0, 2 * np.pi, (channels, len(BANDS_HZ), 1))
+    rhythms = (amplitudes * np.sin(2 * np.pi * np.array(BANDS_HZ)[:, None] * t + phases)).sum(axis=1)
+    return (rhythms + rng.standard_normal((channels, length)) * 10).astype(np.float32)
+
+
+def synthetic_recording(seed: int, length: int = 10000) -> pl.DataFrame:
+    """A raw recording as read from parquet: the 19 EEG columns and EKG, float32"""
+    eeg = synthetic_eeg(seed, length=length)
+    rng = np.random.default_rng(seed + 1)
+    t = np.arange(length) / SAMPLE_RATE
+    ekg = (200 * np.sin(2 * np.pi * 1.2 * t) ** 15 + rng.standard_normal(length) * 5).astype(np.float32)
+    return pl.DataFrame({**{name: eeg[i] for i, name in enumerate(CHANNELS)}, "EKG": ekg})
+
+
+def synthetic_spectrogram(seed: int) -> np.ndarray:
+    """(128, 256, 4) float32 in [0, 1], as spectrogram_generator writes them"""
+    rng = np.random.default_rng(seed)
+    falloff = np.linspace(1.0, 0.2, 128, dtype=np.float32)[:, None, None]
+    return np.clip(falloff * rng.random((128, 256, 4), dtype=np.float32), 0, 1)
+
+
+def write_patients(root: str, n_patients: int, seed: int = 0) -> Tuple[str, str]:
+    """``<root>/eeg/<id>.npy`` and ``<root>/spec/<id>.npy`` for patient ids 0..n-1"""
+    eeg_dir, spec_dir = os.path.join(root, "eeg"), os.path.join(root, "spec")
+    os.makedirs(eeg_dir, exist_ok=True)
+    os.makedirs(spec_dir, exist_ok=True)
+    for pid in range(n_patients):
+        np.save(os.path.join(eeg_dir, f"{pid}.npy"), synthetic_eeg(seed + pid))
+        np.save(os.path.join(spec_dir, f"{pid}.npy"), synthetic_spectrogram(seed + pid))
+    return eeg_dir, spec_dir
+
+
+def stub_model(rng) -> XGBoostModelManager:
+    """Manager with a small booster on random features, so predict does real inference"""
+    manager = XGBoostModelManager(load=False)
+    X = rng.standard_normal((500, len(manager.feature_names)))
+    y = rng.integers(0, len(CLASSES), len(X))
+    manager.model = xgb.train({'objective': 'multi:softprob', 'num_class': len(CLASSES), 'max_depth': 6,
+                               'tree_method': 'hist', 'seed': 0}, xgb.DMatrix(X, label=y), num_boost_round=100)
+    manager.label_encoder = LabelEncoder().fit(CLASSES)
+    manager.config = {'classes': CLASSES}
+    manager.is_loaded = True
+    return manager
+
+
+def stub_manager(seed: int = 0) -> XGBoostModelManager:
+    """``stub_model`` from a seed: an importable factory for inference pool workers"""
+    return stub_model(np.random.default_rng(seed))
+
+
+def labelled_eeg(n: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (n, 19, 2500) recordings and their class indices, three quarters "Other".
+    Other classes add a periodic spike train of random strength to the channel
+    with the class's index, so most recordings are easy and some are not.
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.full(len(CLASSES), 0.25 / (len(CLASSES) - 1))
+    weights[CLASSES.index("Other")] = 0.75
+    y = rng.choice(len(CLASSES), n, p=weights)
+    eeg = np.stack([synthetic_eeg(seed * 100003 + i) for i in range(n)])
+    spikes = np.zeros(eeg.shape[-1], dtype=np.float32)
+    spikes[::SAMPLE_RATE // 2] = 1
+    for i in np.flatnonzero(y != CLASSES.index("Other")):
+        eeg[i, y[i]] += rng.uniform(0, 300) * spikes
+    return eeg, y
+
+
+def trained_stub_manager(rounds: int, max_depth: int, n_train: int = 300, seed: int = 0) -> XGBoostModelManager:
+    """Manager with a booster trained on real features of ``labelled_eeg``, so confidence means something"""
+    manager = XGBoostModelManager(load=False)
+    eeg, y = labelled_eeg(n_train, seed)
+    X = np.stack([manager.extract_features(x) for x in eeg])
+    manager.model = xgb.train({'objective': 'multi:softprob', 'num_class': len(CLASSES), 'max_depth': max_depth,
+                               'tree_method': 'hist', 'seed': 0}, xgb.DMatrix(X, label=y), num_boost_round=rounds)
+    manager.label_encoder = LabelEncoder().fit(CLASSES)
+    manager.config = {'classes': CLASSES}
+    manager.is_loaded = True
+    return manager
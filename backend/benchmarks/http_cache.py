@@ -0,0 +1,79 @@
+"""
+Cost of serving EEGDataView / SPECDataView with and without the encoded
+response cache: a full build (cold), a cache hit per encoding, and a 304
+revalidation.
+
+Run from backend/:
+    python -m benchmarks.http_cache [--repeat 20]
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hms_backend.settings")
+
+import argparse
+import contextlib
+import logging
+import tempfile
+import time
+from unittest import mock
+
+import django
+
+django.setup()
+
+import numpy as np
+from rest_framework.test import APIRequestFactory
+
+from eeg_app import http_cache, views
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        response = fn()
+    return (time.perf_counter() - start) / repeat, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rng = np.random.default_rng(0)
+    factory = APIRequestFactory()
+    with tempfile.TemporaryDirectory() as root:
+        np.save(os.path.join(root, "eeg.npy"), (rng.standard_normal((19, 2500)) * 50).astype(np.float32))
+        np.save(os.path.join(root, "spec.npy"), rng.random((128, 256, 4), dtype=np.float32))
+        cache = http_cache.ResponseCache(os.path.join(root, "cache"))
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.object(views, "eeg_file_path", lambda pid: os.path.join(root, "eeg.npy")))
+            stack.enter_context(mock.patch.object(views, "spec_file_path", lambda pid: os.path.join(root, "spec.npy")))
+            stack.enter_context(mock.patch.object(views, "response_cache", cache))
+
+            print(f"encodings available: {', '.join(http_cache.AVAILABLE_ENCODINGS)}")
+            print(f"{'endpoint':<10}{'case':<26}{'time/request':>14}{'body':>12}")
+            for kind, view in (("eeg", views.EEGDataView.as_view()), ("spec", views.SPECDataView.as_view())):
+                def call(**headers):
+                    return view(factory.get(f"/eeg/{kind}/1/", headers=headers), patient_id="1")
+
+                def cold():
+                    cache.clear()
+                    with mock.patch.object(cache, "get", return_value=None), mock.patch.object(cache, "put"):
+                        return call()
+
+                cases = [("no cache (identity)", cold)]
+                for encoding in http_cache.AVAILABLE_ENCODINGS:
+                    cases.append((f"cache hit ({encoding})", lambda e=encoding: call(accept_encoding=e)))
+                etag = call()["ETag"]
+                cases.append(("304 revalidation", lambda: call(if_none_match=etag)))
+
+                for name, fn in cases:
+                    elapsed, response = timed(fn, args.repeat)
+                    print(f"{kind:<10}{name:<26}{elapsed * 1e3:>11.2f} ms{len(response.content) / 1024:>9.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
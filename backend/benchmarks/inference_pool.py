@@ -0,0 +1,94 @@
+"""
+In-process inference vs. the inference worker pool, seen from an event loop.
+
+Runs --concurrency predict loops through InferenceClient.acall for --seconds,
+once in-process (threads, sharing the GIL with the loop) and once per
+--workers pool size, while a ticker coroutine sleeping 5 ms measures how late
+the loop wakes it: the delay every WebSocket frame on that worker would see.
+--length sets the recording length, standing in for a heavy upload.
+
+Run from backend/:
+    python -m benchmarks.inference_pool [--workers 1 2] [--concurrency 4] [--seconds 5] [--length 2500 30000]
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hms_backend.settings")
+
+import argparse
+import asyncio
+import logging
+import time
+
+import django
+
+django.setup()
+
+import numpy as np
+
+from benchmarks.fixtures import stub_manager, synthetic_eeg
+from intelligence.inference_pool import InferenceClient, InferencePool
+
+TICK = 0.005
+
+
+async def ticker(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def drive(client: InferenceClient, eeg: np.ndarray, concurrency: int, seconds: float):
+    stop = asyncio.Event()
+    lags, latencies = [], []
+
+    async def predict_loop():
+        while not stop.is_set():
+            start = time.perf_counter()
+            result = await client.acall("predict", eeg)
+            assert "error" not in result, result
+            latencies.append(time.perf_counter() - start)
+
+    await client.acall("predict", eeg)  # warm-up (starts pool workers)
+    tasks = [asyncio.ensure_future(predict_loop()) for _ in range(concurrency)]
+    tasks.append(asyncio.ensure_future(ticker(stop, lags)))
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return latencies, lags
+
+
+def report(name, latencies, lags, seconds):
+    lat, lag = np.array(latencies) * 1e3, np.array(lags) * 1e3
+    print(f"{name:<22}{len(lat) / seconds:>9.1f}{np.percentile(lat, 50):>9.1f}{np.percentile(lat, 99):>9.1f}"
+          f"{np.percentile(lag, 50):>10.2f}{np.percentile(lag, 99):>10.2f}{lag.max():>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--length", type=int, nargs="+", default=[2500, 30000])
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    manager = stub_manager()
+    for length in args.length:
+        eeg = synthetic_eeg(0, length=length)
+        print(f"\n19 x {length} recording, {args.concurrency} concurrent predicts, {os.cpu_count()} CPUs")
+        print(f"{'mode':<22}{'pred/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'lag p50':>10}{'lag p99':>10}{'lag max':>10}")
+        in_process = InferenceClient(None, lambda: manager)
+        report("in-process", *asyncio.run(drive(in_process, eeg, args.concurrency, args.seconds)), args.seconds)
+        for workers in args.workers:
+            pool = InferencePool(workers, manager_factory="benchmarks.fixtures:stub_manager")
+            try:
+                client = InferenceClient(pool, None)
+                report(f"pool, {workers} worker(s)", *asyncio.run(drive(client, eeg, args.concurrency, args.seconds)),
+                       args.seconds)
+            finally:
+                pool.close()
+
+
+if __name__ == "__main__":
+    main()
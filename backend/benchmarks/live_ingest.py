@@ -0,0 +1,141 @@
+"""
+Sustained live EEG ingest, in samples per second per worker.
+
+1. LiveBuffers.ingest (decode a binary chunk, write it into the patient's
+   ring buffer) at several chunk sizes, against a buffer that appends by
+   np.concatenate and trims (what the ring buffer replaces).
+2. The same chunks through the ASGI websocket stack (EEGConsumer.receive) for
+   --patients patients at once, with and without a reader computing features
+   from every patient's newest window once a second.
+
+"200 Hz patients" is the throughput divided by the 200 Hz sample rate: how
+many bedside streams one worker could absorb (its CPU would then do nothing
+else).
+
+Run from backend/:
+    python -m benchmarks.live_ingest [--seconds 600] [--patients 40] [--minutes 5]
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hms_backend.settings")
+
+import argparse
+import asyncio
+import logging
+import time
+from unittest import mock
+
+import numpy as np
+from asgiref.testing import ApplicationCommunicator
+from django.test import override_settings
+
+from benchmarks.fixtures import SAMPLE_RATE, stub_manager, synthetic_eeg
+from eeg_app import consumers, live_buffers
+from hms_backend.asgi import application
+
+CHUNKS = (10, 50, 200, 1000)
+
+
+def chunks(stream, size, flags=0):
+    return [live_buffers.encode_chunk(seq, stream[:, seq:seq + size], flags)
+            for seq in range(0, stream.shape[1] - size + 1, size)]
+
+
+def direct(stream, size, capacity):
+    """Samples per second through LiveBuffers.ingest"""
+    buffers = live_buffers.LiveBuffers(capacity, 1)
+    messages = chunks(stream, size)
+    start = time.perf_counter()
+    for message in messages:
+        buffers.ingest("1", message)
+    return len(messages) * size / (time.perf_counter() - start)
+
+
+def concatenating(stream, size, capacity):
+    """Samples per second into a buffer that reallocates on every chunk"""
+    buffer = np.empty((19, 0), dtype=np.float32)
+    messages = chunks(stream, size)
+    start = time.perf_counter()
+    for message in messages:
+        _, _, samples = live_buffers.decode_chunk(message)
+        buffer = np.concatenate([buffer, samples], axis=1)[:, -capacity:]
+    return len(messages) * size / (time.perf_counter() - start)
+
+
+async def through_consumer(stream, size, patients, read):
+    """Samples per second through EEGConsumer for ``patients`` sockets, optionally with a feature reader"""
+    messages = chunks(stream, size)
+    last = (len(messages) - 1) * size
+    messages[-1] = live_buffers.encode_chunk(last, stream[:, last:last + size], live_buffers.FLAG_ACK)
+    sockets = []
+    for p in range(patients):
+        socket = ApplicationCommunicator(application, {"type": "websocket", "path": f"/ws/eeg/{p}/", "headers": [],
+                                                       "query_string": b"", "subprotocols": []})
+        await socket.send_input({"type": "websocket.connect"})
+        await socket.receive_output(5)
+        sockets.append(socket)
+
+    manager = stub_manager()
+    reads = [0]
+
+    async def reader():
+        while True:
+            for p in range(patients):
+                try:
+                    live_buffers.live_buffers.read(str(p), 2500, manager.extract_features)
+                    reads[0] += 1
+                except LookupError:
+                    pass
+            await asyncio.sleep(1.0)
+
+    reading = asyncio.ensure_future(reader()) if read else None
+    start = time.perf_counter()
+    for message in messages:
+        for socket in sockets:
+            await socket.send_input({"type": "websocket.receive", "bytes": message})
+        await asyncio.sleep(0)
+    for socket in sockets:
+        await socket.receive_output(60)  # the final chunk's ack
+    elapsed = time.perf_counter() - start
+    if reading:
+        reading.cancel()
+    for socket in sockets:
+        await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+        await socket.wait(5)
+    return len(messages) * size * patients / elapsed, reads[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=600.0, help="stream length per patient")
+    parser.add_argument("--patients", type=int, default=40)
+    parser.add_argument("--minutes", type=float, default=5.0, help="ring buffer length")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    capacity = int(args.minutes * 60 * SAMPLE_RATE)
+    stream = synthetic_eeg(0, length=int(args.seconds * SAMPLE_RATE))
+    print(f"ring buffer: {args.minutes:g} min at {SAMPLE_RATE} Hz, {19 * 2 * capacity * 4 / 2 ** 20:.1f} MiB per patient")
+    print(f"\n{'ingest':<30}{'chunk':>7}{'samples/s':>13}{'200 Hz patients':>17}")
+    long_stream = synthetic_eeg(1, length=2 * capacity)  # wraps the ring buffer
+    for size in CHUNKS:
+        for name, fn in (("LiveBuffers.ingest", direct), ("np.concatenate + trim", concatenating)):
+            rate = fn(long_stream, size, capacity)
+            print(f"{name:<30}{size:>7}{rate:>13,.0f}{rate / SAMPLE_RATE:>17,.0f}")
+
+    buffers = live_buffers.LiveBuffers(capacity, args.patients)
+    with override_settings(EEG_INGEST=True), mock.patch.object(consumers, "live_buffers", buffers), \
+            mock.patch.object(live_buffers, "live_buffers", buffers):
+        for size in (50, 200):
+            for read in (False, True):
+                for p in range(args.patients):
+                    buffers.discard(str(p))
+                rate, reads = asyncio.run(through_consumer(stream, size, args.patients, read))
+                name = f"EEGConsumer x{args.patients}" + (" + features/s" if read else "")
+                print(f"{name:<30}{size:>7}{rate:>13,.0f}{rate / SAMPLE_RATE:>17,.0f}"
+                      + (f"   ({reads} windows read)" if read else ""))
+
+
+
+if __name__ == "__main__":
+    main()
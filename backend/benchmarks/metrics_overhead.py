@@ -0,0 +1,57 @@
+"""
+Overhead of the metrics layer on the predict path: XGBoostModelManager.predict
+on one 19 x 2500 recording with a stub booster, with recording on and off.
+
+Run from backend/:
+    python -m benchmarks.metrics_overhead [--repeat 2000]
+"""
+import argparse
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.fixtures import stub_model
+from hms_backend import metrics
+
+
+def per_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--trials", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    manager = stub_model(rng)
+    eeg = (rng.standard_normal((19, 2500)) * 50).astype(np.float32)
+    stage = metrics.PREDICT_STAGE_SECONDS.labels("bench")
+
+    with tempfile.TemporaryDirectory() as tmp, mock.patch.object(metrics.REGISTRY, "_directory", tmp):
+        for _ in range(50):
+            manager.predict(eeg)
+        # Interleave trials so drift in machine load hits both variants alike
+        on, off = [], []
+        for _ in range(args.trials):
+            for enabled, results in ((True, on), (False, off)):
+                with mock.patch.object(metrics.REGISTRY, "enabled", enabled):
+                    results.append(per_call(lambda: manager.predict(eeg), args.repeat))
+        observe = per_call(lambda: stage.observe(0.001), 100000)
+
+    on, off = min(on), min(off)
+    print(f"predict, metrics off   {off * 1e3:8.3f} ms")
+    print(f"predict, metrics on    {on * 1e3:8.3f} ms   ({(on - off) / off * 100:+.2f}%)")
+    print(f"one histogram observe  {observe * 1e6:8.2f} us")
+    # The end-to-end difference is within run-to-run noise; this is the direct cost
+    print(f"3 observes per predict {3 * observe / off * 100:8.2f} % of predict")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Sustained recording of live EEG to disk, for many concurrent patients.
+
+For each patient count, one producer appends 50-sample chunks (a quarter
+second at 200 Hz) round-robin over the patients as fast as it can for
+--seconds, while the writer's background thread flushes and fsyncs on its
+intervals; then close() makes the rest durable. The producer outruns the
+disk, so the writer's pending limit drops chunks: what is recorded is the
+writer's sustained rate. Reported: samples and MB per second recorded (to
+durable, indexed storage, close included), the same in 200 Hz patients, the
+producer's append latency, fsyncs, and chunks dropped.
+The baseline opens, appends to and fsyncs the patient's file per chunk.
+
+Run from backend/:
+    python -m benchmarks.recording_store [--seconds 10] [--patients 50 200 1000] [--root DIR]
+"""
+import os
+import argparse
+import logging
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fixtures import SAMPLE_RATE, synthetic_eeg
+from intelligence.recording_store import RecordingReader, RecordingWriter
+
+CHUNK = 50
+
+
+def recorded(root, patients, seconds, stream, **kwargs):
+    writer = RecordingWriter(root, SAMPLE_RATE, **kwargs)
+    latencies = []
+    seqs = [0] * patients
+    dropped = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for p in range(patients):
+            offset = seqs[p] % (stream.shape[1] - CHUNK)
+            t = time.perf_counter()
+            if not writer.append(str(p), seqs[p], stream[:, offset:offset + CHUNK]):
+                dropped += 1
+            latencies.append(time.perf_counter() - t)
+            seqs[p] += CHUNK
+    writer.close()
+    elapsed = time.perf_counter() - start
+    samples = sum(seqs) - dropped * CHUNK
+    assert samples == sum(int((~np.isnan(RecordingReader(root, str(p)).read(0, seqs[p])[0])).sum())
+                          for p in range(patients))
+    return samples / elapsed, np.percentile(latencies, [50, 99]), writer.fsyncs, dropped
+
+
+def per_chunk(root, patients, seconds, stream):
+    """Samples per second when every chunk is its own open/write/fsync"""
+    os.makedirs(root, exist_ok=True)
+    samples = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for p in range(patients):
+            with open(os.path.join(root, f"{p}.f32"), "ab") as f:
+                f.write(np.ascontiguousarray(stream[:, :CHUNK].T).data)
+                f.flush()
+                os.fsync(f.fileno())
+            samples += CHUNK
+    return samples / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--patients", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--root", default=None, help="directory on the disk to measure (default: a temp dir)")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    stream = synthetic_eeg(1, length=SAMPLE_RATE * 60)
+    bytes_per_sample = 19 * 4
+
+    print(f"{'patients':>9}{'samples/s':>12}{'MB/s':>8}{'200 Hz pts':>12}{'append p50 us':>15}{'p99 us':>9}"
+          f"{'fsyncs':>8}{'dropped':>9}{'per-chunk fsync/s':>19}")
+    for patients in args.patients:
+        root = tempfile.mkdtemp(dir=args.root)
+        try:
+            rate, (p50, p99), fsyncs, dropped = recorded(os.path.join(root, "store"), patients, args.seconds, stream)
+            baseline = per_chunk(os.path.join(root, "baseline"), patients, min(args.seconds, 3), stream)
+        finally:
+            shutil.rmtree(root)
+        print(f"{patients:>9}{rate:>12,.0f}{rate * bytes_per_sample / 1e6:>8.1f}{rate / SAMPLE_RATE:>12,.0f}"
+              f"{p50 * 1e6:>15.1f}{p99 * 1e6:>9.1f}{fsyncs:>8}{dropped:>9}{baseline:>19,.0f}")
+
+
+if __name__ == "__main__":
+    main()
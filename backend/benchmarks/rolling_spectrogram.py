@@ -0,0 +1,69 @@
+"""
+Rolling spectrogram update per hop vs. recomputing the displayed window.
+
+For each display width, feeds a stream to RollingSpectrogram one hop (64
+samples, 0.32 s at 200 Hz) at a time and reports the time per hop, against
+compute_spectrogram over the samples the display covers (what refreshing a
+live heatmap cost before; it renders at most the centre SEGMENT_DURATION
+samples, so its cost stops growing past 78 columns, and it cannot show more).
+"Patients/CPU" is how many 200 Hz streams one core could keep current with
+every hop.
+
+Run from backend/:
+    python -m benchmarks.rolling_spectrogram [--widths 64 256 1024 4096] [--hops 2000]
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hms_backend.settings")
+
+import django
+
+django.setup()
+
+import argparse
+import logging
+import time
+
+from benchmarks.fixtures import SAMPLE_RATE, synthetic_eeg
+from eeg_app.rolling_spectrogram import HOP, RollingSpectrogram
+from eeg_app.spectrogram_generator import WIN_LENGTH, compute_spectrogram
+
+
+def per_hop(width, hops, stream):
+    spectrogram = RollingSpectrogram(width)
+    spectrogram.push(stream[:, :WIN_LENGTH - HOP])
+    start = time.perf_counter()
+    for i in range(hops):
+        offset = WIN_LENGTH - HOP + i * HOP
+        spectrogram.push(stream[:, offset:offset + HOP])
+    return (time.perf_counter() - start) / hops
+
+
+def recompute(width, stream, repeat=5):
+    window = stream[:, :min((width - 1) * HOP + WIN_LENGTH, stream.shape[1])]
+    compute_spectrogram(window)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        compute_spectrogram(window)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--widths", type=int, nargs="+", default=[64, 256, 1024, 4096])
+    parser.add_argument("--hops", type=int, default=2000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    stream = synthetic_eeg(1, length=max(args.hops + 1, max(args.widths)) * HOP + WIN_LENGTH)
+    hop_seconds = HOP / SAMPLE_RATE
+
+    print(f"{'width':>6}{'display s':>11}{'per hop us':>12}{'recompute ms':>14}{'speedup':>10}{'patients/CPU':>14}")
+    for width in args.widths:
+        rolling = per_hop(width, args.hops, stream)
+        full = recompute(width, stream)
+        print(f"{width:>6}{width * hop_seconds:>11.0f}{rolling * 1e6:>12.1f}{full * 1e3:>14.2f}"
+              f"{full / rolling:>9.0f}x{hop_seconds / rolling:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Live scoring spread and stability across workers.
+
+Simulates --workers workers scoring --patients streaming patients in lockstep
+rounds (LocalLeases on a simulated clock, so lease expiry is exact), and
+reports:
+  - spread: patients per worker, max / mean (1.0 is perfectly even), for the
+    consistent-hash ring and for plain hash(patient) % workers;
+  - moved: patients that change worker when one joins, ring vs. modulo;
+  - duplicates: patient-rounds scored by two workers (must be 0), and rounds
+    until every patient of a worker that died is scored again;
+  - coordination cost per worker round with DatabaseLeases (in-memory test DB).
+
+Run from backend/:
+    python -m benchmarks.sharding [--workers 4 8 16] [--patients 1000] [--ttl 3]
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hms_backend.settings")
+
+import django
+
+django.setup()
+
+import argparse
+import logging
+import time
+
+from django.db import connection
+from django.test.utils import setup_test_environment
+
+from eeg_app.sharding import DatabaseLeases, HashRing, LiveScoring, LocalLeases, ShardCoordinator, _point
+
+
+def spread(owners, members):
+    counts = [0] * len(members)
+    index = {m: i for i, m in enumerate(members)}
+    for owner in owners:
+        counts[index[owner]] += 1
+    return max(counts) / (len(owners) / len(members))
+
+
+def simulate(n_workers, patients, ttl):
+    clock = [0.0]
+    leases = LocalLeases(clock=lambda: clock[0])
+    scored = []
+    workers = {}
+
+    def add(name):
+        workers[name] = LiveScoring(ShardCoordinator(name, leases, ttl), lambda: patients,
+                                    lambda p, name=name: scored.append(p))
+
+    def round_():
+        scored.clear()
+        for worker in workers.values():
+            worker.run_once()
+        clock[0] += 1
+        return len(scored) - len(set(scored)), set(scored)
+
+    for i in range(n_workers):
+        add(f"w{i}")
+    duplicates = sum(round_()[0] for _ in range(ttl + 2))
+    dead = workers.pop("w0")
+    orphaned = set(dead.coordinator.claimed)
+    rounds = 0
+    while True:
+        rounds += 1
+        extra, done = round_()
+        duplicates += extra
+        if orphaned <= done or rounds > 10 * ttl:
+            break
+    return duplicates, rounds
+
+
+def db_round_cost(n_workers, patients, repeat=5):
+    """Seconds per worker round (heartbeat + claims) with DatabaseLeases"""
+    leases = DatabaseLeases()
+    workers = [LiveScoring(ShardCoordinator(f"w{i}", leases, 15), lambda: patients, lambda p: None)
+               for i in range(n_workers)]
+    for worker in workers:
+        worker.run_once()
+    for worker in workers:  # a second pass so every ring has every member
+        worker.run_once()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for worker in workers:
+            worker.run_once()
+    elapsed = (time.perf_counter() - start) / (repeat * n_workers)
+    for worker in workers:
+        worker.coordinator.leave()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--ttl", type=int, default=3, help="lease TTL in rounds")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    patients = [str(100000 + i) for i in range(args.patients)]
+
+    setup_test_environment()
+    old_db = connection.creation.create_test_db(verbosity=0)  # in-memory; never the real db.sqlite3
+    try:
+        print(f"{'workers':>8}{'spread ring':>13}{'modulo':>8}{'moved ring':>12}{'modulo':>8}"
+              f"{'duplicates':>12}{'takeover rounds':>17}{'db round ms':>13}")
+        for n in args.workers:
+            members = [f"w{i}" for i in range(n)]
+            ring, grown = HashRing(members), HashRing(members + [f"w{n}"])
+            ring_owners = [ring.owner(p) for p in patients]
+            modulo = [members[_point(p) % n] for p in patients]
+            moved_ring = sum(grown.owner(p) != o for p, o in zip(patients, ring_owners)) / len(patients)
+            moved_modulo = sum(f"w{_point(p) % (n + 1)}" != o for p, o in zip(patients, modulo)) / len(patients)
+            duplicates, rounds = simulate(n, patients, args.ttl)
+            cost = db_round_cost(n, patients)
+            print(f"{n:>8}{spread(ring_owners, members):>13.2f}{spread(modulo, members):>8.2f}"
+                  f"{moved_ring:>12.1%}{moved_modulo:>8.1%}{duplicates:>12}{rounds:>17}{cost * 1e3:>13.1f}")
+    finally:
+        connection.creation.destroy_test_db(old_db, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
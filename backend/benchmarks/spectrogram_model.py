@@ -0,0 +1,89 @@
+"""
+Spectrogram CNN serving: batch size, backend and micro-batching.
+
+Exports the reference CNN (intelligence.models.SpectrogramCNN.export, random
+weights) to a temporary directory, or serves --model, and reports for the
+SavedModel and TFLite backends the latency per batch and throughput at each
+batch size, then the throughput of --clients threads each sending single
+requests, sequentially (max_batch=1) and micro-batched.
+
+Run from backend/:
+    python -m benchmarks.spectrogram_model [--model PATH] [--repeat 20] [--clients 16]
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from intelligence.models.SpectrogramCNN.export import export
+from intelligence.models.SpectrogramCNN.serving import SpectrogramModel
+
+BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+
+
+def batch_latency(model, inputs, repeat):
+    """Median seconds per predict_batch call"""
+    model.predict_batch(inputs)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict_batch(inputs)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def concurrent_throughput(model, inputs, clients, per_client):
+    """Requests per second with ``clients`` threads each calling predict ``per_client`` times"""
+    def client(i):
+        for j in range(per_client):
+            model.predict(inputs[(i + j) % len(inputs)])
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clients * per_client / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="SavedModel directory or .tflite (default: reference export)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--per-client", type=int, default=10)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.model:
+            paths = [args.model]
+        else:
+            saved = os.path.join(tmp, "spectrogram_cnn")
+            paths = [saved, export(saved, tflite=True)]
+        for path in paths:
+            backend = "TFLite" if path.endswith(".tflite") else "SavedModel"
+            model = SpectrogramModel(path, max_batch=max(BATCH_SIZES))
+            inputs = np.random.default_rng(0).random((max(BATCH_SIZES),) + model.input_shape, dtype=np.float32)
+            print(f"\n{backend} {path} (input {model.input_shape})")
+            print(f"{'batch':>6}{'ms/batch':>10}{'ms/item':>9}{'items/s':>9}")
+            for size in BATCH_SIZES:
+                latency = batch_latency(model, inputs[:size], args.repeat)
+                print(f"{size:>6}{latency * 1e3:>10.2f}{latency / size * 1e3:>9.2f}{size / latency:>9.0f}")
+            model.close()
+
+            print(f"{args.clients} concurrent clients, single requests")
+            for label, max_batch in (("sequential", 1), ("micro-batched", 16)):
+                model = SpectrogramModel(path, max_batch=max_batch)
+                rate = concurrent_throughput(model, inputs, args.clients, args.per_client)
+                print(f"  {label:<15}{rate:>9.0f} req/s")
+                model.close()
+
+
+if __name__ == "__main__":
+    main()
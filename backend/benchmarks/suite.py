@@ -0,0 +1,456 @@
+"""
+Benchmark suite for the backend hot paths, with a baseline file and a
+regression gate.
+
+Times, on deterministic synthetic fixtures (benchmarks.fixtures):
+  features.*       XGBoostModelManager.extract_features
+  model.*          XGBoostModelManager.predict / predict_features
+  spectrogram.*    spectrogram_from_eeg_npy
+  preprocess.*     the preprocessing.py chains and EEGPreprocessor
+  view.*           every REST endpoint through the Django test client, and
+                   opening a patient by snapshot vs. the four separate requests
+
+The model is xgboost_model.pkl when it loads, else (or with --stub) a small
+stub booster; results record which, and are only compared against a baseline
+made with the same model. Runs offline on CPU against an in-memory test DB.
+
+Each case is run in --rounds rounds of enough calls to take --min-time; the
+median per-call time is compared to the baseline, and the run fails (exit 1)
+if any case is slower by more than --threshold. Baselines are per machine.
+
+Run from backend/:
+    python -m benchmarks.suite --save-baseline          # record benchmarks/baseline.json
+    python -m benchmarks.suite [--threshold 0.25]       # compare against it
+    python -m benchmarks.suite --only view. --output results.json
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hms_backend.settings")
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest import mock
+
+import django
+
+django.setup()
+
+import numpy as np
+import scipy
+import xgboost as xgb
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment
+
+from benchmarks.fixtures import stub_model, synthetic_eeg, synthetic_recording, write_patients
+from eeg_app import http_cache, views
+from eeg_app.spectrogram_generator import spectrogram_from_eeg_npy
+from intelligence.feature_store import FeatureStore
+from intelligence.models.XGBoost.xgboost import XGBoostModelManager
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SUITE_VERSION = 1  # bump when fixtures or cases change meaning, to invalidate baselines
+SEED = 0
+N_PATIENTS = 20
+
+# name -> factory(context) returning the zero-argument callable to time
+CASES: Dict[str, Callable] = {}
+
+
+def case(name: str):
+    def register(factory):
+        CASES[name] = factory
+        return factory
+    return register
+
+
+class NullResponseCache(http_cache.ResponseCache):
+    """Never hits, so the view builds and encodes the body every time"""
+
+    def __init__(self):
+        super().__init__(root="", memory_bytes=0)
+
+    def get(self, *args):
+        return None
+
+    def put(self, *args):
+        pass
+
+
+class Context:
+    def __init__(self, root: str, manager: XGBoostModelManager):
+        self.root = root
+        self.manager = manager
+        self.eeg_dir, self.spec_dir = write_patients(root, N_PATIENTS, SEED)
+        self.eeg = synthetic_eeg(SEED)
+        self.eeg_path = os.path.join(self.eeg_dir, "0.npy")
+        self.features = manager.extract_features(self.eeg)
+        self.client = Client()
+        self._counter = 0
+
+    def next_id(self) -> int:
+        self._counter += 1
+        return self._counter
+
+
+# --- features / model -------------------------------------------------------
+
+@case("features.extract_features")
+def _extract_features(ctx):
+    return lambda: ctx.manager.extract_features(ctx.eeg)
+
+
+@case("model.predict")
+def _predict(ctx):
+    return lambda: ctx.manager.predict(ctx.eeg)
+
+
+@case("model.predict_features")
+def _predict_features(ctx):
+    return lambda: ctx.manager.predict_features(ctx.features)
+
+
+# --- spectrogram --------------------------------------------------------------
+
+@case("spectrogram.from_eeg_npy")
+def _spectrogram(ctx):
+    out = os.path.join(ctx.root, "spectrograms")
+    return lambda: spectrogram_from_eeg_npy(ctx.eeg_path, output_dir=out)
+
+
+# --- preprocessing ------------------------------------------------------------
+
+def _preprocessing():
+    # Heavy imports (torch, tensorflow, albumentations); only when these cases run
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from intelligence.preprocessed import preprocessing
+    return preprocessing
+
+
+@case("preprocess.compute_eeg_chain")
+def _eeg_chain(ctx):
+    df = synthetic_recording(SEED)
+    preprocessing = _preprocessing()
+    return lambda: preprocessing.compute_eeg_chain(df)
+
+
+@case("preprocess.compute_spec_chain")
+def _spec_chain(ctx):
+    df = synthetic_recording(SEED)
+    preprocessing = _preprocessing()
+    return lambda: preprocessing.compute_spec_chain(df)
+
+
+def _chain_inputs():
+    chains, mid, ekg = _preprocessing().compute_eeg_chain(synthetic_recording(SEED))
+    rng = np.random.default_rng(SEED)
+    kspec = (rng.random((4, 100)) * 20).astype(np.float32)
+    eeg_spec = rng.random((4, 96, 228), dtype=np.float32)
+    return {"proc_eeg": (chains, mid, ekg), "proc_kspec": (kspec,), "proc_eeg_spec": (eeg_spec,)}
+
+
+def _copying(fn, args):
+    # The proc_* steps modify their inputs in place
+    return lambda: fn(*(a.copy() for a in args))
+
+
+for _step in ("proc_eeg", "proc_kspec", "proc_eeg_spec"):
+    def _function(ctx, step=_step):
+        return _copying(getattr(_preprocessing(), step), _chain_inputs()[step])
+
+    def _preprocessor(ctx, step=_step):
+        from intelligence.preprocessed.preprocessor import EEGPreprocessor
+        return _copying(getattr(EEGPreprocessor(), step), _chain_inputs()[step])
+
+    case(f"preprocess.{_step}")(_function)
+    case(f"preprocess.{_step}.preprocessor")(_preprocessor)
+
+
+# --- views --------------------------------------------------------------------
+
+def _get(ctx, url):
+    def call():
+        response = ctx.client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+    return call
+
+
+@case("view.eeg_data.cached")
+def _eeg_data_cached(ctx):
+    return _get(ctx, "/eeg/data/1/")
+
+
+@case("view.eeg_data.uncached")
+def _eeg_data_uncached(ctx):
+    call = _get(ctx, "/eeg/data/1/")
+    return lambda: _with_patch(views, "response_cache", NullResponseCache(), call)
+
+
+@case("view.eeg_data.not_modified")
+def _eeg_data_not_modified(ctx):
+    etag = ctx.client.get("/eeg/data/1/")["ETag"]
+
+    def call():
+        assert ctx.client.get("/eeg/data/1/", headers={"If-None-Match": etag}).status_code == 304
+    return call
+
+
+@case("view.spec_data.cached")
+def _spec_data_cached(ctx):
+    return _get(ctx, "/eeg/spec/1/")
+
+
+@case("view.spec_data.uncached")
+def _spec_data_uncached(ctx):
+    call = _get(ctx, "/eeg/spec/1/")
+    return lambda: _with_patch(views, "response_cache", NullResponseCache(), call)
+
+
+@case("view.patients")
+def _patients(ctx):
+    return _get(ctx, "/eeg/patients/")
+
+
+@case("view.patient_details")
+def _patient_details(ctx):
+    return _get(ctx, "/eeg/eeg/patients/1/")
+
+
+@case("view.patient_snapshot")
+def _patient_snapshot(ctx):
+    return _get(ctx, "/eeg/patients/1/snapshot/")
+
+
+@case("view.patient_open.separate")
+def _patient_open_separate(ctx):
+    # What the dashboard did before the snapshot: four requests, the EEG uploaded back for predict
+    buffer = io.BytesIO()
+    np.save(buffer, ctx.eeg)
+    data = buffer.getvalue()
+    gets = [_get(ctx, url) for url in ("/eeg/eeg/patients/1/", "/eeg/data/1/", "/eeg/spec/1/")]
+
+    def call():
+        for get in gets:
+            get()
+        upload = io.BytesIO(data)
+        upload.name = "recording.npy"
+        assert ctx.client.post("/eeg/predict/", {"eeg_file": upload}).status_code == 200
+    return call
+
+
+def _post(ctx, url, data, **kwargs):
+    def call():
+        response = ctx.client.post(url, data, **kwargs)
+        assert response.status_code in (200, 202), (url, response.status_code, response.content[:200])
+    return call
+
+
+@case("view.predict.patient_id")
+def _predict_patient_id(ctx):
+    # Features come from the feature store after the first call
+    return _post(ctx, "/eeg/predict/", {"patient_id": "1"}, content_type="application/json")
+
+
+@case("view.predict.features")
+def _predict_manual_features(ctx):
+    return _post(ctx, "/eeg/predict/", {"features": ctx.features.tolist()}, content_type="application/json")
+
+
+@case("view.predict.file_upload")
+def _predict_upload(ctx):
+    buffer = io.BytesIO()
+    np.save(buffer, ctx.eeg)
+    data = buffer.getvalue()
+
+    def call():
+        upload = io.BytesIO(data)
+        upload.name = "recording.npy"
+        response = ctx.client.post("/eeg/predict/", {"eeg_file": upload})
+        assert response.status_code == 200, response.content[:200]
+    return call
+
+
+@case("view.alerts")
+def _alerts(ctx):
+    def call():
+        # A new patient each call, so every request inserts a queued alert
+        _post(ctx, "/eeg/alerts/", {"patient_id": f"bench-{ctx.next_id()}", "patient_name": "Synthetic",
+                                    "room": "1", "alert_type": "Seizure", "severity": "critical",
+                                    "phone_number": "9876543210"}, content_type="application/json")()
+    return call
+
+
+def _with_patch(target, name, value, fn):
+    with mock.patch.object(target, name, value):
+        return fn()
+
+
+# --- runner -------------------------------------------------------------------
+
+def load_manager(force_stub: bool) -> Tuple[XGBoostModelManager, str]:
+    if not force_stub:
+        manager = XGBoostModelManager()
+        if manager.is_loaded:
+            return manager, "xgboost_model.pkl"
+    return stub_model(np.random.default_rng(SEED)), "stub"
+
+
+def measure(fn: Callable, rounds: int, min_time: float) -> Dict:
+    """Per-call seconds over ``rounds`` rounds, each long enough to be timed reliably"""
+    fn()  # warm-up: caches, lazy imports, buffers
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 16:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)) + 1)
+    samples = [elapsed / number]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {"median": statistics.median(samples), "min": min(samples), "max": max(samples),
+            "rounds": rounds, "number": number}
+
+
+def environment(model: str) -> Dict:
+    return {
+        "suite_version": SUITE_VERSION,
+        "model": model,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "xgboost": xgb.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    regressions = []
+    print(f"\n{'case':<40}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, current in results["cases"].items():
+        base = baseline["cases"].get(name)
+        if base is None:
+            print(f"{name:<40}{'-':>12}{_format(current['median']):>12}{'new':>9}")
+            continue
+        change = current["median"] / base["median"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40}{_format(base['median']):>12}{_format(current['median']):>12}{change:>+8.1%}{flag}")
+    return regressions
+
+
+def _format(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def run(selected: List[str], manager, model: str, rounds: int, min_time: float) -> Dict:
+    results = {"environment": environment(model), "cases": {}}
+    with tempfile.TemporaryDirectory() as root, contextlib.ExitStack() as stack:
+        ctx = Context(root, manager)
+        stack.enter_context(override_settings(ALERT_DISPATCH_IN_PROCESS=False))
+        for target, name, value in (
+                (views, "EEG_DATA_PATH", ctx.eeg_dir),
+                (views, "SPEC_DATA_PATH", ctx.spec_dir),
+                (views, "xgb_model_manager", manager),
+                (views, "feature_store", FeatureStore(os.path.join(root, "features"))),
+                (views, "response_cache", http_cache.ResponseCache(os.path.join(root, "responses")))):
+            stack.enter_context(mock.patch.object(target, name, value))
+
+        print(f"{'case':<40}{'median':>12}{'min':>12}{'calls':>8}")
+        for name in selected:
+            timing = measure(CASES[name](ctx), rounds, min_time)
+            results["cases"][name] = timing
+            print(f"{name:<40}{_format(timing['median']):>12}{_format(timing['min']):>12}"
+                  f"{timing['rounds'] * timing['number']:>8}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare with / save to")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fail if a case's median is slower than baseline by more than this fraction")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per round")
+    parser.add_argument("--only", nargs="+", default=[], help="run cases whose name starts with any of these")
+    parser.add_argument("--stub", action="store_true", help="use the stub booster even if the model loads")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(CASES))
+        return 0
+    selected = [name for name in CASES if not args.only or name.startswith(tuple(args.only))]
+    if not selected:
+        parser.error(f"no case matches {args.only}")
+
+    logging.disable(logging.WARNING)
+    setup_test_environment()
+    old_db = connection.creation.create_test_db(verbosity=0)  # in-memory; never the real db.sqlite3
+    try:
+        manager, model = load_manager(args.stub)
+        results = run(selected, manager, model, args.rounds, args.min_time)
+    finally:
+        connection.creation.destroy_test_db(old_db, verbosity=0)
+
+    for path in filter(None, [args.output, args.baseline if args.save_baseline else None]):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nwrote {path}")
+    if args.save_baseline:
+        return 0
+
+    baseline = _read_baseline(args.baseline)
+    if baseline is None:
+        print(f"\nno baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+    if baseline["environment"]["model"] != model or baseline["environment"]["suite_version"] != SUITE_VERSION:
+        print(f"\nbaseline was recorded with model {baseline['environment']['model']!r}, suite version "
+              f"{baseline['environment']['suite_version']}; not comparable, re-record it")
+        return 2
+    differing = [key for key, value in results["environment"].items() if baseline["environment"].get(key) != value]
+    if differing:
+        print(f"\nnote: environment differs from the baseline in {', '.join(differing)}")
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} case(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print(f"\nno regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+def _read_baseline(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
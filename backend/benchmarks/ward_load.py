@@ -0,0 +1,318 @@
+"""
+ICU ward load generator for a running ASGI deployment (HTTP + WebSocket).
+
+Simulates beds, each with a dashboard that
+  - polls data/<id>/ and spec/<id>/ every --poll-interval (revalidating with
+    If-None-Match, as a browser would), and patients/ every --patients-interval,
+  - keeps ws/eeg/<id>/ open and measures the delivery lag of every frame that
+    carries a "sent_at" timestamp,
+  - submits predict/ every --predict-interval (patient_id, or an uploaded
+    recording with --predict-upload),
+  - fires alerts/ at --alerts-per-hour (without a phone number unless
+    --alert-phone is given, so no SMS goes out),
+and a bedside feed socket sending a --feed-samples sample EEG frame
+--feed-rate times a second. The server fans the feed out to the dashboards
+only when started with EEG_WS_RELAY=1; otherwise lag is reported as n/a.
+
+The bed count ramps through --beds, holding each step for --step-seconds;
+every step reports throughput and p50/p95/p99 latency per endpoint, and
+WebSocket connects and delivery lag. Upload recordings come from --eeg-dir
+(recorded .npy files) or are synthetic (benchmarks.fixtures).
+
+Needs aiohttp (requirements.txt; the server itself does not use it).
+
+Start the server, e.g.
+    EEG_WS_RELAY=1 daphne -p 8000 hms_backend.asgi:application
+then run from backend/ (on other cores or another host: a saturated load
+generator inflates the latencies it reports):
+    python -m benchmarks.ward_load --url http://127.0.0.1:8000 --beds 10 50 100 --step-seconds 60
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import aiohttp
+import numpy as np
+
+from benchmarks.fixtures import SAMPLE_RATE, synthetic_eeg
+
+ALERT_PAYLOAD = {"patient_name": "Load Test", "room": "ICU", "alert_type": "Seizure", "severity": "critical",
+                 "doctor_id": "load-test", "message": "ward_load synthetic alert"}
+
+
+class Recorder:
+    """Latencies, errors and WebSocket delivery lag for one ramp step"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.ws_lag: List[float] = []
+        self.ws_counts: Dict[str, int] = defaultdict(int)
+
+    def request(self, endpoint: str, seconds: float, status: Optional[int]):
+        self.latencies[endpoint].append(seconds)
+        if status is None or status >= 400:
+            self.errors[endpoint] += 1
+        if status is not None:
+            self.statuses[endpoint][status] += 1
+
+    def summary(self) -> Dict:
+        elapsed = time.perf_counter() - self.started
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            endpoints[endpoint] = {"requests": len(latencies), "errors": self.errors[endpoint],
+                                   "throughput": len(latencies) / elapsed,
+                                   "statuses": dict(self.statuses[endpoint]), **_percentiles(latencies)}
+        return {"seconds": elapsed, "endpoints": endpoints,
+                "websocket": {**self.ws_counts, "lag": _percentiles(self.ws_lag) if self.ws_lag else None}}
+
+
+def _percentiles(seconds: List[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds) * 1e3
+    return {f"p{q}_ms": float(np.percentile(ms, q)) for q in (50, 95, 99)}
+
+
+class Ward:
+    def __init__(self, args, session: aiohttp.ClientSession, patient_ids: List[str]):
+        self.args = args
+        self.session = session
+        self.patient_ids = patient_ids
+        self.base = args.url.rstrip("/")
+        self.ws_base = "ws" + self.base[len("http"):]
+        self.recorder = Recorder()
+        self.stop = asyncio.Event()
+        self.uploads = self._uploads()
+
+    def _uploads(self) -> List[bytes]:
+        if not self.args.predict_upload:
+            return []
+        if self.args.eeg_dir:
+            names = sorted(name for name in os.listdir(self.args.eeg_dir) if name.endswith(".npy"))[:20]
+            return [open(os.path.join(self.args.eeg_dir, name), "rb").read() for name in names]
+        uploads = []
+        for seed in range(8):
+            buffer = io.BytesIO()
+            np.save(buffer, synthetic_eeg(seed))
+            uploads.append(buffer.getvalue())
+        return uploads
+
+    async def timed(self, endpoint: str, method: str, path: str, **kwargs) -> Optional[aiohttp.ClientResponse]:
+        start = time.perf_counter()
+        response = None
+        try:
+            async with self.session.request(method, self.base + path, **kwargs) as response:
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            response = None
+        self.recorder.request(endpoint, time.perf_counter() - start, response.status if response else None)
+        return response
+
+    async def every(self, interval: float, action):
+        """Run ``action`` every ``interval`` seconds (+-10% jitter, random phase) until stopped"""
+        if interval <= 0:
+            return
+        try:
+            await asyncio.wait_for(self.stop.wait(), random.uniform(0, interval))
+            return
+        except asyncio.TimeoutError:
+            pass
+        while not self.stop.is_set():
+            await action()
+            try:
+                await asyncio.wait_for(self.stop.wait(), interval * random.uniform(0.9, 1.1))
+            except asyncio.TimeoutError:
+                pass
+
+    async def bed(self, index: int):
+        patient_id = self.patient_ids[index % len(self.patient_ids)]
+        etags: Dict[str, str] = {}
+
+        async def poll(endpoint, path):
+            headers = {"Accept-Encoding": "gzip, br, zstd"}
+            if self.args.revalidate and path in etags:
+                headers["If-None-Match"] = etags[path]
+            response = await self.timed(endpoint, "GET", path, headers=headers)
+            if response is not None and response.status == 200 and "ETag" in response.headers:
+                etags[path] = response.headers["ETag"]
+
+        async def dashboard():
+            await poll("data", f"/eeg/data/{patient_id}/")
+            await poll("spec", f"/eeg/spec/{patient_id}/")
+
+        async def patients():
+            await poll("patients", "/eeg/patients/")
+
+        async def predict():
+            if self.uploads:
+                form = aiohttp.FormData()
+                form.add_field("eeg_file", random.choice(self.uploads), filename="recording.npy",
+                               content_type="application/octet-stream")
+                await self.timed("predict", "POST", "/eeg/predict/", data=form)
+            else:
+                await self.timed("predict", "POST", "/eeg/predict/", json={"patient_id": patient_id})
+
+        async def alert():
+            if random.random() < self.args.alerts_per_hour * self.args.alert_check / 3600:
+                payload = {**ALERT_PAYLOAD, "patient_id": patient_id}
+                if self.args.alert_phone:
+                    payload["phone_number"] = self.args.alert_phone
+                await self.timed("alerts", "POST", "/eeg/alerts/", json=payload)
+
+        await asyncio.gather(
+            self.every(self.args.poll_interval, dashboard),
+            self.every(self.args.patients_interval, patients),
+            self.every(self.args.predict_interval, predict),
+            self.every(self.args.alert_check, alert),
+            self.dashboard_socket(patient_id),
+            self.feed_socket(patient_id),
+        )
+
+    async def _connect(self, patient_id: str) -> Optional[aiohttp.ClientWebSocketResponse]:
+        try:
+            ws = await self.session.ws_connect(f"{self.ws_base}/ws/eeg/{patient_id}/", heartbeat=30)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.recorder.ws_counts["connect_failed"] += 1
+            return None
+        self.recorder.ws_counts["connected"] += 1
+        return ws
+
+    async def dashboard_socket(self, patient_id: str):
+        ws = await self._connect(patient_id)
+        if ws is None:
+            return
+        stopping = asyncio.ensure_future(self.stop.wait())
+        try:
+            while not self.stop.is_set():
+                receiving = asyncio.ensure_future(ws.receive())
+                await asyncio.wait({receiving, stopping}, return_when=asyncio.FIRST_COMPLETED)
+                if not receiving.done():
+                    receiving.cancel()
+                    break
+                message = receiving.result()
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    self.recorder.ws_counts["closed"] += 1
+                    break
+                self.recorder.ws_counts["received"] += 1
+                sent_at = json.loads(message.data).get("sent_at")
+                if sent_at is not None:
+                    self.recorder.ws_lag.append(time.time() - sent_at)
+        finally:
+            stopping.cancel()
+            await ws.close()
+
+    async def feed_socket(self, patient_id: str):
+        if self.args.feed_rate <= 0:
+            return
+        ws = await self._connect(patient_id)
+        if ws is None:
+            return
+        eeg = synthetic_eeg(int(patient_id) if patient_id.isdigit() else 0, length=SAMPLE_RATE * 10)
+        frames = eeg.reshape(19, -1, self.args.feed_samples).transpose(1, 0, 2).tolist()
+        index = 0
+
+        async def send():
+            nonlocal index
+            try:
+                await ws.send_str(json.dumps({"type": "eeg_data", "patient_id": patient_id,
+                                              "sent_at": time.time(), "data": frames[index % len(frames)]}))
+                self.recorder.ws_counts["sent"] += 1
+            except (aiohttp.ClientError, ConnectionResetError):
+                self.recorder.ws_counts["send_failed"] += 1
+            index += 1
+
+        try:
+            await self.every(1 / self.args.feed_rate, send)
+        finally:
+            await ws.close()
+
+    def snapshot(self) -> Dict:
+        summary = self.recorder.summary()
+        self.recorder = Recorder()
+        return summary
+
+
+async def discover_patients(session: aiohttp.ClientSession, base: str) -> List[str]:
+    async with session.get(f"{base}/eeg/patients/") as response:
+        response.raise_for_status()
+        return [str(patient["id"]) for patient in await response.json()]
+
+
+def print_step(beds: int, summary: Dict):
+    print(f"\n{beds} beds, {summary['seconds']:.0f} s")
+    print(f"{'endpoint':<12}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for endpoint, stats in summary["endpoints"].items():
+        print(f"{endpoint:<12}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput']:>9.1f}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}")
+    ws = summary["websocket"]
+    lag = ws["lag"]
+    lag_text = (f"lag p50 {lag['p50_ms']:.1f} / p95 {lag['p95_ms']:.1f} / p99 {lag['p99_ms']:.1f} ms"
+                if lag else "lag n/a (no timestamped frames delivered; is EEG_WS_RELAY=1 set on the server?)")
+    print(f"{'websocket':<12}connected {ws.get('connected', 0)}, failed {ws.get('connect_failed', 0)}, "
+          f"sent {ws.get('sent', 0)}, received {ws.get('received', 0)}; {lag_text}")
+
+
+async def run(args) -> List[Dict]:
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.max_connections)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        patient_ids = args.patients or await discover_patients(session, args.url.rstrip("/"))
+        if not patient_ids:
+            raise SystemExit("No patients: the server lists none; pass --patients")
+        ward = Ward(args, session, patient_ids)
+        beds: List[asyncio.Task] = []
+        steps = []
+        for target in args.beds:
+            while len(beds) < target:
+                beds.append(asyncio.ensure_future(ward.bed(len(beds))))
+            ward.snapshot()  # start the step's measurements after the ramp
+            await asyncio.sleep(args.step_seconds)
+            summary = ward.snapshot()
+            print_step(target, summary)
+            steps.append({"beds": target, **summary})
+        ward.stop.set()
+        await asyncio.gather(*beds, return_exceptions=True)
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--beds", type=int, nargs="+", default=[10, 25, 50], help="bed counts to ramp through")
+    parser.add_argument("--step-seconds", type=float, default=30)
+    parser.add_argument("--patients", nargs="+", help="patient ids (default: those listed by patients/)")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="data/ and spec/ polling, seconds")
+    parser.add_argument("--patients-interval", type=float, default=10.0)
+    parser.add_argument("--predict-interval", type=float, default=15.0)
+    parser.add_argument("--predict-upload", action="store_true", help="upload recordings instead of patient_id")
+    parser.add_argument("--eeg-dir", help="recorded .npy files to upload (default: synthetic)")
+    parser.add_argument("--alerts-per-hour", type=float, default=2.0, help="per bed")
+    parser.add_argument("--alert-check", type=float, default=5.0, help=argparse.SUPPRESS)
+    parser.add_argument("--alert-phone", help="include this phone number, so alerts queue real SMS")
+    parser.add_argument("--feed-rate", type=float, default=5.0, help="bedside feed frames per second per bed")
+    parser.add_argument("--feed-samples", type=int, default=40, help="samples per channel per frame")
+    parser.add_argument("--no-revalidate", dest="revalidate", action="store_false")
+    parser.add_argument("--max-connections", type=int, default=0, help="0: unlimited, like one browser per bed")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", help="write the per-step results to this file")
+    args = parser.parse_args()
+    if (SAMPLE_RATE * 10) % args.feed_samples:
+        parser.error(f"--feed-samples must divide {SAMPLE_RATE * 10}")
+
+    steps = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"url": args.url, "args": vars(args), "steps": steps}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
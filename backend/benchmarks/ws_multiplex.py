@@ -0,0 +1,148 @@
+"""
+Ward dashboards over WebSockets: one socket per patient vs. one multiplexed
+socket (ws/eeg/ward/) per viewer.
+
+Runs the ASGI websocket stack (AuthMiddlewareStack + routing) in process
+against the in-memory channel layer. Each of --viewers viewers watches the same
+--beds patients; every patient's feed publishes --rate frames a second (19
+channels x --samples samples) to its group for --seconds, as EEGConsumer
+relays them. Reports per viewer:
+server memory held by the open connections (tracemalloc), CPU to open them,
+CPU per second of streaming, WebSocket messages per second, and the mean
+delivery lag of the frames (the ward socket adds up to one batch interval).
+
+Run from backend/:
+    python -m benchmarks.ws_multiplex [--viewers 10] [--beds 40] [--rate 4] [--seconds 5] [--interval 0.25]
+"""
+import os
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hms_backend.settings")
+
+import argparse
+import asyncio
+import json
+import logging
+import re
+import time
+import tracemalloc
+
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import get_channel_layer
+from django.test import override_settings
+
+from hms_backend.asgi import application
+
+SENT_AT = re.compile(r'"sent_at":([0-9.e+-]+)')
+
+
+def communicator(path):
+    return ApplicationCommunicator(application, {"type": "websocket", "path": path, "headers": [],
+                                                 "query_string": b"", "subprotocols": []})
+
+
+async def open_viewer(design, beds, interval):
+    """The sockets of one viewer, connected (and subscribed, for the ward design)"""
+    paths = [f"/ws/eeg/{p}/" for p in beds] if design == "per-patient" else ["/ws/eeg/ward/"]
+    sockets = [communicator(path) for path in paths]
+    for socket in sockets:
+        await socket.send_input({"type": "websocket.connect"})
+        assert (await socket.receive_output(5))["type"] == "websocket.accept"
+    if design == "multiplexed":
+        await sockets[0].send_input({"type": "websocket.receive", "text": json.dumps(
+            {"action": "subscribe", "patients": beds, "interval": interval})})
+        assert json.loads((await sockets[0].receive_output(5))["text"])["type"] == "subscriptions"
+    return sockets
+
+
+async def close(sockets):
+    for socket in sockets:
+        await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+    for socket in sockets:
+        await socket.wait(5)
+
+
+async def connect_cost(design, viewers, beds, interval):
+    """(bytes, CPU seconds) per viewer to open its connections"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cpu = time.process_time()
+    opened = [await open_viewer(design, beds, interval) for _ in range(viewers)]
+    cpu = time.process_time() - cpu
+    await asyncio.sleep(0.1)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    for sockets in opened:
+        await close(sockets)
+    return held / viewers, cpu / viewers
+
+
+async def stream_cost(design, viewers, beds, interval, rate, samples, seconds):
+    """(CPU seconds per viewer-second, messages per viewer-second, mean lag s) while streaming"""
+    opened = [await open_viewer(design, beds, interval) for _ in range(viewers)]
+    messages, lags = [0], []
+
+    async def drain(socket):
+        # Timestamps are scanned rather than the messages decoded, so the client
+        # side of the harness costs little and the same in both designs
+        while True:
+            text = (await socket.output_queue.get())["text"]
+            messages[0] += 1
+            now = time.time()
+            sent = SENT_AT.findall(text)
+            if text.startswith('{"type":"eeg_batch"'):
+                sent = sent[1:]  # the batch's own timestamp
+            lags.extend(now - float(t) for t in sent)
+
+    drains = [asyncio.ensure_future(drain(s)) for sockets in opened for s in sockets]
+    layer = get_channel_layer()
+    data = json.dumps([[0.5] * samples for _ in range(19)])
+    cpu, start = time.process_time(), time.perf_counter()
+    tick = 0
+    while time.perf_counter() - start < seconds:
+        for patient_id in beds:
+            # What EEGConsumer relays for a bedside feed frame
+            await layer.group_send(f"eeg_{patient_id}", {"type": "send_eeg_data", "patient_id": patient_id,
+                                                         "text": f'{{"sent_at":{time.time()},"data":{data}}}'})
+        tick += 1
+        await asyncio.sleep(max(0.0, start + tick / rate - time.perf_counter()))
+    await asyncio.sleep(interval * 2)  # let the last batches go out
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    for task in drains:
+        task.cancel()
+    for sockets in opened:
+        await close(sockets)
+    return cpu / viewers / elapsed, messages[0] / viewers / elapsed, sum(lags) / max(len(lags), 1)
+
+
+async def run(args):
+    beds = [str(1000 + i) for i in range(args.beds)]
+    print(f"{args.viewers} viewers x {args.beds} beds, {args.rate} frames/s per bed, {args.samples} samples per frame")
+    print(f"{'design':<14}{'sockets':>8}{'KiB/viewer':>12}{'connect ms':>12}{'CPU ms/s':>10}{'msgs/s':>9}{'lag ms':>9}")
+    for design in ("per-patient", "multiplexed"):
+        memory, connect = await connect_cost(design, args.viewers, beds, args.interval)
+        cpu, rate, lag = await stream_cost(design, args.viewers, beds, args.interval, args.rate, args.samples,
+                                           args.seconds)
+        sockets = args.beds if design == "per-patient" else 1
+        print(f"{design:<14}{sockets:>8}{memory / 1024:>12.1f}{connect * 1e3:>12.2f}{cpu * 1e3:>10.2f}"
+              f"{rate:>9.1f}{lag * 1e3:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--viewers", type=int, default=10)
+    parser.add_argument("--beds", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=4.0, help="frames per second per bed")
+    parser.add_argument("--samples", type=int, default=50, help="samples per channel per frame")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--interval", type=float, default=0.25, help="ward batch interval")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    # The channel layer's per-channel queue must hold a viewer's frames between batches
+    with override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer",
+                                                       "CONFIG": {"capacity": 1000}}}):
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
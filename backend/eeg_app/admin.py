@@ -1,3 +1,11 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import AlertDispatch
+
+
+@admin.register(AlertDispatch)
+class AlertDispatchAdmin(admin.ModelAdmin):
+    list_display = ("id", "patient_id", "phone_number", "severity", "status", "attempts", "coalesced_count",
+                    "created_at", "sent_at")
+    list_filter = ("status", "severity")
+    search_fields = ("patient_id", "phone_number", "provider_sid")
@@ -0,0 +1,310 @@
+"""
+Background dispatch of emergency SMS alerts.
+
+AlertMedicalStaffView only inserts an AlertDispatch row and returns; worker
+threads claim due rows, send them through one shared, connection-pooled
+Twilio client and retry transient failures with exponential backoff.
+
+Alerts for the same patient and phone number are coalesced: while one is
+still pending, new ones are merged into it (latest text wins, the count is
+appended to the SMS), and after one has gone out the next is held until
+ALERT_COALESCE_WINDOW seconds after it, so a storm costs one SMS per window.
+
+Delivery is at-least-once: a row claimed by a worker that died is picked up
+again once its claim is older than ALERT_CLAIM_TIMEOUT.
+
+Run the workers in their own process with ``python manage.py dispatch_alerts``
+or in the web process (ALERT_DISPATCH_IN_PROCESS, started on first alert).
+"""
+import logging
+import random
+import threading
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+from hms_backend.metrics import ALERTS
+
+from .db_retry import retry_locked
+from .models import AlertDispatch
+
+logger = logging.getLogger(__name__)
+
+TWILIO_API_URL = "https://api.twilio.com"
+# HTTP statuses worth retrying; any other Twilio error (bad number, auth) is final
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def normalize_phone_number(phone_number: str) -> str:
+    """Twilio needs full international format; bare numbers are assumed Indian"""
+    phone_number = phone_number.strip()
+    if phone_number.startswith('+'):
+        return phone_number
+    if phone_number.startswith('91'):
+        return '+' + phone_number
+    return '+91' + phone_number
+
+
+class SMSError(Exception):
+    def __init__(self, message: str, retryable: bool):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class _PooledHttpClient(TwilioHttpClient):
+    """
+    TwilioHttpClient with a keep-alive pool sized for the worker count, no
+    transport-level retries (the dispatcher owns retrying) and an optional
+    base URL override so tests and staging can point at a local server.
+    """
+
+    def __init__(self, base_url: Optional[str], timeout: float, pool_size: int):
+        super().__init__(pool_connections=True, timeout=timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.base_url = base_url.rstrip('/') if base_url else None
+
+    def request(self, method, url, *args, **kwargs):
+        if self.base_url and url.startswith(TWILIO_API_URL):
+            url = self.base_url + url[len(TWILIO_API_URL):]
+        return super().request(method, url, *args, **kwargs)
+
+
+class TwilioSMSSender:
+    """One Twilio client, shared by all dispatch workers"""
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str,
+                 base_url: Optional[str] = None, timeout: float = 10.0, pool_size: int = 4):
+        self.from_number = from_number
+        self.client = Client(account_sid, auth_token,
+                             http_client=_PooledHttpClient(base_url, timeout, pool_size))
+
+    @classmethod
+    def from_settings(cls, pool_size: int = 4) -> Optional["TwilioSMSSender"]:
+        account_sid = settings.TWILIO_ACCOUNT_SID
+        auth_token = settings.TWILIO_AUTH_TOKEN
+        from_number = settings.TWILIO_PHONE_NUMBER
+        if not all([account_sid, auth_token, from_number]):
+            return None
+        return cls(account_sid, auth_token, from_number,
+                   base_url=_setting('TWILIO_API_BASE_URL', None),
+                   timeout=_setting('ALERT_SMS_TIMEOUT', 10.0), pool_size=pool_size)
+
+    def send(self, phone_number: str, body: str) -> str:
+        """Send one SMS and return its message SID; raises SMSError"""
+        try:
+            message = self.client.messages.create(body=body, from_=self.from_number, to=phone_number)
+        except TwilioRestException as e:
+            raise SMSError(f"Twilio API error {e.status}: {e.msg}", e.status in RETRYABLE_STATUSES) from e
+        except requests.RequestException as e:
+            raise SMSError(f"Twilio request failed: {e}", retryable=True) from e
+        return message.sid
+
+
+class AlertDispatcher:
+    """Durable, coalescing SMS alert queue backed by the AlertDispatch table"""
+
+    def __init__(self, sender: Optional[TwilioSMSSender] = None, workers: Optional[int] = None,
+                 coalesce_window: Optional[float] = None, max_attempts: Optional[int] = None,
+                 retry_base_delay: Optional[float] = None, retry_max_delay: Optional[float] = None,
+                 claim_timeout: Optional[float] = None, poll_interval: float = 1.0):
+        self.workers = workers or _setting('ALERT_DISPATCH_WORKERS', 4)
+        self.coalesce_window = timedelta(seconds=coalesce_window if coalesce_window is not None
+                                         else _setting('ALERT_COALESCE_WINDOW', 60))
+        self.max_attempts = max_attempts or _setting('ALERT_MAX_ATTEMPTS', 5)
+        self.retry_base_delay = retry_base_delay if retry_base_delay is not None \
+            else _setting('ALERT_RETRY_BASE_DELAY', 2.0)
+        self.retry_max_delay = retry_max_delay if retry_max_delay is not None \
+            else _setting('ALERT_RETRY_MAX_DELAY', 300.0)
+        self.claim_timeout = timedelta(seconds=claim_timeout or _setting('ALERT_CLAIM_TIMEOUT', 120))
+        self.poll_interval = poll_interval
+
+        self._sender = sender
+        self._sender_lock = threading.Lock()
+        self._enqueue_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    # -- producer side ---------------------------------------------------
+
+    def enqueue(self, patient_id, phone_number: str, body: str, alert_type: str = "",
+                severity: str = "", doctor_id: str = "") -> Tuple[AlertDispatch, bool]:
+        """
+        Queue an alert, or merge it into an unsent one for the same patient and
+        recipient. Returns the row that will carry it and whether it was merged.
+        """
+        patient_id = str(patient_id)
+        phone_number = normalize_phone_number(phone_number)
+        fields = dict(body=body, alert_type=alert_type or "", severity=severity or "", doctor_id=doctor_id or "")
+        with self._enqueue_lock:
+            dispatch, coalesced = retry_locked(lambda: self._enqueue(patient_id, phone_number, fields))
+        if not coalesced:
+            self._wakeup.set()
+        return dispatch, coalesced
+
+    def _enqueue(self, patient_id: str, phone_number: str, fields: Dict) -> Tuple[AlertDispatch, bool]:
+        current = timezone.now()
+        with transaction.atomic():
+            same_key = AlertDispatch.objects.filter(patient_id=patient_id, phone_number=phone_number)
+            pending = same_key.filter(status=AlertDispatch.PENDING).order_by('-created_at').first()
+            if pending is not None:
+                merged = AlertDispatch.objects.filter(pk=pending.pk, status=AlertDispatch.PENDING) \
+                    .update(coalesced_count=F('coalesced_count') + 1, **fields)
+                if merged:
+                    pending.refresh_from_db()
+                    logger.info(f"Coalesced alert for patient {patient_id} into dispatch {pending.pk}")
+                    ALERTS.labels("coalesced").inc()
+                    return pending, True
+
+            # Hold the next SMS until a window after the last one that went out
+            last = same_key.filter(status__in=[AlertDispatch.SENDING, AlertDispatch.SENT],
+                                   created_at__gte=current - self.coalesce_window) \
+                .order_by('-created_at').first()
+            next_attempt_at = max(current, last.created_at + self.coalesce_window) if last else current
+            dispatch = AlertDispatch.objects.create(patient_id=patient_id, phone_number=phone_number,
+                                                    next_attempt_at=next_attempt_at, **fields)
+        return dispatch, False
+
+    # -- consumer side ---------------------------------------------------
+
+    def _get_sender(self) -> Optional[TwilioSMSSender]:
+        with self._sender_lock:
+            if self._sender is None:
+                self._sender = TwilioSMSSender.from_settings(pool_size=self.workers)
+            return self._sender
+
+    def _due(self, current):
+        stale_claim = current - self.claim_timeout
+        return AlertDispatch.objects.filter(
+            Q(status=AlertDispatch.PENDING, next_attempt_at__lte=current)
+            | Q(status=AlertDispatch.SENDING, claimed_at__lt=stale_claim)
+        )
+
+    def _claim(self) -> Optional[AlertDispatch]:
+        """Atomically take one due row; several workers may race for the same one"""
+        current = timezone.now()
+        due = self._due(current)
+        for pk in due.order_by('next_attempt_at').values_list('pk', flat=True)[:self.workers]:
+            # Re-checking "due" in the UPDATE makes the claim a compare-and-set
+            claimed = due.filter(pk=pk).update(status=AlertDispatch.SENDING, claimed_at=current,
+                                               attempts=F('attempts') + 1)
+            if claimed:
+                return AlertDispatch.objects.get(pk=pk)
+        return None
+
+    @staticmethod
+    def _record(pk, **fields):
+        # A lost update after a send would leave the row 'sending' and resend it later
+        return retry_locked(lambda: AlertDispatch.objects.filter(pk=pk).update(**fields))
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _deliver(self, dispatch: AlertDispatch):
+        body = dispatch.body
+        if dispatch.coalesced_count:
+            body += f"\n(+{dispatch.coalesced_count} more alerts for this patient)"
+
+        sender = self._get_sender()
+        try:
+            if sender is None:
+                raise SMSError("Missing Twilio credentials in environment variables", retryable=False)
+            sid = sender.send(dispatch.phone_number, body)
+        except SMSError as e:
+            if e.retryable and dispatch.attempts < self.max_attempts:
+                delay = self._backoff(dispatch.attempts)
+                logger.warning(f"Alert {dispatch.pk} attempt {dispatch.attempts} failed ({e}); retrying in {delay:.1f}s")
+                ALERTS.labels("retry").inc()
+                self._record(
+                    dispatch.pk, status=AlertDispatch.PENDING, last_error=str(e),
+                    next_attempt_at=timezone.now() + timedelta(seconds=delay))
+            else:
+                logger.error(f"Alert {dispatch.pk} to {dispatch.phone_number} failed after "
+                             f"{dispatch.attempts} attempts: {e}")
+                self._record(dispatch.pk, status=AlertDispatch.FAILED, last_error=str(e))
+                ALERTS.labels("failed").inc()
+            return
+
+        logger.info(f"Alert {dispatch.pk} sent to {dispatch.phone_number}. SID: {sid}")
+        ALERTS.labels("sent").inc()
+        self._record(dispatch.pk, status=AlertDispatch.SENT, provider_sid=sid or "",
+                     sent_at=timezone.now(), last_error="")
+
+    def run_once(self) -> bool:
+        """Claim and deliver one due alert in the calling thread; False if none was due"""
+        dispatch = self._claim()
+        if dispatch is None:
+            return False
+        self._deliver(dispatch)
+        return True
+
+    def drain(self) -> int:
+        """Deliver alerts in the calling thread until none is due; returns the number handled"""
+        count = 0
+        while self.run_once():
+            count += 1
+        return count
+
+    def _seconds_until_next(self) -> float:
+        next_at = AlertDispatch.objects.filter(status=AlertDispatch.PENDING) \
+            .order_by('next_attempt_at').values_list('next_attempt_at', flat=True).first()
+        if next_at is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.0, (next_at - timezone.now()).total_seconds()))
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            close_old_connections()
+            try:
+                if self.run_once():
+                    continue
+                timeout = self._seconds_until_next()
+            except Exception as e:
+                logger.error(f"Alert dispatch worker error: {e}", exc_info=True)
+                timeout = self.poll_interval
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+        connection.close()
+
+    # -- lifecycle -------------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def start(self):
+        with self._sender_lock:
+            if self.running:
+                return
+            self._stopping.clear()
+            self._threads = [threading.Thread(target=self._worker, name=f"alert-dispatch-{i}", daemon=True)
+                             for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Started {self.workers} alert dispatch workers")
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+alert_dispatcher = AlertDispatcher()
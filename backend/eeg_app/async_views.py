@@ -0,0 +1,90 @@
+"""
+Async-native versions of the data views for the ASGI deployment.
+
+Django runs a sync view under ASGI through sync_to_async(thread_sensitive=True),
+so every sync request in a worker shares one thread. These views keep the
+event loop free instead: loading, inference and JSON rendering run on a
+bounded thread pool (ASYNC_VIEW_WORKERS), and any number of requests can wait
+on it at once. The responses are byte-identical to the DRF views'.
+"""
+import asyncio
+import functools
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.renderers import JSONRenderer
+
+from hms_backend.profiling import bind
+
+from .views import eeg_data_response, patients_payload, predict_payload, snapshot_points, snapshot_response, spec_data_response
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=settings.ASYNC_VIEW_WORKERS, thread_name_prefix="eeg-view")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the view executor without holding the event loop"""
+    loop = asyncio.get_running_loop()
+    # bind() profiles the call when this request is being profiled
+    return await loop.run_in_executor(executor, bind(functools.partial(fn, *args, **kwargs)))
+
+
+def _render(payload_fn, *args):
+    payload, code = payload_fn(*args)
+    return JSONRenderer().render(payload), code
+
+
+async def respond(payload_fn, *args) -> HttpResponse:
+    """Build and serialize a ``(payload, status)`` view result off the event loop"""
+    body, code = await run_blocking(_render, payload_fn, *args)
+    return HttpResponse(body, status=code, content_type="application/json")
+
+
+def _predict_from_request(request):
+    # Body and multipart parsing read the request stream, so they run here too
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError as e:
+            return {"error": f"JSON parse error - {e}"}, 400
+        return predict_payload(data if isinstance(data, dict) else {}, {})
+    return predict_payload(request.POST, request.FILES)
+
+
+class AsyncEEGDataView(View):
+    async def get(self, request, patient_id):
+        return await run_blocking(eeg_data_response, request, patient_id)
+
+
+class AsyncSPECDataView(View):
+    async def get(self, request, patient_id):
+        return await run_blocking(spec_data_response, request, patient_id)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPredictEEG(View):
+    async def post(self, request):
+        return await respond(_predict_from_request, request)
+
+
+class AsyncPatientsView(View):
+    async def get(self, request):
+        return await respond(patients_payload)
+
+
+class AsyncPatientSnapshotView(View):
+    async def get(self, request, patient_id):
+        try:
+            points = snapshot_points(request.GET)
+        except ValueError as e:
+            return HttpResponse(JSONRenderer().render({"error": f"Invalid points: {e}"}), status=400,
+                                content_type="application/json")
+        body, code = await run_blocking(snapshot_response, patient_id, points)
+        return HttpResponse(body, status=code, content_type="application/json")
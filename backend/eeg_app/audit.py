@@ -0,0 +1,141 @@
+"""
+Buffered audit log of predictions and alerts, on with AUDIT_LOG=1.
+
+Request handlers call ``audit_log.record_prediction`` / ``record_alert``,
+which build the model instance and append it to an in-memory list: no
+database round trip on the request path. A background thread writes the
+list with one ``bulk_create`` per model every AUDIT_FLUSH_INTERVAL seconds,
+or as soon as AUDIT_BATCH_SIZE records are waiting. If the database falls
+behind by AUDIT_MAX_PENDING records, new ones are dropped and counted
+(hms_audit_records{outcome="dropped"}) rather than growing without bound.
+Records still buffered are written at exit.
+
+Rows appear up to one flush interval after the response; ``created_at`` is
+the time of the prediction or alert, not of the write.
+"""
+import atexit
+import logging
+import threading
+from functools import wraps
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from hms_backend.metrics import AUDIT_RECORDS
+
+from .db_retry import retry_locked
+from .models import AlertRecord, PredictionRecord
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog:
+    def __init__(self, flush_interval: float = 1.0, batch_size: int = 500, max_pending: int = 100000):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending: List = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, instance) -> bool:
+        """Buffer an unsaved model instance for the next flush; False if dropped"""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                AUDIT_RECORDS.labels(type(instance).__name__, "dropped").inc()
+                return False
+            self._pending.append(instance)
+            full = len(self._pending) >= self.batch_size
+        if self._thread is None:
+            self.start()
+        if full:
+            self._wake.set()
+        return True
+
+    def record_prediction(self, payload: Dict, patient_id: Optional[str] = None) -> bool:
+        """Buffer a successful predict_payload response; other responses are ignored"""
+        result = payload.get("result") or {}
+        if "predicted_class" not in result:
+            return False
+        return self.record(PredictionRecord(
+            patient_id=patient_id or "", model=payload.get("model", ""), input_method=payload.get("input_method", ""),
+            predicted_class=result["predicted_class"], confidence=result.get("confidence", 0.0),
+            probabilities=result.get("probabilities", {}), seq=payload.get("seq"), created_at=timezone.now()))
+
+    def record_alert(self, patient_id: str, alert_type: str = "", severity: str = "", doctor_id: str = "",
+                     message: str = "", confidence_scores=None, dispatch_id: Optional[int] = None,
+                     coalesced: bool = False) -> bool:
+        return self.record(AlertRecord(
+            patient_id=patient_id or "", alert_type=alert_type or "", severity=severity or "",
+            doctor_id=doctor_id or "", message=message or "", confidence_scores=confidence_scores,
+            dispatch_id=dispatch_id, coalesced=coalesced, created_at=timezone.now()))
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stop.is_set():  # close() writes the rest
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Audit log flush failed: {e}")
+            finally:
+                close_old_connections()
+
+    def flush(self) -> int:
+        """Write everything buffered, one bulk_create per model; returns the rows written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            by_model: Dict[type, List] = {}
+            for instance in pending:
+                by_model.setdefault(type(instance), []).append(instance)
+            written = 0
+            for model, instances in by_model.items():
+                try:
+                    retry_locked(lambda: model.objects.bulk_create(instances, batch_size=self.batch_size))
+                except Exception as e:
+                    AUDIT_RECORDS.labels(model.__name__, "failed").inc(len(instances))
+                    logger.error(f"Dropped {len(instances)} {model.__name__} audit records: {e}")
+                    continue
+                AUDIT_RECORDS.labels(model.__name__, "written").inc(len(instances))
+                written += len(instances)
+            return written
+
+    def close(self):
+        """Stop the background thread and write what is still buffered"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+
+def audited(payload_fn):
+    """Record the predictions a ``(data, files) -> (payload, status)`` function serves"""
+    @wraps(payload_fn)
+    def wrapper(data, files):
+        payload, code = payload_fn(data, files)
+        if settings.AUDIT_LOG and code == 200:
+            try:
+                audit_log.record_prediction(payload, str(data["patient_id"]) if "patient_id" in data else None)
+            except Exception as e:
+                logger.error(f"Error recording prediction: {e}")
+        return payload, code
+    return wrapper
+
+
+audit_log = AuditLog(settings.AUDIT_FLUSH_INTERVAL, settings.AUDIT_BATCH_SIZE, settings.AUDIT_MAX_PENDING)
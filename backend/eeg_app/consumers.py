@@ -1,6 +1,41 @@
 # backend/eeg_app/consumers.py
+import asyncio
 import json
+import logging
+import math
+import re
+import time
+from collections import deque
+from typing import Deque, Dict
+
+import numpy as np
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from hms_backend.metrics import WEBSOCKET_EVENTS, WEBSOCKET_MESSAGE_SECONDS
+from .live_buffers import N_CHANNELS, live_buffers
+from .rolling_spectrogram import live_spectrograms
+from .spectrogram_generator import MONTAGES
+
+logger = logging.getLogger(__name__)
+
+_CONNECTS = WEBSOCKET_EVENTS.labels("eeg", "connect")
+_DISCONNECTS = WEBSOCKET_EVENTS.labels("eeg", "disconnect")
+_RECEIVED = WEBSOCKET_EVENTS.labels("eeg", "receive")
+_SENT = WEBSOCKET_EVENTS.labels("eeg", "send")
+_RECEIVE_SECONDS = WEBSOCKET_MESSAGE_SECONDS.labels("eeg", "receive")
+_SEND_SECONDS = WEBSOCKET_MESSAGE_SECONDS.labels("eeg", "send")
+_WARD_CONNECTS = WEBSOCKET_EVENTS.labels("ward", "connect")
+_WARD_DISCONNECTS = WEBSOCKET_EVENTS.labels("ward", "disconnect")
+_WARD_RECEIVED = WEBSOCKET_EVENTS.labels("ward", "receive")
+_WARD_SENT = WEBSOCKET_EVENTS.labels("ward", "send")
+_WARD_DROPPED = WEBSOCKET_EVENTS.labels("ward", "drop")
+_WARD_SEND_SECONDS = WEBSOCKET_MESSAGE_SECONDS.labels("ward", "send")
+_SPEC_CONNECTS = WEBSOCKET_EVENTS.labels("spec", "connect")
+_SPEC_DISCONNECTS = WEBSOCKET_EVENTS.labels("spec", "disconnect")
+_SPEC_SENT = WEBSOCKET_EVENTS.labels("spec", "send")
+
+# Channel layer group names allow ASCII letters, digits, "-", "_" and "."
+PATIENT_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
 
 class EEGConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -13,19 +48,217 @@ class EEGConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
-        print(f"WebSocket connected for {self.patient_id}")
+        _CONNECTS.inc()
+        logger.info(f"WebSocket connected for {self.patient_id}")
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
-        print(f"WebSocket disconnected for {self.patient_id}")
+        _DISCONNECTS.inc()
+        logger.info(f"WebSocket disconnected for {self.patient_id}")
 
-    async def receive(self, text_data):
-        print("Received:", text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        start = time.perf_counter()
+        _RECEIVED.inc()
+        logger.debug(f"Received: {text_data if bytes_data is None else f'{len(bytes_data)} bytes'}")
         # Optionally parse and process EEG data
+        if settings.EEG_WS_RELAY and text_data:
+            # Bedside feed: fan the frame out to every socket watching this patient
+            try:
+                json.loads(text_data)
+            except ValueError as e:
+                logger.warning(f"Dropping malformed frame for {self.patient_id}: {e}")
+            else:
+                # Relay the validated text: a string is cheap for the channel layer to
+                # copy per receiver, and no receiver has to encode the frame again
+                await self.channel_layer.group_send(self.room_group_name, {"type": "send_eeg_data", "text": text_data,
+                                                                            "patient_id": self.patient_id})
+        if settings.EEG_INGEST and bytes_data:
+            # Gateway sample chunk into the patient's ring buffer (a few microseconds of copying)
+            try:
+                ack, seq, samples = live_buffers.write_chunk(self.patient_id, bytes_data)
+            except ValueError as e:
+                logger.warning(f"Rejected EEG chunk for {self.patient_id}: {e}")
+                await self.send(text_data=json.dumps({"type": "error", "message": str(e)}))
+            else:
+                if ack is not None:
+                    await self.send(text_data=json.dumps(ack))
+                if samples.shape[1]:
+                    # The new samples, to ward sockets subscribed to this patient
+                    await self.channel_layer.group_send(f"live_{self.patient_id}", {
+                        "type": "send_live_samples", "patient_id": self.patient_id, "seq": seq,
+                        "samples": samples.tobytes()})
+                if settings.LIVE_SPECTROGRAM:
+                    # Only the columns this chunk completed, to ws/eeg/<id>/spec/ sockets
+                    message = live_spectrograms.update(self.patient_id, live_buffers.get(self.patient_id))
+                    if message is not None:
+                        await self.channel_layer.group_send(f"spec_{self.patient_id}",
+                                                            {"type": "send_spec_columns", "text": json.dumps(message)})
+        _RECEIVE_SECONDS.observe(time.perf_counter() - start)
 
     # Optional: Send data from backend
     async def send_eeg_data(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        start = time.perf_counter()
+        await self.send(text_data=event["text"] if "text" in event else json.dumps(event["data"]))
+        _SENT.inc()
+        _SEND_SECONDS.observe(time.perf_counter() - start)
+
+
+class WardConsumer(AsyncWebsocketConsumer):
+    """
+    One socket for a whole ward overview (ws/eeg/ward/). The client sends
+        {"action": "subscribe", "patients": ["7", "8"], "interval": 0.5}
+        {"action": "unsubscribe", "patients": ["8"]}
+    ("interval" optional, seconds, at least WARD_WS_MIN_INTERVAL) and gets the
+    current set back as {"type": "subscriptions", "patients": [...]}. Frames
+    for any subscribed patient are buffered and sent every interval as one
+    message:
+        {"type": "eeg_batch", "sent_at": <epoch s>, "frames": {"7": [frame, ...]},
+         "dropped": {"7": n}}
+    keeping the newest WARD_WS_MAX_FRAMES frames per patient ("dropped" only
+    when some were not). A frame is either a JSON frame relayed to the
+    patient's group (as EEGConsumer receives them) or the new samples of a
+    gateway chunk ingested by EEGConsumer, as {"seq": <stream position of the
+    first>, "eeg": [[samples] per channel]} with null for missing samples.
+    """
+
+    async def connect(self):
+        self.subscriptions: Dict[str, Deque] = {}
+        self.dropped: Dict[str, int] = {}
+        self.interval = settings.WARD_WS_INTERVAL
+        self.flusher = None
+        await self.accept()
+        _WARD_CONNECTS.inc()
+        logger.info("Ward WebSocket connected")
+
+    async def disconnect(self, close_code):
+        if self.flusher is not None:
+            self.flusher.cancel()
+        for patient_id in self.subscriptions:
+            await self.leave(patient_id)
+        self.subscriptions.clear()
+        _WARD_DISCONNECTS.inc()
+        logger.info("Ward WebSocket disconnected")
+
+    async def receive(self, text_data=None, bytes_data=None):
+        _WARD_RECEIVED.inc()
+        try:
+            command = json.loads(text_data or "")
+            action, patients = command["action"], command.get("patients", [])
+            if not isinstance(patients, list) or not all(isinstance(p, str) and PATIENT_ID.match(p) for p in patients):
+                raise ValueError("patients must be a list of patient ids")
+            if action == "subscribe":
+                await self.subscribe(patients, command.get("interval"))
+            elif action == "unsubscribe":
+                await self.unsubscribe(patients)
+            else:
+                raise ValueError(f"unknown action {action!r}")
+        except (ValueError, KeyError, TypeError) as e:
+            await self.send(text_data=json.dumps({"type": "error", "message": str(e)}))
+            return
+        await self.send(text_data=json.dumps({"type": "subscriptions", "patients": sorted(self.subscriptions)}))
+
+    async def subscribe(self, patients, interval=None):
+        if interval is not None:
+            interval = float(interval)
+            if not math.isfinite(interval):
+                raise ValueError("interval must be a finite number of seconds")
+            self.interval = max(interval, settings.WARD_WS_MIN_INTERVAL)
+        new = [p for p in dict.fromkeys(patients) if p not in self.subscriptions]
+        if len(self.subscriptions) + len(new) > settings.WARD_WS_MAX_SUBSCRIPTIONS:
+            raise ValueError(f"at most {settings.WARD_WS_MAX_SUBSCRIPTIONS} patients per connection")
+        for patient_id in new:
+            self.subscriptions[patient_id] = deque(maxlen=settings.WARD_WS_MAX_FRAMES)
+            await self.channel_layer.group_add(f"eeg_{patient_id}", self.channel_name)
+            await self.channel_layer.group_add(f"live_{patient_id}", self.channel_name)
+        if self.flusher is None and self.subscriptions:
+            self.flusher = asyncio.ensure_future(self.flush_periodically())
+
+    async def unsubscribe(self, patients):
+        for patient_id in patients:
+            if self.subscriptions.pop(patient_id, None) is not None:
+                self.dropped.pop(patient_id, None)
+                await self.leave(patient_id)
+
+    async def leave(self, patient_id):
+        await self.channel_layer.group_discard(f"eeg_{patient_id}", self.channel_name)
+        await self.channel_layer.group_discard(f"live_{patient_id}", self.channel_name)
+
+    async def send_eeg_data(self, event):
+        if "patient_id" not in event:
+            # The group name is not part of the event: without the tag the patient is unknown
+            logger.warning("Ward socket dropped a send_eeg_data event without patient_id")
+            _WARD_DROPPED.inc()
+            return
+        self.buffer(event["patient_id"], event["text"] if "text" in event else json.dumps(event["data"]))
+
+    async def send_live_samples(self, event):
+        samples = np.frombuffer(event["samples"], dtype="<f4").reshape(N_CHANNELS, -1)
+        eeg = [[v if math.isfinite(v) else None for v in channel] for channel in samples.tolist()]
+        self.buffer(event["patient_id"], json.dumps({"seq": event["seq"], "eeg": eeg}))
+
+    def buffer(self, patient_id, frame):
+        frames = self.subscriptions.get(patient_id)
+        if frames is None:  # unsubscribed while the message was in flight
+            return
+        if len(frames) == frames.maxlen:
+            self.dropped[patient_id] = self.dropped.get(patient_id, 0) + 1
+            _WARD_DROPPED.inc()
+        frames.append(frame)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        """Send everything buffered since the last flush as one eeg_batch message"""
+        if not any(self.subscriptions.values()):
+            return
+        start = time.perf_counter()
+        # Frames are buffered as JSON text and spliced in without decoding
+        frames = []
+        for patient_id, buffered in self.subscriptions.items():
+            if buffered:
+                frames.append(f'{json.dumps(patient_id)}:[{",".join(buffered)}]')
+                buffered.clear()
+        text = f'{{"type":"eeg_batch","sent_at":{time.time()},"frames":{{{",".join(frames)}}}'
+        if self.dropped:
+            text += f',"dropped":{json.dumps(self.dropped)}'
+            self.dropped = {}
+        await self.send(text_data=text + "}")
+        _WARD_SENT.inc()
+        _WARD_SEND_SECONDS.observe(time.perf_counter() - start)
+
+
+class SpectrogramConsumer(AsyncWebsocketConsumer):
+    """
+    Rolling spectrogram of a streaming patient (ws/eeg/<patient_id>/spec/).
+    On connect: the current image, {"type": "spec_image", "next_column": i,
+    "columns": {montage: [[128 values] per column, oldest first]}} (if the
+    stream has started), then each update's new columns as
+    {"type": "spec_columns", "column": <index of the first>, "seq": <stream
+    position>, "columns": {montage: [[128 values], ...]}}.
+    """
+
+    async def connect(self):
+        self.patient_id = self.scope['url_route']['kwargs']['patient_id']
+        await self.channel_layer.group_add(f"spec_{self.patient_id}", self.channel_name)
+        await self.accept()
+        _SPEC_CONNECTS.inc()
+        spectrogram = live_spectrograms.get(self.patient_id)
+        if spectrogram is not None:
+            image = spectrogram.ordered()
+            await self.send(text_data=json.dumps({
+                "type": "spec_image", "next_column": spectrogram.next_column,
+                "columns": {name: image[:, :, k].T.tolist() for k, name in enumerate(MONTAGES)}}))
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(f"spec_{self.patient_id}", self.channel_name)
+        _SPEC_DISCONNECTS.inc()
+
+    async def send_spec_columns(self, event):
+        await self.send(text_data=event["text"])
+        _SPEC_SENT.inc()
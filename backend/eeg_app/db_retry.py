@@ -0,0 +1,30 @@
+"""
+Retrying writes that lose a race for SQLite's lock.
+
+Background writers (alert dispatch, the audit log, shard leases) share the
+database with request handlers. SQLite serializes writers, and a write that
+finds the database or a table locked fails with OperationalError instead of
+waiting. ``retry_locked`` retries those, with exponential backoff. Any other
+OperationalError (a missing table, disk I/O, a corrupt file) is raised at once.
+"""
+import time
+
+from django.db import OperationalError
+
+# SQLITE_BUSY and SQLITE_LOCKED (shared-cache databases, e.g. the in-memory test database)
+LOCKED_MESSAGES = ("database is locked", "database table is locked")
+
+
+def is_locked(error: Exception) -> bool:
+    return isinstance(error, OperationalError) and any(message in str(error) for message in LOCKED_MESSAGES)
+
+
+def retry_locked(fn, retries: int = 6):
+    """Call ``fn``, retrying with backoff while SQLite reports the database locked"""
+    for attempt in range(retries):
+        try:
+            return fn()
+        except OperationalError as e:
+            if not is_locked(e) or attempt == retries - 1:
+                raise
+            time.sleep(0.05 * 2 ** attempt)
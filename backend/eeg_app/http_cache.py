@@ -0,0 +1,274 @@
+"""
+Conditional GET and pre-compressed responses for endpoints that serialize a
+stored array file (EEGDataView, SPECDataView), and cached JSON fragments for
+responses assembled from several files (the patient snapshot).
+
+A response is identified by the file it was built from: the ETag hashes the
+endpoint, the file's device/inode, size and mtime, and RESPONSE_FORMAT_VERSION.
+If-None-Match / If-Modified-Since are answered with a 304 from a single stat,
+before any array is loaded. Otherwise the JSON body is looked up in a
+ResponseCache already encoded for the client (zstd, br, gzip or identity), so
+a repeated view of a patient costs a stat and a cache read. Bodies are only
+built and compressed on a miss, and a changed file simply gets a new ETag.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework.renderers import JSONRenderer
+
+from hms_backend.metrics import CACHE_REQUESTS
+from intelligence.recording_store import patient_directory
+
+try:
+    import brotli
+except ImportError:  # optional: br is simply not offered
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd is simply not offered
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+_NOT_MODIFIED = CACHE_REQUESTS.labels("response", "not_modified")
+_HITS = CACHE_REQUESTS.labels("response", "hit")
+_MISSES = CACHE_REQUESTS.labels("response", "miss")
+
+# Bump when the JSON produced from the same file changes, to invalidate caches and ETags
+RESPONSE_FORMAT_VERSION = 1
+CACHE_CONTROL = "private, no-cache"  # always revalidate; revalidation is a stat
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=10).compress(data)
+
+
+# Content-Encoding -> (cache file suffix, compressor), in server preference order
+ENCODINGS = OrderedDict([
+    ("zstd", ("zst", _zstd_compress if zstandard else None)),
+    ("br", ("br", (lambda data: brotli.compress(data, quality=9)) if brotli else None)),
+    ("gzip", ("gz", lambda data: gzip.compress(data, compresslevel=6, mtime=0))),
+    ("identity", ("json", lambda data: data)),
+])
+AVAILABLE_ENCODINGS = [name for name, (_, compress) in ENCODINGS.items() if compress is not None]
+
+
+class Validators(NamedTuple):
+    etag_base: str
+    last_modified: int
+
+    def etag(self, encoding: str) -> str:
+        # Strong ETags must differ between encodings of the same resource
+        return f'"{self.etag_base}"' if encoding == "identity" else f'"{self.etag_base}-{encoding}"'
+
+
+def file_validators(kind: str, path: str, variant: str = "") -> Optional[Validators]:
+    """
+    ETag and Last-Modified for the response built from ``path``, and from
+    whatever ``variant`` names besides the file; None if it does not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    identity = f"{RESPONSE_FORMAT_VERSION}:{kind}:{variant}:{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+    return Validators(hashlib.sha1(identity.encode()).hexdigest()[:24], int(st.st_mtime))
+
+
+def _strip_encoding(tag: str) -> str:
+    for encoding in ENCODINGS:
+        if tag.endswith(f"-{encoding}"):
+            return tag[:-len(encoding) - 1]
+    return tag
+
+
+def is_not_modified(request, validators: Validators) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        # Weak comparison, and any encoding of the current representation matches
+        for tag in parse_etags(if_none_match):
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if _strip_encoding(tag.strip('"')) == validators.etag_base:
+                return True
+        return False
+    since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+    return since is not None and validators.last_modified <= since
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """Pick the preferred available encoding the client accepts (RFC 9110 q-values)"""
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+    for encoding in AVAILABLE_ENCODINGS:
+        if encoding == "identity":
+            return encoding
+        if weights.get(encoding, weights.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+class ResponseCache:
+    """
+    Encoded response bodies keyed by (kind, patient, ETag, encoding): an
+    in-memory LRU bounded by ``memory_bytes`` in front of files under ``root``,
+    which other worker processes and restarts reuse. Each key has its own
+    directory, ``root/kind/key/``, holding the bodies of its current ETag.
+    """
+
+    def __init__(self, root: str, memory_bytes: int = 128 * 1024 * 1024):
+        self.root = root
+        self.memory_bytes = memory_bytes
+        self._memory: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+
+    def _directory(self, kind: str, key: str) -> str:
+        # ValueError unless the key is one plain path component
+        return patient_directory(os.path.join(self.root, kind), key)
+
+    def _path(self, kind: str, key: str, etag_base: str, encoding: str) -> str:
+        return os.path.join(self._directory(kind, key), f"{etag_base}.{ENCODINGS[encoding][0]}")
+
+    def _remember(self, cache_key: Tuple, body: bytes):
+        with self._lock:
+            if cache_key in self._memory:
+                self._memory.move_to_end(cache_key)
+                return
+            if len(body) > self.memory_bytes:
+                return
+            self._memory[cache_key] = body
+            self._memory_used += len(body)
+            while self._memory_used > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+
+    def get(self, kind: str, key: str, etag_base: str, encoding: str) -> Optional[bytes]:
+        cache_key = (kind, key, etag_base, encoding)
+        with self._lock:
+            body = self._memory.get(cache_key)
+            if body is not None:
+                self._memory.move_to_end(cache_key)
+                return body
+        try:
+            with open(self._path(kind, key, etag_base, encoding), "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        self._remember(cache_key, body)
+        return body
+
+    def put(self, kind: str, key: str, etag_base: str, encoding: str, body: bytes):
+        self._remember((kind, key, etag_base, encoding), body)
+        try:
+            directory = self._directory(kind, key)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, self._path(kind, key, etag_base, encoding))
+            # Drop bodies built from older versions of this patient's file
+            for name in os.listdir(directory):
+                if not name.startswith(f"{etag_base}.") and not name.endswith(".tmp"):
+                    os.unlink(os.path.join(directory, name))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not write response cache entry for {kind}/{key}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+
+
+def _finish(response: HttpResponse, validators: Validators, encoding: str) -> HttpResponse:
+    response["ETag"] = validators.etag(encoding)
+    response["Last-Modified"] = http_date(validators.last_modified)
+    response["Cache-Control"] = CACHE_CONTROL
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+def cached_file_response(request, cache: ResponseCache, kind: str, key: str, path: str,
+                         payload_fn: Callable, *args) -> HttpResponse:
+    """
+    JSON response for the array file at ``path``: 304 if the client's copy is
+    current, else the cached encoded body, else ``payload_fn(*args)`` (which
+    returns ``(payload, status)``) rendered, compressed and cached.
+    """
+    validators = file_validators(kind, path)
+    if validators is not None:
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+        if is_not_modified(request, validators):
+            _NOT_MODIFIED.inc()
+            return _finish(HttpResponseNotModified(), validators, encoding)
+        body = cache.get(kind, key, validators.etag_base, encoding)
+        if body is not None:
+            _HITS.inc()
+            return _encoded_response(body, validators, encoding)
+        _MISSES.inc()
+
+    payload, code = payload_fn(*args)
+    raw = JSONRenderer().render(payload)
+    if code != 200 or validators is None:
+        return HttpResponse(raw, status=code, content_type="application/json")
+
+    body = ENCODINGS[encoding][1](raw)
+    # Only cache if the file did not change while it was being read
+    if file_validators(kind, path) == validators:
+        cache.put(kind, key, validators.etag_base, encoding, body)
+    return _encoded_response(body, validators, encoding)
+
+
+def cached_json(cache: ResponseCache, kind: str, key: str, path: str, build: Callable, variant: str = "") -> bytes:
+    """
+    Rendered JSON of ``build()``, a value derived from the file at ``path``
+    (and ``variant``, see file_validators), cached like the response bodies
+    (uncompressed), for splicing into a larger response.
+    """
+    validators = file_validators(kind, path, variant)
+    if validators is not None:
+        body = cache.get(kind, key, validators.etag_base, "identity")
+        if body is not None:
+            _HITS.inc()
+            return body
+        _MISSES.inc()
+    body = JSONRenderer().render(build())
+    if validators is not None and file_validators(kind, path, variant) == validators:
+        cache.put(kind, key, validators.etag_base, "identity", body)
+    return body
+
+
+def _encoded_response(body: bytes, validators: Validators, encoding: str) -> HttpResponse:
+    response = HttpResponse(body, content_type="application/json")
+    if encoding != "identity":
+        response["Content-Encoding"] = encoding
+    return _finish(response, validators, encoding)
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_PATH, settings.RESPONSE_CACHE_MEMORY_BYTES)
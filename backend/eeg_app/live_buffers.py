@@ -0,0 +1,169 @@
+"""
+Live EEG pushed by bedside gateways over ws/eeg/<patient_id>/.
+
+A gateway sends binary WebSocket messages, each one chunk of samples:
+
+    header   <2sBBIQ: magic b"EG", version 1, flags, n_samples, seq
+    payload  19 x n_samples little-endian float32, channel-major
+
+``seq`` is the stream position of the chunk's first sample. Chunks go into
+the patient's EEGRingBuffer (intelligence.ring_buffer), which holds the last
+LIVE_BUFFER_MINUTES at LIVE_SAMPLE_RATE in place. Retransmitted samples are
+dropped and skipped ones read as NaN. With flag ACK the server answers
+{"type": "ack", "seq": <next expected seq>}; it always does after a gap or a
+duplicate, so a gateway can resend from there.
+
+Buffers live in the worker process that receives the chunks, so a patient's
+gateway and readers must reach the same worker (one worker, or sticky routing).
+
+With EEG_RECORD the new samples of every chunk are also queued on
+``recording_writer`` (intelligence.recording_store), which persists them in
+the background; ``recording_reader`` reads them back. EEGConsumer also
+publishes them to the patient's ``live_<id>`` group for ward sockets.
+"""
+import logging
+import struct
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+import numpy as np
+from django.conf import settings
+
+from intelligence.recording_store import RecordingReader, RecordingWriter
+from intelligence.ring_buffer import EEGRingBuffer
+from hms_backend.metrics import LIVE_SAMPLES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+HEADER = struct.Struct("<2sBBIQ")
+MAGIC = b"EG"
+VERSION = 1
+FLAG_ACK = 1
+N_CHANNELS = 19
+
+_WRITTEN = LIVE_SAMPLES.labels("written")
+_GAP = LIVE_SAMPLES.labels("gap")
+_DUPLICATE = LIVE_SAMPLES.labels("duplicate")
+
+
+def encode_chunk(seq: int, samples: np.ndarray, flags: int = 0) -> bytes:
+    """The binary message for (19, n) ``samples`` starting at ``seq`` (what a gateway sends)"""
+    samples = np.ascontiguousarray(samples, dtype="<f4")
+    if samples.ndim != 2 or samples.shape[0] != N_CHANNELS:
+        raise ValueError(f"Expected ({N_CHANNELS}, n) samples, got {samples.shape}")
+    return HEADER.pack(MAGIC, VERSION, flags, samples.shape[1], seq) + samples.tobytes()
+
+
+def decode_chunk(message: bytes) -> Tuple[int, int, np.ndarray]:
+    """(flags, seq, (19, n) float32 view of ``message``); ValueError if malformed"""
+    if len(message) < HEADER.size:
+        raise ValueError("Chunk shorter than its header")
+    magic, version, flags, n_samples, seq = HEADER.unpack_from(message)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a version {VERSION} EEG chunk")
+    if len(message) != HEADER.size + N_CHANNELS * n_samples * 4:
+        raise ValueError(f"Chunk of {n_samples} samples has {len(message) - HEADER.size} payload bytes")
+    samples = np.frombuffer(message, dtype="<f4", count=N_CHANNELS * n_samples, offset=HEADER.size)
+    return flags, seq, samples.reshape(N_CHANNELS, n_samples)
+
+
+class LiveBuffers:
+    """One ring buffer per streaming patient, created on its first chunk"""
+
+    def __init__(self, capacity: int, max_patients: int, recorder: Optional[RecordingWriter] = None):
+        self.capacity = capacity
+        self.max_patients = max_patients
+        self.recorder = recorder
+        self._buffers: Dict[str, EEGRingBuffer] = {}
+        self._lock = threading.Lock()
+
+    def get(self, patient_id: str) -> Optional[EEGRingBuffer]:
+        return self._buffers.get(patient_id)
+
+    def _buffer(self, patient_id: str) -> EEGRingBuffer:
+        buffer = self._buffers.get(patient_id)
+        if buffer is None:
+            with self._lock:
+                buffer = self._buffers.get(patient_id)
+                if buffer is None:
+                    if len(self._buffers) >= self.max_patients:
+                        raise ValueError(f"Live buffers for {self.max_patients} patients already in use")
+                    buffer = self._buffers[patient_id] = EEGRingBuffer(self.capacity, N_CHANNELS)
+                    logger.info(f"Live buffer for patient {patient_id}: {buffer.nbytes / 2 ** 20:.1f} MiB")
+        return buffer
+
+    def ingest(self, patient_id: str, message: bytes) -> Optional[Dict]:
+        """Store one chunk; returns the ack to send, or None if none is due"""
+        return self.write_chunk(patient_id, message)[0]
+
+    def write_chunk(self, patient_id: str, message: bytes) -> Tuple[Optional[Dict], int, np.ndarray]:
+        """
+        ``ingest``, also returning the samples the chunk added: (ack, stream
+        position of the first new sample, (19, n) view of them in ``message``)
+        """
+        flags, seq, samples = decode_chunk(message)
+        buffer = self._buffer(patient_id)
+        gaps, duplicates = buffer.gap_samples, buffer.duplicate_samples
+        written = buffer.write(seq, samples)
+        gap, duplicate = buffer.gap_samples - gaps, buffer.duplicate_samples - duplicates
+        _WRITTEN.inc(written)
+        # the new samples are the chunk's last ones; a gap stays a gap in the recording
+        new_seq, new = seq + samples.shape[1] - written, samples[:, samples.shape[1] - written:]
+        if written and self.recorder is not None:
+            self.recorder.append(patient_id, new_seq, new)
+        if gap:
+            _GAP.inc(gap)
+        if duplicate:
+            _DUPLICATE.inc(duplicate)
+        ack = None
+        if flags & FLAG_ACK or gap or duplicate:
+            ack = {"type": "ack", "seq": buffer.end_seq}
+            if gap:
+                ack["gap"] = gap
+            if duplicate:
+                ack["duplicate"] = duplicate
+        return ack, new_seq, new
+
+    def read(self, patient_id: str, n: int, fn: Callable[[np.ndarray], T]) -> Tuple[T, int]:
+        """``EEGRingBuffer.read`` on the patient's buffer; LookupError if nothing was streamed"""
+        buffer = self._buffers.get(patient_id)
+        if buffer is None:
+            raise LookupError(f"No live EEG for patient {patient_id}")
+        return buffer.read(n, fn)
+
+    def discard(self, patient_id: str):
+        with self._lock:
+            self._buffers.pop(patient_id, None)
+
+
+recording_writer = RecordingWriter(settings.RECORDING_PATH, settings.LIVE_SAMPLE_RATE,
+                                   int(settings.RECORDING_SEGMENT_MINUTES * 60 * settings.LIVE_SAMPLE_RATE),
+                                   settings.RECORDING_FLUSH_INTERVAL, settings.RECORDING_FSYNC_INTERVAL)
+live_buffers = LiveBuffers(int(settings.LIVE_BUFFER_MINUTES * 60 * settings.LIVE_SAMPLE_RATE),
+                           settings.LIVE_MAX_PATIENTS, recording_writer if settings.EEG_RECORD else None)
+
+READER_CACHE_SIZE = 256  # readers keep their segments mapped
+_readers: "OrderedDict[str, RecordingReader]" = OrderedDict()
+_readers_lock = threading.Lock()
+
+
+def recording_reader(patient_id: str) -> RecordingReader:
+    """
+    The reader of a patient's recording, cached for the READER_CACHE_SIZE most
+    recently read patients; ValueError for an id that is not a valid directory name
+    """
+    with _readers_lock:
+        reader = _readers.get(patient_id)
+        if reader is not None:
+            _readers.move_to_end(patient_id)
+            return reader
+    reader = RecordingReader(settings.RECORDING_PATH, patient_id, settings.LIVE_SAMPLE_RATE)
+    with _readers_lock:
+        reader = _readers.setdefault(patient_id, reader)
+        _readers.move_to_end(patient_id)
+        while len(_readers) > READER_CACHE_SIZE:
+            _readers.popitem(last=False)
+    return reader
@@ -0,0 +1,30 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from eeg_app.alerts import alert_dispatcher
+
+
+class Command(BaseCommand):
+    help = "Run the SMS alert dispatch workers (use with ALERT_DISPATCH_IN_PROCESS=0 on the web servers)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="deliver every alert that is due, then exit")
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.INFO)
+        if options["once"]:
+            count = alert_dispatcher.drain()
+            self.stdout.write(f"Handled {count} alerts")
+            return
+
+        alert_dispatcher.start()
+        self.stdout.write(f"Dispatching alerts with {alert_dispatcher.workers} workers; Ctrl-C to stop")
+        try:
+            while alert_dispatcher.running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            alert_dispatcher.stop(timeout=30)
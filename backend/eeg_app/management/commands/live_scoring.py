@@ -0,0 +1,31 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from eeg_app.sharding import live_scoring
+
+
+class Command(BaseCommand):
+    help = "Join the live scoring cluster and score this worker's share of the streaming patients"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="run one round, then leave the cluster")
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.INFO)
+        if options["once"]:
+            scored = live_scoring.run_once()
+            live_scoring.coordinator.leave()
+            self.stdout.write(f"Scored {len(scored)} patients")
+            return
+
+        live_scoring.start()
+        self.stdout.write(f"Live scoring as {live_scoring.coordinator.worker_id}; Ctrl-C to stop")
+        try:
+            while live_scoring.running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            live_scoring.stop(timeout=30)
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertDispatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('patient_id', models.CharField(db_index=True, max_length=64)),
+                ('phone_number', models.CharField(max_length=32)),
+                ('body', models.TextField()),
+                ('alert_type', models.CharField(blank=True, default='', max_length=64)),
+                ('severity', models.CharField(blank=True, default='', max_length=32)),
+                ('doctor_id', models.CharField(blank=True, default='', max_length=128)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('coalesced_count', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField()),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('provider_sid', models.CharField(blank=True, default='', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='eeg_app_ale_status_0255c2_idx'), models.Index(fields=['patient_id', 'phone_number', 'created_at'], name='eeg_app_ale_patient_01609b_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eeg_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('patient_id', models.CharField(blank=True, default='', max_length=64)),
+                ('alert_type', models.CharField(blank=True, default='', max_length=64)),
+                ('severity', models.CharField(blank=True, default='', max_length=32)),
+                ('doctor_id', models.CharField(blank=True, default='', max_length=128)),
+                ('message', models.TextField(blank=True, default='')),
+                ('confidence_scores', models.JSONField(blank=True, null=True)),
+                ('dispatch_id', models.BigIntegerField(blank=True, null=True)),
+                ('coalesced', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient_id', '-id'], name='alert_patient_history'), models.Index(fields=['created_at'], name='eeg_app_ale_created_076c0d_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PredictionRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('patient_id', models.CharField(blank=True, default='', max_length=64)),
+                ('model', models.CharField(max_length=32)),
+                ('input_method', models.CharField(max_length=32)),
+                ('predicted_class', models.CharField(max_length=32)),
+                ('confidence', models.FloatField()),
+                ('probabilities', models.JSONField(default=dict)),
+                ('seq', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['patient_id', '-id'], name='prediction_patient_history'), models.Index(fields=['created_at'], name='eeg_app_pre_created_a3c53e_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eeg_app', '0002_alertrecord_predictionrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardLease',
+            fields=[
+                ('name', models.CharField(max_length=128, primary_key=True, serialize=False)),
+                ('holder', models.CharField(max_length=128)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eeg_app', '0003_shardlease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shardlease',
+            name='position',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,3 +1,109 @@
 from django.db import models
 
-# Create your models here.
+
+class AlertDispatch(models.Model):
+    """
+    One outgoing SMS alert. Rows are the durable dispatch queue: the view
+    inserts them, eeg_app.alerts workers claim, send and retry them.
+    """
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (SENDING, "Sending"), (SENT, "Sent"), (FAILED, "Failed")]
+
+    patient_id = models.CharField(max_length=64, db_index=True)
+    phone_number = models.CharField(max_length=32)
+    body = models.TextField()
+    alert_type = models.CharField(max_length=64, blank=True, default="")
+    severity = models.CharField(max_length=32, blank=True, default="")
+    doctor_id = models.CharField(max_length=128, blank=True, default="")
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    # Alerts for the same patient and recipient merged into this one
+    coalesced_count = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    provider_sid = models.CharField(max_length=64, blank=True, default="")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+            models.Index(fields=["patient_id", "phone_number", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"Alert {self.pk} for patient {self.patient_id} ({self.status})"
+
+
+class PredictionRecord(models.Model):
+    """
+    One prediction served by /eeg/predict/. Written in batches by
+    eeg_app.audit, so a row appears up to AUDIT_FLUSH_INTERVAL after the
+    response; ``created_at`` is when the prediction was made.
+    """
+    patient_id = models.CharField(max_length=64, blank=True, default="")  # "" for uploaded inputs
+    model = models.CharField(max_length=32)
+    input_method = models.CharField(max_length=32)
+    predicted_class = models.CharField(max_length=32)
+    confidence = models.FloatField()
+    probabilities = models.JSONField(default=dict)
+    seq = models.BigIntegerField(null=True, blank=True)  # live stream position, for source=live
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # history pages: one patient, newest first, keyset on id
+            models.Index(fields=["patient_id", "-id"], name="prediction_patient_history"),
+            models.Index(fields=["created_at"]),
+        ]
+
+    def __str__(self):
+        return f"Prediction {self.pk} for patient {self.patient_id}: {self.predicted_class}"
+
+
+class AlertRecord(models.Model):
+    """
+    One alert request to /eeg/alerts/, including those coalesced into an
+    existing AlertDispatch or sent without a phone number. Written in batches
+    by eeg_app.audit.
+    """
+    patient_id = models.CharField(max_length=64, blank=True, default="")
+    alert_type = models.CharField(max_length=64, blank=True, default="")
+    severity = models.CharField(max_length=32, blank=True, default="")
+    doctor_id = models.CharField(max_length=128, blank=True, default="")
+    message = models.TextField(blank=True, default="")
+    confidence_scores = models.JSONField(null=True, blank=True)
+    dispatch_id = models.BigIntegerField(null=True, blank=True)  # the AlertDispatch it was queued as
+    coalesced = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["patient_id", "-id"], name="alert_patient_history"),
+            models.Index(fields=["created_at"]),
+        ]
+
+    def __str__(self):
+        return f"Alert record {self.pk} for patient {self.patient_id}"
+
+
+class ShardLease(models.Model):
+    """
+    A named lease held by one worker until ``expires_at``, renewed while it
+    lives: "worker:<id>" for cluster membership, "patient:<id>" for the worker
+    running that patient's live scoring (eeg_app.sharding). A patient lease
+    keeps ``position``, the end seq of the last window scored, across holders.
+    """
+    name = models.CharField(max_length=128, primary_key=True)
+    holder = models.CharField(max_length=128)
+    expires_at = models.DateTimeField(db_index=True)
+    position = models.BigIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder} until {self.expires_at}"
@@ -0,0 +1,176 @@
+"""
+Rolling spectrograms of live EEG streams.
+
+compute_spectrogram renders a whole recording at once: each of the 16 bipolar
+pairs through scipy.signal.spectrogram (WIN_LENGTH samples per segment, half
+overlapping, N_FFT points), in dB, scaled by the pair's own min/max, resized to
+128 frequency rows and averaged per montage. RollingSpectrogram produces the
+same image one column at a time. Every WIN_LENGTH // 2 new samples make one
+column: the last WIN_LENGTH samples of the 16 pairs, with the same window,
+detrending, FFT and density scaling as scipy, in one batched rfft, then the
+same frequency resize (as a precomputed (128, N_FFT // 2 + 1) matrix). A hop
+costs the same however long the display is.
+
+Two things differ from the offline image, both because a stream has no end:
+    - dB values are scaled by a running min/max per pair, which widens at once
+      to any new extreme and narrows back by ``decay`` per column (one display
+      width by default). Columns already drawn keep their scale.
+    - one column per hop, not resized to 256: the image is a circular
+      (128, width, 4) array written in place, ``next_column`` the one written
+      next (the oldest).
+
+LiveSpectrograms keeps one per streaming patient, fed from the patient's ring
+buffer with the samples since its last update, and renders the new columns for
+the socket at ws/eeg/<patient_id>/spec/.
+"""
+import logging
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+from django.conf import settings
+from scipy.ndimage import zoom
+from scipy.signal import get_window
+
+from intelligence.ring_buffer import EEGRingBuffer
+from .spectrogram_generator import EEG_CHANNELS, MONTAGES, N_FFT, SAMPLE_RATE, WIN_LENGTH
+
+logger = logging.getLogger(__name__)
+
+HOP = WIN_LENGTH - WIN_LENGTH // 2  # compute_spectrogram passes noverlap=nperseg // 2 (scipy defaults to nperseg // 8)
+FREQ_BINS = 128
+PAIRS = [(a, b) for chain in MONTAGES.values() for a, b in zip(chain, chain[1:])]  # montage-major, 4 each
+
+
+def _bipolar_matrix() -> np.ndarray:
+    """(16, 19) matrix taking the 19 channels to the 16 bipolar pairs"""
+    matrix = np.zeros((len(PAIRS), len(EEG_CHANNELS)), dtype=np.float32)
+    for i, (a, b) in enumerate(PAIRS):
+        matrix[i, EEG_CHANNELS.index(a)] = 1
+        matrix[i, EEG_CHANNELS.index(b)] = -1
+    return matrix
+
+
+BIPOLAR = _bipolar_matrix()
+WINDOW = get_window(("tukey", 0.25), WIN_LENGTH).astype(np.float32)  # scipy.signal.spectrogram's default
+# density scaling of the one-sided spectrum, as scipy applies it
+DENSITY = np.full(N_FFT // 2 + 1, 2 / (SAMPLE_RATE * np.sum(WINDOW.astype(np.float64) ** 2)), dtype=np.float32)
+DENSITY[0] /= 2
+DENSITY[-1] /= 2
+# compute_spectrogram's zoom to 128 rows is linear in the spectrum: this is it as a matrix
+RESIZE = zoom(np.eye(N_FFT // 2 + 1), (FREQ_BINS / (N_FFT // 2 + 1), 1), order=1).T.astype(np.float32)
+
+
+def frame_decibels(frames: np.ndarray) -> np.ndarray:
+    """
+    (..., 128) dB spectra of (..., WIN_LENGTH) frames, as one segment of
+    compute_spectrogram's scipy.signal.spectrogram followed by its resize
+    """
+    frames = frames - frames.mean(axis=-1, keepdims=True)
+    power = np.abs(np.fft.rfft(frames * WINDOW, n=N_FFT)) ** 2 * DENSITY
+    return 10 * np.log10(power.astype(np.float32) @ RESIZE + 1e-10)
+
+
+class RollingSpectrogram:
+    def __init__(self, width: int = 256, decay: Optional[float] = None):
+        self.width = width
+        self.decay = 1 / width if decay is None else decay
+        self.image = np.zeros((FREQ_BINS, width, len(MONTAGES)), dtype=np.float32)
+        self.next_column = 0
+        self.columns = 0  # written in total
+        self._tail = np.empty((len(PAIRS), 0), dtype=np.float32)  # pair samples not yet in a full hop
+        self._low: Optional[np.ndarray] = None  # running dB range per pair
+        self._high: Optional[np.ndarray] = None
+
+    def push(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Add (19, n) samples; returns the (m, 128, 4) columns they completed
+        (m = 0 while a hop is still filling), already written to ``image``
+        """
+        pairs = BIPOLAR @ np.asarray(samples, dtype=np.float32)
+        pending = np.concatenate([self._tail, pairs], axis=1)
+        m = max((pending.shape[1] - WIN_LENGTH) // HOP + 1, 0)
+        self._tail = pending[:, m * HOP:]
+        if not m:
+            return np.empty((0, FREQ_BINS, len(MONTAGES)), dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(pending, WIN_LENGTH, axis=1)[:, :m * HOP:HOP]
+        frames = frames.transpose(1, 0, 2)  # (m, 16, WIN_LENGTH)
+        if np.isnan(frames).any():
+            frames = self._fill_gaps(frames)
+        decibels = frame_decibels(frames)
+        columns = np.empty((m, FREQ_BINS, len(MONTAGES)), dtype=np.float32)
+        for i in range(m):
+            columns[i] = self._scale(decibels[i]).reshape(len(MONTAGES), -1, FREQ_BINS).mean(axis=1).T
+        shown = columns[-self.width:]  # of more than a display of columns, only the last fit
+        index = (self.next_column + m - len(shown) + np.arange(len(shown))) % self.width
+        self.image[:, index, :] = shown.transpose(1, 0, 2)
+        self.next_column = (self.next_column + m) % self.width
+        self.columns += m
+        return columns
+
+    @staticmethod
+    def _fill_gaps(frames: np.ndarray) -> np.ndarray:
+        """NaN (stream gaps) as the frame's mean, as compute_spectrogram fills them; all-NaN frames as 0"""
+        valid = ~np.isnan(frames)
+        counts = valid.sum(axis=-1, keepdims=True)
+        means = np.where(valid, frames, 0).sum(axis=-1, keepdims=True) / np.maximum(counts, 1)
+        return np.where(valid, frames, means)
+
+    def _scale(self, decibels: np.ndarray) -> np.ndarray:
+        """(16, 128) dB to 0..1 by each pair's running range"""
+        low, high = decibels.min(axis=1), decibels.max(axis=1)
+        if self._low is None:
+            self._low, self._high = low, high
+        else:
+            self._low = np.minimum(low, self._low + self.decay * (low - self._low))
+            self._high = np.maximum(high, self._high + self.decay * (high - self._high))
+        return (decibels - self._low[:, None]) / (self._high - self._low + 1e-10)[:, None]
+
+    def ordered(self) -> np.ndarray:
+        """(128, width, 4) copy of the image, oldest column first"""
+        return np.roll(self.image, -self.next_column, axis=1)
+
+
+def columns_message(columns: np.ndarray, first: int, seq: int) -> Dict:
+    """Socket message for new columns: per montage, one list of 128 values per column"""
+    return {"type": "spec_columns", "column": first, "seq": seq,
+            "columns": {name: columns[:, :, k].tolist() for k, name in enumerate(MONTAGES)}}
+
+
+class LiveSpectrograms:
+    """One RollingSpectrogram per streaming patient, updated from its ring buffer"""
+
+    def __init__(self, width: int):
+        self.width = width
+        self._spectrograms: Dict[str, RollingSpectrogram] = {}
+        self._positions: Dict[str, int] = {}  # seq each has been fed up to
+        self._lock = threading.Lock()
+
+    def get(self, patient_id: str) -> Optional[RollingSpectrogram]:
+        return self._spectrograms.get(patient_id)
+
+    def update(self, patient_id: str, buffer: EEGRingBuffer) -> Optional[Dict]:
+        """Feed the samples the buffer got since the last update; the columns message, or None if none completed"""
+        with self._lock:
+            spectrogram = self._spectrograms.get(patient_id)
+            if spectrogram is None:
+                spectrogram = self._spectrograms[patient_id] = RollingSpectrogram(self.width)
+                self._positions[patient_id] = buffer.start_seq
+            n = min(buffer.end_seq - self._positions[patient_id], buffer.capacity)
+            if n <= 0:
+                return None
+            # copied out first: read retries fn if the writer overtakes it, and push must run once
+            samples, self._positions[patient_id] = buffer.read(n, np.array)
+            first = spectrogram.next_column
+            columns = spectrogram.push(samples)
+            if not len(columns):
+                return None
+            return columns_message(columns, first, self._positions[patient_id])
+
+    def discard(self, patient_id: str):
+        with self._lock:
+            self._spectrograms.pop(patient_id, None)
+            self._positions.pop(patient_id, None)
+
+
+live_spectrograms = LiveSpectrograms(settings.LIVE_SPECTROGRAM_COLUMNS)
@@ -1,6 +1,9 @@
 from django.urls import re_path
-from eeg_app.consumers import EEGConsumer
+from eeg_app.consumers import EEGConsumer, SpectrogramConsumer, WardConsumer
 
 websocket_urlpatterns = [
+    # Before the per-patient route, which would otherwise take "ward" as a patient id
+    re_path(r'ws/eeg/ward/$', WardConsumer.as_asgi()),
     re_path(r'ws/eeg/(?P<patient_id>[^/]+)/$', EEGConsumer.as_asgi()),
+    re_path(r'ws/eeg/(?P<patient_id>[^/]+)/spec/$', SpectrogramConsumer.as_asgi()),
 ]
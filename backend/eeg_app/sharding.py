@@ -0,0 +1,376 @@
+"""
+Patient affinity across ASGI workers for live scoring.
+
+Every worker process with LIVE_SCORING joins the cluster by holding a
+"worker:<id>" lease, renewed every LIVE_SCORING_INTERVAL and expiring after
+SHARD_LEASE_TTL. The live members form a consistent-hash ring (SHARD_VNODES
+points each), which maps every patient to one worker: patients spread evenly,
+and when a worker joins or dies only the patients on its arcs move.
+
+The ring only says who *should* score a patient; two workers can briefly
+disagree while a membership change propagates. So the owner also takes a
+"patient:<id>" lease before each round of scoring it, and a worker that no
+longer owns a patient releases its lease; after a worker dies its patients
+move once its leases expire. A slow round can outlive its lease, so a result
+is only published after a fenced commit: one conditional write that succeeds
+while this worker still holds the unexpired lease, renews it, and stores the
+window's end seq as the lease's ``position``. A window is therefore published
+at most once, by one worker, and the position carries over to the next holder
+instead of living in one process.
+
+Leases are rows of ShardLease (DatabaseLeases) in production, so all workers
+must share the database, or a LocalLeases dict for tests and single-process
+runs. Each round, the patients to score are those whose recording
+(intelligence.recording_store, on storage every worker sees) was indexed in
+the last LIVE_SCORING_ACTIVE seconds. The owner scores the newest
+LIVE_WINDOW_SAMPLES, sends {"type": "prediction", ...} to the patient's
+eeg_<patient_id> group and records it in the audit log. The channel layer must
+be shared too (Redis) for sockets on other workers to see it.
+
+Start with the ASGI workers (LIVE_SCORING=1) or as its own process:
+    python manage.py live_scoring
+"""
+import os
+import bisect
+import hashlib
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from hms_backend.metrics import SHARD_EVENTS
+
+from .db_retry import retry_locked
+from .models import ShardLease
+
+logger = logging.getLogger(__name__)
+
+WORKER = "worker:"
+PATIENT = "patient:"
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of keys onto members, ``vnodes`` points per member"""
+
+    def __init__(self, members: Iterable[str], vnodes: int = 256):
+        self.members = sorted(set(members))
+        points = sorted((_point(f"{member}#{i}"), member) for member in self.members for i in range(vnodes))
+        self._points = [p for p, _ in points]
+        self._owners = [m for _, m in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        return self._owners[bisect.bisect(self._points, _point(key)) % len(self._points)]
+
+
+class LocalLeases:
+    """In-memory leases for tests and single-process runs; share one instance between coordinators"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self._leases: Dict[str, tuple] = {}  # name -> (holder, expires at, position)
+        self._lock = threading.Lock()
+
+    def acquire(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew ``name`` for ``ttl`` seconds; False if another holder's lease is still valid"""
+        with self._lock:
+            now = self.clock()
+            current = self._leases.get(name)
+            if current is not None and current[0] != holder and current[1] > now:
+                return False
+            self._leases[name] = (holder, now + ttl, current[2] if current else None)
+            return True
+
+    def commit(self, name: str, holder: str, position: int, ttl: float) -> bool:
+        """Store ``position`` and renew, only if ``holder`` still holds the unexpired lease"""
+        with self._lock:
+            now = self.clock()
+            current = self._leases.get(name)
+            if current is None or current[0] != holder or current[1] <= now:
+                return False
+            self._leases[name] = (holder, now + ttl, position)
+            return True
+
+    def position(self, name: str) -> Optional[int]:
+        with self._lock:
+            return self._leases.get(name, (None, None, None))[2]
+
+    def release(self, name: str, holder: str):
+        """Give up the lease; one with a position is expired instead of removed, keeping it"""
+        with self._lock:
+            current = self._leases.get(name)
+            if current is not None and current[0] == holder:
+                if current[2] is None:
+                    del self._leases[name]
+                else:
+                    self._leases[name] = (holder, float("-inf"), current[2])
+
+    def held(self, prefix: str) -> Dict[str, str]:
+        """Unexpired leases whose name starts with ``prefix``: name -> holder"""
+        with self._lock:
+            now = self.clock()
+            return {name: holder for name, (holder, expires, _) in self._leases.items()
+                    if name.startswith(prefix) and expires > now}
+
+
+class DatabaseLeases:
+    """Leases as ShardLease rows: an expired or own row is taken over with one conditional UPDATE"""
+
+    def acquire(self, name: str, holder: str, ttl: float) -> bool:
+        def attempt():
+            now = timezone.now()
+            expires = now + timedelta(seconds=ttl)
+            if ShardLease.objects.filter(Q(holder=holder) | Q(expires_at__lte=now), name=name) \
+                    .update(holder=holder, expires_at=expires):
+                return True
+            try:
+                with transaction.atomic():
+                    ShardLease.objects.create(name=name, holder=holder, expires_at=expires)
+                return True
+            except IntegrityError:  # held by someone else
+                return False
+        return retry_locked(attempt)
+
+    def commit(self, name: str, holder: str, position: int, ttl: float) -> bool:
+        def attempt():
+            now = timezone.now()
+            return bool(ShardLease.objects.filter(name=name, holder=holder, expires_at__gt=now)
+                        .update(position=position, expires_at=now + timedelta(seconds=ttl)))
+        return retry_locked(attempt)
+
+    def position(self, name: str) -> Optional[int]:
+        return ShardLease.objects.filter(name=name).values_list("position", flat=True).first()
+
+    def release(self, name: str, holder: str):
+        def attempt():
+            leases = ShardLease.objects.filter(name=name, holder=holder)
+            leases.filter(position__isnull=True).delete()
+            leases.update(expires_at=timezone.now())
+        retry_locked(attempt)
+
+    def held(self, prefix: str) -> Dict[str, str]:
+        return dict(ShardLease.objects.filter(name__startswith=prefix, expires_at__gt=timezone.now())
+                    .values_list("name", "holder"))
+
+
+class ShardCoordinator:
+    """One worker's view of the cluster: membership, the ring, and its patient leases"""
+
+    def __init__(self, worker_id: str, leases, ttl: float = 15.0, vnodes: int = 256):
+        self.worker_id = worker_id
+        self.leases = leases
+        self.ttl = ttl
+        self.vnodes = vnodes
+        self.ring = HashRing([], vnodes)
+        self.claimed: Set[str] = set()
+        self._beat = float("-inf")
+
+    def heartbeat(self) -> List[str]:
+        """Renew this worker's membership and rebuild the ring if members changed; returns them"""
+        self._beat = time.monotonic()
+        self.leases.acquire(WORKER + self.worker_id, self.worker_id, self.ttl)
+        members = sorted(name[len(WORKER):] for name in self.leases.held(WORKER))
+        if members != self.ring.members:
+            logger.info(f"Shard members changed: {self.ring.members} -> {members}")
+            SHARD_EVENTS.labels("rebalance").inc()
+            self.ring = HashRing(members, self.vnodes)
+        return members
+
+    def keep_alive(self):
+        """Heartbeat again if a third of the TTL has passed since the last one (a long round)"""
+        if time.monotonic() - self._beat >= self.ttl / 3:
+            self.heartbeat()
+
+    def owns(self, patient_id: str) -> bool:
+        return self.ring.owner(patient_id) == self.worker_id
+
+    def claim(self, patient_id: str) -> bool:
+        """True if this worker should score the patient now: it owns it on the ring and holds its lease"""
+        name = PATIENT + patient_id
+        if self.owns(patient_id) and self.leases.acquire(name, self.worker_id, self.ttl):
+            if patient_id not in self.claimed:
+                SHARD_EVENTS.labels("acquire").inc()
+                self.claimed.add(patient_id)
+            return True
+        if patient_id in self.claimed:
+            self.leases.release(name, self.worker_id)
+            SHARD_EVENTS.labels("release").inc()
+            self.claimed.discard(patient_id)
+        return False
+
+    def position(self, patient_id: str) -> Optional[int]:
+        """End seq of the last window any worker committed for the patient"""
+        return self.leases.position(PATIENT + patient_id)
+
+    def commit(self, patient_id: str, position: int) -> bool:
+        """
+        The fence: record ``position`` as scored, and renew the lease, only if
+        this worker still holds it. False if it expired and may have moved.
+        """
+        if self.leases.commit(PATIENT + patient_id, self.worker_id, position, self.ttl):
+            return True
+        if patient_id in self.claimed:
+            SHARD_EVENTS.labels("lost").inc()
+            self.claimed.discard(patient_id)
+        return False
+
+    def drop(self, patient_id: str):
+        """Release the patient's lease if held (its stream has stopped)"""
+        if patient_id in self.claimed:
+            self.leases.release(PATIENT + patient_id, self.worker_id)
+            self.claimed.discard(patient_id)
+
+    def leave(self):
+        """Give up every lease, so the other workers take over at their next heartbeat"""
+        for patient_id in list(self.claimed):
+            self.leases.release(PATIENT + patient_id, self.worker_id)
+        self.claimed.clear()
+        self.leases.release(WORKER + self.worker_id, self.worker_id)
+
+
+def active_recordings(root: str, max_age: float) -> List[str]:
+    """Patients whose recording index was appended to in the last ``max_age`` seconds"""
+    cutoff = time.time() - max_age
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return []
+    active = []
+    for entry in entries:
+        try:
+            if entry.is_dir() and os.stat(os.path.join(entry.path, "index.log")).st_mtime >= cutoff:
+                active.append(entry.name)
+        except FileNotFoundError:
+            continue
+    return sorted(active)
+
+
+class LiveScorer:
+    """
+    Scores the newest window of a patient's recording, once per new window
+    position; publishes only after the coordinator's fenced commit
+    """
+
+    def __init__(self, coordinator: ShardCoordinator):
+        self.coordinator = coordinator
+
+    def __call__(self, patient_id: str) -> Optional[Dict]:
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        from .audit import audit_log
+        from .live_buffers import recording_reader
+        from .views import inference
+
+        reader = recording_reader(patient_id)
+        first, last = reader.extent()
+        if last == first or self.coordinator.position(patient_id) == last:
+            return None
+        eeg = reader.read(max(first, last - settings.LIVE_WINDOW_SAMPLES), last)
+        features = inference.call("extract_features", eeg)
+        if features is None:
+            return None
+        result = inference.call("predict_features", features, input_type="live")
+        if not self.coordinator.commit(patient_id, last):
+            logger.warning(f"Lease on patient {patient_id} lapsed while scoring; result discarded")
+            return None
+        payload = {"model": "XGBoost", "input_method": "live_scoring", "seq": last, "result": result}
+        async_to_sync(get_channel_layer().group_send)(f"eeg_{patient_id}", {
+            "type": "send_eeg_data", "patient_id": patient_id,
+            "text": json.dumps({"type": "prediction", "patient_id": patient_id, **payload})})
+        if settings.AUDIT_LOG:
+            audit_log.record_prediction(payload, patient_id)
+        return payload
+
+
+class LiveScoring:
+    """
+    The scoring loop of one worker: every ``interval``, heartbeat, then score
+    each active patient this worker can claim
+    """
+
+    def __init__(self, coordinator: ShardCoordinator, patients: Callable[[], List[str]],
+                 score: Callable[[str], object], interval: float = 5.0):
+        self.coordinator = coordinator
+        self.patients = patients
+        self.score = score
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def run_once(self) -> List[str]:
+        """One round; returns the patients scored"""
+        self.coordinator.heartbeat()
+        active = self.patients()
+        scored = []
+        for patient_id in active:
+            self.coordinator.keep_alive()
+            if self.coordinator.claim(patient_id):
+                try:
+                    self.score(patient_id)
+                    scored.append(patient_id)
+                except Exception as e:
+                    logger.error(f"Live scoring of patient {patient_id} failed: {e}")
+        for patient_id in self.coordinator.claimed - set(active):
+            self.coordinator.drop(patient_id)
+        return scored
+
+    def _run(self):
+        while not self._stop.is_set():
+            close_old_connections()
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Live scoring round failed: {e}")
+            self._stop.wait(max(self.interval - (time.monotonic() - started), 0))
+        self.coordinator.leave()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="live-scoring", daemon=True)
+            self._thread.start()
+        logger.info(f"Live scoring worker {self.coordinator.worker_id} started")
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def live_scoring_from_settings() -> LiveScoring:
+    leases = LocalLeases() if settings.SHARD_LEASES == "local" else DatabaseLeases()
+    coordinator = ShardCoordinator(worker_id(), leases, settings.SHARD_LEASE_TTL, settings.SHARD_VNODES)
+    return LiveScoring(coordinator,
+                       lambda: active_recordings(settings.RECORDING_PATH, settings.LIVE_SCORING_ACTIVE),
+                       LiveScorer(coordinator), settings.LIVE_SCORING_INTERVAL)
+
+
+live_scoring = live_scoring_from_settings()
@@ -1,8 +1,14 @@
 import os
+import logging
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.signal import spectrogram, detrend
 from scipy.ndimage import zoom
+from intelligence.storage import load_array, save_array
+from hms_backend.metrics import SPECTROGRAM_SECONDS
+
+logger = logging.getLogger(__name__)
 
 # === Configuration ===
 BASE_DIR = r"E:\4th SEM Data\HMS_Main_EL\HMS-Brian\project\backend\intelligence\preprocessed"
@@ -27,10 +33,9 @@ EEG_CHANNELS = [
     "C3", "C4", "P3", "P4", "T3", "T4", "T5", "T6", "O1", "O2"
 ]
 
-def spectrogram_from_eeg_npy(npy_path, output_dir="spectrograms", display=False):
-    basename = os.path.basename(npy_path).replace(".npy", "")
-    eeg = np.load(npy_path)
-    
+def compute_spectrogram(eeg, basename=""):
+    """(128, 256, 4) float32 spectrogram image of a (19, samples) float32 EEG array"""
+    start_time = time.perf_counter()
     if eeg.shape[0] != 19:
         raise ValueError(f"Expected 19 channels, got {eeg.shape[0]}")
     
@@ -38,19 +43,19 @@ def spectrogram_from_eeg_npy(npy_path, output_dir="spectrograms", display=False)
     
     # Check actual signal length and adjust segment extraction
     total_len = eeg.shape[1]
-    print(f"Processing {basename}: Total length = {total_len} samples")
+    logger.debug(f"Processing {basename}: Total length = {total_len} samples")
     
     # Use the entire signal if it's shorter than expected, otherwise take center segment
     if total_len <= SEGMENT_DURATION:
         start = 0
         end = total_len
         actual_duration = total_len
-        print(f"  Using entire signal: {actual_duration} samples")
+        logger.debug(f"  Using entire signal: {actual_duration} samples")
     else:
         start = max(0, total_len // 2 - SEGMENT_DURATION // 2)
         end = start + SEGMENT_DURATION
         actual_duration = SEGMENT_DURATION
-        print(f"  Using center segment: {actual_duration} samples (from {start} to {end})")
+        logger.debug(f"  Using center segment: {actual_duration} samples (from {start} to {end})")
     
     img = np.zeros((128, 256, 4), dtype=np.float32)  # 128 frequency bins, 256 time bins, 4 montages
     
@@ -71,7 +76,7 @@ def spectrogram_from_eeg_npy(npy_path, output_dir="spectrograms", display=False)
             
             # Skip if signal is too short or all zeros
             if len(x) < WIN_LENGTH or np.all(x == 0):
-                print(f"  Warning: Skipping {a}-{b} (insufficient data)")
+                logger.warning(f"  Skipping {a}-{b} (insufficient data)")
                 continue
             
             # Calculate spectrogram with adjusted parameters for shorter signals
@@ -88,7 +93,7 @@ def spectrogram_from_eeg_npy(npy_path, output_dir="spectrograms", display=False)
                     scaling='density'
                 )
                 
-                print(f"  {montage_name} {a}-{b}: Original spectrogram shape = {Sxx.shape}")
+                logger.debug(f"  {montage_name} {a}-{b}: Original spectrogram shape = {Sxx.shape}")
                 
                 # Convert to decibels and normalize
                 Sxx = 10 * np.log10(Sxx + 1e-10)
@@ -108,57 +113,62 @@ def spectrogram_from_eeg_npy(npy_path, output_dir="spectrograms", display=False)
                     time_zoom_factor = target_time_bins / Sxx.shape[1]
                     Sxx = zoom(Sxx, (1, time_zoom_factor), order=1)
                 
-                print(f"  {montage_name} {a}-{b}: Final spectrogram shape = {Sxx.shape}")
+                logger.debug(f"  {montage_name} {a}-{b}: Final spectrogram shape = {Sxx.shape}")
                 
                 # Ensure exact dimensions
                 Sxx = Sxx[:target_freq_bins, :target_time_bins]
                 montage_spectrograms.append(Sxx)
                 
             except Exception as e:
-                print(f"  Error computing spectrogram for {a}-{b}: {e}")
+                logger.error(f"  Error computing spectrogram for {a}-{b}: {e}")
                 continue
         
         # Average the spectrograms for this montage
         if montage_spectrograms:
             img[:, :, k] = np.mean(montage_spectrograms, axis=0)
         else:
-            print(f"  Warning: No valid spectrograms for montage {montage_name}")
-        
-        if display:
+            logger.warning(f"  No valid spectrograms for montage {montage_name}")
+    
+    # Log statistics about the final spectrogram
+    if logger.isEnabledFor(logging.DEBUG):
+        total_elements = img.size
+        non_zero_elements = np.count_nonzero(img)
+        logger.debug(f"  Final spectrogram: {img.shape}, non-zero elements: {non_zero_elements}/{total_elements} ({100*non_zero_elements/total_elements:.1f}%)")
+    
+    SPECTROGRAM_SECONDS.observe(time.perf_counter() - start_time)
+    return img
+
+
+def spectrogram_from_eeg_npy(npy_path, output_dir="spectrograms", display=False):
+    basename = os.path.basename(npy_path).replace(".npy", "")
+    eeg = load_array(npy_path)  # float32 end to end; scipy keeps single precision
+    img = compute_spectrogram(eeg, basename)
+    
+    if display:
+        for k, montage_name in enumerate(MONTAGES):
             plt.subplot(2, 2, k + 1)
             plt.imshow(img[:, :, k], aspect='auto', origin='lower', cmap='viridis')
             plt.title(f'{montage_name} (non-zero: {np.count_nonzero(img[:, :, k])})')
             plt.xlabel('Time bins')
             plt.ylabel('Frequency bins')
-    
-    if display:
         plt.tight_layout()
         plt.show()
     
-    # Print statistics about the final spectrogram
-    total_elements = img.size
-    non_zero_elements = np.count_nonzero(img)
-    print(f"  Final spectrogram: {img.shape}, non-zero elements: {non_zero_elements}/{total_elements} ({100*non_zero_elements/total_elements:.1f}%)")
-    
-    os.makedirs(output_dir, exist_ok=True)
-    np.save(os.path.join(output_dir, f"{basename}.npy"), img)
+    save_array(os.path.join(output_dir, f"{basename}.npy"), img)
     return img
 
 # Process all EEG files in the directory
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     os.makedirs(SPEC_DIR, exist_ok=True)  # Ensure the output directory exists
     
     # Iterate through all .npy files in the EEG directory
     for filename in sorted(os.listdir(EEG_DIR)):
         if filename.endswith(".npy"):
             npy_path = os.path.join(EEG_DIR, filename)
-            print(f"\n{'='*50}")
-            print(f"Processing: {filename}")
-            print(f"{'='*50}")
+            logger.info(f"Processing: {filename}")
             try:
                 spectrogram_from_eeg_npy(npy_path, output_dir=SPEC_DIR, display=False)
-                print(f"✓ Successfully processed {filename}")
+                logger.info(f"✓ Successfully processed {filename}")
             except Exception as e:
-                print(f"✗ Error processing {filename}: {e}")
-                import traceback
-                traceback.print_exc()
\ No newline at end of file
+                logger.error(f"✗ Error processing {filename}: {e}", exc_info=True)
\ No newline at end of file
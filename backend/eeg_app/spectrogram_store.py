@@ -0,0 +1,88 @@
+"""
+Spectrograms computed on first request.
+
+``SpectrogramStore.ensure`` makes sure a patient's spectrogram file exists,
+computing it from the patient's EEG file with the same code as the offline
+spectrogram_generator script when it is missing. Concurrent requests for one
+patient compute it once: a per-patient lock serializes them within a process,
+and an flock on ``<spec dir>/.locks/<id>.lock`` across worker processes. The
+result is written through with an atomic rename, so other readers see either
+no file or the complete spectrogram, and newly admitted patients no longer
+wait for a batch regeneration.
+"""
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from intelligence.storage import load_array, save_array
+from hms_backend.metrics import CACHE_REQUESTS
+from .spectrogram_generator import compute_spectrogram
+
+try:
+    import fcntl
+except ImportError:  # Windows: the in-process lock only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_HITS = CACHE_REQUESTS.labels("spec_store", "hit")
+_MISSES = CACHE_REQUESTS.labels("spec_store", "miss")
+
+
+class SpectrogramStore:
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks: Dict[str, List] = {}  # spec path -> [lock, holders + waiters]
+
+    @contextmanager
+    def _patient_lock(self, spec_path: str):
+        with self._guard:
+            entry = self._locks.setdefault(spec_path, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if fcntl is None:
+                    yield
+                    return
+                lock_dir = os.path.join(os.path.dirname(spec_path), ".locks")
+                os.makedirs(lock_dir, exist_ok=True)
+                name = os.path.basename(spec_path).replace(".npy", ".lock")
+                with open(os.path.join(lock_dir, name), "a") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[spec_path]
+
+    def ensure(self, eeg_path: str, spec_path: str, eeg: Optional[np.ndarray] = None) -> bool:
+        """
+        True if ``spec_path`` exists, computing it from ``eeg_path`` (or from
+        ``eeg``, when the caller already has it loaded) and storing it first
+        if needed; False if there is no EEG to compute from.
+        """
+        if os.path.exists(spec_path):
+            _HITS.inc()
+            return True
+        if eeg is None and not os.path.exists(eeg_path):
+            return False
+        with self._patient_lock(spec_path):
+            if os.path.exists(spec_path):  # computed while we waited
+                _HITS.inc()
+                return True
+            _MISSES.inc()
+            name = os.path.basename(spec_path).replace(".npy", "")
+            save_array(spec_path, compute_spectrogram(load_array(eeg_path) if eeg is None else eeg, name))
+            logger.info(f"Computed spectrogram {spec_path}")
+        return True
+
+
+spectrogram_store = SpectrogramStore()
@@ -1,3 +1,1764 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs
 
-# Create your tests here.
+import numpy as np
+import xgboost as xgb
+from django.db import OperationalError
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import URLRouter
+from django.test import AsyncRequestFactory
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+from sklearn.preprocessing import LabelEncoder
+
+from benchmarks.fixtures import stub_manager as fixture_manager
+from intelligence.dataset import CLASSES, PreprocessedDataset, load_vote_labels
+from intelligence.feature_store import FeatureStore
+from intelligence.inference_pool import InferenceClient, InferenceError, InferencePool, InferenceTimeout, WorkerCrashed
+from intelligence.models.SpectrogramCNN import export as spectrogram_export
+from intelligence.models.SpectrogramCNN.serving import SpectrogramModel
+from intelligence.models.XGBoost import cascade
+from intelligence.models.XGBoost.xgboost import FULL_PLAN, FeaturePlan, XGBoostModelManager, compile_feature_plan
+from intelligence import eeg_codec
+from intelligence.recording_store import RecordingReader, RecordingWriter
+from intelligence.ring_buffer import EEGRingBuffer, WindowOverwritten
+from intelligence.storage import load_array, load_range, save_array
+from hms_backend import instrumentation, metrics, profiling
+
+from . import async_views, audit, db_retry, http_cache, live_buffers, rolling_spectrogram, sharding, spectrogram_store, views
+from .alerts import AlertDispatcher, TwilioSMSSender
+from .models import AlertDispatch, AlertRecord, PredictionRecord, ShardLease
+from .routing import websocket_urlpatterns
+from .spectrogram_generator import compute_spectrogram, spectrogram_from_eeg_npy
+
+
+def synthetic_eeg(rng, n_recordings, n_samples=2500):
+    """Microvolt-scale channels with DC offsets and some inter-channel correlation"""
+    eeg = rng.standard_normal((n_recordings, 19, n_samples)) * rng.uniform(20, 120, (n_recordings, 19, 1))
+    eeg += rng.uniform(-500, 500, (n_recordings, 19, 1))
+    eeg[:, 1:] += 0.4 * eeg[:, :-1]
+    return eeg
+
+
+def stub_manager(rng, n_train=300):
+    """Manager with a small booster trained on float64 reference features of synthetic EEG"""
+    manager = XGBoostModelManager(load=False)
+    eeg = synthetic_eeg(rng, n_train)
+    y = rng.integers(0, len(CLASSES), n_train)
+    eeg[np.arange(n_train), y] *= 3  # make the class recoverable from one channel's energy
+    X = np.stack([manager.extract_features(x, dtype=np.float64) for x in eeg])
+    manager.model = xgb.train({'objective': 'multi:softprob', 'num_class': len(CLASSES), 'max_depth': 4,
+                               'tree_method': 'hist', 'seed': 0}, xgb.DMatrix(X, label=y), num_boost_round=30)
+    manager.label_encoder = LabelEncoder().fit(CLASSES)
+    manager.config = {'classes': CLASSES}
+    manager.is_loaded = True
+    return manager
+
+
+# The global audit log would write from its own thread into whichever test is
+# running (SimpleTestCases refuse it, TestCases hold the database locked);
+# AuditLogTests turns it back on with its own AuditLog
+_no_audit_log = override_settings(AUDIT_LOG=False)
+
+
+def setUpModule():
+    _no_audit_log.enable()
+
+
+def tearDownModule():
+    _no_audit_log.disable()
+
+
+class EEGPreprocessorTests(SimpleTestCase):
+    def test_steps_match_the_preprocessing_functions(self):
+        from benchmarks.preprocessing_alloc import make_inputs
+        from intelligence.preprocessed import preprocessing
+        from intelligence.preprocessed.preprocessor import EEGPreprocessor
+        preprocessor = EEGPreprocessor()
+        for length, seed in ((2500, 0), (3001, 1), (2500, 2)):  # odd lengths take the other median branch
+            for name, args in make_inputs(length, seed).items():
+                expected = getattr(preprocessing, name)(*(a.copy() for a in args))
+                actual = getattr(preprocessor, name)(*(a.copy() for a in args))
+                self.assertEqual(actual.dtype, expected.dtype, name)
+                np.testing.assert_array_equal(actual, expected, err_msg=name)
+
+    def test_buffers_are_reused_and_short_input_is_rejected(self):
+        from benchmarks.preprocessing_alloc import make_inputs
+        from intelligence.preprocessed.preprocessor import EEGPreprocessor
+        preprocessor = EEGPreprocessor()
+        eeg, mid, ekg = make_inputs(2500)["proc_eeg"]
+        first = preprocessor.proc_eeg(eeg.copy(), mid.copy(), ekg.copy())
+        second = preprocessor.proc_eeg(eeg.copy(), mid.copy(), ekg.copy())
+        self.assertTrue(np.shares_memory(first, second))
+        spec = make_inputs(2500)["proc_eeg_spec"][0]
+        original = spec.copy()
+        preprocessor.proc_eeg_spec(spec)
+        np.testing.assert_array_equal(spec, original)
+        eeg, mid, ekg = make_inputs(2000)["proc_eeg"]
+        with self.assertRaises(ValueError):
+            preprocessor.proc_eeg(eeg, mid, ekg)
+
+
+class PreprocessedDatasetTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dirs = {"eeg": os.path.join(tmp.name, "eeg"), "spec": os.path.join(tmp.name, "spec")}
+        for directory in self.dirs.values():
+            os.makedirs(directory)
+        rng = np.random.default_rng(27)
+        self.ids = [str(1000 + i) for i in range(11)]
+        for sample_id in self.ids:
+            np.save(os.path.join(self.dirs["eeg"], f"{sample_id}.npy"), rng.standard_normal((19, 300)))
+            np.save(os.path.join(self.dirs["spec"], f"{sample_id}.npy"), rng.random((8, 16, 4)))
+        np.save(os.path.join(self.dirs["eeg"], "9999.npy"), np.zeros((19, 300)))  # no spectrogram
+        self.csv = os.path.join(tmp.name, "train.csv")
+        with open(self.csv, "w") as f:
+            f.write("eeg_id,seizure_vote,lpd_vote,gpd_vote,lrda_vote,grda_vote,other_vote\n")
+            f.write("1000,3,0,0,0,0,1\n1000,1,0,0,0,0,3\n1001,0,0,0,0,0,0\n")
+
+    def test_batches_match_loading_each_file(self):
+        dataset = PreprocessedDataset(batch_size=4, chunk_size=4, seed=1, dirs=self.dirs, num_workers=2, prefetch=2)
+        self.assertEqual(dataset.ids, self.ids)
+        self.assertEqual(len(dataset), 3)
+        seen = []
+        for batch in dataset:
+            seen.extend(batch["ids"])
+            for modality in ("eeg", "spec"):
+                self.assertEqual(batch[modality].dtype, np.float32)
+                expected = np.stack([np.load(os.path.join(self.dirs[modality], f"{i}.npy")) for i in batch["ids"]])
+                np.testing.assert_array_equal(batch[modality], expected.astype(np.float32))
+        self.assertEqual(sorted(seen), self.ids)
+        self.assertNotEqual(seen, self.ids)
+        # chunk shuffling keeps each chunk of neighbouring files together
+        chunks = [set(self.ids[i:i + 4]) for i in range(0, 11, 4)]
+        self.assertIn(set(seen[:4]), chunks)
+        again = PreprocessedDataset(batch_size=4, chunk_size=4, seed=1, dirs=self.dirs)
+        self.assertEqual([i for batch in again for i in batch["ids"]], seen)
+        self.assertEqual(len(PreprocessedDataset(batch_size=4, dirs=self.dirs, drop_last=True)), 2)
+
+    def test_labels_and_features(self):
+        labels = load_vote_labels(self.csv)
+        np.testing.assert_allclose(labels["1000"], [0.5, 0, 0, 0, 0, 0.5])
+        np.testing.assert_array_equal(labels["1001"], np.zeros(6))
+        dataset = PreprocessedDataset(modalities=("eeg",), labels=labels, batch_size=8, shuffle=False,
+                                      dirs=self.dirs)
+        self.assertEqual(dataset.ids, ["1000", "1001"])
+        batch = next(iter(dataset))
+        np.testing.assert_array_equal(batch["y"], np.stack([labels["1000"], labels["1001"]]))
+        manager = XGBoostModelManager(load=False)
+        features = next(dataset.feature_batches(manager))
+        self.assertEqual(features["X"].shape, (2, len(manager.feature_names)))
+        np.testing.assert_array_equal(features["X"][1], manager.extract_features(batch["eeg"][1]))
+
+
+class FeatureStoreTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.root = os.path.join(tmp.name, "features")
+        self.rows = np.random.default_rng(28).standard_normal((3, 5)).astype(np.float32)
+
+    def test_rows_round_trip_between_instances(self):
+        writer = FeatureStore(self.root, version=1, n_features=5)
+        writer.put_many(["a", "b"], self.rows[:2])
+        reader = FeatureStore(self.root, version=1, n_features=5)
+        np.testing.assert_array_equal(reader.get("a"), self.rows[0])
+        self.assertIsNone(reader.get("c"))
+        writer.put("c", self.rows[2])
+        X, found = reader.get_many(["c", "missing", "a"])  # sees the later write
+        np.testing.assert_array_equal(found, [True, False, True])
+        np.testing.assert_array_equal(X[[0, 2]], self.rows[[2, 0]])
+        self.assertTrue(np.isnan(X[1]).all())
+        self.assertEqual(len(reader), 3)
+
+    def test_new_extractor_version_invalidates_rows(self):
+        FeatureStore(self.root, version=1, n_features=5).put_many(["a", "b"], self.rows[:2])
+        upgraded = FeatureStore(self.root, version=2, n_features=5)
+        self.assertEqual(upgraded.stale_ids(["a", "b"]), ["a", "b"])
+        self.assertNotIn("a", upgraded)
+        upgraded.put("a", self.rows[2])  # recomputed in place: same row, newer index line
+        np.testing.assert_array_equal(upgraded.get("a"), self.rows[2])
+        self.assertEqual(upgraded.stale_ids(["a", "b"]), ["b"])
+        self.assertIsNone(FeatureStore(self.root, version=1, n_features=5).get("a"))
+        self.assertEqual(upgraded._n_rows, 2)
+
+    def test_populate_computes_only_missing_recordings(self):
+        eeg_dir = os.path.join(self.tmp, "eeg")
+        os.makedirs(eeg_dir)
+        recordings = synthetic_eeg(np.random.default_rng(29), 3, n_samples=400).astype(np.float32)
+        for i, eeg in enumerate(recordings):
+            np.save(os.path.join(eeg_dir, f"{i}.npy"), eeg)
+        store = FeatureStore(self.root)
+        manager = XGBoostModelManager(load=False)
+        store.put("0", manager.extract_features(recordings[0]))
+        self.assertEqual(store.populate(eeg_dir=eeg_dir, workers=1), 2)
+        for i, eeg in enumerate(recordings):
+            np.testing.assert_array_equal(store.get(str(i)), manager.extract_features(eeg))
+        self.assertEqual(store.populate(eeg_dir=eeg_dir, workers=1), 0)
+
+    def test_ids_with_index_delimiters_are_rejected(self):
+        store = FeatureStore(self.root, version=1, n_features=5)
+        store.put("a", self.rows[0])
+        for recording_id in ("b,1", "b\nc,0,1", "b\rc", ""):
+            with self.assertRaises(ValueError):
+                store.put(recording_id, self.rows[1])
+        self.assertEqual(len(FeatureStore(self.root, version=1, n_features=5)), 1)
+
+    def test_predict_rejects_patient_ids_outside_the_eeg_directory(self):
+        eeg_dir = os.path.join(self.tmp, "eeg")
+        os.makedirs(eeg_dir)
+        np.save(os.path.join(self.tmp, "outside.npy"), synthetic_eeg(np.random.default_rng(30), 1)[0])
+        store = FeatureStore(self.root)
+        client = APIClient()
+        with mock.patch.object(views, "EEG_DATA_PATH", eeg_dir), mock.patch.object(views, "feature_store", store):
+            for patient_id in ("../outside", "..", "a,b"):
+                response = client.post("/eeg/predict/", {"patient_id": patient_id}, format="json")
+                self.assertEqual(response.status_code, 400, patient_id)
+        self.assertEqual(len(store), 0)
+
+
+class TrainingSmokeTests(SimpleTestCase):
+    def test_train_and_continue_on_synthetic_recordings(self):
+        import pickle
+        import shutil
+        from intelligence.models.XGBoost import train
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        eeg_dir, output_dir = os.path.join(tmp.name, "eeg"), os.path.join(tmp.name, "model")
+        os.makedirs(eeg_dir)
+        os.makedirs(output_dir)
+        # The deployed model's artifacts, with a cascade calibrated for its booster
+        deployed_dir = os.path.join(tmp.name, "deployed")
+        os.makedirs(deployed_dir)
+        shutil.copy(os.path.join(train.MODEL_DIR, "label_encoder.pkl"), deployed_dir)
+        with open(os.path.join(train.MODEL_DIR, "training_config.pkl"), "rb") as f:
+            deployed = pickle.load(f)
+        with open(os.path.join(deployed_dir, "training_config.pkl"), "wb") as f:
+            pickle.dump({**deployed, "cascade": {"rounds": 1, "threshold": 0.5}}, f)
+        patcher = mock.patch.object(train, "MODEL_DIR", deployed_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        rng = np.random.default_rng(29)
+        recordings = synthetic_eeg(rng, 24, n_samples=400).astype(np.float32)
+        csv = os.path.join(tmp.name, "train.csv")
+        with open(csv, "w") as f:
+            f.write("eeg_id,seizure_vote,lpd_vote,gpd_vote,lrda_vote,grda_vote,other_vote\n")
+            for i, eeg in enumerate(recordings):
+                np.save(os.path.join(eeg_dir, f"{i}.npy"), eeg)
+                f.write(f"{i}," + ",".join(str(v) for v in rng.integers(0, 3, 6)) + "\n")
+
+        report = train.train(csv, store_dir=os.path.join(tmp.name, "features"), eeg_dir=eeg_dir,
+                             output_dir=output_dir, rounds=3, batch_size=8, workers=1)
+        self.assertEqual(report["rounds"], 3)
+        self.assertGreaterEqual(report["val"]["accuracy"], 0.0)
+        with open(os.path.join(output_dir, "xgboost_model.pkl"), "rb") as f:
+            booster = pickle.load(f)
+        with open(os.path.join(output_dir, "training_config.pkl"), "rb") as f:
+            config = pickle.load(f)
+        self.assertEqual((config["n_train_samples"], config["n_val_samples"]), (20, 4))
+        self.assertNotIn("cascade", config)
+        manager = XGBoostModelManager(load=False)
+        probabilities = booster.predict(xgb.DMatrix(manager.extract_features(recordings[0]).reshape(1, -1)))
+        self.assertEqual(probabilities.shape, (1, len(CLASSES)))
+
+        report = train.train(csv, store_dir=os.path.join(tmp.name, "features"), eeg_dir=eeg_dir,
+                             output_dir=output_dir, rounds=2, batch_size=8, workers=1, continue_training=True)
+        self.assertEqual(report["rounds"], 5)
+
+
+class Float32PolicyTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(1234)
+        self.manager = XGBoostModelManager(load=False)
+
+    def test_features_track_float64_reference(self):
+        # float64 storage and computation vs. float32 storage and the default path
+        for eeg in synthetic_eeg(self.rng, 20):
+            reference = self.manager.extract_features(eeg, dtype=np.float64)
+            features = self.manager.extract_features(eeg.astype(np.float32))
+            self.assertEqual(features.dtype, np.float32)
+            np.testing.assert_allclose(features, reference, rtol=1e-4, atol=1e-4)
+
+    def test_prediction_drift_is_bounded(self):
+        manager = stub_manager(self.rng)
+        worst = 0.0
+        for eeg in synthetic_eeg(self.rng, 50).astype(np.float32):
+            reference = manager.model.predict(xgb.DMatrix(
+                manager.extract_features(eeg, dtype=np.float64).reshape(1, -1)))[0]
+            result = manager.predict(eeg)
+            probabilities = np.array([result['probabilities'][c] for c in CLASSES])
+            worst = max(worst, np.abs(probabilities - reference).max())
+        self.assertLess(worst, 1e-3)
+
+    def test_input_is_not_modified(self):
+        eeg = synthetic_eeg(self.rng, 1)[0].astype(np.float32)
+        eeg[3, 10] = np.nan
+        original = eeg.copy()
+        self.assertIsNotNone(self.manager.extract_features(eeg))
+        np.testing.assert_array_equal(eeg, original)
+
+    def test_load_array_returns_float32(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "1.npy")
+            np.save(path, np.arange(6, dtype=np.float64).reshape(2, 3))
+            array = load_array(path)
+            self.assertEqual(array.dtype, np.float32)
+            np.testing.assert_array_equal(array, np.arange(6).reshape(2, 3))
+
+
+class FeaturePlanTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(99)
+        self.manager = XGBoostModelManager(load=False)
+
+    def test_planned_features_are_bit_identical(self):
+        eeg = synthetic_eeg(self.rng, 30).astype(np.float32)
+        eeg[::4, 2, :50] = np.nan
+        for recording in eeg:
+            full = self.manager.extract_features(recording)
+            indices = self.rng.choice(len(full), self.rng.integers(1, 40), replace=False)
+            planned = self.manager.extract_features(recording, plan=FeaturePlan(indices))
+            np.testing.assert_array_equal(planned[indices], full[indices])
+            skipped = np.setdiff1d(np.arange(len(full)), indices)
+            self.assertTrue(np.isnan(planned[skipped]).any())
+
+    def test_plan_follows_booster_splits(self):
+        X = self.rng.standard_normal((200, len(self.manager.feature_names))).astype(np.float32)
+        y = (X[:, 5] > 0).astype(int) + (X[:, 250] > 0.5)
+        for names in (None, self.manager.feature_names):
+            booster = xgb.train({'objective': 'multi:softprob', 'num_class': 3, 'max_depth': 2},
+                                xgb.DMatrix(X, label=y, feature_names=names), num_boost_round=3)
+            used = sorted(booster.get_score(importance_type="weight"))
+            plan = compile_feature_plan(booster)
+            self.assertEqual(len(plan), len(used))
+            self.assertIn(5, plan.indices)
+            self.assertIn(250, plan.indices)  # a global feature: every channel is kept
+            self.assertIsNone(plan.rows)
+        self.assertIs(compile_feature_plan(object()), FULL_PLAN)
+
+    def test_predict_uses_plan_with_identical_output(self):
+        manager = stub_manager(self.rng)
+        plan = manager.feature_plan()
+        self.assertLess(len(plan), len(manager.feature_names))
+        for recording in synthetic_eeg(self.rng, 10).astype(np.float32):
+            expected = manager.predict_features(manager.extract_features(recording), input_type="time_series")
+            self.assertEqual(manager.predict(recording), expected)
+        self.assertIs(manager.feature_plan(), plan)
+
+
+class CascadeTests(SimpleTestCase):
+    def test_screen_answers_confident_cases(self):
+        manager = stub_manager(np.random.default_rng(21))
+        recordings = synthetic_eeg(np.random.default_rng(22), 5).astype(np.float32)
+        full = [manager.predict(eeg) for eeg in recordings]
+
+        manager.cascade = {'rounds': 5, 'threshold': 0.0}
+        for eeg in recordings:
+            result = manager.predict(eeg)
+            self.assertEqual(result.pop("stage"), "screen")
+            screened = manager.predict_features(manager.extract_features(eeg), input_type="time_series",
+                                                iteration_range=(0, 5))
+            self.assertEqual(result, screened)
+
+        manager.cascade = {'rounds': 5, 'threshold': cascade.NEVER}
+        for eeg, expected in zip(recordings, full):
+            result = manager.predict(eeg)
+            self.assertEqual(result.pop("stage"), "full")
+            self.assertEqual(result, expected)
+
+    def test_single_values_bypass_the_cascade(self):
+        manager = stub_manager(np.random.default_rng(23))
+        manager.cascade = {'rounds': 5, 'threshold': 0.0}
+        values = np.arange(19, dtype=np.float32)
+        result = manager.predict_from_single_values(values)
+        self.assertNotIn("error", result)
+        self.assertEqual(result["input_type"], "single_values")
+        expected = manager.model.predict(xgb.DMatrix(
+            manager.extract_features_from_single_values(values).reshape(1, -1)))[0]
+        np.testing.assert_allclose([result["probabilities"][c] for c in CLASSES], expected, rtol=1e-6)
+        self.assertEqual(manager.predict(values), result)
+
+    def test_calibrate_keeps_agreement(self):
+        probs = np.array([[.9, .1], [.8, .2], [.8, .2], [.6, .4], [.55, .45]])
+        full = np.array([0, 1, 0, 0, 0])
+        self.assertEqual(cascade.calibrate(probs, full, 1.0), (0.9, 0.2, 1.0))
+        # ties at 0.8 are screened together, taking the one disagreement
+        self.assertEqual(cascade.calibrate(probs, full, 0.8), (0.55, 1.0, 0.8))
+        self.assertEqual(cascade.calibrate(probs[1:2], full[1:2], 1.0), (cascade.NEVER, 0.0, 1.0))
+
+
+class EEGCodecTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "7.npy")
+        self.eeg = synthetic_eeg(np.random.default_rng(7), 1, n_samples=5000)[0].astype(np.float32)
+
+    def test_round_trip_within_bound(self):
+        for options in ({}, {"compressor": "zlib"}, {"compressor": "zlib", "max_error": 0.05}):
+            save_array(self.path, self.eeg, compress=True, chunk=1000, **options)
+            bound = eeg_codec.CompressedArray(self.path).max_error
+            if "max_error" in options:
+                self.assertLessEqual(bound, 0.05)
+            decoded = load_array(self.path)
+            self.assertEqual(decoded.dtype, np.float32)
+            self.assertEqual(decoded.shape, self.eeg.shape)
+            # half a quantization step, plus float32 rounding of the decoded value
+            slack = np.spacing(np.abs(self.eeg).max())
+            self.assertLessEqual(np.abs(decoded - self.eeg).max(), bound + slack)
+            self.assertLess(os.path.getsize(self.path), self.eeg.nbytes / 1.9)
+
+    def test_range_reads_match_full_decode(self):
+        save_array(self.path, self.eeg, compress=True, chunk=1000, compressor="zlib")
+        full = load_array(self.path)
+        for start, stop in ((0, 1), (999, 1001), (1500, 4200), (4000, 5000), (4990, None)):
+            np.testing.assert_array_equal(load_range(self.path, start, stop), full[:, start:stop])
+
+    def test_constant_channel_and_plain_npy(self):
+        self.eeg[4] = 12.5
+        save_array(self.path, self.eeg, compress=True)
+        np.testing.assert_array_equal(load_array(self.path)[4], 12.5)
+        save_array(self.path, self.eeg)
+        self.assertFalse(eeg_codec.is_compressed(self.path))
+        np.testing.assert_array_equal(load_range(self.path, 10, 20), self.eeg[:, 10:20])
+
+    def test_non_finite_values_are_rejected(self):
+        self.eeg[0, 0] = np.nan
+        with self.assertRaises(ValueError):
+            save_array(self.path, self.eeg, compress=True)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_eeg_view_decodes_transparently(self):
+        save_array(self.path, self.eeg[:, :2500], compress=True)
+        with mock.patch.object(views, "eeg_file_path", return_value=self.path):
+            payload, code = views.eeg_data_payload("7")
+        self.assertEqual(code, 200)
+        self.assertAlmostEqual(payload["eeg_data"][100]["Cz"], float(self.eeg[3, 100]), places=2)
+
+
+class FakeSMSServer:
+    """
+    Local stand-in for the Twilio Messages API. ``failures`` is a list of HTTP
+    statuses returned, in order, before requests start succeeding.
+    """
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.messages = []
+        self.client_ports = set()
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is observable
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                with server.lock:
+                    server.client_ports.add(self.client_address[1])
+                    code = server.failures.pop(0) if server.failures else 201
+                    if code == 201:
+                        server.messages.append(form)
+                        payload = {"sid": f"SM{len(server.messages):032d}", "status": "queued",
+                                   "to": form.get("To"), "body": form.get("Body")}
+                    else:
+                        payload = {"code": 20000 + code, "message": "fake failure", "status": code}
+                body = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def fake_dispatcher(server, **kwargs):
+    sender = TwilioSMSSender("AC" + "0" * 32, "token", "+15550001111", base_url=server.url, timeout=5)
+    kwargs.setdefault("coalesce_window", 60)
+    kwargs.setdefault("retry_base_delay", 0)
+    return AlertDispatcher(sender=sender, workers=2, max_attempts=3, poll_interval=0.05, **kwargs)
+
+
+@override_settings(ALERT_DISPATCH_IN_PROCESS=False)
+class AlertDispatchTests(TestCase):
+    def setUp(self):
+        self.server = FakeSMSServer()
+        self.addCleanup(self.server.close)
+        self.dispatcher = fake_dispatcher(self.server)
+
+    def test_view_queues_alert_for_delivery(self):
+        with mock.patch.object(views, "alert_dispatcher", self.dispatcher):
+            response = APIClient().post("/eeg/alerts/", {
+                "patient_id": "p1", "patient_name": "Jane Roe", "room": "12", "alert_type": "Seizure",
+                "severity": "critical", "phone_number": "9876543210",
+            }, format="json")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.server.messages, [])  # nothing sent inside the request
+
+        self.assertEqual(self.dispatcher.drain(), 1)
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.server.messages[0]["To"], "+919876543210")
+        self.assertIn("Jane Roe", self.server.messages[0]["Body"])
+        dispatch = AlertDispatch.objects.get(pk=response.data["alert_id"])
+        self.assertEqual(dispatch.status, AlertDispatch.SENT)
+        self.assertTrue(dispatch.provider_sid.startswith("SM"))
+
+    def test_alert_storm_is_coalesced(self):
+        for i in range(10):
+            dispatch, coalesced = self.dispatcher.enqueue("p1", "+15551234567", f"alert {i}")
+            self.assertEqual(coalesced, i > 0)
+        self.assertEqual(AlertDispatch.objects.count(), 1)
+        self.dispatcher.drain()
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertIn("alert 9", self.server.messages[0]["Body"])
+        self.assertIn("+9 more alerts", self.server.messages[0]["Body"])
+
+        # Inside the window after a send, the next alert waits for the window to close
+        follow_up, coalesced = self.dispatcher.enqueue("p1", "+15551234567", "alert 10")
+        self.assertFalse(coalesced)
+        self.assertEqual(self.dispatcher.drain(), 0)
+        self.assertGreater(follow_up.next_attempt_at, follow_up.created_at)
+
+        # Other patients are not held back
+        self.dispatcher.enqueue("p2", "+15551234567", "other patient")
+        self.assertEqual(self.dispatcher.drain(), 1)
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_transient_failures_are_retried_on_one_connection(self):
+        self.server.failures = [503, 429]
+        dispatch, _ = self.dispatcher.enqueue("p1", "+15551234567", "alert")
+        self.assertEqual(self.dispatcher.drain(), 3)
+        dispatch.refresh_from_db()
+        self.assertEqual(dispatch.status, AlertDispatch.SENT)
+        self.assertEqual(dispatch.attempts, 3)
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_permanent_failure_is_not_retried(self):
+        self.server.failures = [400]
+        dispatch, _ = self.dispatcher.enqueue("p1", "+15551234567", "alert")
+        self.dispatcher.drain()
+        dispatch.refresh_from_db()
+        self.assertEqual(dispatch.status, AlertDispatch.FAILED)
+        self.assertEqual(dispatch.attempts, 1)
+        self.assertIn("400", dispatch.last_error)
+
+    def test_retries_stop_at_max_attempts(self):
+        self.server.failures = [500] * 5
+        dispatch, _ = self.dispatcher.enqueue("p1", "+15551234567", "alert")
+        self.dispatcher.drain()
+        dispatch.refresh_from_db()
+        self.assertEqual(dispatch.status, AlertDispatch.FAILED)
+        self.assertEqual(dispatch.attempts, 3)
+        self.assertEqual(self.server.messages, [])
+
+
+class RetryLockedTests(SimpleTestCase):
+    def failing(self, message, times):
+        calls = []
+
+        def write():
+            calls.append(1)
+            if len(calls) <= times:
+                raise OperationalError(message)
+            return "written"
+        return write, calls
+
+    def test_only_lock_errors_are_retried(self):
+        with mock.patch.object(db_retry.time, "sleep"):
+            for message in ("database is locked", "database table is locked"):
+                write, calls = self.failing(message, 2)
+                self.assertEqual(db_retry.retry_locked(write), "written")
+                self.assertEqual(len(calls), 3)
+                write, calls = self.failing(message, 5)
+                with self.assertRaises(OperationalError):
+                    db_retry.retry_locked(write, retries=3)
+                self.assertEqual(len(calls), 3)
+            for message in ("no such table: eeg_app_shardlease", "disk I/O error"):
+                write, calls = self.failing(message, 1)
+                with self.assertRaises(OperationalError):
+                    db_retry.retry_locked(write)
+                self.assertEqual(len(calls), 1)
+
+
+class AlertDispatchWorkerTests(TransactionTestCase):
+    def test_workers_deliver_queued_alerts(self):
+        server = FakeSMSServer(failures=[503])
+        self.addCleanup(server.close)
+        dispatcher = fake_dispatcher(server)
+        dispatcher.start()
+        self.addCleanup(dispatcher.stop, 5)
+
+        for patient in range(5):
+            dispatcher.enqueue(f"p{patient}", "+15551234567", f"alert for p{patient}")
+        sent = AlertDispatch.objects.filter(status=AlertDispatch.SENT)
+        deadline = time.monotonic() + 10
+        while sent.count() < 5 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(sent.count(), 5)
+        self.assertEqual(len(server.messages), 5)
+
+
+@override_settings(AUDIT_LOG=True)
+class AuditLogTests(TestCase):
+    def setUp(self):
+        self.log = audit.AuditLog(flush_interval=60, batch_size=3)
+        self.addCleanup(self.log.close)
+
+    def test_predictions_and_alerts_are_buffered_then_bulk_inserted(self):
+        manager = fixture_manager()
+        client = APIClient()
+        eeg = synthetic_eeg(np.random.default_rng(14), 1, n_samples=500)[0]
+        with mock.patch.object(audit, "audit_log", self.log), mock.patch.object(views, "audit_log", self.log), \
+                mock.patch.object(views, "inference", InferenceClient(None, lambda: manager)), \
+                mock.patch.object(views.feature_store, "get", lambda patient_id: manager.extract_features(eeg)):
+            response = client.post("/eeg/predict/", {"patient_id": "p1"}, format="json")
+            self.assertEqual(response.status_code, 200)
+            client.post("/eeg/predict/", {"features": [0.0]}, format="json")  # 400: not recorded
+            client.post("/eeg/alerts/", {"patient_id": "p1", "alert_type": "Seizure", "message": "check"}, format="json")
+            self.assertEqual(PredictionRecord.objects.count(), 0)  # nothing written inside the requests
+            self.assertEqual(self.log.flush(), 2)
+        record = PredictionRecord.objects.get()
+        self.assertEqual((record.patient_id, record.model, record.input_method), ("p1", "XGBoost", "patient_id"))
+        result = response.json()["result"]
+        self.assertEqual((record.predicted_class, record.probabilities), (result["predicted_class"], result["probabilities"]))
+        alert = AlertRecord.objects.get()
+        self.assertEqual((alert.patient_id, alert.alert_type, alert.dispatch_id), ("p1", "Seizure", None))
+
+    def test_full_buffer_drops_records(self):
+        log = audit.AuditLog(flush_interval=60, max_pending=2)
+        self.addCleanup(log.close)
+        payload = {"model": "XGBoost", "input_method": "features", "result": {"predicted_class": "GPD", "confidence": 0.5}}
+        self.assertEqual([log.record_prediction(payload, "p1") for _ in range(3)], [True, True, False])
+        self.assertFalse(log.record_prediction({"result": {"error": "Model not loaded"}}))
+
+    def test_history_pages_newest_first(self):
+        now = timezone.now()
+        PredictionRecord.objects.bulk_create(
+            PredictionRecord(patient_id=patient, model="XGBoost", input_method="patient_id", predicted_class="LPD",
+                             confidence=i / 10, created_at=now) for i in range(7) for patient in ("p1", "p2"))
+        client = APIClient()
+        pages, cursor = [], ""
+        while cursor is not None:
+            body = client.get(f"/eeg/patients/p1/predictions/?limit=3&before={cursor}").json()
+            pages.append([row["confidence"] for row in body["predictions"]])
+            cursor = body["next"]
+        self.assertEqual(pages, [[0.6, 0.5, 0.4], [0.3, 0.2, 0.1], [0.0]])
+        self.assertEqual(client.get("/eeg/patients/p1/predictions/?limit=0").status_code, 400)
+        self.assertEqual(client.get("/eeg/patients/p3/predictions/").json()["predictions"], [])
+
+
+class AsyncViewParityTests(SimpleTestCase):
+    """The async views must answer exactly like the DRF views they replace"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        rng = np.random.default_rng(7)
+        for name, shape in (("eeg", (19, 2500)), ("spec", (128, 256, 4))):
+            os.makedirs(os.path.join(tmp.name, name))
+            np.save(os.path.join(tmp.name, name, "42.npy"), rng.random(shape, dtype=np.float32))
+        for name, value in (("EEG_DATA_PATH", os.path.join(tmp.name, "eeg")),
+                            ("SPEC_DATA_PATH", os.path.join(tmp.name, "spec")),
+                            ("response_cache", http_cache.ResponseCache(os.path.join(tmp.name, "cache")))):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def assertSameResponse(self, sync_view, async_view, sync_request, async_request, **kwargs):
+        expected = sync_view.as_view()(sync_request, **kwargs)
+        if hasattr(expected, "render"):
+            expected.render()
+        actual = async_to_sync(async_view.as_view())(async_request, **kwargs)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual.content, expected.content)
+
+    def test_data_views(self):
+        sync_factory, async_factory = APIRequestFactory(), AsyncRequestFactory()
+        for sync_view, async_view, url in ((views.EEGDataView, async_views.AsyncEEGDataView, "/eeg/data/"),
+                                           (views.SPECDataView, async_views.AsyncSPECDataView, "/eeg/spec/")):
+            for patient_id in ("42", "404"):
+                self.assertSameResponse(sync_view, async_view, sync_factory.get(url + patient_id),
+                                        async_factory.get(url + patient_id), patient_id=patient_id)
+        self.assertSameResponse(views.PatientsView, async_views.AsyncPatientsView,
+                                sync_factory.get("/eeg/patients/"), async_factory.get("/eeg/patients/"))
+
+    def test_predict(self):
+        manager = stub_manager(np.random.default_rng(0))
+        body = {"eeg_values": list(range(19))}
+        with mock.patch.object(views, "xgb_model_manager", manager):
+            self.assertSameResponse(views.PredictEEG, async_views.AsyncPredictEEG,
+                                    APIRequestFactory().post("/eeg/predict/", body, format="json"),
+                                    AsyncRequestFactory().post("/eeg/predict/", body, content_type="application/json"))
+
+
+class ConditionalResponseTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.eeg_path = os.path.join(tmp.name, "42.npy")
+        np.save(self.eeg_path, np.random.default_rng(3).random((19, 2500), dtype=np.float32))
+        self.cache = http_cache.ResponseCache(os.path.join(tmp.name, "cache"))
+        for name, value in (("EEG_DATA_PATH", tmp.name), ("response_cache", self.cache)):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = APIRequestFactory()
+
+    def get(self, **headers):
+        request = self.factory.get("/eeg/data/42/", headers=headers)
+        return views.EEGDataView.as_view()(request, patient_id="42")
+
+    def test_revalidation_skips_loading(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("Accept-Encoding", first["Vary"])
+        with mock.patch.object(views, "load_array", side_effect=AssertionError("array loaded")):
+            not_modified = self.get(if_none_match=first["ETag"])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified["ETag"], first["ETag"])
+            self.assertEqual(self.get(if_modified_since=first["Last-Modified"]).status_code, 304)
+            # A cached body is served without serializing again
+            self.assertEqual(self.get().content, first.content)
+
+    def test_gzip_body_matches_identity(self):
+        plain = self.get()
+        compressed = self.get(accept_encoding="gzip;q=1, identity;q=0.5")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertNotEqual(compressed["ETag"], plain["ETag"])
+        self.assertLess(len(compressed.content), len(plain.content))
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertEqual(self.get(accept_encoding="gzip", if_none_match=plain["ETag"]).status_code, 304)
+
+    def test_changed_file_gets_new_etag(self):
+        first = self.get()
+        np.save(self.eeg_path, np.zeros((19, 2500), dtype=np.float32))
+        os.utime(self.eeg_path, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+        second = self.get(if_none_match=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+        self.assertEqual(json.loads(second.content)["eeg_data"][0]["Fp1"], 0.0)
+
+    def test_missing_file_is_not_cached(self):
+        request = self.factory.get("/eeg/data/7/", headers={"if-none-match": "*"})
+        response = views.EEGDataView.as_view()(request, patient_id="7")
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("ETag", response)
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(http_cache.negotiate_encoding(""), "identity")
+        self.assertEqual(http_cache.negotiate_encoding("gzip, deflate"), "gzip")
+        self.assertEqual(http_cache.negotiate_encoding("gzip;q=0, identity"), "identity")
+        self.assertEqual(http_cache.negotiate_encoding("*"), http_cache.AVAILABLE_ENCODINGS[0])
+
+    def test_new_etag_replaces_only_its_own_key(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = os.path.join(tmp.name, "cache")
+        cache = http_cache.ResponseCache(root, memory_bytes=0)
+        cache.put("eeg", "42", "old", "gzip", b"a")
+        cache.put("eeg", "42.5", "other", "gzip", b"b")
+        cache.put("eeg", "42", "new", "gzip", b"c")
+        self.assertIsNone(cache.get("eeg", "42", "old", "gzip"))
+        self.assertEqual(cache.get("eeg", "42", "new", "gzip"), b"c")
+        self.assertEqual(cache.get("eeg", "42.5", "other", "gzip"), b"b")
+        # Keys that are not one path component are never cached on disk
+        for key in ("..", ".", "", "a/b"):
+            cache.put("eeg", key, "tag", "gzip", b"d")
+            self.assertIsNone(cache.get("eeg", key, "tag", "gzip"))
+        self.assertEqual(sorted(os.listdir(root)), ["eeg"])
+        self.assertEqual(sorted(os.listdir(os.path.join(root, "eeg"))), ["42", "42.5"])
+
+
+class OnDemandSpectrogramTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.eeg_dir, self.spec_dir = os.path.join(tmp.name, "eeg"), os.path.join(tmp.name, "spec")
+        os.makedirs(self.eeg_dir)
+        np.save(os.path.join(self.eeg_dir, "42.npy"), synthetic_eeg(np.random.default_rng(5), 1)[0].astype(np.float32))
+        self.spec_path = os.path.join(self.spec_dir, "42.npy")
+        self.store = spectrogram_store.SpectrogramStore()
+        for target, name, value in ((views, "EEG_DATA_PATH", self.eeg_dir), (views, "SPEC_DATA_PATH", self.spec_dir),
+                                    (views, "spectrogram_store", self.store),
+                                    (views, "response_cache", http_cache.ResponseCache(os.path.join(tmp.name, "c")))):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = APIRequestFactory()
+
+    def get(self, patient_id="42"):
+        request = self.factory.get(f"/spec/data/{patient_id}/")
+        return views.SPECDataView.as_view()(request, patient_id=patient_id)
+
+    def test_missing_spectrogram_is_computed_and_stored(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("ETag", response)
+        expected = spectrogram_from_eeg_npy(os.path.join(self.eeg_dir, "42.npy"), output_dir=self.spec_dir + "-ref")
+        np.testing.assert_array_equal(load_array(self.spec_path), expected)
+        self.assertEqual(json.loads(response.content)["spectrograms"]["LP"], expected[:, :, 1].tolist())
+        self.assertEqual([n for n in os.listdir(self.spec_dir) if n.endswith(".tmp")], [])
+        with mock.patch.object(spectrogram_store, "compute_spectrogram", side_effect=AssertionError("recomputed")):
+            self.assertEqual(self.get().status_code, 200)
+
+    def test_concurrent_requests_compute_once(self):
+        calls = []
+        real = spectrogram_store.compute_spectrogram
+
+        def slow_compute(*args):
+            calls.append(threading.get_ident())
+            time.sleep(0.2)
+            return real(*args)
+
+        eeg_path = os.path.join(self.eeg_dir, "42.npy")
+        with mock.patch.object(spectrogram_store, "compute_spectrogram", slow_compute):
+            threads = [threading.Thread(target=self.store.ensure, args=(eeg_path, self.spec_path)) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.store._locks, {})
+        self.assertEqual(load_array(self.spec_path).shape, (128, 256, 4))
+
+    def test_unknown_patient_is_not_found(self):
+        self.assertEqual(self.get("7").status_code, 404)
+        self.assertFalse(os.path.exists(os.path.join(self.spec_dir, "7.npy")))
+
+
+class MetricsTests(SimpleTestCase):
+    def test_samples_are_summed_across_processes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            registry = metrics.Registry(tmp, enabled=True)
+            counter = metrics.Counter("test_events", "Test events", ("kind",), registry=registry)
+            histogram = metrics.Histogram("test_seconds", "Test latency", buckets=(0.1, 1.0), registry=registry)
+            counter.labels("a").inc()
+            histogram.observe(0.05)
+            pid = os.fork()
+            if pid == 0:  # a second worker process
+                counter.labels("a").inc(2)
+                histogram.observe(0.5)
+                os._exit(0)
+            os.waitpid(pid, 0)
+
+            text = registry.render()
+            self.assertIn('test_events_total{kind="a"} 3', text)
+            self.assertIn('test_seconds_bucket{le="0.1"} 1', text)
+            self.assertIn('test_seconds_bucket{le="1"} 2', text)
+            self.assertIn('test_seconds_bucket{le="+Inf"} 2', text)
+            self.assertIn("test_seconds_count 2", text)
+            self.assertEqual(len(os.listdir(tmp)), 2)
+
+    def test_disabled_registry_records_nothing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            registry = metrics.Registry(tmp, enabled=False)
+            metrics.Counter("test_events", "Test events", registry=registry).inc()
+            self.assertEqual(os.listdir(tmp), [])
+
+    def test_metrics_endpoint_reports_views(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(metrics.REGISTRY, "_directory", tmp), \
+                mock.patch.object(metrics.REGISTRY, "_pid", None), \
+                mock.patch.object(views, "EEG_DATA_PATH", tmp):
+            self.client.get("/eeg/data/404/")
+            response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn('hms_http_request_duration_seconds_count{view="eeg_data",method="GET",status="404"} 1',
+                      response.content.decode())
+
+
+@override_settings(PROFILING_TOKEN="secret")
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        np.save(os.path.join(tmp.name, "42.npy"), np.random.default_rng(4).random((19, 2500), dtype=np.float32))
+        self.store = profiling.ProfileStore(os.path.join(tmp.name, "profiles"), max_profiles=3)
+        for target, name, value in ((views, "EEG_DATA_PATH", tmp.name),
+                                    (views, "response_cache", http_cache.ResponseCache(os.path.join(tmp.name, "c"))),
+                                    (instrumentation, "profile_store", self.store)):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_only_requests_with_the_token_are_profiled(self):
+        self.assertNotIn("X-Profile-Id", self.client.get("/eeg/data/42/"))
+        self.assertNotIn("X-Profile-Id", self.client.get("/eeg/data/42/", headers={"X-Profile": "guess"}))
+        self.assertEqual(self.store.list(), [])
+
+        response = self.client.get("/eeg/data/42/", headers={"X-Profile": "secret"})
+        self.assertEqual(response.status_code, 200)
+        profile_id = response["X-Profile-Id"]
+        [saved] = self.store.list()
+        self.assertEqual((saved["id"], saved["view"], saved["status"], saved["trigger"]),
+                         (profile_id, "eeg_data", 200, "header"))
+        # The view's work on the async view executor is in the profile
+        self.assertIn("eeg_data_response", self.store.report(profile_id, limit=200))
+
+    def test_listing_requires_privilege(self):
+        self.assertEqual(self.client.get("/admin/profiles/").status_code, 403)
+        self.client.get("/eeg/data/42/", headers={"X-Profile": "secret"})
+        listing = self.client.get("/admin/profiles/", headers={"X-Profile": "secret"}).json()
+        profile_id = listing["profiles"][0]["id"]
+        report = self.client.get(f"/admin/profiles/{profile_id}/", headers={"X-Profile": "secret"})
+        self.assertIn("function calls", report.content.decode())
+        self.assertEqual(self.client.get("/admin/profiles/0-0/", headers={"X-Profile": "secret"}).status_code, 404)
+
+    def test_ring_keeps_newest_profiles(self):
+        for _ in range(5):
+            self.client.get("/eeg/data/42/", headers={"X-Profile": "secret"})
+        self.assertEqual(len(self.store.list()), 3)
+        self.assertEqual(len([name for name in os.listdir(self.store.root) if name.endswith(".prof")]), 3)
+
+    def test_bound_calls_run_under_the_request_profiler(self):
+        def work():
+            return sum(range(1000))
+
+        def run_in_thread(fn):
+            results = []
+            thread = threading.Thread(target=lambda: results.append(fn()))
+            thread.start()
+            thread.join()
+            return results
+
+        profile = profiling.try_start()
+        profiler = profile.profiler()
+        profiler.enable()
+        try:
+            self.assertEqual(run_in_thread(profiling.bind(work)), [499500])
+            # Python 3.12+ refuses a second profiler while the request's is enabled
+            with mock.patch.object(profiling.cProfile.Profile, "enable",
+                                   side_effect=ValueError("Another profiling tool is already active")):
+                self.assertEqual(run_in_thread(profiling.bind(work)), [499500])
+        finally:
+            profiler.disable()
+            profiling.finish(profile)
+        self.assertIn("work", [name for _, _, name in profile.stats().stats])
+
+    def test_async_view_executor_work_is_profiled(self):
+        def blocking_work():
+            return np.linalg.svd(np.ones((64, 64)))
+
+        async def view(request):
+            await async_views.run_blocking(blocking_work)
+            return HttpResponse("ok")
+
+        middleware = instrumentation.ProfilingMiddleware(view)
+        request = AsyncRequestFactory().get("/", headers={"X-Profile": "secret"})
+        response = async_to_sync(middleware)(request)
+        report = self.store.report(response["X-Profile-Id"], limit=200)
+        self.assertIn("blocking_work", report)
+        self.assertIn("svd", report)
+
+
+class EEGSocketRelayTests(SimpleTestCase):
+    def socket(self, app, patient_id):
+        return ApplicationCommunicator(app, {"type": "websocket", "path": f"/ws/eeg/{patient_id}/",
+                                             "headers": [], "query_string": b"", "subprotocols": []})
+
+    async def _open(self, socket):
+        await socket.send_input({"type": "websocket.connect"})
+        self.assertEqual((await socket.receive_output(1))["type"], "websocket.accept")
+
+    async def _relay(self, relay):
+        app = URLRouter(websocket_urlpatterns)
+        feed, dashboard, other = self.socket(app, "7"), self.socket(app, "7"), self.socket(app, "8")
+        for socket in (feed, dashboard, other):
+            await self._open(socket)
+        frame = {"type": "eeg_data", "sent_at": 1.5, "data": [[1.0, 2.0]]}
+        with override_settings(EEG_WS_RELAY=relay):
+            await feed.send_input({"type": "websocket.receive", "text": json.dumps(frame)})
+            await feed.send_input({"type": "websocket.receive", "text": "not json"})
+            # receive_nothing() is True if no frame arrives
+            received = await dashboard.receive_nothing(0.2) or json.loads((await dashboard.receive_output(1))["text"])
+        self.assertTrue(await other.receive_nothing(0.1))
+        for socket in (feed, dashboard, other):
+            await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+            await socket.wait(1)
+        return received
+
+    def test_frames_reach_the_patients_sockets_only_when_relaying(self):
+        self.assertEqual(async_to_sync(self._relay)(True), {"type": "eeg_data", "sent_at": 1.5, "data": [[1.0, 2.0]]})
+        self.assertIs(async_to_sync(self._relay)(False), True)
+
+
+@override_settings(EEG_WS_RELAY=True, WARD_WS_MIN_INTERVAL=0.01, WARD_WS_MAX_FRAMES=3, WARD_WS_MAX_SUBSCRIPTIONS=3)
+class WardSocketTests(SimpleTestCase):
+    def socket(self, app, path):
+        return ApplicationCommunicator(app, {"type": "websocket", "path": path, "headers": [],
+                                             "query_string": b"", "subprotocols": []})
+
+    async def _session(self):
+        app = URLRouter(websocket_urlpatterns)
+        feeds = {p: self.socket(app, f"/ws/eeg/{p}/") for p in ("7", "8")}
+        ward = self.socket(app, "/ws/eeg/ward/")
+        for socket in (*feeds.values(), ward):
+            await socket.send_input({"type": "websocket.connect"})
+            self.assertEqual((await socket.receive_output(1))["type"], "websocket.accept")
+
+        async def command(**message):
+            await ward.send_input({"type": "websocket.receive", "text": json.dumps(message)})
+            return json.loads((await ward.receive_output(1))["text"])
+
+        async def feed(patient_id, *values):
+            for value in values:
+                await feeds[patient_id].send_input({"type": "websocket.receive", "text": json.dumps({"v": value})})
+
+        replies = [await command(action="subscribe", patients=["7", "8", "7"], interval=0.2)]
+        await feed("7", 1, 2, 3, 4, 5)
+        await feed("8", 6)
+        batch = json.loads((await ward.receive_output(2))["text"])
+        replies.append(await command(action="unsubscribe", patients=["8", "9"]))
+        await feed("8", 7)
+        await feed("7", 8)
+        second = json.loads((await ward.receive_output(2))["text"])
+        replies.append(await command(action="subscribe", patients=["1", "2", "3"]))
+        replies.append(await command(action="subscribe", patients="7"))
+        replies.append(await command(action="resubscribe"))
+        replies.append(await command(action="subscribe", patients=["7"], interval=float("nan")))
+        for socket in (*feeds.values(), ward):
+            await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+            await socket.wait(1)
+        return replies, batch, second
+
+    def test_one_socket_gets_tagged_batches_for_its_patients(self):
+        replies, batch, second = async_to_sync(self._session)()
+        self.assertEqual(replies[0], {"type": "subscriptions", "patients": ["7", "8"]})
+        self.assertEqual(batch["type"], "eeg_batch")
+        self.assertEqual(batch["frames"], {"7": [{"v": 3}, {"v": 4}, {"v": 5}], "8": [{"v": 6}]})
+        self.assertEqual(batch["dropped"], {"7": 2})
+        self.assertEqual(replies[1], {"type": "subscriptions", "patients": ["7"]})
+        self.assertEqual(second["frames"], {"7": [{"v": 8}]})
+        self.assertNotIn("dropped", second)
+        self.assertEqual([r["type"] for r in replies[2:]], ["error"] * 4)
+        self.assertIn("at most 3", replies[2]["message"])
+        self.assertIn("finite", replies[5]["message"])
+
+    async def _binary_session(self, samples):
+        app = URLRouter(websocket_urlpatterns)
+        gateway, ward = self.socket(app, "/ws/eeg/7/"), self.socket(app, "/ws/eeg/ward/")
+        for socket in (gateway, ward):
+            await socket.send_input({"type": "websocket.connect"})
+            self.assertEqual((await socket.receive_output(1))["type"], "websocket.accept")
+        await ward.send_input({"type": "websocket.receive",
+                               "text": json.dumps({"action": "subscribe", "patients": ["7"], "interval": 0.2})})
+        await ward.receive_output(1)
+        chunk = live_buffers.encode_chunk(0, samples)
+        await gateway.send_input({"type": "websocket.receive", "bytes": chunk})
+        await gateway.send_input({"type": "websocket.receive", "bytes": chunk})  # a resend adds nothing
+        ack = json.loads((await gateway.receive_output(1))["text"])
+        batch = json.loads((await ward.receive_output(2))["text"])
+        # Events without a patient tag are dropped rather than filed under a guess
+        await get_channel_layer().group_send("eeg_7", {"type": "send_eeg_data", "data": {"v": 1}})
+        await asyncio.sleep(0.4)
+        empty = await ward.receive_nothing(0.1)
+        for socket in (gateway, ward):
+            await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+            await socket.wait(1)
+        return ack, batch, empty
+
+    @override_settings(EEG_INGEST=True)
+    def test_binary_ingested_samples_reach_ward_subscribers(self):
+        samples = np.arange(19 * 4, dtype=np.float32).reshape(19, 4)
+        samples[3, 1] = np.nan
+        buffers = live_buffers.LiveBuffers(capacity=3000, max_patients=2)
+        with mock.patch("eeg_app.consumers.live_buffers", buffers), self.assertLogs("eeg_app.consumers", "WARNING"):
+            ack, batch, empty = async_to_sync(self._binary_session)(samples)
+        self.assertEqual(ack, {"type": "ack", "seq": 4, "duplicate": 4})
+        expected = samples.tolist()
+        expected[3][1] = None
+        self.assertEqual(batch["frames"], {"7": [{"seq": 0, "eeg": expected}]})
+        self.assertTrue(empty)
+
+
+class LiveIngestTests(SimpleTestCase):
+    def setUp(self):
+        self.stream = synthetic_eeg(np.random.default_rng(11), 1, n_samples=4000)[0].astype(np.float32)
+
+    def test_ring_buffer_windows_are_views_of_the_newest_samples(self):
+        buffer = EEGRingBuffer(1000)
+        data = buffer._data
+        for start in range(0, 3000, 150):
+            buffer.write(start, self.stream[:, start:start + 150])
+        window, end = buffer.read(600, lambda view: view)
+        self.assertEqual(end, 3000)
+        np.testing.assert_array_equal(window, self.stream[:, 2400:3000])
+        self.assertTrue(np.shares_memory(window, data))
+        self.assertIs(buffer._data, data)
+        self.assertFalse(window.flags.writeable)
+        self.assertEqual(buffer.read(5000, lambda view: view.shape)[0], (19, 1000))
+
+    def test_gaps_read_as_nan_and_duplicates_are_dropped(self):
+        buffer = EEGRingBuffer(1000)
+        buffer.write(0, self.stream[:, :100])
+        self.assertEqual(buffer.write(50, self.stream[:, 50:150]), 50)
+        self.assertEqual(buffer.write(200, self.stream[:, 200:250]), 50)
+        window, end = buffer.read(250, np.array)
+        self.assertEqual((end, buffer.duplicate_samples, buffer.gap_samples), (250, 50, 50))
+        np.testing.assert_array_equal(window[:, :150], self.stream[:, :150])
+        self.assertTrue(np.isnan(window[:, 150:200]).all())
+        np.testing.assert_array_equal(window[:, 200:], self.stream[:, 200:250])
+
+    def test_reader_overtaken_by_the_writer_retries(self):
+        buffer = EEGRingBuffer(100)
+        buffer.write(0, self.stream[:, :100])
+        calls = []
+
+        def slow_reader(view):
+            calls.append(view.copy())
+            buffer.write(100 + 60 * len(calls), self.stream[:, :60])
+            return len(calls)
+        with self.assertRaises(WindowOverwritten):
+            buffer.read(100, slow_reader)
+        self.assertEqual(buffer.read(10, slow_reader)[0], 4)
+
+    async def _ingest(self):
+        app = URLRouter(websocket_urlpatterns)
+        socket = ApplicationCommunicator(app, {"type": "websocket", "path": "/ws/eeg/42/", "headers": [],
+                                               "query_string": b"", "subprotocols": []})
+        await socket.send_input({"type": "websocket.connect"})
+        await socket.receive_output(1)
+        replies = []
+        for seq, flags in ((0, 0), (500, live_buffers.FLAG_ACK), (500, 0), (1500, 0)):
+            chunk = live_buffers.encode_chunk(seq, self.stream[:, seq:seq + 500], flags)
+            await socket.send_input({"type": "websocket.receive", "bytes": chunk})
+            if not await socket.receive_nothing(0.05):
+                replies.append(json.loads((await socket.receive_output(1))["text"]))
+        await socket.send_input({"type": "websocket.receive", "bytes": b"EG\x01\x00junk"})
+        replies.append(json.loads((await socket.receive_output(1))["text"]))
+        await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+        await socket.wait(1)
+        return replies
+
+    @override_settings(EEG_INGEST=True, LIVE_WINDOW_SAMPLES=1500)
+    def test_gateway_chunks_feed_the_live_views(self):
+        buffers = live_buffers.LiveBuffers(capacity=3000, max_patients=2)
+        with mock.patch.object(live_buffers, "live_buffers", buffers), mock.patch.object(views, "live_buffers", buffers), \
+                mock.patch("eeg_app.consumers.live_buffers", buffers):
+            replies = async_to_sync(self._ingest)()
+            self.assertEqual(replies[:3], [{"type": "ack", "seq": 1000}, {"type": "ack", "seq": 1000, "duplicate": 500},
+                                           {"type": "ack", "seq": 2000, "gap": 500}])
+            self.assertEqual(replies[3]["type"], "error")
+
+            client = APIClient()
+            body = client.get("/eeg/data/42/?source=live").json()
+            self.assertEqual(body["seq"], 2000)
+            self.assertEqual(len(body["eeg_data"]), 1500)
+            self.assertAlmostEqual(body["eeg_data"][0]["Fp1"], float(self.stream[0, 500]), places=4)
+            self.assertIsNone(body["eeg_data"][500]["O2"])
+            self.assertEqual(client.get("/eeg/data/7/?source=live").status_code, 404)
+
+            spec = client.get("/eeg/spec/42/?source=live").json()
+            window = np.concatenate([self.stream[:, 500:1000], np.full((19, 500), np.nan, np.float32),
+                                     self.stream[:, 1500:2000]], axis=1)
+            self.assertEqual(spec["spectrograms"]["LL"], compute_spectrogram(window)[:, :, 0].tolist())
+
+            manager = fixture_manager()
+            with mock.patch.object(views, "inference", InferenceClient(None, lambda: manager)):
+                response = client.post("/eeg/predict/", {"patient_id": "42", "source": "live"}, format="json")
+            self.assertEqual(response.status_code, 200)
+            expected = manager.predict_features(manager.extract_features(window), input_type="live")
+            self.assertEqual(response.json()["result"], expected)
+
+
+class RecordingStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.stream = synthetic_eeg(np.random.default_rng(12), 1, n_samples=3000)[0].astype(np.float32)
+
+    def writer(self, **kwargs):
+        writer = RecordingWriter(self.root, segment_samples=700, flush_interval=60, **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_chunks_read_back_across_segments_with_gaps_as_nan(self):
+        writer = self.writer()
+        for start in range(0, 2000, 150):
+            writer.append("7", start, self.stream[:, start:start + 150], timestamp=1000 + start / 200)
+        writer.append("7", 1900, self.stream[:, 1900:2100], timestamp=1009.5)  # 100 duplicates
+        writer.append("7", 2500, self.stream[:, 2500:3000], timestamp=1012.5)
+        writer.flush()
+        reader = RecordingReader(self.root, "7")
+        self.assertEqual(reader.extent(), (0, 2100))  # only the segments closed by a rotation are synced
+        writer.sync()
+        self.assertEqual(reader.extent(), (0, 3000))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, "7")))[:3],
+                         ["index.log", "seg-000000000000.f32", "seg-000000000700.f32"])
+        np.testing.assert_array_equal(reader.read(0, 2100), self.stream[:, :2100])
+        window = reader.read(100, 600)
+        self.assertIsInstance(window.base, np.memmap)
+        np.testing.assert_array_equal(window, self.stream[:, 100:600])
+        gapped = reader.read(2000, 3000)
+        np.testing.assert_array_equal(gapped[:, :100], self.stream[:, 2000:2100])
+        self.assertTrue(np.isnan(gapped[:, 100:500]).all())
+        np.testing.assert_array_equal(gapped[:, 500:], self.stream[:, 2500:3000])
+        self.assertEqual(reader.seq_at(1005), 1000)
+        self.assertEqual(reader.seq_at(1013), 2600)
+        samples, first = reader.read_time(1001, 1002)
+        self.assertEqual(first, 200)
+        np.testing.assert_array_equal(samples, self.stream[:, 200:400])
+        frame = reader.read_frame(2000, 2200)
+        self.assertEqual(frame.shape, (200, 20))
+        self.assertEqual(frame["O2"][150], 0)
+
+    def test_unindexed_samples_are_dropped_on_reopen(self):
+        writer = self.writer()
+        writer.append("7", 0, self.stream[:, :600])
+        writer.flush()
+        writer.sync()
+        writer.append("7", 600, self.stream[:, 600:1000])  # rotates at 700
+        writer.flush()  # on disk, never indexed: the process dies here
+        directory = os.path.join(self.root, "7")
+        self.assertEqual(len(os.listdir(directory)), 3)
+
+        recovered = self.writer()
+        recovered.append("7", 700, self.stream[:, 700:1200])
+        recovered.close()
+        reader = RecordingReader(self.root, "7")
+        self.assertEqual(reader.extent(), (0, 1200))
+        samples = reader.read(0, 1200)
+        np.testing.assert_array_equal(samples[:, :700], self.stream[:, :700])
+        np.testing.assert_array_equal(samples[:, 700:], self.stream[:, 700:1200])
+
+    def test_overloaded_writer_drops_chunks(self):
+        writer = self.writer(max_pending_bytes=19 * 4 * 250)
+        self.assertTrue(writer.append("7", 0, self.stream[:, :200]))
+        self.assertFalse(writer.append("7", 200, self.stream[:, 200:400]))
+
+    def test_patient_ids_must_stay_under_the_root(self):
+        writer = self.writer()
+        for patient_id in ("..", ".", "", "../7", "7/..", "a/b"):
+            with self.assertRaises(ValueError):
+                writer.append(patient_id, 0, self.stream[:, :100])
+            with self.assertRaises(ValueError):
+                RecordingReader(self.root, patient_id)
+        writer.close()
+        self.assertEqual(os.listdir(self.root), [])
+        self.assertEqual(APIClient().get("/eeg/data/../?source=recording").status_code, 400)
+
+    def test_reader_cache_keeps_the_most_recent_patients(self):
+        with mock.patch.object(live_buffers, "READER_CACHE_SIZE", 2), \
+                mock.patch.object(live_buffers, "_readers", live_buffers.OrderedDict()):
+            first = live_buffers.recording_reader("1")
+            live_buffers.recording_reader("2")
+            self.assertIs(live_buffers.recording_reader("1"), first)
+            live_buffers.recording_reader("3")  # evicts 2, the least recently read
+            self.assertEqual(list(live_buffers._readers), ["1", "3"])
+
+    def test_ingested_chunks_are_recorded_and_served(self):
+        writer = self.writer()
+        buffers = live_buffers.LiveBuffers(capacity=1000, max_patients=2, recorder=writer)
+        for seq in (0, 500, 500, 1500):
+            buffers.ingest("42", live_buffers.encode_chunk(seq, self.stream[:, seq:seq + 500]))
+        writer.close()
+        reader = RecordingReader(self.root, "42")
+        with mock.patch.object(views, "recording_reader", lambda patient_id: reader), \
+                override_settings(LIVE_WINDOW_SAMPLES=1500):
+            client = APIClient()
+            body = client.get("/eeg/data/42/?source=recording").json()
+            self.assertEqual((body["start_seq"], body["end_seq"]), (500, 2000))
+            self.assertAlmostEqual(body["eeg_data"][0]["Fp1"], float(self.stream[0, 500]), places=4)
+            self.assertIsNone(body["eeg_data"][500]["O2"])
+            after_gap = next(run.time for run in reader.runs if run.seq == 1500)
+            body = client.get(f"/eeg/data/42/?source=recording&start={after_gap}&end={after_gap + 1}").json()
+            self.assertEqual((body["start_seq"], len(body["eeg_data"])), (1500, 200))
+            with mock.patch.object(views, "RECORDING_MAX_SAMPLES", 1000):
+                self.assertEqual(client.get("/eeg/data/42/?source=recording&start=0").status_code, 400)
+            self.assertEqual(client.get("/eeg/data/42/?source=recording&start=soon").status_code, 400)
+
+
+class RollingSpectrogramTests(SimpleTestCase):
+    def setUp(self):
+        self.stream = synthetic_eeg(np.random.default_rng(13), 1, n_samples=3000)[0].astype(np.float32)
+
+    def test_columns_match_scipy_segments(self):
+        from scipy.ndimage import zoom
+        from scipy.signal import spectrogram
+        pair = rolling_spectrogram.BIPOLAR[5] @ self.stream
+        _, _, power = spectrogram(pair, fs=200, nperseg=128, noverlap=64, nfft=1024, scaling="density")
+        expected = 10 * np.log10(zoom(power, (128 / power.shape[0], 1), order=1) + 1e-10)
+        frames = np.lib.stride_tricks.sliding_window_view(pair, 128)[::64]
+        np.testing.assert_allclose(rolling_spectrogram.frame_decibels(frames).T, expected, atol=1e-2)
+
+    def test_chunking_and_width_do_not_change_the_columns(self):
+        whole = rolling_spectrogram.RollingSpectrogram(width=16, decay=0.01)
+        columns = whole.push(self.stream)
+        self.assertEqual(columns.shape, ((3000 - 128) // 64 + 1, 128, 4))
+        wide = rolling_spectrogram.RollingSpectrogram(width=4096, decay=0.01)
+        image = wide.image
+        chunked = np.concatenate([wide.push(self.stream[:, i:i + 37]) for i in range(0, 3000, 37)])
+        np.testing.assert_array_equal(chunked, columns)
+        self.assertIs(wide.image, image)
+        np.testing.assert_array_equal(whole.ordered(), columns[-16:].transpose(1, 0, 2))
+        self.assertEqual(whole.next_column, len(columns) % 16)
+        self.assertTrue(((columns >= 0) & (columns <= 1)).all())
+
+    def test_gaps_are_filled(self):
+        stream = self.stream.copy()
+        stream[:, 1000:1500] = np.nan
+        columns = rolling_spectrogram.RollingSpectrogram().push(stream)
+        self.assertFalse(np.isnan(columns).any())
+
+    async def _stream(self, buffers, spectrograms):
+        app = URLRouter(websocket_urlpatterns)
+        scope = {"type": "websocket", "headers": [], "query_string": b"", "subprotocols": []}
+        gateway = ApplicationCommunicator(app, {**scope, "path": "/ws/eeg/42/"})
+        await gateway.send_input({"type": "websocket.connect"})
+        await gateway.receive_output(1)
+        viewer = ApplicationCommunicator(app, {**scope, "path": "/ws/eeg/42/spec/"})
+        await viewer.send_input({"type": "websocket.connect"})
+        await viewer.receive_output(1)
+        messages = []
+        for seq in range(0, 1000, 100):
+            await gateway.send_input({"type": "websocket.receive",
+                                      "bytes": live_buffers.encode_chunk(seq, self.stream[:, seq:seq + 100])})
+            if not await viewer.receive_nothing(0.05):
+                messages.append(json.loads((await viewer.receive_output(1))["text"]))
+        late = ApplicationCommunicator(app, {**scope, "path": "/ws/eeg/42/spec/"})
+        await late.send_input({"type": "websocket.connect"})
+        await late.receive_output(1)
+        image = json.loads((await late.receive_output(1))["text"])
+        for socket in (gateway, viewer, late):
+            await socket.send_input({"type": "websocket.disconnect", "code": 1000})
+            await socket.wait(1)
+        return messages, image
+
+    @override_settings(EEG_INGEST=True, LIVE_SPECTROGRAM=True)
+    def test_new_columns_are_pushed_to_spectrogram_sockets(self):
+        buffers = live_buffers.LiveBuffers(capacity=3000, max_patients=2)
+        spectrograms = rolling_spectrogram.LiveSpectrograms(width=64)
+        with mock.patch("eeg_app.consumers.live_buffers", buffers), \
+                mock.patch("eeg_app.consumers.live_spectrograms", spectrograms):
+            messages, image = async_to_sync(self._stream)(buffers, spectrograms)
+        expected = rolling_spectrogram.RollingSpectrogram(width=64).push(self.stream[:, :1000])
+        received = [np.array(m["columns"]["LP"]) for m in messages]
+        self.assertEqual([m["column"] for m in messages], list(np.cumsum([0] + [len(c) for c in received[:-1]])))
+        self.assertEqual(messages[-1]["seq"], 1000)
+        received = np.concatenate(received)
+        np.testing.assert_allclose(received, expected[:, :, 1], rtol=1e-6)
+        self.assertEqual((image["type"], image["next_column"], len(image["columns"]["RR"])), ("spec_image", 14, 64))
+
+
+class ShardingTests(SimpleTestCase):
+    def test_ring_spreads_patients_and_moves_few_on_join(self):
+        patients = [str(i) for i in range(4000)]
+        ring = sharding.HashRing(["a", "b", "c", "d"])
+        owners = {p: ring.owner(p) for p in patients}
+        counts = [list(owners.values()).count(member) for member in "abcd"]
+        self.assertLess(max(counts) / min(counts), 1.5)
+        grown = sharding.HashRing(["a", "b", "c", "d", "e"])
+        moved = [p for p in patients if grown.owner(p) != owners[p]]
+        self.assertTrue(all(grown.owner(p) == "e" for p in moved))
+        self.assertLess(abs(len(moved) / len(patients) - 0.2), 0.08)
+
+    def cluster(self, names, leases, patients, scored):
+        return {name: sharding.LiveScoring(sharding.ShardCoordinator(name, leases, ttl=3),
+                                           lambda: patients, lambda p, name=name: scored.append((name, p)))
+                for name in names}
+
+    def rounds(self, workers, clock, n):
+        """Scores per patient in each of ``n`` lockstep rounds, one second apart"""
+        counts = []
+        for _ in range(n):
+            scored = self.scored
+            scored.clear()
+            for worker in workers.values():
+                worker.run_once()
+            counts.append({p: sum(1 for _, q in scored if q == p) for p in self.patients})
+            clock[0] += 1
+        return counts
+
+    def test_each_patient_scored_once_across_joins_and_deaths(self):
+        clock = [0.0]
+        leases = sharding.LocalLeases(clock=lambda: clock[0])
+        self.patients, self.scored = [f"p{i}" for i in range(60)], []
+        workers = self.cluster(["w1", "w2", "w3"], leases, self.patients, self.scored)
+        counts = self.rounds(workers, clock, 3)
+        self.assertTrue(all(c <= 1 for round_ in counts for c in round_.values()))
+        self.assertEqual(set(counts[-1].values()), {1})  # settled: everyone scored exactly once
+        shares = {name: len(w.coordinator.claimed) for name, w in workers.items()}
+        self.assertEqual(sum(shares.values()), 60)
+        self.assertTrue(all(share >= 10 for share in shares.values()))
+
+        workers.update(self.cluster(["w4"], leases, self.patients, self.scored))
+        counts = self.rounds(workers, clock, 3)
+        self.assertTrue(all(c <= 1 for round_ in counts for c in round_.values()))
+        self.assertEqual(set(counts[-1].values()), {1})
+        self.assertTrue(workers["w4"].coordinator.claimed)
+
+        orphaned = set(workers.pop("w2").coordinator.claimed)  # dies without releasing anything
+        counts = self.rounds(workers, clock, 6)
+        self.assertTrue(all(c <= 1 for round_ in counts for c in round_.values()))
+        self.assertTrue(all(counts[0][p] == 0 for p in orphaned))  # its leases have not expired yet
+        self.assertEqual(set(counts[-1].values()), {1})
+
+    def test_stopped_streams_release_their_lease(self):
+        leases = sharding.LocalLeases()
+        patients = ["p1", "p2"]
+        scoring = sharding.LiveScoring(sharding.ShardCoordinator("w1", leases), lambda: list(patients), lambda p: None)
+        self.assertEqual(scoring.run_once(), ["p1", "p2"])
+        patients.remove("p2")
+        scoring.run_once()
+        self.assertEqual(set(leases.held(sharding.PATIENT)), {"patient:p1"})
+        scoring.coordinator.leave()
+        self.assertEqual(leases.held(""), {})
+
+    def test_scorer_sends_each_new_window_to_the_patient_group(self):
+        root = tempfile.mkdtemp()
+        writer = RecordingWriter(root)
+        writer.append("42", 0, synthetic_eeg(np.random.default_rng(15), 1, n_samples=3000)[0])
+        writer.close()
+        os.utime(os.path.join(root, "42", "index.log"))
+        self.assertEqual(sharding.active_recordings(root, 30), ["42"])
+        manager = fixture_manager()
+        layer = InMemoryChannelLayer()
+
+        async def listen():
+            channel = await layer.new_channel()
+            await layer.group_add("eeg_42", channel)
+            return channel
+        channel = async_to_sync(listen)()
+        clock = [0.0]
+        leases = sharding.LocalLeases(clock=lambda: clock[0])
+        w1, w2 = sharding.ShardCoordinator("w1", leases, ttl=3), sharding.ShardCoordinator("w2", leases, ttl=3)
+        self.assertTrue(w1.heartbeat() and w1.claim("42"))
+        client = InferenceClient(None, lambda: manager)
+
+        def slow_round(op, *args, **kwargs):
+            if op == "predict_features":  # w1's lease lapses and w2 takes the patient mid-round
+                clock[0] += 5
+                self.assertTrue(leases.acquire("patient:42", "w2", 3))
+            return client.call(op, *args, **kwargs)
+        with mock.patch("eeg_app.live_buffers.recording_reader", lambda p: RecordingReader(root, p)), \
+                mock.patch("channels.layers.get_channel_layer", lambda: layer):
+            with mock.patch.object(views, "inference", mock.Mock(call=slow_round)):
+                self.assertIsNone(sharding.LiveScorer(w1)("42"))  # fenced out: nothing published
+            self.assertNotIn("42", w1.claimed)
+            with mock.patch.object(views, "inference", client):
+                payload = sharding.LiveScorer(w2)("42")
+                self.assertIsNone(sharding.LiveScorer(w2)("42"))  # no new samples since
+                leases.release("patient:42", "w2")
+                self.assertTrue(leases.acquire("patient:42", "w1", 3))
+                self.assertIsNone(sharding.LiveScorer(w1)("42"))  # the position moved with the lease
+        self.assertEqual(payload["seq"], 3000)
+        self.assertEqual(leases.position("patient:42"), 3000)
+        message = json.loads(async_to_sync(layer.receive)(channel)["text"])
+        self.assertEqual((message["type"], message["result"]), ("prediction", payload["result"]))
+
+        async def nothing_more():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(channel), 0.1)
+        async_to_sync(nothing_more)()  # one prediction for the window, from w2 only
+
+
+class DatabaseLeaseTests(TestCase):
+    def test_leases_exclude_other_holders_until_expiry(self):
+        leases = sharding.DatabaseLeases()
+        self.assertTrue(leases.acquire("patient:1", "w1", ttl=60))
+        self.assertFalse(leases.acquire("patient:1", "w2", ttl=60))
+        self.assertTrue(leases.acquire("patient:1", "w1", ttl=60))  # renewal
+        self.assertEqual(leases.held("patient:"), {"patient:1": "w1"})
+        ShardLease.objects.filter(name="patient:1").update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(leases.held("patient:"), {})
+        self.assertTrue(leases.acquire("patient:1", "w2", ttl=60))
+        leases.release("patient:1", "w1")  # not the holder: no effect
+        self.assertEqual(leases.held(""), {"patient:1": "w2"})
+        leases.release("patient:1", "w2")
+        self.assertEqual(ShardLease.objects.count(), 0)
+
+    def test_commit_is_fenced_and_position_outlives_the_holder(self):
+        leases = sharding.DatabaseLeases()
+        self.assertTrue(leases.acquire("patient:1", "w1", ttl=60))
+        self.assertTrue(leases.commit("patient:1", "w1", 400, ttl=60))
+        self.assertFalse(leases.commit("patient:1", "w2", 800, ttl=60))
+        ShardLease.objects.filter(name="patient:1").update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertFalse(leases.commit("patient:1", "w1", 800, ttl=60))  # lapsed
+        self.assertTrue(leases.acquire("patient:1", "w2", ttl=60))
+        self.assertEqual(leases.position("patient:1"), 400)
+        leases.release("patient:1", "w2")
+        self.assertEqual(leases.held(""), {})
+        self.assertEqual(leases.position("patient:1"), 400)
+        self.assertIsNone(leases.position("patient:2"))
+
+
+class SlowManager:
+    """Pool worker manager whose predict takes longer than the tests' timeouts"""
+
+    def predict(self, eeg):
+        time.sleep(30)
+
+    def predict_features(self, features, input_type="features"):
+        time.sleep(0.2)
+        return {"sum": float(features.sum()), "input_type": input_type}
+
+
+class InferencePoolTests(SimpleTestCase):
+    def pool(self, **kwargs):
+        pool = InferencePool(**kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_pool_matches_in_process_inference(self):
+        pool = self.pool(workers=1, manager_factory="benchmarks.fixtures:stub_manager",
+                         slot_bytes=64 * 1024)
+        manager = fixture_manager()
+        client = InferenceClient(pool, lambda: manager)
+        in_process = InferenceClient(None, lambda: manager)
+        eeg = (np.random.default_rng(5).standard_normal((19, 2500)) * 40).astype(np.float32)
+        # 190 kB does not fit the 64 kB slot, so it travels in its own segment
+        self.assertEqual(client.call("predict", eeg), in_process.call("predict", eeg))
+        features = client.call("extract_features", eeg[:, :500])
+        np.testing.assert_array_equal(features, manager.extract_features(eeg[:, :500]))
+
+        async def concurrent():
+            return await asyncio.gather(*(client.acall("predict_features", features, input_type="x")
+                                          for _ in range(6)))
+        results = async_to_sync(concurrent)()
+        self.assertEqual(results, [manager.predict_features(features, input_type="x")] * 6)
+        self.assertEqual(pool.health()["alive"], 1)
+
+    def test_crashed_worker_is_replaced(self):
+        pool = self.pool(workers=1, manager_factory="eeg_app.tests:SlowManager", start_method="fork")
+        future = pool.submit("predict", np.zeros((19, 10), dtype=np.float32))
+        pool._workers[0].process.kill()
+        with self.assertRaises(WorkerCrashed):
+            future.result(timeout=10)
+        self.assertEqual(pool.restarts, 1)
+        self.assertTrue(pool._workers[0].process.is_alive())
+
+    def test_overrunning_call_times_out(self):
+        pool = self.pool(workers=1, manager_factory="eeg_app.tests:SlowManager", start_method="fork", timeout=0.5)
+        with self.assertRaises(InferenceTimeout):
+            pool.submit("predict", np.zeros((19, 10), dtype=np.float32)).result(timeout=10)
+        self.assertEqual(pool.health()["restarts"], 1)
+
+    def test_cancelled_calls_do_not_stop_the_pool(self):
+        pool = self.pool(workers=1, manager_factory="eeg_app.tests:SlowManager", start_method="fork")
+        client = InferenceClient(pool, None)
+        features = np.ones(4, dtype=np.float32)
+
+        async def cancel_running_and_queued():
+            calls = [asyncio.ensure_future(client.acall("predict_features", features)) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            for call in calls:
+                call.cancel()
+            return await asyncio.gather(*calls, return_exceptions=True)
+        results = async_to_sync(cancel_running_and_queued)()
+        self.assertTrue(all(isinstance(r, asyncio.CancelledError) for r in results))
+        self.assertEqual(pool.submit("predict_features", features).result(timeout=10),
+                         {"sum": 4.0, "input_type": "features"})
+        self.assertTrue(pool._collector.is_alive())
+
+    def test_one_array_argument_per_call(self):
+        pool = self.pool(workers=1)
+        features = np.ones(4, dtype=np.float32)
+        with self.assertRaises(ValueError):
+            pool.submit("predict_features", features, features)
+        self.assertIsNone(pool._collector)  # rejected before any worker started
+
+    def test_view_errors_when_pool_is_closed(self):
+        pool = InferencePool(workers=1)
+        pool.close()
+        with mock.patch.object(views, "inference", InferenceClient(pool, None)):
+            response = APIClient().post("/eeg/predict/", {"features": [0.0] * len(views.xgb_model_manager.feature_names)}, format="json")
+        self.assertEqual(response.status_code, 500)
+
+
+class SpectrogramServingTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.tflite_path = spectrogram_export.export(os.path.join(cls.tmp.name, "cnn"), tflite=True, input_shape=(16, 32, 4))
+        cls.saved_path = os.path.join(cls.tmp.name, "cnn")
+        cls.inputs = np.random.default_rng(0).random((11, 16, 32, 4), dtype=np.float32)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def model(self, path=None, **kwargs):
+        model = SpectrogramModel(path or self.saved_path, **{"max_batch": 4, **kwargs})
+        self.addCleanup(model.close)
+        return model
+
+    def test_batched_matches_single_and_tflite(self):
+        model = self.model()
+        self.assertEqual(model.input_shape, (16, 32, 4))
+        self.assertEqual(model.buckets, [1, 2, 4])
+        batched = model.predict_batch(self.inputs)
+        self.assertEqual(batched.shape, (11, len(CLASSES)))
+        single = np.stack([model.predict_batch(x[None])[0] for x in self.inputs])
+        np.testing.assert_allclose(batched, single, atol=1e-6)
+        np.testing.assert_allclose(self.model(self.tflite_path).predict_batch(self.inputs), batched, atol=1e-5)
+        result = model.predict(self.inputs[0])
+        self.assertEqual(result["predicted_class"], CLASSES[int(np.argmax(batched[0]))])
+        self.assertAlmostEqual(sum(result["probabilities"].values()), 1.0, places=5)
+
+    def test_concurrent_requests_share_batches(self):
+        model = self.model(batch_window=0.05)
+        sizes = []
+        real_run = model._run
+        model._run = lambda batch: sizes.append(len(batch)) or real_run(batch)
+        futures = [model.submit(x) for x in self.inputs[:8]]
+        results = np.stack([f.result(timeout=10) for f in futures])
+        np.testing.assert_allclose(results, model.predict_batch(self.inputs[:8]), atol=1e-6)
+        self.assertLess(len(sizes), 8)
+        self.assertLessEqual(max(sizes), 4)
+
+    def test_wrong_shape_is_rejected(self):
+        model = self.model(warmup=False)
+        with self.assertRaises(ValueError):
+            model.submit(np.zeros((128, 256, 4), dtype=np.float32))
+        with self.assertRaises(ValueError):
+            model.predict_batch(np.zeros((2, 16, 32), dtype=np.float32))
+
+    def test_view_serves_patient_and_upload(self):
+        model = self.model()
+        spec_dir = os.path.join(self.tmp.name, "spec")
+        os.makedirs(spec_dir, exist_ok=True)
+        save_array(os.path.join(spec_dir, "42.npy"), self.inputs[3])
+        client = APIClient()
+        with mock.patch.object(views, "spectrogram_model", None):
+            self.assertEqual(client.post("/eeg/predict/", {"model": "spectrogram_cnn", "patient_id": "42"},
+                                         format="json").status_code, 503)
+        with mock.patch.object(views, "spectrogram_model", model), mock.patch.object(views, "SPEC_DATA_PATH", spec_dir), \
+                mock.patch.object(views, "EEG_DATA_PATH", os.path.join(self.tmp.name, "eeg")):
+            response = client.post("/eeg/predict/", {"model": "spectrogram_cnn", "patient_id": "42"}, format="json")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["model"], "SpectrogramCNN")
+            self.assertEqual(response.json()["result"], model.predict(self.inputs[3], input_type="spec_store"))
+            self.assertEqual(client.post("/eeg/predict/", {"model": "spectrogram_cnn", "patient_id": "7"},
+                                         format="json").status_code, 404)
+
+            buffer = io.BytesIO()
+            np.save(buffer, np.zeros((3, 3), dtype=np.float32))
+            buffer.seek(0)
+            buffer.name = "bad.npy"
+            response = client.post("/eeg/predict/", {"model": "spectrogram_cnn", "spec_file": buffer}, format="multipart")
+            self.assertEqual(response.status_code, 400)
+
+    def test_view_rejects_patient_ids_outside_the_data_directories(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        eeg_dir, spec_dir = os.path.join(tmp.name, "data", "eeg"), os.path.join(tmp.name, "data", "spec")
+        os.makedirs(eeg_dir)
+        os.makedirs(spec_dir)
+        save_array(os.path.join(tmp.name, "data", "outside.npy"), synthetic_eeg(np.random.default_rng(43), 1)[0])
+        client = APIClient()
+        with mock.patch.object(views, "spectrogram_model", self.model(warmup=False)), \
+                mock.patch.object(views, "SPEC_DATA_PATH", spec_dir), mock.patch.object(views, "EEG_DATA_PATH", eeg_dir):
+            for patient_id in ("../outside", "..", ""):
+                response = client.post("/eeg/predict/", {"model": "spectrogram_cnn", "patient_id": patient_id},
+                                       format="json")
+                self.assertEqual(response.status_code, 400, patient_id)
+        self.assertEqual(sorted(os.listdir(os.path.join(tmp.name, "data"))), ["eeg", "outside.npy", "spec"])
+        self.assertEqual(os.listdir(spec_dir), [])
+
+
+class PatientSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.eeg_dir, self.spec_dir = os.path.join(tmp.name, "eeg"), os.path.join(tmp.name, "spec")
+        os.makedirs(self.eeg_dir)
+        self.eeg = synthetic_eeg(np.random.default_rng(9), 1)[0].astype(np.float32)
+        self.eeg_path = os.path.join(self.eeg_dir, "42.npy")
+        np.save(self.eeg_path, self.eeg)
+        self.manager = fixture_manager()
+        self.store = FeatureStore(os.path.join(tmp.name, "features"))
+        for name, value in (("EEG_DATA_PATH", self.eeg_dir), ("SPEC_DATA_PATH", self.spec_dir),
+                            ("spectrogram_store", spectrogram_store.SpectrogramStore()), ("feature_store", self.store),
+                            ("inference", InferenceClient(None, lambda: self.manager)),
+                            ("response_cache", http_cache.ResponseCache(os.path.join(tmp.name, "cache")))):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_snapshot_reads_the_recording_once(self):
+        reads = []
+        real_load = views.load_array
+
+        def counting_load(path, *args, **kwargs):
+            reads.append(path)
+            return real_load(path, *args, **kwargs)
+
+        with mock.patch.object(views, "load_array", counting_load), \
+                mock.patch.object(spectrogram_store, "load_array", side_effect=AssertionError("EEG re-read")):
+            response = APIClient().get("/eeg/patients/42/snapshot/?points=250")
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["errors"], {})
+        self.assertEqual(reads.count(self.eeg_path), 1)
+        self.assertEqual(body["details"], views.generate_patient_data("42"))
+        self.assertEqual(body["waveform"]["step"], 10)
+        self.assertEqual(len(body["waveform"]["eeg_data"]), 250)
+        self.assertAlmostEqual(body["waveform"]["eeg_data"][0]["Fp1"], float(self.eeg[0, :10].mean()), places=3)
+        self.assertEqual(body["spectrograms"]["RR"], load_array(os.path.join(self.spec_dir, "42.npy"))[:, :, 3].tolist())
+        self.assertEqual(body["prediction"], self.manager.predict_features(self.manager.extract_features(self.eeg),
+                                                                          input_type="feature_store"))
+        self.assertIsNotNone(self.store.get("42"))
+
+        with mock.patch.object(views, "load_array", side_effect=AssertionError("read from disk")):
+            self.assertEqual(APIClient().get("/eeg/patients/42/snapshot/?points=250").json(), body)
+
+    def test_cache_entries_are_shared_and_bounded(self):
+        client = APIClient()
+        body = client.get("/eeg/patients/42/snapshot/?points=250").json()
+        for points in (260, 0, 2500, 100000):  # block lengths 10, 1, 1, 1
+            self.assertEqual(client.get(f"/eeg/patients/42/snapshot/?points={points}").status_code, 200)
+        waveforms = [name for _, _, names in os.walk(os.path.join(views.response_cache.root, "snapshot_waveform"))
+                     for name in names]
+        self.assertEqual(len(waveforms), 2)
+
+        recompute = mock.Mock(call=mock.Mock(side_effect=AssertionError("prediction recomputed")))
+        with mock.patch.object(views, "inference", recompute):
+            self.assertEqual(client.get("/eeg/patients/42/snapshot/?points=250").json(), body)
+            with mock.patch.object(views.xgb_model_manager, "version", "retrained"):
+                again = client.get("/eeg/patients/42/snapshot/?points=250").json()
+        self.assertEqual(again["errors"], {"prediction": "prediction recomputed"})
+
+    def test_failed_step_does_not_fail_the_snapshot(self):
+        with mock.patch.object(views, "feature_store", mock.Mock(get=mock.Mock(side_effect=OSError("store offline")))):
+            body, code = views.snapshot_response("42", points=0)
+        body = json.loads(body)
+        self.assertEqual(code, 200)
+        self.assertIsNone(body["prediction"])
+        self.assertEqual(body["errors"], {"prediction": "store offline"})
+        self.assertEqual(len(body["waveform"]["eeg_data"]), 2500)
+
+    def test_missing_patient_and_bad_points(self):
+        client = APIClient()
+        self.assertEqual(client.get("/eeg/patients/7/snapshot/").status_code, 404)
+        self.assertEqual(client.get("/eeg/patients/42/snapshot/?points=-1").status_code, 400)
+        self.assertEqual(client.get("/eeg/patients/42/snapshot/?points=x").status_code, 400)
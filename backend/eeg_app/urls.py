@@ -1,11 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from .views import SPECDataView, AlertMedicalStaffView, PatientsView, PredictEEG, EEGDataView, PatientDetailsView
+from .views import SPECDataView, AlertMedicalStaffView, PatientsView, PredictEEG, EEGDataView, PatientDetailsView, PatientSnapshotView, PredictionHistoryView
+
+if settings.ASYNC_DATA_VIEWS:
+    from .async_views import (AsyncSPECDataView as SPECDataView, AsyncPatientsView as PatientsView,
+                              AsyncPredictEEG as PredictEEG, AsyncEEGDataView as EEGDataView,
+                              AsyncPatientSnapshotView as PatientSnapshotView)
 
 urlpatterns = [
     path('predict/', PredictEEG.as_view(), name='predict'),
     path('patients/', PatientsView.as_view(), name='patients'),
     path('eeg/patients/<str:patient_id>/', PatientDetailsView.as_view(), name='patient_details'), # remove eeg if necessary
+    path('patients/<str:patient_id>/snapshot/', PatientSnapshotView.as_view(), name='patient_snapshot'),
+    path('patients/<str:patient_id>/predictions/', PredictionHistoryView.as_view(), name='prediction_history'),
     path('data/<str:patient_id>/', EEGDataView.as_view(), name='eeg_data'),
     path('spec/<str:patient_id>/', SPECDataView.as_view(), name='spec_data'),
     path('alerts/', AlertMedicalStaffView.as_view(), name='alert_medical_staff'),
-]
\ No newline at end of file
+]
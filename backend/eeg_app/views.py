@@ -6,183 +6,555 @@ import matplotlib.pyplot as plt
 from io import BytesIO
 from PIL import Image
 from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 import os
 from django.utils.timezone import now
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 import logging
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from .patient_generator import generate_patient_data
+from .alerts import alert_dispatcher
+from .audit import audit_log, audited
+from .models import PredictionRecord
+from .http_cache import cached_file_response, cached_json, response_cache
+from .spectrogram_store import spectrogram_store
+from .spectrogram_generator import compute_spectrogram
+from .live_buffers import live_buffers, recording_reader
 import base64
 import numpy as np
 import tempfile
-from twilio.rest import Client
-from twilio.base.exceptions import TwilioException
-from intelligence.models.XGBoost.xgboost import xgb_model_manager
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from intelligence.models.XGBoost.xgboost import FEATURE_EXTRACTOR_VERSION, xgb_model_manager
+from intelligence.models.SpectrogramCNN.serving import SpectrogramModel
+from intelligence.feature_store import FeatureStore, check_recording_id
+from intelligence.inference_pool import InferenceClient
+from intelligence.recording_store import check_patient_id
+from intelligence.storage import array_shape, as_float32, load_array
+from hms_backend.metrics import CACHE_REQUESTS
+from hms_backend.profiling import bind
 
 SPECTROGRAM_NAMES = ['LL', 'LP', 'RP', 'RR']
+EEG_CHANNELS = ["Fp1", "Fp2", "Fz", "Cz", "Pz", "F3", "F4", "F7", "F8", "C3", "C4", "P3", "P4", "T3", "T4", "T5", "T6", "O1", "O2"]
+SNAPSHOT_WAVEFORM_POINTS = 500
 EEG_DATA_PATH = settings.EEG_DATA_PATH
 SPEC_DATA_PATH = settings.SPEC_DATA_PATH
+feature_store = FeatureStore(settings.FEATURE_STORE_PATH)
+# Worker processes when INFERENCE_POOL_WORKERS is set; else xgb_model_manager,
+# looked up on each call so it can be swapped
+inference = InferenceClient.from_settings(lambda: xgb_model_manager)
+# None unless SPEC_MODEL_PATH is set; serves predict requests with model=spectrogram_cnn
+spectrogram_model = SpectrogramModel.from_settings()
+# Runs the independent parts of a patient snapshot side by side
+snapshot_executor = ThreadPoolExecutor(max_workers=settings.ASYNC_VIEW_WORKERS, thread_name_prefix="eeg-snapshot")
+_FEATURE_HITS = CACHE_REQUESTS.labels("feature_store", "hit")
+_FEATURE_MISSES = CACHE_REQUESTS.labels("feature_store", "miss")
 
-class EEGDataView(APIView):
-    def get(self, request, patient_id):
-        try:
-            file_path = os.path.join(EEG_DATA_PATH, f"{patient_id}.npy")
-            if not os.path.exists(file_path):
-                return Response({"error": f"EEG .npy file for patient {patient_id} not found"}, status=404)
-            eeg_array = np.load(file_path)  # shape (19, 2500)
-            if eeg_array.shape[0] != 19:
-                return Response({"error": f"Unexpected shape: expected 19 channels, got {eeg_array.shape[0]}"}, status=400)
-            # Transpose to shape (2500, 19)
-            eeg_array = eeg_array.T
-            # Map channel names
-            channels = ["Fp1", "Fp2", "Fz", "Cz", "Pz", "F3", "F4", "F7", "F8", "C3", "C4", "P3", "P4", "T3", "T4", "T5", "T6", "O1", "O2"]
-            eeg_data = [
-                {channels[i]: float(sample[i]) for i in range(len(channels))}
-                for sample in eeg_array
-            ]
-            return Response({"eeg_data": eeg_data}, status=status.HTTP_200_OK) 
-            # return Response({"eeg_data": eeg_data[-100:]}, status=status.HTTP_200_OK)# Send last 100 samples
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+# The request handling lives in *_payload functions returning (body, status) so
+# the sync APIViews below and the async views in async_views.py share it.
 
-class SPECDataView(APIView):
-    def get(self, request, patient_id):
-        try:
-            file_path = os.path.join(SPEC_DATA_PATH, f"{patient_id}.npy")
-            if not os.path.exists(file_path):
-                return Response({"error": f"Spectrogram .npy file for patient {patient_id} not found"}, status=404)
+def eeg_file_path(patient_id):
+    return os.path.join(EEG_DATA_PATH, f"{patient_id}.npy")
 
-            spec_array = np.load(file_path)  # shape: (128, 256, 4)
-            if spec_array.shape != (128, 256, 4):
-                return Response({"error": f"Invalid spectrogram shape: {spec_array.shape}"}, status=400)
 
-            # Convert each of the 4 channels to list of lists for heatmap display
-            spectrograms = {
-                'LL': spec_array[:, :, 0].tolist(),
-                'LP': spec_array[:, :, 1].tolist(),
-                'RP': spec_array[:, :, 2].tolist(),
-                'RR': spec_array[:, :, 3].tolist()
-            }
+def spec_file_path(patient_id):
+    return os.path.join(SPEC_DATA_PATH, f"{patient_id}.npy")
 
-            return Response({"spectrograms": spectrograms}, status=status.HTTP_200_OK)
 
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+def live_response(payload_fn, *args):
+    """Render a live-buffer payload; never cached, the buffer changes with every chunk"""
+    payload, code = payload_fn(*args)
+    response = HttpResponse(JSONRenderer().render(payload), status=code, content_type="application/json")
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+def live_eeg_payload(patient_id):
+    """The newest LIVE_WINDOW_SAMPLES of a streaming patient, in the eeg_data format, and the stream position"""
+    try:
+        eeg_data, seq = live_buffers.read(patient_id, settings.LIVE_WINDOW_SAMPLES, eeg_samples)
+    except LookupError as e:
+        return {"error": str(e)}, status.HTTP_404_NOT_FOUND
+    return {"eeg_data": eeg_data, "seq": seq}, status.HTTP_200_OK
+
+
+def live_spec_payload(patient_id):
+    """Spectrogram heatmaps of the newest LIVE_WINDOW_SAMPLES of a streaming patient"""
+    try:
+        spec_array, seq = live_buffers.read(patient_id, settings.LIVE_WINDOW_SAMPLES,
+                                            lambda eeg: compute_spectrogram(eeg, patient_id))
+    except LookupError as e:
+        return {"error": str(e)}, status.HTTP_404_NOT_FOUND
+    return {"spectrograms": spectrogram_heatmaps(spec_array), "seq": seq}, status.HTTP_200_OK
+
+
+RECORDING_MAX_SAMPLES = 12000  # one minute at the live sample rate per data/ request
+
+
+def recording_eeg_payload(patient_id, query_params):
+    """
+    A range of a patient's persisted live stream in the eeg_data format, from
+    ?start= to ?end= (epoch seconds; default: the newest LIVE_WINDOW_SAMPLES)
+    """
+    try:
+        reader = recording_reader(patient_id)
+    except ValueError as e:
+        return {"error": str(e)}, status.HTTP_400_BAD_REQUEST
+    first, last = reader.extent()
+    if first == last:
+        return {"error": f"No recording for patient {patient_id}"}, status.HTTP_404_NOT_FOUND
+    try:
+        start = reader.seq_at(float(query_params["start"])) if "start" in query_params else None
+        stop = reader.seq_at(float(query_params["end"])) if "end" in query_params else last
+    except ValueError:
+        return {"error": "start and end must be epoch seconds"}, status.HTTP_400_BAD_REQUEST
+    if start is None:
+        start = max(stop - settings.LIVE_WINDOW_SAMPLES, first)
+    if stop < start:
+        return {"error": "end is before start"}, status.HTTP_400_BAD_REQUEST
+    if stop - start > RECORDING_MAX_SAMPLES:
+        return {"error": f"At most {RECORDING_MAX_SAMPLES} samples per request"}, status.HTTP_400_BAD_REQUEST
+    return {"eeg_data": eeg_samples(reader.read(start, stop)), "start_seq": start, "end_seq": stop}, status.HTTP_200_OK
+
+
+def eeg_data_response(request, patient_id):
+    """
+    EEG samples as JSON, with ETag/304 handling and a cache of encoded bodies;
+    with ?source=live, the newest samples streamed by the patient's gateway,
+    and with ?source=recording, a time range of what it streamed
+    """
+    if request.GET.get("source") == "live":
+        return live_response(live_eeg_payload, patient_id)
+    if request.GET.get("source") == "recording":
+        return live_response(recording_eeg_payload, patient_id, request.GET)
+    return cached_file_response(request, response_cache, "eeg", patient_id, eeg_file_path(patient_id),
+                                eeg_data_payload, patient_id)
+
+
+def spec_data_response(request, patient_id):
+    """
+    Spectrogram heatmaps as JSON, with ETag/304 handling and a cache of encoded
+    bodies. A missing spectrogram is computed from the patient's EEG first.
+    With ?source=live it is computed from the newest streamed samples instead.
+    """
+    if request.GET.get("source") == "live":
+        return live_response(live_spec_payload, patient_id)
+    try:
+        spectrogram_store.ensure(eeg_file_path(patient_id), spec_file_path(patient_id))
+    except Exception as e:
+        logger.error(f"Error computing spectrogram for patient {patient_id}: {e}")
+        return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return cached_file_response(request, response_cache, "spec", patient_id, spec_file_path(patient_id),
+                                spec_data_payload, patient_id)
+
+
+def eeg_samples(eeg_array):
+    """One {channel: value} dict per sample of a (19, n) recording; NaN (a gap in a live stream) as null"""
+    # tolist() converts the whole (n, 19) block to Python floats in C
+    samples = eeg_array.T.tolist()
+    if np.isnan(eeg_array).any():
+        samples = [[None if value != value else value for value in sample] for sample in samples]
+    return [dict(zip(EEG_CHANNELS, sample)) for sample in samples]
+
+
+def spectrogram_heatmaps(spec_array):
+    """Each of the 4 montages of a (128, 256, 4) spectrogram as a list of lists for heatmap display"""
+    return {name: spec_array[:, :, i].tolist() for i, name in enumerate(SPECTROGRAM_NAMES)}
+
+
+def eeg_data_payload(patient_id):
+    try:
+        file_path = eeg_file_path(patient_id)
+        if not os.path.exists(file_path):
+            return {"error": f"EEG .npy file for patient {patient_id} not found"}, 404
+        eeg_array = load_array(file_path)  # shape (19, 2500), float32
+        if eeg_array.shape[0] != 19:
+            return {"error": f"Unexpected shape: expected 19 channels, got {eeg_array.shape[0]}"}, 400
+        return {"eeg_data": eeg_samples(eeg_array)}, status.HTTP_200_OK
+        # return {"eeg_data": eeg_data[-100:]}, status.HTTP_200_OK  # Send last 100 samples
+    except Exception as e:
+        return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+def spec_data_payload(patient_id):
+    try:
+        file_path = spec_file_path(patient_id)
+        if not os.path.exists(file_path):
+            return {"error": f"Spectrogram and EEG .npy files for patient {patient_id} not found"}, 404
+
+        spec_array = load_array(file_path)  # shape: (128, 256, 4)
+        if spec_array.shape != (128, 256, 4):
+            return {"error": f"Invalid spectrogram shape: {spec_array.shape}"}, 400
+
+        return {"spectrograms": spectrogram_heatmaps(spec_array)}, status.HTTP_200_OK
+
+    except Exception as e:
+        return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+@audited
+def predict_payload(data, files):
+    """
+    XGBoost EEG prediction
+
+    Expected input formats:
+    1. File upload (.npy file): 19 channels x time_points
+    2. JSON array: 19 channels x time_points
+    3. Manual feature input: Pre-computed features
+    4. Single EEG values: 19 single values (one per channel)
+    5. Stored recording: patient_id of a preprocessed EEG (features served from the feature store)
+    6. Live stream: patient_id with source=live (the newest samples in the patient's live buffer)
+
+    With model=spectrogram_cnn the spectrogram CNN answers instead; see
+    spectrogram_predict_payload.
+    """
+
+    if data.get('model') == 'spectrogram_cnn':
+        return spectrogram_predict_payload(data, files)
+
+    try:
+        # Method 1: File upload
+        if 'eeg_file' in files:
+            uploaded_file = files['eeg_file']
+
+            # Save temporarily
+            with tempfile.NamedTemporaryFile(suffix='.npy', delete=False) as tmp_file:
+                for chunk in uploaded_file.chunks():
+                    tmp_file.write(chunk)
+                tmp_file_path = tmp_file.name
+
+            try:
+                result = inference.call("predict_from_file", tmp_file_path)
+                return {
+                    "model": "XGBoost",
+                    "input_method": "file_upload",
+                    "result": result
+                }, status.HTTP_200_OK
+            finally:
+                os.unlink(tmp_file_path)
+
+        # Method 3: Single EEG values (19 values, one per channel)
+        elif 'eeg_values' in data:
+            eeg_values = as_float32(data['eeg_values'])
+
+            if len(eeg_values) != 19:
+                return {
+                    "error": "Must provide exactly 19 EEG values (one per channel)"
+                }, status.HTTP_400_BAD_REQUEST
+
+            # Convert single values to time series by repeating values
+            # This creates a 19 x 100 array where each channel has constant value
+            time_points = 100  # You can adjust this
+            eeg_data = np.tile(eeg_values.reshape(19, 1), (1, time_points))
+
+            result = inference.call("predict", eeg_data)
+            return {
+                "model": "XGBoost",
+                "input_method": "single_values",
+                "result": result
+            }, status.HTTP_200_OK
+
+        # Method 4: Manual feature input (for testing)
+        elif 'features' in data:
+            features = as_float32(data['features'])
+
+            if len(features) != len(xgb_model_manager.feature_names):
+                return {
+                    "error": f"Expected {len(xgb_model_manager.feature_names)} features"
+                }, status.HTTP_400_BAD_REQUEST
+
+            # Direct prediction with features
+            result = inference.call("predict_features", features)
+
+            return {
+                "model": "XGBoost",
+                "input_method": "manual_features",
+                "result": result
+            }, status.HTTP_200_OK
+
+        # Method 6: Live stream, features of the newest window read in place
+        elif 'patient_id' in data and data.get('source') == 'live':
+            try:
+                features, seq = live_buffers.read(str(data['patient_id']), settings.LIVE_WINDOW_SAMPLES,
+                                                  lambda eeg: inference.call("extract_features", eeg))
+            except LookupError as e:
+                return {"error": str(e)}, status.HTTP_404_NOT_FOUND
+            if features is None:
+                return {
+                    "error": "Feature extraction failed"
+                }, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+            result = inference.call("predict_features", features, input_type="live")
+            return {
+                "model": "XGBoost",
+                "input_method": "live",
+                "seq": seq,
+                "result": result
+            }, status.HTTP_200_OK
+
+        # Method 5: Stored recording, features cached per extractor version
+        elif 'patient_id' in data:
+            patient_id = str(data['patient_id'])
+            try:
+                check_recording_id(check_patient_id(patient_id))
+            except ValueError as e:
+                return {"error": str(e)}, status.HTTP_400_BAD_REQUEST
+            features = feature_store.get(patient_id)
+            (_FEATURE_HITS if features is not None else _FEATURE_MISSES).inc()
+
+            if features is None:
+                file_path = eeg_file_path(patient_id)
+                if not os.path.exists(file_path):
+                    return {
+                        "error": f"EEG .npy file for patient {patient_id} not found"
+                    }, status.HTTP_404_NOT_FOUND
+
+                features = inference.call("extract_features", load_array(file_path))
+                if features is None:
+                    return {
+                        "error": "Feature extraction failed"
+                    }, status.HTTP_500_INTERNAL_SERVER_ERROR
+                feature_store.put(patient_id, features)
+
+            result = inference.call("predict_features", features, input_type="feature_store")
+            return {
+                "model": "XGBoost",
+                "input_method": "patient_id",
+                "result": result
+            }, status.HTTP_200_OK
+
+        else:
+            return {
+                "error": "No valid input provided. Use 'eeg_file', 'eeg_data', 'eeg_values', 'features', or 'patient_id'"
+            }, status.HTTP_400_BAD_REQUEST
+
+    except Exception as e:
+        return {
+            "error": str(e)
+        }, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+def spectrogram_predict_payload(data, files):
+    """
+    Spectrogram CNN prediction, micro-batched with concurrent requests
+
+    Expected input formats:
+    1. File upload (.npy file): one spectrogram in the model's input shape
+    2. Stored recording: patient_id (spectrogram computed on first request)
+    """
+    if spectrogram_model is None:
+        return {
+            "error": "Spectrogram model not configured (set SPEC_MODEL_PATH)"
+        }, status.HTTP_503_SERVICE_UNAVAILABLE
+
+    try:
+        if 'spec_file' in files:
+            spectrogram = np.load(BytesIO(files['spec_file'].read()), allow_pickle=False)
+            result = spectrogram_model.predict(spectrogram, input_type="file_upload")
+            input_method = "file_upload"
+
+        elif 'patient_id' in data:
+            patient_id = check_patient_id(str(data['patient_id']))
+            spec_path = spec_file_path(patient_id)
+            if not spectrogram_store.ensure(eeg_file_path(patient_id), spec_path):
+                return {
+                    "error": f"No spectrogram or EEG for patient {patient_id}"
+                }, status.HTTP_404_NOT_FOUND
+            result = spectrogram_model.predict_file(spec_path)
+            input_method = "patient_id"
+
+        else:
+            return {
+                "error": "No valid input provided. Use 'spec_file' or 'patient_id'"
+            }, status.HTTP_400_BAD_REQUEST
+
+        return {
+            "model": "SpectrogramCNN",
+            "input_method": input_method,
+            "result": result
+        }, status.HTTP_200_OK
+
+    except ValueError as e:
+        return {"error": str(e)}, status.HTTP_400_BAD_REQUEST
+    except Exception as e:
+        return {"error": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+def prediction_history_payload(patient_id, query_params):
+    """
+    A patient's recorded predictions, newest first, one page at a time:
+    ?limit= rows (default 50) and ?before= the "next" cursor of the previous
+    page. Keyset pagination on the (patient_id, -id) index, so every page is
+    an index range scan however deep it is.
+    """
+    try:
+        limit = int(query_params.get("limit", 50))
+        before = int(query_params["before"]) if query_params.get("before") else None
+    except ValueError:
+        return {"error": "limit and before must be integers"}, status.HTTP_400_BAD_REQUEST
+    if not 0 < limit <= settings.PREDICTION_HISTORY_MAX_LIMIT:
+        return {"error": f"limit must be in 1..{settings.PREDICTION_HISTORY_MAX_LIMIT}"}, status.HTTP_400_BAD_REQUEST
+    rows = PredictionRecord.objects.filter(patient_id=patient_id)
+    if before is not None:
+        rows = rows.filter(id__lt=before)
+    rows = list(rows.order_by("-id").values("id", "model", "input_method", "predicted_class", "confidence",
+                                            "probabilities", "seq", "created_at")[:limit + 1])
+    return {
+        "patient_id": patient_id,
+        "predictions": rows[:limit],
+        "next": rows[limit - 1]["id"] if len(rows) > limit else None,
+    }, status.HTTP_200_OK
+
+
+def downsample_step(n_samples, points):
+    """Block length that reduces ``n_samples`` to ``points`` or fewer (0: no reduction)"""
+    return max(1, -(-n_samples // points)) if points else 1
+
+
+def downsample(eeg_array, points):
+    """Block means of ``points`` or fewer samples per channel, and the block length"""
+    step = downsample_step(eeg_array.shape[1], points)
+    if step == 1:
+        return eeg_array, 1
+    usable = eeg_array.shape[1] // step * step
+    return eeg_array[:, :usable].reshape(eeg_array.shape[0], -1, step).mean(axis=2), step
+
+
+def snapshot_response(patient_id, points=SNAPSHOT_WAVEFORM_POINTS):
+    """
+    Everything the dashboard shows for one patient, as rendered JSON: (body, status)
+
+    The independent sections run concurrently on snapshot_executor:
+    - details: the patient record (as PatientDetailsView)
+    - waveform: the EEG as block means of at most ``points`` samples per
+      channel (0 for full resolution), in the eeg_data format
+    - spectrograms: as SPECDataView, computed from the EEG if missing
+    - prediction: XGBoost on the patient's feature-store features
+    The waveform, spectrograms and prediction are spliced in already rendered
+    from the response cache, and the EEG is read at most once, by whichever
+    section needs it first (none, when everything is cached). A failing
+    section is null, with its message in "errors".
+    """
+    try:
+        file_path = eeg_file_path(patient_id)
+        if not os.path.exists(file_path):
+            return JSONRenderer().render({"error": f"EEG .npy file for patient {patient_id} not found"}), \
+                status.HTTP_404_NOT_FOUND
+
+        recording_lock, recording = threading.Lock(), []
+
+        def eeg_array():
+            with recording_lock:
+                if not recording:
+                    eeg = load_array(file_path)
+                    if eeg.shape[0] != 19:
+                        raise ValueError(f"Unexpected shape: expected 19 channels, got {eeg.shape[0]}")
+                    recording.append(eeg)
+            return recording[0]
+
+        def details():
+            return JSONRenderer().render(generate_patient_data(patient_id))
+
+        def waveform():
+            # Keyed by block length: every ?points= that gives the same waveform shares one entry
+            step = downsample_step(array_shape(file_path)[1], points)
+
+            def build():
+                samples, step = downsample(eeg_array(), points)
+                return {"step": step, "eeg_data": eeg_samples(samples)}
+            return cached_json(response_cache, "snapshot_waveform", f"{patient_id}.{step}", file_path, build)
+
+        def spectrograms():
+            spec_path = spec_file_path(patient_id)
+            if not os.path.exists(spec_path):
+                spectrogram_store.ensure(file_path, spec_path, eeg=eeg_array())
+            return cached_json(response_cache, "snapshot_spec", patient_id, spec_path,
+                               lambda: spectrogram_heatmaps(load_array(spec_path)))
+
+        def prediction():
+            def build():
+                features = feature_store.get(patient_id)
+                (_FEATURE_HITS if features is not None else _FEATURE_MISSES).inc()
+                if features is None:
+                    features = inference.call("extract_features", eeg_array())
+                    if features is None:
+                        raise ValueError("Feature extraction failed")
+                    feature_store.put(patient_id, features)
+                result = inference.call("predict_features", features, input_type="feature_store")
+                if "error" in result:
+                    raise ValueError(result["error"])
+                return result
+            # A new model or feature extractor changes the prediction without touching the EEG
+            variant = f"{FEATURE_EXTRACTOR_VERSION}:{xgb_model_manager.version}"
+            return cached_json(response_cache, "snapshot_prediction", patient_id, file_path, build, variant)
+
+        sections = {"details": details, "waveform": waveform, "spectrograms": spectrograms, "prediction": prediction}
+        futures = {name: snapshot_executor.submit(bind(section)) for name, section in sections.items()}
+        parts, errors = [b'{"patient_id":' + JSONRenderer().render(patient_id)], {}
+        for name, future in futures.items():
+            try:
+                body = future.result()
+            except Exception as e:
+                logger.error(f"Snapshot of patient {patient_id}: {name} failed: {e}")
+                body, errors[name] = b"null", str(e)
+            parts.append(f',"{name}":'.encode() + body)
+        parts.append(b',"errors":' + JSONRenderer().render(errors) + b"}")
+        return b"".join(parts), status.HTTP_200_OK
+
+    except Exception as e:
+        return JSONRenderer().render({"error": str(e)}), status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+def snapshot_points(query_params):
+    """The ?points= waveform resolution of a snapshot request; ValueError if invalid"""
+    points = int(query_params.get('points', SNAPSHOT_WAVEFORM_POINTS))
+    if points < 0:
+        raise ValueError("points must be >= 0")
+    return points
+
+
+def patients_payload():
+    try:
+        patient_ids = [
+            fname.replace(".npy", "")
+            for fname in os.listdir(EEG_DATA_PATH)
+            if fname.endswith(".npy")
+        ][:50]
+        patients = [generate_patient_data(pid) for pid in patient_ids]
+        return patients, 200
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+class EEGDataView(APIView):
+    def get(self, request, patient_id):
+        return eeg_data_response(request, patient_id)
+
+class SPECDataView(APIView):
+    def get(self, request, patient_id):
+        return spec_data_response(request, patient_id)
 
 # now update the frontend to display the predict eeg from xgboost, sub page next to Model Comparison as Predict Custom Values
 class PredictEEG(APIView):
     def post(self, request):
-        """
-        Endpoint for XGBoost EEG prediction
-        
-        Expected input formats:
-        1. File upload (.npy file): 19 channels x time_points
-        2. JSON array: 19 channels x time_points
-        3. Manual feature input: Pre-computed features
-        4. Single EEG values: 19 single values (one per channel)
-        """
-        
-        try:
-            # Method 1: File upload
-            if 'eeg_file' in request.FILES:
-                uploaded_file = request.FILES['eeg_file']
-                
-                # Save temporarily
-                with tempfile.NamedTemporaryFile(suffix='.npy', delete=False) as tmp_file:
-                    for chunk in uploaded_file.chunks():
-                        tmp_file.write(chunk)
-                    tmp_file_path = tmp_file.name
-                
-                try:
-                    result = xgb_model_manager.predict_from_file(tmp_file_path)
-                    return Response({
-                        "model": "XGBoost",
-                        "input_method": "file_upload",
-                        "result": result
-                    })
-                finally:
-                    os.unlink(tmp_file_path)
-                        
-            # Method 3: Single EEG values (19 values, one per channel)
-            elif 'eeg_values' in request.data:
-                eeg_values = np.array(request.data['eeg_values'])
-                
-                if len(eeg_values) != 19:
-                    return Response({
-                        "error": "Must provide exactly 19 EEG values (one per channel)"
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                
-                # Convert single values to time series by repeating values
-                # This creates a 19 x 100 array where each channel has constant value
-                time_points = 100  # You can adjust this
-                eeg_data = np.tile(eeg_values.reshape(19, 1), (1, time_points))
-                
-                result = xgb_model_manager.predict(eeg_data)
-                return Response({
-                    "model": "XGBoost",
-                    "input_method": "single_values",
-                    "result": result
-                })
-            
-            # Method 4: Manual feature input (for testing)
-            elif 'features' in request.data:
-                features = np.array(request.data['features'])
-                
-                if len(features) != len(xgb_model_manager.feature_names):
-                    return Response({
-                        "error": f"Expected {len(xgb_model_manager.feature_names)} features"
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                
-                # Direct prediction with features
-                import xgboost as xgb
-                dtest = xgb.DMatrix(features.reshape(1, -1))
-                probabilities = xgb_model_manager.model.predict(dtest)[0]
-                
-                predicted_class_idx = np.argmax(probabilities)
-                predicted_class = xgb_model_manager.label_encoder.inverse_transform([predicted_class_idx])[0]
-                
-                class_probabilities = {}
-                for i, class_name in enumerate(xgb_model_manager.config['classes']):
-                    class_probabilities[class_name] = float(probabilities[i])
-                
-                result = {
-                    "predicted_class": predicted_class,
-                    "confidence": float(probabilities[predicted_class_idx]),
-                    "probabilities": class_probabilities
-                }
-                
-                return Response({
-                    "model": "XGBoost",
-                    "input_method": "manual_features",
-                    "result": result
-                })
-            
-            else:
-                return Response({
-                    "error": "No valid input provided. Use 'eeg_file', 'eeg_data', 'eeg_values', or 'features'"
-                }, status=status.HTTP_400_BAD_REQUEST)
-        
-        except Exception as e:
-            return Response({
-                "error": str(e)
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        """Endpoint for XGBoost EEG prediction; see predict_payload for the input formats"""
+        payload, code = predict_payload(request.data, request.FILES)
+        return Response(payload, status=code)
+
+class PredictionHistoryView(APIView):
+    def get(self, request, patient_id):
+        """Recorded predictions for a patient, newest first; see prediction_history_payload"""
+        payload, code = prediction_history_payload(patient_id, request.GET)
+        return Response(payload, status=code)
 
 class PatientsView(APIView):
     def get(self, request):
-        try:
-            patient_ids = [
-                fname.replace(".npy", "")
-                for fname in os.listdir(EEG_DATA_PATH)
-                if fname.endswith(".npy")
-            ][:50]
-            patients = [generate_patient_data(pid) for pid in patient_ids]
-            return Response(patients, status=200)
-        except Exception as e:
-            return Response({"error": str(e)}, status=500)
-
+        payload, code = patients_payload()
+        return Response(payload, status=code)
 
 class PatientDetailsView(APIView):
     def get(self, request, patient_id):
@@ -196,63 +568,17 @@ class PatientDetailsView(APIView):
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
-logger = logging.getLogger(__name__)
-
-def send_sms_twilio(phone_number: str, sms_message: str) -> bool:
-    """
-    Send SMS using Twilio
-    """
-    try:
-        # Get Twilio credentials from environment
-        account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-        auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-        from_number = os.getenv('TWILIO_PHONE_NUMBER')
-        
-        print(f"🔍 Debug - Account SID exists: {bool(account_sid)}")
-        print(f"🔍 Debug - Auth Token exists: {bool(auth_token)}")
-        print(f"🔍 Debug - From Number: {from_number}")
-        
-        if not all([account_sid, auth_token, from_number]):
-            logger.error("❌ Missing Twilio credentials in environment variables")
-            print("❌ Missing Twilio credentials in environment variables")
-            return False
-        
-        # Initialize Twilio client
-        client = Client(account_sid, auth_token)
-        
-        # Format phone number - Twilio needs full international format
-        if not phone_number.startswith('+'):
-            # Assume Indian number if no country code
-            if phone_number.startswith('91'):
-                phone_number = '+' + phone_number
-            else:
-                phone_number = '+91' + phone_number
-        
-        print(f"🔍 Debug - Formatted phone number: {phone_number}")
-        print(f"🔍 Debug - Message length: {len(sms_message)} chars")
-        
-        # Send SMS
-        message = client.messages.create(
-            body=sms_message,
-            from_=from_number,
-            to=phone_number
-        )
-        
-        logger.info(f"✅ SMS sent successfully via Twilio. SID: {message.sid}")
-        print(f"✅ SMS sent successfully via Twilio. SID: {message.sid}")
-        return True
-        
-    except TwilioException as e:
-        logger.error(f"❌ Twilio API error: {e}")
-        print(f"❌ Twilio API error: {e}")
-        return False
-    except Exception as e:
-        logger.error(f"❌ Failed to send SMS via Twilio: {e}")
-        print(f"❌ Failed to send SMS via Twilio: {e}")
-        import traceback
-        print(f"🔍 Full traceback: {traceback.format_exc()}")
-        return False
+class PatientSnapshotView(APIView):
+    def get(self, request, patient_id):
+        """Details, waveform, spectrograms and prediction in one response; see snapshot_response"""
+        try:
+            points = snapshot_points(request.query_params)
+        except ValueError as e:
+            return Response({"error": f"Invalid points: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        body, code = snapshot_response(patient_id, points)
+        return HttpResponse(body, status=code, content_type="application/json")
 
+logger = logging.getLogger(__name__)
 
 @method_decorator(csrf_exempt, name='dispatch')
 class AlertMedicalStaffView(APIView):
@@ -273,7 +599,7 @@ class AlertMedicalStaffView(APIView):
             # Log the emergency alert
             logger.info(f"🚨 Emergency alert for Patient {patient_name} (Room {room}) by Doctor {doctor_id}")
 
-            # Send SMS using Twilio
+            # Queue the SMS; eeg_app.alerts workers send, retry and coalesce it
             if phone_number:
                 sms_message = f"""MEDICAL EMERGENCY ALERT 🚨
 
@@ -283,24 +609,29 @@ Alert: {alert_type}
 Severity: {severity}
 Time: {timestamp}"""
 
-                sms_sent = send_sms_twilio(phone_number, sms_message)
-                
-                if sms_sent:
-                    logger.info(f"✅ Emergency SMS sent successfully to {phone_number}")
-                    return Response({
-                        "status": "success", 
-                        "message": "Medical alert sent successfully",
-                        "sms_sent": True
-                    }, status=status.HTTP_200_OK)
-                else:
-                    logger.error(f"❌ Failed to send emergency SMS to {phone_number}")
-                    return Response({
-                        "status": "partial_success", 
-                        "message": "Alert received but SMS failed to send",
-                        "sms_sent": False
-                    }, status=status.HTTP_200_OK)
+                dispatch, coalesced = alert_dispatcher.enqueue(
+                    patient_id or patient_name or "", phone_number, sms_message,
+                    alert_type=alert_type, severity=severity, doctor_id=doctor_id)
+                if settings.ALERT_DISPATCH_IN_PROCESS:
+                    alert_dispatcher.start()
+
+                logger.info(f"✅ Emergency SMS to {phone_number} queued as alert {dispatch.pk}"
+                            f"{' (coalesced)' if coalesced else ''}")
+                if settings.AUDIT_LOG:
+                    audit_log.record_alert(patient_id or patient_name or "", alert_type, severity, doctor_id,
+                                           message, confidence_scores, dispatch.pk, coalesced)
+                return Response({
+                    "status": "queued",
+                    "message": "Medical alert accepted for delivery",
+                    "alert_id": dispatch.pk,
+                    "coalesced": coalesced,
+                    "sms_sent": False
+                }, status=status.HTTP_202_ACCEPTED)
             else:
                 logger.warning("⚠️ No phone number provided for SMS alert")
+                if settings.AUDIT_LOG:
+                    audit_log.record_alert(patient_id or patient_name or "", alert_type, severity, doctor_id,
+                                           message, confidence_scores)
                 return Response({
                     "status": "success", 
                     "message": "Alert received but no phone number provided",
@@ -17,6 +17,13 @@ from eeg_app.routing import websocket_urlpatterns
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hms_backend.settings")
 django.setup()
 
+from django.conf import settings
+
+if settings.LIVE_SCORING:
+    # Join the live scoring cluster; eeg_app.sharding splits patients between workers
+    from eeg_app.sharding import live_scoring
+    live_scoring.start()
+
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AuthMiddlewareStack(
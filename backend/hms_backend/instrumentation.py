@@ -0,0 +1,169 @@
+"""
+Django glue for hms_backend.metrics and hms_backend.profiling: per-view
+request timing, the /metrics endpoint, opt-in request profiling and the admin
+endpoints that list the saved profiles.
+"""
+import hmac
+import random
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse
+
+from . import profiling
+from .metrics import CONTENT_TYPE, HTTP_REQUEST_SECONDS, REGISTRY
+
+profile_store = profiling.ProfileStore(settings.PROFILING_DIR, settings.PROFILING_MAX_PROFILES)
+
+
+class MetricsMiddleware:
+    """Times every request by URL name; async-capable so async views stay on the event loop"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    @staticmethod
+    def _observe(request, response, start):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        HTTP_REQUEST_SECONDS.labels(view, request.method, response.status_code).observe(time.perf_counter() - start)
+
+
+def metrics_view(request):
+    """Prometheus scrape target, aggregated over all worker processes"""
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+def _has_profiling_token(request) -> bool:
+    token = settings.PROFILING_TOKEN
+    header = request.META.get("HTTP_X_PROFILE")
+    return bool(token) and header is not None and hmac.compare_digest(header.encode(), token.encode())
+
+
+class ProfilingMiddleware:
+    """
+    cProfiles a request sent with ``X-Profile: <PROFILING_TOKEN>``, or a
+    PROFILING_SAMPLE_RATE fraction of all requests, into ``profile_store``.
+    The profile id is returned in the ``X-Profile-Id`` response header.
+    Other requests cost a header lookup (and a random() if sampling is on).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self._is_async = iscoroutinefunction(get_response)
+        if self._is_async:
+            markcoroutinefunction(self)
+
+    def _trigger(self, request):
+        if "HTTP_X_PROFILE" in request.META:
+            return "header" if _has_profiling_token(request) else None
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    def __call__(self, request):
+        if self._is_async:
+            return self.__acall__(request)
+        trigger = self._trigger(request)
+        profile = profiling.try_start() if trigger else None
+        if profile is None:
+            return self.get_response(request)
+
+        profiler = profile.profiler()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+            profiling.finish(profile)
+        return self._save(request, response, profile, trigger, start)
+
+    async def __acall__(self, request):
+        trigger = self._trigger(request)
+        profile = profiling.try_start() if trigger else None
+        if profile is None:
+            return await self.get_response(request)
+
+        profiler = profile.profiler()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+            profiling.finish(profile)
+        return self._save(request, response, profile, trigger, start)
+
+    @staticmethod
+    def _save(request, response, profile, trigger, start):
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        stats = profile.stats()
+        profile_id = profile_store.save(stats, {
+            "path": request.path,
+            "method": request.method,
+            "view": (match.url_name or match.view_name) if match else None,
+            "status": response.status_code,
+            "trigger": trigger,
+            "duration_ms": round(duration * 1e3, 3),
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "top": profiling.top_functions(stats),
+        })
+        if profile_id:
+            response["X-Profile-Id"] = profile_id
+        return response
+
+
+def _is_privileged(request) -> bool:
+    user = getattr(request, "user", None)
+    return _has_profiling_token(request) or bool(user and user.is_staff)
+
+
+def profiles_view(request):
+    """Saved request profiles, newest first"""
+    if not _is_privileged(request):
+        return JsonResponse({"error": "Staff login or profiling token required"}, status=403)
+    return JsonResponse({"profiles": profile_store.list()})
+
+
+def profile_view(request, profile_id):
+    """One saved profile: a pstats text report (?sort=, ?limit=) or the raw file (?format=pstats)"""
+    if not _is_privileged(request):
+        return JsonResponse({"error": "Staff login or profiling token required"}, status=403)
+    if request.GET.get("format") == "pstats":
+        path = profile_store.path(profile_id)
+        if path is None:
+            return JsonResponse({"error": "Profile not found"}, status=404)
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=f"{profile_id}.prof")
+    try:
+        report = profile_store.report(profile_id, request.GET.get("sort", "cumulative"),
+                                      int(request.GET.get("limit", 50)))
+    except (KeyError, ValueError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if report is None:
+        return JsonResponse({"error": "Profile not found"}, status=404)
+    return HttpResponse(report, content_type="text/plain; charset=utf-8")
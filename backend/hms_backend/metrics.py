@@ -0,0 +1,347 @@
+"""
+Counters and latency histograms, exported in the Prometheus text format.
+
+Every process writes its samples to its own memory-mapped file in METRICS_DIR
+(``<pid>.db``), so recording a sample is a dict lookup and an 8-byte store, and
+``render()`` can aggregate every gunicorn/ASGI worker by summing their files.
+Counters and histograms are cumulative, so the files of exited workers keep
+counting towards the totals; clear METRICS_DIR when the server is (re)started.
+
+File layout (little endian): a uint32 count of used bytes, 4 bytes padding,
+then entries of uint32 key length, the UTF-8 key padded to 8 bytes and a
+float64 value. A new entry is written before ``used`` is advanced, so readers
+never see a partial one.
+
+Set METRICS_ENABLED=0 to turn recording into a no-op.
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "metrics")
+INITIAL_FILE_SIZE = 1024 * 1024
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans a cached 304 (~0.2 ms) to a cold spectrogram build (~1 s)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_HEADER = struct.Struct("<I4x")
+_KEY_LEN = struct.Struct("<I")
+_VALUE = struct.Struct("<d")
+
+
+def metrics_dir() -> str:
+    return os.environ.get("METRICS_DIR") or DEFAULT_DIR
+
+
+def metrics_enabled() -> bool:
+    return os.environ.get("METRICS_ENABLED", "1") != "0"
+
+
+class _ValueFile:
+    """Append-only key -> float64 map in a memory-mapped file, written by one process"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "a+b")
+        size = os.fstat(self._f.fileno()).st_size
+        if size < INITIAL_FILE_SIZE:
+            self._f.truncate(INITIAL_FILE_SIZE)
+            size = INITIAL_FILE_SIZE
+        self._m = mmap.mmap(self._f.fileno(), size)
+        self._used = _HEADER.unpack_from(self._m, 0)[0] or _HEADER.size
+        self._positions = {key: pos for key, _, pos in _entries(self._m, self._used)}
+
+    def _grow(self, needed: int):
+        size = len(self._m)
+        while size < needed:
+            size *= 2
+        self._m.close()
+        self._f.truncate(size)
+        self._m = mmap.mmap(self._f.fileno(), size)
+
+    def _allocate(self, key: str) -> int:
+        encoded = key.encode()
+        padded = len(encoded) + (-(_KEY_LEN.size + len(encoded)) % 8)
+        entry_size = _KEY_LEN.size + padded + _VALUE.size
+        if self._used + entry_size > len(self._m):
+            self._grow(self._used + entry_size)
+        _KEY_LEN.pack_into(self._m, self._used, len(encoded))
+        self._m[self._used + _KEY_LEN.size:self._used + _KEY_LEN.size + len(encoded)] = encoded
+        position = self._used + _KEY_LEN.size + padded
+        _VALUE.pack_into(self._m, position, 0.0)
+        self._used += entry_size
+        _HEADER.pack_into(self._m, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def position(self, key: str) -> int:
+        position = self._positions.get(key)
+        return position if position is not None else self._allocate(key)
+
+    def add(self, position: int, amount: float):
+        _VALUE.pack_into(self._m, position, _VALUE.unpack_from(self._m, position)[0] + amount)
+
+    def close(self):
+        self._m.close()
+        self._f.close()
+
+
+def _entries(data, used: int) -> Iterator[Tuple[str, float, int]]:
+    pos = _HEADER.size
+    while pos + _KEY_LEN.size <= used:
+        key_len = _KEY_LEN.unpack_from(data, pos)[0]
+        key_start = pos + _KEY_LEN.size
+        key = bytes(data[key_start:key_start + key_len]).decode()
+        value_pos = key_start + key_len + (-(_KEY_LEN.size + key_len) % 8)
+        yield key, _VALUE.unpack_from(data, value_pos)[0], value_pos
+        pos = value_pos + _VALUE.size
+
+
+def _read_file(path: str) -> List[Tuple[str, float]]:
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        return []
+    used = min(_HEADER.unpack_from(data, 0)[0], len(data))
+    return [(key, value) for key, value, _ in _entries(data, used)]
+
+
+class Registry:
+    """The metric families of this codebase and the per-process sample file"""
+
+    def __init__(self, directory: Optional[str] = None, enabled: Optional[bool] = None):
+        self._directory = directory
+        self.enabled = metrics_enabled() if enabled is None else enabled
+        self.families: Dict[str, "_Metric"] = {}
+        self._file: Optional[_ValueFile] = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        return self._directory or metrics_dir()
+
+    def register(self, metric: "_Metric"):
+        self.families[metric.name] = metric
+
+    def _value_file(self) -> _ValueFile:
+        # Re-open after fork: a worker must never write into its parent's file
+        if self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = _ValueFile(os.path.join(self.directory, f"{os.getpid()}.db"))
+            self._pid = os.getpid()
+            for metric in self.families.values():
+                metric._positions.clear()
+        return self._file
+
+    def add(self, cache: Dict, *samples: Tuple[str, float]):
+        """Add ``(key, amount)`` samples; ``cache`` maps keys to file positions for the caller"""
+        if not self.enabled:
+            return
+        with self._lock:
+            value_file = self._value_file()
+            for key, amount in samples:
+                position = cache.get(key)
+                if position is None:
+                    position = cache[key] = value_file.position(key)
+                value_file.add(position, amount)
+
+    def collect(self) -> Dict[str, float]:
+        """Samples summed over every process that wrote to the metrics directory"""
+        totals: Dict[str, float] = defaultdict(float)
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(".db")]
+        except OSError:
+            names = []
+        for name in names:
+            try:
+                samples = _read_file(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            for key, value in samples:
+                totals[key] += value
+        return totals
+
+    def render(self) -> str:
+        """Prometheus text exposition of all families"""
+        samples: Dict[str, List[Tuple]] = defaultdict(list)
+        for key, value in self.collect().items():
+            name, suffix, label_values, le = json.loads(key)
+            samples[name].append((label_values, suffix, le, value))
+
+        lines = []
+        for name in sorted(self.families):
+            metric = self.families[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.expose(samples.get(name, [])))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence, le: Optional[str] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        self._positions: Dict[str, int] = {}
+        self._children: Dict[Tuple, object] = {}
+        registry.register(self)
+
+    def labels(self, *values):
+        """Child bound to one label set; keep it around on hot paths"""
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._child(self, values)
+        return child
+
+    def _key(self, suffix: str, values: Tuple, le: Optional[str] = None) -> str:
+        return json.dumps([self.name, suffix, list(values), le])
+
+    def _add(self, *samples: Tuple[str, float]):
+        self.registry.add(self._positions, *samples)
+
+
+class _CounterChild:
+    def __init__(self, metric: "Counter", values: Tuple):
+        self._metric = metric
+        self._key = metric._key("_total", values)
+
+    def inc(self, amount: float = 1.0):
+        self._metric._add((self._key, amount))
+
+
+class Counter(_Metric):
+    kind = "counter"
+    _child = _CounterChild
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def expose(self, samples) -> List[str]:
+        return [f"{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(value)}"
+                for values, _, _, value in sorted(samples, key=lambda s: s[0])]
+
+
+class _HistogramChild:
+    def __init__(self, metric: "Histogram", values: Tuple):
+        self._metric = metric
+        self._bounds = metric.buckets
+        self._bucket_keys = [metric._key("_bucket", values, _format_value(b)) for b in metric.buckets]
+        self._sum_key = metric._key("_sum", values)
+
+    def observe(self, value: float):
+        # Buckets are stored per interval and made cumulative at render time: one write per bucket
+        self._metric._add((self._bucket_keys[bisect_left(self._bounds, value)], 1.0), (self._sum_key, value))
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    _child = _HistogramChild
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets)) + ((math.inf,) if buckets[-1] != math.inf else ())
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def expose(self, samples) -> List[str]:
+        by_labels: Dict[Tuple, Dict] = defaultdict(lambda: {"buckets": defaultdict(float), "sum": 0.0})
+        for values, suffix, le, value in samples:
+            entry = by_labels[tuple(values)]
+            if suffix == "_bucket":
+                entry["buckets"][le] += value
+            else:
+                entry["sum"] += value
+
+        lines = []
+        for values in sorted(by_labels):
+            entry = by_labels[values]
+            cumulative = 0.0
+            for bound in self.buckets:
+                le = _format_value(bound)
+                cumulative += entry["buckets"].get(le, 0.0)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} "
+                             f"{_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(entry['sum'])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+
+# -- the metrics of this codebase -------------------------------------------
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "hms_http_request_duration_seconds", "REST request latency by view", ("view", "method", "status"))
+PREDICT_STAGE_SECONDS = Histogram(
+    "hms_predict_stage_duration_seconds", "Time spent in each stage of XGBoostModelManager.predict", ("stage",))
+PREDICT_CASCADE = Counter(
+    "hms_predict_cascade", "Cascade predictions by the stage that answered", ("stage",))
+WEBSOCKET_EVENTS = Counter(
+    "hms_websocket_events", "WebSocket connects, disconnects and messages", ("consumer", "event"))
+WEBSOCKET_MESSAGE_SECONDS = Histogram(
+    "hms_websocket_message_duration_seconds", "Time to handle one WebSocket message", ("consumer", "direction"))
+CACHE_REQUESTS = Counter(
+    "hms_cache_requests", "Cache lookups by cache and result", ("cache", "result"))
+ALERTS = Counter(
+    "hms_alert_dispatch", "Alert dispatch outcomes", ("result",))
+INFERENCE_WORKER_EVENTS = Counter(
+    "hms_inference_worker_events", "Inference pool worker starts and restarts by cause", ("event",))
+SPECTROGRAM_SECONDS = Histogram(
+    "hms_spectrogram_duration_seconds", "Time to build one spectrogram from EEG")
+LIVE_SAMPLES = Counter(
+    "hms_live_samples", "Live EEG samples ingested into ring buffers, by outcome", ("outcome",))
+RECORDING_SAMPLES = Counter(
+    "hms_recording_samples", "Live EEG samples persisted to recordings, by outcome", ("outcome",))
+AUDIT_RECORDS = Counter(
+    "hms_audit_records", "Prediction and alert audit records, by model and outcome", ("model", "outcome"))
+SHARD_EVENTS = Counter(
+    "hms_shard_events", "Live scoring ring rebalances and patient lease acquisitions/releases/losses", ("event",))
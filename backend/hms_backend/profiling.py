@@ -0,0 +1,183 @@
+"""
+On-demand cProfile capture of single requests.
+
+A request is profiled when it carries ``X-Profile: <PROFILING_TOKEN>`` or is
+picked by PROFILING_SAMPLE_RATE. cProfile records C calls too, so time inside
+NumPy/SciPy ufuncs and the XGBoost booster shows up as ``<built-in method ...>``
+and ``{method ... of ...}`` entries under the Python frames that made them.
+
+Before Python 3.12, cProfile only sees the thread that enabled it. Work handed
+to another thread through ``bind()`` (eeg_app.async_views.run_blocking does
+this) is profiled in that thread and merged into the request's profile. From
+3.12 cProfile is built on sys.monitoring, which allows one profiler per process
+and covers every thread, so ``bind()`` leaves it to the request's profiler.
+Either way a profile can include other requests' work running at the same time
+(under ASGI the event-loop thread is shared). At most one request per process
+is profiled at a time.
+
+Profiles are kept in a ring of PROFILING_MAX_PROFILES ``.prof`` files (pstats
+format, loadable with ``python -m pstats`` or snakeviz) with a ``.json`` file of
+request metadata next to each.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_active: "contextvars.ContextVar[Optional[RequestProfile]]" = contextvars.ContextVar("request_profile", default=None)
+_slot = threading.Lock()  # one profiled request per process
+
+
+class RequestProfile:
+    """The cProfile profilers of one request, one per thread it ran in"""
+
+    def __init__(self):
+        self._profilers: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def profiler(self) -> cProfile.Profile:
+        profiler = cProfile.Profile()
+        self.add(profiler)
+        return profiler
+
+    def add(self, profiler: cProfile.Profile):
+        with self._lock:
+            self._profilers.append(profiler)
+
+    def stats(self) -> pstats.Stats:
+        with self._lock:
+            profilers = list(self._profilers)
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+
+def try_start() -> Optional[RequestProfile]:
+    """A new profile made current for this context, or None if one is already running"""
+    if not _slot.acquire(blocking=False):
+        return None
+    profile = RequestProfile()
+    profile._token = _active.set(profile)
+    return profile
+
+
+def finish(profile: RequestProfile):
+    _active.reset(profile._token)
+    _slot.release()
+
+
+def bind(fn: Callable) -> Callable:
+    """``fn``, profiled into the current request's profile when it runs on another thread"""
+    profile = _active.get()
+    if profile is None:
+        return fn
+
+    def profiled(*args, **kwargs):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 3.12+: "Another profiling tool is already active", and the
+            # request's profiler already records this thread
+            return fn(*args, **kwargs)
+        profile.add(profiler)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+    return profiled
+
+
+class ProfileStore:
+    """Bounded ring of saved profiles under ``root``, shared by all worker processes"""
+
+    def __init__(self, root: str, max_profiles: int = 200):
+        self.root = root
+        self.max_profiles = max_profiles
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        return os.path.join(self.root, f"{profile_id}.{suffix}")
+
+    def _write(self, path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def save(self, stats: pstats.Stats, meta: Dict) -> Optional[str]:
+        # Time first, so that name order is age order
+        profile_id = f"{time.time_ns():020d}-{os.getpid()}"
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            os.close(fd)
+            stats.dump_stats(tmp_path)
+            os.replace(tmp_path, self._path(profile_id, "prof"))
+            # Metadata last: a profile is listed only once it is complete
+            self._write(self._path(profile_id, "json"), json.dumps({"id": profile_id, **meta}).encode())
+            self._prune()
+        except OSError as e:
+            logger.warning(f"Could not save request profile: {e}")
+            return None
+        return profile_id
+
+    def _ids(self) -> List[str]:
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith(".json"))
+
+    def _prune(self):
+        ids = self._ids()
+        for profile_id in ids[:max(0, len(ids) - self.max_profiles)]:
+            for suffix in ("json", "prof"):
+                try:
+                    os.unlink(self._path(profile_id, suffix))
+                except OSError:
+                    pass
+
+    def list(self) -> List[Dict]:
+        """Metadata of the saved profiles, newest first"""
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            try:
+                with open(self._path(profile_id, "json")) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # pruned by another process meanwhile
+        return profiles
+
+    def path(self, profile_id: str) -> Optional[str]:
+        if profile_id not in self._ids():
+            return None
+        return self._path(profile_id, "prof")
+
+    def report(self, profile_id: str, sort: str = "cumulative", limit: int = 50) -> Optional[str]:
+        path = self.path(profile_id)
+        if path is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+def top_functions(stats: pstats.Stats, limit: int = 10) -> List[Dict]:
+    """The functions with the most cumulative time, for the profile listing"""
+    rows = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({"function": f"{os.path.basename(filename)}:{line}({name})" if line else name,
+                     "calls": calls, "tottime": round(tottime, 6), "cumtime": round(cumtime, 6)})
+    rows.sort(key=lambda row: row["cumtime"], reverse=True)
+    return rows[:limit]
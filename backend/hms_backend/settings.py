@@ -30,10 +30,60 @@ import os
 # Define paths relative to the base directory
 EEG_DATA_PATH = os.path.join(BASE_DIR, "intelligence/preprocessed/eeg/")
 SPEC_DATA_PATH = os.path.join(BASE_DIR, "intelligence/preprocessed/spec/")
+FEATURE_STORE_PATH = os.path.join(BASE_DIR, "intelligence/features/")
+# Encoded EEG/SPEC response bodies (eeg_app.http_cache), keyed by source file identity
+RESPONSE_CACHE_PATH = os.path.join(BASE_DIR, "cache/responses/")
+RESPONSE_CACHE_MEMORY_BYTES = 128 * 1024 * 1024
 
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
+TWILIO_API_BASE_URL = os.getenv('TWILIO_API_BASE_URL')  # e.g. a local fake SMS server
+
+# Alert dispatch (eeg_app.alerts)
+ALERT_DISPATCH_IN_PROCESS = os.getenv('ALERT_DISPATCH_IN_PROCESS', '1') == '1'
+ALERT_DISPATCH_WORKERS = 4
+ALERT_COALESCE_WINDOW = 60  # seconds
+ALERT_MAX_ATTEMPTS = 5
+ALERT_RETRY_BASE_DELAY = 2.0  # seconds, doubled per attempt
+ALERT_RETRY_MAX_DELAY = 300.0
+ALERT_CLAIM_TIMEOUT = 120  # seconds before a stuck 'sending' alert is retried
+ALERT_SMS_TIMEOUT = 10.0
+
+# Serve the EEG/SPEC/patients/predict endpoints with the async views
+# (eeg_app.async_views); their blocking work runs on a pool of this many threads
+ASYNC_DATA_VIEWS = os.getenv('ASYNC_DATA_VIEWS', '1') == '1'
+ASYNC_VIEW_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Run feature extraction and XGBoost prediction in this many worker processes
+# (intelligence.inference_pool); 0 keeps inference in the web process
+INFERENCE_POOL_WORKERS = int(os.getenv('INFERENCE_POOL_WORKERS', '0'))
+INFERENCE_POOL_SLOT_BYTES = 8 * 1024 * 1024  # shared memory per worker; larger arrays get their own
+INFERENCE_TIMEOUT = 30.0  # seconds before a call fails and its worker is replaced
+INFERENCE_HEALTH_INTERVAL = 10.0  # seconds between pings of an idle worker
+
+# Answer confident predictions from the first rounds of the booster and a
+# subset of the features; thresholds are calibrated offline into
+# training_config.pkl by intelligence.models.XGBoost.cascade
+XGBOOST_CASCADE = os.getenv('XGBOOST_CASCADE', '0') == '1'
+
+# Spectrogram CNN served in-process (intelligence.models.SpectrogramCNN.serving):
+# a SavedModel directory or .tflite file; unset disables model=spectrogram_cnn.
+# Concurrent requests are micro-batched up to MAX_BATCH within BATCH_WINDOW
+# seconds. Thread pools are process-wide and fixed at load (0 = TensorFlow's choice).
+SPEC_MODEL_PATH = os.getenv('SPEC_MODEL_PATH', '')
+SPEC_MODEL_MAX_BATCH = int(os.getenv('SPEC_MODEL_MAX_BATCH', '16'))
+SPEC_MODEL_BATCH_WINDOW = float(os.getenv('SPEC_MODEL_BATCH_WINDOW', '0.002'))
+SPEC_MODEL_INTRA_OP_THREADS = int(os.getenv('SPEC_MODEL_INTRA_OP_THREADS', '0'))
+SPEC_MODEL_INTER_OP_THREADS = int(os.getenv('SPEC_MODEL_INTER_OP_THREADS', '0'))
+SPEC_MODEL_JIT_COMPILE = os.getenv('SPEC_MODEL_JIT_COMPILE', '0') == '1'
+
+# Opt-in request profiling (hms_backend.profiling): send "X-Profile: <token>"
+# or sample a fraction of requests; listed at /admin/profiles/
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_DIR = os.path.join(BASE_DIR, "cache/profiles/")
+PROFILING_MAX_PROFILES = 200
 # Application definition
 
 INSTALLED_APPS = [
@@ -45,9 +95,12 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
     'corsheaders',
     'channels',
+    'eeg_app',
 ]
 
 MIDDLEWARE = [
+    'hms_backend.instrumentation.MetricsMiddleware',
+    'hms_backend.instrumentation.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -87,10 +140,20 @@ CORS_ALLOWED_ORIGINS = [
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLITE_WAL=1: readers (history queries) no longer block the audit log's and
+# alert workers' writes, and a commit is one append to the log;
+# synchronous=NORMAL fsyncs at checkpoints instead of every commit. The mode is
+# stored in the database file, which then keeps db.sqlite3-wal/-shm beside it
+SQLITE_WAL = os.getenv('SQLITE_WAL', '0') == '1'
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;" if SQLITE_WAL else "",
+            "timeout": 20,
+        },
     }
 }
 
@@ -131,6 +194,64 @@ REST_FRAMEWORK = {
     ),
 }
 
+# Relay JSON frames a client sends on ws/eeg/<id>/ to every socket of that
+# patient (a bedside feed; used by benchmarks.ward_load to measure delivery lag)
+EEG_WS_RELAY = os.getenv('EEG_WS_RELAY', '0') == '1'
+
+# Accept binary sample chunks from bedside gateways on ws/eeg/<id>/ into
+# per-patient ring buffers (eeg_app.live_buffers) holding the last
+# LIVE_BUFFER_MINUTES, preallocated: 19 x 2 x minutes x 60 x rate x 4 bytes each.
+# data/, spec/ and predict/ read the newest LIVE_WINDOW_SAMPLES with source=live.
+EEG_INGEST = os.getenv('EEG_INGEST', '0') == '1'
+LIVE_SAMPLE_RATE = 200
+LIVE_BUFFER_MINUTES = float(os.getenv('LIVE_BUFFER_MINUTES', '5'))
+LIVE_MAX_PATIENTS = int(os.getenv('LIVE_MAX_PATIENTS', '64'))
+LIVE_WINDOW_SAMPLES = 2500  # as long as the stored recordings
+
+# Also persist ingested samples to append-only per-patient segment files
+# (intelligence.recording_store) from a background thread: written every
+# RECORDING_FLUSH_INTERVAL s, fsynced and indexed every RECORDING_FSYNC_INTERVAL s.
+# data/ reads them back with source=recording&start=<epoch>&end=<epoch>.
+EEG_RECORD = os.getenv('EEG_RECORD', '0') == '1'
+RECORDING_PATH = os.getenv('RECORDING_PATH', os.path.join(BASE_DIR, "intelligence/recordings/"))
+RECORDING_FLUSH_INTERVAL = float(os.getenv('RECORDING_FLUSH_INTERVAL', '0.5'))
+RECORDING_FSYNC_INTERVAL = float(os.getenv('RECORDING_FSYNC_INTERVAL', '2'))
+RECORDING_SEGMENT_MINUTES = 10
+
+# Keep a rolling spectrogram of each ingested stream (eeg_app.rolling_spectrogram),
+# one column per 64 new samples, and push new columns to ws/eeg/<id>/spec/
+LIVE_SPECTROGRAM = os.getenv('LIVE_SPECTROGRAM', '0') == '1'
+LIVE_SPECTROGRAM_COLUMNS = int(os.getenv('LIVE_SPECTROGRAM_COLUMNS', '256'))
+
+# Persist every prediction and alert (eeg_app.audit): buffered in memory and
+# written with bulk_create every AUDIT_FLUSH_INTERVAL s or AUDIT_BATCH_SIZE records.
+# Off unless enabled: the tables grow with every request (pair with SQLITE_WAL=1)
+AUDIT_LOG = os.getenv('AUDIT_LOG', '0') == '1'
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', '1'))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+AUDIT_MAX_PENDING = int(os.getenv('AUDIT_MAX_PENDING', '100000'))
+PREDICTION_HISTORY_MAX_LIMIT = 500
+
+# Score every actively recording patient's newest window every
+# LIVE_SCORING_INTERVAL s, each patient on exactly one worker: workers hold
+# SHARD_LEASE_TTL s leases ("db": ShardLease rows, shared by all workers;
+# "local": in-process, one worker) and split patients on a consistent-hash
+# ring (eeg_app.sharding). Started by asgi.py, or run `manage.py live_scoring`.
+LIVE_SCORING = os.getenv('LIVE_SCORING', '0') == '1'
+LIVE_SCORING_INTERVAL = float(os.getenv('LIVE_SCORING_INTERVAL', '5'))
+LIVE_SCORING_ACTIVE = 30  # seconds since a recording's last index append
+SHARD_LEASES = os.getenv('SHARD_LEASES', 'db')
+SHARD_LEASE_TTL = float(os.getenv('SHARD_LEASE_TTL', '15'))
+SHARD_VNODES = 256
+
+# ws/eeg/ward/ (eeg_app.consumers.WardConsumer): one socket subscribed to many
+# patients, receiving their frames batched every interval (a client may ask for
+# a longer or shorter one, down to the minimum)
+WARD_WS_INTERVAL = float(os.getenv('WARD_WS_INTERVAL', '0.25'))
+WARD_WS_MIN_INTERVAL = 0.05
+WARD_WS_MAX_SUBSCRIPTIONS = int(os.getenv('WARD_WS_MAX_SUBSCRIPTIONS', '64'))
+WARD_WS_MAX_FRAMES = 50  # per patient per batch; older frames are dropped
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels.layers.InMemoryChannelLayer',
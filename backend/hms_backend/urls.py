@@ -17,7 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .instrumentation import metrics_view, profile_view, profiles_view
+
 urlpatterns = [
+    path('admin/profiles/', profiles_view, name='profiles'),
+    path('admin/profiles/<str:profile_id>/', profile_view, name='profile'),
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('eeg/', include('eeg_app.urls')),
 ]
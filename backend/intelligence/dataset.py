@@ -0,0 +1,228 @@
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from intelligence.storage import load_array
+
+logger = logging.getLogger(__name__)
+
+PREPROCESSED_DIR = os.path.join(os.path.dirname(__file__), "preprocessed")
+EEG_DIR = os.path.join(PREPROCESSED_DIR, "eeg")
+SPEC_DIR = os.path.join(PREPROCESSED_DIR, "spec")
+
+# Same order as training_config.pkl['classes']
+CLASSES = ['Seizure', 'LPD', 'GPD', 'LRDA', 'GRDA', 'Other']
+VOTE_COLUMNS = ['seizure_vote', 'lpd_vote', 'gpd_vote', 'lrda_vote', 'grda_vote', 'other_vote']
+
+MODALITY_DIRS = {"eeg": EEG_DIR, "spec": SPEC_DIR}
+
+
+def list_ids(modalities: Sequence[str] = ("eeg", "spec"), dirs: Optional[Dict[str, str]] = None) -> List[str]:
+    """Sorted ids that have a .npy file for every requested modality"""
+    dirs = {**MODALITY_DIRS, **(dirs or {})}
+    ids = None
+    for modality in modalities:
+        with os.scandir(dirs[modality]) as entries:
+            found = {e.name[:-4] for e in entries if e.name.endswith(".npy")}
+        ids = found if ids is None else ids & found
+    return sorted(ids or [])
+
+
+def load_vote_labels(csv_path: str) -> Dict[str, np.ndarray]:
+    """
+    Read HMS-style expert votes (eeg_id + *_vote columns) into normalized
+    per-recording class distributions, pooling the votes of all sub-windows of a recording.
+    """
+    df = pd.read_csv(csv_path, usecols=['eeg_id'] + VOTE_COLUMNS)
+    votes = df.groupby('eeg_id')[VOTE_COLUMNS].sum()
+    totals = votes.sum(axis=1).replace(0, 1)
+    probs = votes.div(totals, axis=0).astype(np.float32)
+    return {str(eeg_id): row for eeg_id, row in zip(probs.index, probs.to_numpy())}
+
+
+def _load_batch(batch_ids, modalities, dirs, batch_labels, transform, dtype):
+    """Worker side: read one batch from memory-mapped files into fresh contiguous arrays"""
+    batch = {"ids": list(batch_ids)}
+    for modality in modalities:
+        out = None
+        for i, sample_id in enumerate(batch_ids):
+            # mmap keeps the page cache as the only copy until we slice it into the batch;
+            # encoded recordings are decoded here instead
+            arr = load_array(os.path.join(dirs[modality], f"{sample_id}.npy"), mmap=True)
+            if out is None:
+                out = np.empty((len(batch_ids),) + arr.shape, dtype=dtype)
+            out[i] = arr
+        batch[modality] = out
+    if transform is not None:
+        batch = transform(batch)
+    if batch_labels is not None:
+        batch["y"] = np.stack(batch_labels).astype(np.float32, copy=False)
+    return batch
+
+
+class PreprocessedDataset:
+    """
+    Streams preprocessed EEG/spectrogram arrays in shuffled batches.
+
+    Ids are shuffled in chunks of ``chunk_size`` neighbouring files (good read
+    locality, decent randomness), then within each chunk. Batches are decoded
+    on a thread or process pool with at most ``prefetch`` batches in flight, so
+    resident memory is ``prefetch * batch_size * sample_size`` no matter how
+    many recordings are on disk.
+
+    Each batch is a dict: ``ids`` (list of str), one float32 array per modality
+    (``eeg``: (B, 19, 2500), ``spec``: (B, 128, 256, 4)) and ``y`` (B, 6) when
+    ``labels`` is given. ``transform`` is called on the batch dict inside the
+    worker, so augmentation runs off the training thread; it must be picklable
+    when ``use_processes`` is set.
+    """
+
+    def __init__(self, ids: Optional[Sequence[str]] = None, modalities: Sequence[str] = ("eeg", "spec"),
+                 labels: Optional[Dict[str, np.ndarray]] = None, batch_size: int = 32, chunk_size: int = 1024,
+                 shuffle: bool = True, seed: Optional[int] = None, prefetch: int = 4, num_workers: int = 4,
+                 use_processes: bool = False, transform: Optional[Callable[[Dict], Dict]] = None,
+                 drop_last: bool = False, dirs: Optional[Dict[str, str]] = None, dtype=np.float32):
+        self.modalities = tuple(modalities)
+        self.dirs = {**MODALITY_DIRS, **(dirs or {})}
+        if ids is None:
+            ids = list_ids(self.modalities, self.dirs)
+        if labels is not None:
+            missing = len(ids)
+            ids = [i for i in ids if i in labels]
+            missing -= len(ids)
+            if missing:
+                logger.warning(f"Dropping {missing} recordings without labels")
+        self.ids = list(ids)
+        self.labels = labels
+        self.batch_size = batch_size
+        self.chunk_size = max(chunk_size, batch_size)
+        self.shuffle = shuffle
+        self.prefetch = max(prefetch, 1)
+        self.num_workers = num_workers
+        self.use_processes = use_processes
+        self.transform = transform
+        self.drop_last = drop_last
+        self.dtype = dtype
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return len(self.ids) // self.batch_size
+        return -(-len(self.ids) // self.batch_size)
+
+    def _epoch_order(self) -> List[str]:
+        if not self.shuffle:
+            return self.ids
+        chunks = [self.ids[i:i + self.chunk_size] for i in range(0, len(self.ids), self.chunk_size)]
+        order = []
+        for c in self._rng.permutation(len(chunks)):
+            order.extend(chunks[c][j] for j in self._rng.permutation(len(chunks[c])))
+        return order
+
+    def _batches_of_ids(self) -> Iterator[List[str]]:
+        order = self._epoch_order()
+        for start in range(0, len(order), self.batch_size):
+            batch_ids = order[start:start + self.batch_size]
+            if self.drop_last and len(batch_ids) < self.batch_size:
+                return
+            yield batch_ids
+
+    def __iter__(self) -> Iterator[Dict]:
+        pool_cls = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        with pool_cls(max_workers=self.num_workers) as pool:
+            pending = deque()
+            try:
+                for batch_ids in self._batches_of_ids():
+                    # Only this batch's labels travel to the worker, not the whole mapping
+                    batch_labels = [self.labels[i] for i in batch_ids] if self.labels is not None else None
+                    pending.append(pool.submit(_load_batch, batch_ids, self.modalities, self.dirs,
+                                               batch_labels, self.transform, self.dtype))
+                    if len(pending) >= self.prefetch:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def feature_batches(self, manager=None, store=None) -> Iterator[Dict]:
+        """
+        Batches of XGBoost features: ``X`` (B, 251) float32, ``ids`` and ``y`` when labelled.
+
+        With a ``FeatureStore``, cached rows are read from it and only missing or
+        stale recordings are featurized (and written back); the dataset may then
+        be built with ``modalities=()`` so cached recordings are never read.
+        Rows whose feature extraction fails are dropped.
+        """
+        if manager is None:
+            from intelligence.models.XGBoost.xgboost import XGBoostModelManager
+            manager = XGBoostModelManager(load=False)
+        for batch in self:
+            ids = batch["ids"]
+            if store is not None:
+                X, found = store.get_many(ids)
+            else:
+                X = np.empty((len(ids), len(manager.feature_names)), dtype=np.float32)
+                found = np.zeros(len(ids), dtype=bool)
+
+            computed = []
+            for i in np.flatnonzero(~found):
+                if "eeg" in batch:
+                    eeg = batch["eeg"][i]
+                else:
+                    eeg = load_array(os.path.join(self.dirs["eeg"], f"{ids[i]}.npy"))
+                features = manager.extract_features(eeg)
+                if features is not None:
+                    X[i] = features
+                    found[i] = True
+                    computed.append(i)
+            if store is not None and computed:
+                store.put_many([ids[i] for i in computed], X[computed])
+
+            if not found.any():
+                continue
+            out = {"ids": [sample_id for sample_id, ok in zip(ids, found) if ok], "X": X[found]}
+            if "y" in batch:
+                out["y"] = batch["y"][found]
+            yield out
+
+    def as_tf_dataset(self, inputs: Optional[Sequence[str]] = None):
+        """``tf.data.Dataset`` of (inputs, y) tuples, or inputs only for unlabelled data"""
+        import tensorflow as tf
+
+        inputs = tuple(inputs or self.modalities)
+        sample = _load_batch(self.ids[:1], inputs, self.dirs, None, None, self.dtype)
+        x_spec = tuple(tf.TensorSpec((None,) + sample[m].shape[1:], tf.float32) for m in inputs)
+        if len(x_spec) == 1:
+            x_spec = x_spec[0]
+
+        def generator():
+            for batch in self:
+                x = tuple(batch[m] for m in inputs)
+                x = x[0] if len(x) == 1 else x
+                yield (x, batch["y"]) if self.labels is not None else x
+
+        signature = (x_spec, tf.TensorSpec((None, len(CLASSES)), tf.float32)) if self.labels is not None else x_spec
+        return tf.data.Dataset.from_generator(generator, output_signature=signature)
+
+    def as_torch_dataset(self):
+        """``torch.utils.data.IterableDataset`` yielding batches of tensors (use ``batch_size=None`` in DataLoader)"""
+        import torch
+        from torch.utils.data import IterableDataset
+
+        dataset = self
+
+        class _TorchBatches(IterableDataset):
+            def __iter__(self):
+                for batch in dataset:
+                    yield {k: (torch.from_numpy(v) if isinstance(v, np.ndarray) else v) for k, v in batch.items()}
+
+            def __len__(self):
+                return len(dataset)
+
+        return _TorchBatches()
@@ -0,0 +1,256 @@
+"""
+Compact on-disk encoding for (channels, samples) EEG arrays.
+
+The recording is cut into chunks of ``chunk`` samples. Within a chunk every
+channel is quantized to int16 against its own offset (mid-range) and scale
+(range / 65534), so the reconstruction error is at most scale / 2 per sample
+(plus the float32 rounding of the decoded value): about 0.004 uV for a channel
+spanning 500 uV. ``max_error`` coarsens the step to a chosen bound instead.
+
+Codes are stored as plain int16 by default: half the size of float32 and the
+fastest decode. With ``compressor="zlib"`` they are delta-coded along time,
+split into low/high byte planes and deflated at level 1, which pays off once
+``max_error`` has removed the noise in the low bits. Each chunk is an
+independently decodable block, so a time range costs only the chunks it
+overlaps.
+
+File layout (little-endian):
+    magic       7 bytes  b"\\x93EEGQ16", then a uint8 format version
+    header_len  uint32
+    header      JSON: shape, chunk, compressor, delta
+    scales      float32 (n_chunks, channels)
+    offsets     float32 (n_chunks, channels)
+    positions   uint64 (n_chunks + 1) payload offsets of each chunk
+    payload     the chunk blocks
+
+Files keep their ``<id>.npy`` names, so paths, ETags and the feature store
+are unaffected; ``intelligence.storage.load_array`` tells the two formats
+apart by the magic and decodes transparently.
+
+Convert an archive in place from backend/:
+    python -m intelligence.eeg_codec [--eeg-dir DIR] [--chunk 1024] [--compressor none|zlib]
+                                     [--max-error UV] [--restore]
+"""
+import os
+import argparse
+import json
+import logging
+import struct
+import tempfile
+import time
+import zlib
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"\x93EEGQ16"
+FORMAT_VERSION = 1
+DEFAULT_CHUNK = 1024
+COMPRESSORS = ("zlib", "none")
+QUANT_LEVELS = 65534  # codes -32767..32767; -32768 is never written
+_PREFIX = struct.Struct("<7sBI")
+
+
+def is_compressed(path: str) -> bool:
+    """True if ``path`` holds an encoded array rather than a .npy"""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def quantize(chunk: np.ndarray, max_error: Optional[float] = None):
+    """(codes int16, scale float32, offset float32) for one (channels, n) chunk"""
+    lo = chunk.min(axis=1).astype(np.float64)
+    hi = chunk.max(axis=1).astype(np.float64)
+    offset = ((hi + lo) / 2).astype(np.float32)
+    scale = ((hi - lo) / QUANT_LEVELS).astype(np.float32)
+    if max_error is not None:
+        # the largest float32 step not above 2 * max_error, so the stored step keeps the bound
+        step = np.float32(2 * max_error)
+        step = step if float(step) <= 2 * max_error else np.nextafter(step, np.float32(0))
+        scale = np.maximum(scale, step)
+    scale = np.where(scale > 0, scale, np.float32(1))
+    # round against the stored float32 scale and offset, in float64, so |x - decoded| <= scale / 2
+    codes = np.rint((chunk - offset[:, None].astype(np.float64)) / scale[:, None])
+    return np.clip(codes, -32767, 32767).astype(np.int16), scale, offset
+
+
+def _pack(codes: np.ndarray, compressor: str, delta: bool) -> bytes:
+    if delta:
+        codes = np.diff(codes, axis=1, prepend=np.int16(0))  # wraps in int16; cumsum undoes it exactly
+    if compressor == "none":
+        return codes.astype("<i2").tobytes()
+    # low byte plane then high byte plane: small deltas leave the high plane nearly constant
+    words = codes.view(np.uint16)
+    return zlib.compress(np.stack([words.astype(np.uint8), (words >> 8).astype(np.uint8)]), 1)
+
+
+def _unpack(block: bytes, channels: int, n: int, compressor: str, delta: bool) -> np.ndarray:
+    if compressor == "none":
+        codes = np.frombuffer(block, dtype="<i2").reshape(channels, n)
+    else:
+        planes = np.frombuffer(zlib.decompress(block), dtype=np.uint8).reshape(2, channels, n)
+        codes = (planes[1].astype(np.uint16) << 8 | planes[0]).view(np.int16)
+    return np.cumsum(codes, axis=1, dtype=np.int16) if delta else codes
+
+
+def save_compressed(path: str, array: np.ndarray, chunk: int = DEFAULT_CHUNK, compressor: str = "none",
+                    max_error: Optional[float] = None, delta: Optional[bool] = None) -> int:
+    """
+    Encode a (channels, samples) array to ``path`` and return the file size.
+    ``delta`` defaults to on with zlib and off without a compressor, where it
+    would only cost decode time. zlib pays off once ``max_error`` coarsens the
+    step; at full resolution the noise in the low bits leaves little to
+    deflate. Written to a temporary file and renamed, so readers never see a
+    partial file.
+    """
+    if delta is None:
+        delta = compressor != "none"
+    array = np.asarray(array, dtype=np.float32)
+    if array.ndim != 2:
+        raise ValueError(f"Expected a (channels, samples) array, got shape {array.shape}")
+    if compressor not in COMPRESSORS:
+        raise ValueError(f"Unknown compressor {compressor!r}; expected one of {COMPRESSORS}")
+    if not np.isfinite(array).all():
+        raise ValueError("Cannot quantize non-finite values; store the recording as float32")
+
+    channels, samples = array.shape
+    n_chunks = max(1, -(-samples // chunk))
+    scales = np.empty((n_chunks, channels), dtype=np.float32)
+    offsets = np.empty((n_chunks, channels), dtype=np.float32)
+    blocks = []
+    for i in range(n_chunks):
+        piece = array[:, i * chunk:(i + 1) * chunk]
+        if piece.shape[1] == 0:
+            scales[i], offsets[i] = 1.0, 0.0
+            blocks.append(b"")
+            continue
+        codes, scales[i], offsets[i] = quantize(piece, max_error)
+        blocks.append(_pack(codes, compressor, delta))
+    positions = np.zeros(n_chunks + 1, dtype=np.uint64)
+    positions[1:] = np.cumsum([len(b) for b in blocks])
+
+    header = json.dumps({"shape": [channels, samples], "chunk": chunk, "compressor": compressor,
+                         "delta": delta}).encode()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            f.write(scales.astype("<f4").tobytes())
+            f.write(offsets.astype("<f4").tobytes())
+            f.write(positions.astype("<u8").tobytes())
+            for block in blocks:
+                f.write(block)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+
+class CompressedArray:
+    """
+    Reader for an encoded file. Opening reads only the header and chunk index;
+    ``read(start, stop)`` decodes just the chunks overlapping the range.
+    """
+
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{path} is not an encoded EEG array (version {FORMAT_VERSION})")
+            header = json.loads(f.read(header_len))
+            self.shape = tuple(header["shape"])
+            self.chunk = header["chunk"]
+            self.compressor = header["compressor"]
+            self.delta = header["delta"]
+            channels = self.shape[0]
+            self.n_chunks = max(1, -(-self.shape[1] // self.chunk))
+            table = self.n_chunks * channels
+            self.scales = np.frombuffer(f.read(4 * table), dtype="<f4").reshape(self.n_chunks, channels)
+            self.offsets = np.frombuffer(f.read(4 * table), dtype="<f4").reshape(self.n_chunks, channels)
+            self.positions = np.frombuffer(f.read(8 * (self.n_chunks + 1)), dtype="<u8")
+            self.data_start = f.tell()
+
+    @property
+    def max_error(self) -> float:
+        """Worst-case absolute quantization error over the file (half the largest step)"""
+        return float(self.scales.max() / 2)
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Decode samples [start, stop) of every channel as a (channels, n) float32 array"""
+        channels, samples = self.shape
+        start, stop, _ = slice(start, stop).indices(samples)
+        out = np.empty((channels, max(0, stop - start)), dtype=np.float32)
+        if stop <= start:
+            return out
+        first, last = start // self.chunk, (stop - 1) // self.chunk
+        with open(self.path, "rb") as f:
+            f.seek(self.data_start + int(self.positions[first]))
+            payload = f.read(int(self.positions[last + 1] - self.positions[first]))
+        base = int(self.positions[first])
+        for i in range(first, last + 1):
+            chunk_start = i * self.chunk
+            n = min(self.chunk, samples - chunk_start)
+            block = payload[int(self.positions[i]) - base:int(self.positions[i + 1]) - base]
+            codes = _unpack(block, channels, n, self.compressor, self.delta)
+            lo, hi = max(start, chunk_start), min(stop, chunk_start + n)
+            decoded = out[:, lo - start:hi - start]
+            np.multiply(codes[:, lo - chunk_start:hi - chunk_start], self.scales[i][:, None], out=decoded,
+                        casting="unsafe")
+            decoded += self.offsets[i][:, None]
+        return out
+
+
+def convert(eeg_dir: str, chunk: int = DEFAULT_CHUNK, compressor: str = "none", max_error: Optional[float] = None,
+            restore: bool = False):
+    """Encode (or with ``restore``, decode back to float32 .npy) every recording in ``eeg_dir`` in place"""
+    from intelligence.storage import load_array, save_array
+
+    start = time.perf_counter()
+    names = sorted(n for n in os.listdir(eeg_dir) if n.endswith(".npy"))
+    before = after = converted = 0
+    worst = 0.0
+    for name in names:
+        path = os.path.join(eeg_dir, name)
+        try:
+            if is_compressed(path) != restore:
+                continue
+            size = os.path.getsize(path)
+            array = load_array(path)
+            if restore:
+                save_array(path, array)
+            else:
+                save_compressed(path, array, chunk=chunk, compressor=compressor, max_error=max_error)
+                worst = max(worst, float(np.abs(CompressedArray(path).read() - array).max()))
+        except Exception as e:
+            logger.error(f"Error converting {name}: {e}")
+            continue
+        before += size
+        after += os.path.getsize(path)
+        converted += 1
+    elapsed = time.perf_counter() - start
+    logger.info(f"Converted {converted}/{len(names)} recordings in {elapsed:.1f}s: "
+                f"{before / 2 ** 20:.1f} MiB -> {after / 2 ** 20:.1f} MiB"
+                + ("" if restore else f", max abs error {worst:.4g}"))
+    return converted
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Encode the preprocessed EEG archive in place")
+    parser.add_argument("--eeg-dir", default=os.path.join(os.path.dirname(__file__), "preprocessed", "eeg"))
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="samples per independently decoded chunk")
+    parser.add_argument("--compressor", choices=COMPRESSORS, default="none")
+    parser.add_argument("--max-error", type=float, default=None,
+                        help="allowed absolute error per sample (default: full int16 resolution)")
+    parser.add_argument("--restore", action="store_true", help="decode back to float32 .npy files")
+    args = parser.parse_args()
+    convert(args.eeg_dir, chunk=args.chunk, compressor=args.compressor, max_error=args.max_error,
+            restore=args.restore)
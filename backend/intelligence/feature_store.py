@@ -0,0 +1,261 @@
+"""
+Persistent cache of the XGBoost feature vectors, one float32 row per recording.
+
+Layout of a store directory:
+    features.f32   row-major (rows, n_features) little-endian float32 matrix
+    index.log      append-only "recording_id,row,extractor_version" lines
+
+A recording keeps its row forever; recomputing it (e.g. after the extractor
+version changes) overwrites the row in place and appends a newer index line,
+which wins on replay. Readers memory-map the matrix and only parse the index
+lines appended since their last look, so a lookup is a dict hit plus a row read.
+
+Bulk fill from backend/:
+    python -m intelligence.feature_store [--workers N] [--eeg-dir DIR] [--store DIR]
+"""
+import os
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from intelligence.models.XGBoost.xgboost import FEATURE_EXTRACTOR_VERSION, XGBoostModelManager
+from intelligence.storage import load_array
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-writer deployments only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOT = os.path.join(os.path.dirname(__file__), "features")
+DEFAULT_EEG_DIR = os.path.join(os.path.dirname(__file__), "preprocessed", "eeg")
+N_FEATURES = len(XGBoostModelManager(load=False).feature_names)
+GROW_ROWS = 4096
+ROW_DTYPE = np.dtype("<f4")
+
+
+def check_recording_id(recording_id: str) -> str:
+    """``recording_id``, if it can be written as the first field of an index line; ValueError otherwise"""
+    if "," in recording_id or recording_id.splitlines() != [recording_id]:
+        raise ValueError(f"Invalid recording id {recording_id!r}")
+    return recording_id
+
+
+class FeatureStore:
+    """Memory-mapped float32 feature matrix with an append-only id index"""
+
+    def __init__(self, root: Optional[str] = None, version: int = FEATURE_EXTRACTOR_VERSION,
+                 n_features: int = N_FEATURES):
+        self.root = root or DEFAULT_ROOT
+        self.version = version
+        self.n_features = n_features
+        self.data_path = os.path.join(self.root, "features.f32")
+        self.index_path = os.path.join(self.root, "index.log")
+        self.lock_path = os.path.join(self.root, ".lock")
+        self._row_bytes = n_features * ROW_DTYPE.itemsize
+        self._rows: Dict[str, Tuple[int, int]] = {}
+        self._n_rows = 0
+        self._index_offset = 0
+        self._data = None
+        self._lock = threading.RLock()
+
+    # -- index / mapping -------------------------------------------------
+
+    def _sync_index(self):
+        """Replay index lines appended since the last sync"""
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            return
+        if size <= self._index_offset:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            chunk = f.read(size - self._index_offset)
+        # A concurrent writer may be mid-line; leave the partial line for next time
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].decode().splitlines():
+            recording_id, row, version = line.split(",")
+            row = int(row)
+            self._rows[recording_id] = (row, int(version))
+            self._n_rows = max(self._n_rows, row + 1)
+        self._index_offset += end
+
+    def _matrix(self, min_rows: int) -> Optional[np.ndarray]:
+        if self._data is None or self._data.shape[0] < min_rows:
+            if not os.path.exists(self.data_path):
+                return None
+            rows = os.path.getsize(self.data_path) // self._row_bytes
+            if rows == 0:
+                return None
+            self._data = np.memmap(self.data_path, dtype=ROW_DTYPE, mode="r", shape=(rows, self.n_features))
+        return self._data
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # -- reads -----------------------------------------------------------
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sync_index()
+            return len(self._rows)
+
+    def __contains__(self, recording_id) -> bool:
+        return self.get(recording_id) is not None
+
+    def get(self, recording_id) -> Optional[np.ndarray]:
+        """Cached features for one recording, or None if missing or stale"""
+        with self._lock:
+            self._sync_index()
+            entry = self._rows.get(str(recording_id))
+            if entry is None or entry[1] != self.version:
+                return None
+            matrix = self._matrix(entry[0] + 1)
+            return None if matrix is None else np.array(matrix[entry[0]])
+
+    def get_many(self, recording_ids: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Features for many recordings as an (n, n_features) float32 matrix plus
+        a boolean mask of which rows were found fresh; other rows are NaN.
+        """
+        out = np.full((len(recording_ids), self.n_features), np.nan, dtype=np.float32)
+        found = np.zeros(len(recording_ids), dtype=bool)
+        with self._lock:
+            self._sync_index()
+            rows = []
+            for i, recording_id in enumerate(recording_ids):
+                entry = self._rows.get(str(recording_id))
+                if entry is not None and entry[1] == self.version:
+                    rows.append(entry[0])
+                    found[i] = True
+            if rows:
+                matrix = self._matrix(max(rows) + 1)
+                out[found] = matrix[np.asarray(rows)]
+        return out, found
+
+    def stale_ids(self, recording_ids: Iterable) -> List[str]:
+        """Ids that are missing or were computed by another extractor version"""
+        with self._lock:
+            self._sync_index()
+            stale = []
+            for recording_id in recording_ids:
+                entry = self._rows.get(str(recording_id))
+                if entry is None or entry[1] != self.version:
+                    stale.append(str(recording_id))
+            return stale
+
+    # -- writes ----------------------------------------------------------
+
+    def put(self, recording_id, features: np.ndarray):
+        self.put_many([recording_id], np.asarray(features).reshape(1, -1))
+
+    def put_many(self, recording_ids: Sequence, features: np.ndarray):
+        """Write feature rows, reusing a recording's existing row if it has one"""
+        features = np.asarray(features, dtype=ROW_DTYPE).reshape(len(recording_ids), self.n_features)
+        if len(recording_ids) == 0:
+            return
+        # One bad id would make every later replay of the index fail
+        recording_ids = [check_recording_id(str(rid)) for rid in recording_ids]
+        with self._write_lock():
+            self._sync_index()
+            rows = []
+            next_row = self._n_rows
+            for recording_id in recording_ids:
+                entry = self._rows.get(str(recording_id))
+                if entry is None:
+                    entry = (next_row, self.version)
+                    next_row += 1
+                rows.append(entry[0])
+
+            capacity = os.path.getsize(self.data_path) // self._row_bytes if os.path.exists(self.data_path) else 0
+            if next_row > capacity:
+                capacity = -(-next_row // GROW_ROWS) * GROW_ROWS
+                with open(self.data_path, "ab") as f:
+                    f.truncate(capacity * self._row_bytes)
+
+            matrix = np.memmap(self.data_path, dtype=ROW_DTYPE, mode="r+", shape=(capacity, self.n_features))
+            matrix[np.asarray(rows)] = features
+            matrix.flush()
+            del matrix
+
+            # Rows are durable before the index points at them
+            lines = "".join(f"{rid},{row},{self.version}\n" for rid, row in zip(recording_ids, rows))
+            with open(self.index_path, "a") as f:
+                f.write(lines)
+            self._sync_index()
+
+    def populate(self, recording_ids: Optional[Sequence] = None, eeg_dir: str = DEFAULT_EEG_DIR,
+                 workers: Optional[int] = None, chunk_size: int = 256) -> int:
+        """
+        Compute and store features for every missing or stale recording in
+        ``recording_ids`` (default: all .npy files in ``eeg_dir``), in parallel.
+        Returns the number of rows written.
+        """
+        if recording_ids is None:
+            recording_ids = sorted(f[:-4] for f in os.listdir(eeg_dir) if f.endswith(".npy"))
+        todo = self.stale_ids(recording_ids)
+        if not todo:
+            return 0
+
+        logger.info(f"Computing features for {len(todo)} of {len(recording_ids)} recordings")
+        start = time.perf_counter()
+        written = 0
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for ids, matrix in pool.map(_extract_chunk, chunks, [eeg_dir] * len(chunks)):
+                if ids:
+                    self.put_many(ids, matrix)
+                    written += len(ids)
+        logger.info(f"Stored {written} feature rows in {time.perf_counter() - start:.1f}s")
+        return written
+
+
+_extractor = None
+
+
+def _extract_chunk(recording_ids: Sequence[str], eeg_dir: str) -> Tuple[List[str], np.ndarray]:
+    """Worker side of populate(): load and featurize one chunk of recordings"""
+    global _extractor
+    if _extractor is None:
+        _extractor = XGBoostModelManager(load=False)
+    ids, rows = [], []
+    for recording_id in recording_ids:
+        try:
+            eeg = load_array(os.path.join(eeg_dir, f"{recording_id}.npy"))
+        except Exception as e:
+            logger.error(f"Error loading {recording_id}: {e}")
+            continue
+        features = _extractor.extract_features(eeg)
+        if features is not None:
+            ids.append(recording_id)
+            rows.append(features)
+    return ids, np.stack(rows) if rows else np.empty((0, N_FEATURES), dtype=np.float32)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Fill the XGBoost feature store")
+    parser.add_argument("--store", default=DEFAULT_ROOT)
+    parser.add_argument("--eeg-dir", default=DEFAULT_EEG_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    store = FeatureStore(args.store)
+    count = store.populate(eeg_dir=args.eeg_dir, workers=args.workers)
+    print(f"Wrote {count} rows; store holds {len(store)} recordings")
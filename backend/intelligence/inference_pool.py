@@ -0,0 +1,419 @@
+"""
+Out-of-process inference: a pool of worker processes, each holding its own
+XGBoostModelManager, so feature extraction and prediction never compete for
+the web worker's GIL.
+
+Every worker owns a shared-memory slot. A call copies its array argument into
+the slot (arrays larger than the slot get a one-off segment) and sends only
+the op name, shape and dtype down the worker's pipe, so the payload is never
+pickled; the small result dict comes back on the same pipe.
+
+One collector thread per pool waits on all worker pipes and process sentinels.
+It resolves futures, hands queued calls to workers as they free up, pings idle
+workers every ``health_interval`` seconds, and replaces a worker that exits,
+stops answering pings or overruns ``timeout`` (failing its call with
+WorkerCrashed / InferenceTimeout). Workers start on first use.
+
+InferenceClient is the single entry point for the views and any streaming
+scorer: ``call()`` blocks, ``acall()`` awaits without holding the event loop.
+With INFERENCE_POOL_WORKERS = 0 it runs the manager in-process instead.
+"""
+import asyncio
+import atexit
+import collections
+import importlib
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from hms_backend.metrics import INFERENCE_WORKER_EVENTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MANAGER_FACTORY = "intelligence.models.XGBoost.xgboost:XGBoostModelManager"
+# XGBoostModelManager methods a worker will run
+OPS = ("predict", "predict_features", "extract_features", "predict_from_file")
+
+
+class InferenceError(Exception):
+    pass
+
+
+class WorkerCrashed(InferenceError):
+    pass
+
+
+class InferenceTimeout(InferenceError):
+    pass
+
+
+class _ArrayRef:
+    """Stands in for the array argument on the pipe: where to find it in shared memory"""
+
+    def __init__(self, segment: Optional[str], shape: Tuple[int, ...], dtype: str):
+        self.segment = segment  # None: the worker's own slot
+        self.shape = shape
+        self.dtype = dtype
+
+
+def _load_factory(path: str) -> Callable:
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def _resolve(arg, slot: SharedMemory, attached: List[SharedMemory]):
+    if not isinstance(arg, _ArrayRef):
+        return arg
+    # Attaching registers the segment with the resource tracker the workers share
+    # with the parent, whose unlink() is the only cleanup
+    segment = slot
+    if arg.segment is not None:
+        segment = SharedMemory(name=arg.segment)
+        attached.append(segment)
+    return np.ndarray(arg.shape, dtype=arg.dtype, buffer=segment.buf)
+
+
+def _worker_main(conn, slot_name: str, manager_factory: str):
+    if os.environ.get("DJANGO_SETTINGS_MODULE"):
+        import django
+        django.setup()
+    manager = _load_factory(manager_factory)()
+    slot = SharedMemory(name=slot_name)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:  # close()
+            break
+        request_id, op, args, kwargs = message
+        if op == "ping":
+            conn.send((request_id, True, None))
+            continue
+        attached = []
+        try:
+            resolved = [_resolve(arg, slot, attached) for arg in args]
+            result = getattr(manager, op)(*resolved, **kwargs)
+            del resolved  # release the views before their segments are closed
+            conn.send((request_id, True, result))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+        finally:
+            for segment in attached:
+                segment.close()
+    slot.close()
+
+
+class _Call:
+    def __init__(self, op: str, args: tuple, kwargs: dict, future: Optional[Future]):
+        self.op = op
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future  # None for health pings
+        self.segment: Optional[SharedMemory] = None
+        self.sent_at = 0.0
+
+
+class _Worker:
+    def __init__(self, index: int, slot: SharedMemory):
+        self.index = index
+        self.slot = slot
+        self.process = None
+        self.conn = None
+        self.call: Optional[_Call] = None
+        self.request_id = None
+        self.last_seen = 0.0
+
+
+class InferencePool:
+    """A fixed number of model worker processes fed through shared memory"""
+
+    def __init__(self, workers: int, manager_factory: str = DEFAULT_MANAGER_FACTORY,
+                 slot_bytes: int = 8 * 1024 * 1024, timeout: float = 30.0, health_interval: float = 10.0,
+                 start_method: str = "spawn"):
+        self.workers = workers
+        self.manager_factory = manager_factory
+        self.slot_bytes = slot_bytes
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self._context = multiprocessing.get_context(start_method)
+        self._lock = threading.Lock()
+        self._workers: List[_Worker] = []
+        self._idle: Deque[_Worker] = collections.deque()
+        self._pending: Deque[_Call] = collections.deque()
+        self._ids = itertools.count()
+        self._collector = None
+        self._closed = False
+        self._pid = None
+        self.restarts = 0
+
+    # --- lifecycle ------------------------------------------------------------
+
+    def start(self):
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self):
+        if self._pid == os.getpid():
+            return
+        if self._closed:
+            raise InferenceError("Inference pool is closed")
+        # A forked copy of a started pool shares nothing usable with the parent's
+        self._workers, self._idle, self._pending = [], collections.deque(), collections.deque()
+        for index in range(self.workers):
+            worker = _Worker(index, SharedMemory(create=True, size=self.slot_bytes))
+            self._spawn(worker)
+            self._workers.append(worker)
+        if self._pid is None:
+            atexit.register(self.close)  # unlink the shared-memory slots
+        self._pid = os.getpid()
+        self._collector = threading.Thread(target=self._collect, name="inference-pool", daemon=True)
+        self._collector.start()
+
+    def _spawn(self, worker: _Worker):
+        parent, child = self._context.Pipe()
+        worker.process = self._context.Process(target=_worker_main, args=(child, worker.slot.name, self.manager_factory),
+                                               name=f"inference-worker-{worker.index}", daemon=True)
+        worker.process.start()
+        child.close()
+        worker.conn = parent
+        worker.call = None
+        worker.last_seen = time.monotonic()
+        self._idle.append(worker)
+        INFERENCE_WORKER_EVENTS.labels("started").inc()
+
+    def close(self):
+        if self._pid not in (None, os.getpid()):
+            return  # a forked copy: the slots belong to the parent
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+            pending, self._pending = list(self._pending), collections.deque()
+        for call in pending:
+            self._fail(call, InferenceError("Inference pool closed"))
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            worker.conn.close()
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+            if worker.call is not None:
+                self._release(worker.call)
+                self._fail(worker.call, InferenceError("Inference pool closed"))
+            worker.slot.close()
+            worker.slot.unlink()
+        if self._collector is not None and self._collector is not threading.current_thread():
+            self._collector.join(timeout=5)
+
+    def health(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": len(self._workers),
+                "alive": sum(worker.process.is_alive() for worker in self._workers),
+                "busy": sum(worker.call is not None for worker in self._workers),
+                "queued": len(self._pending),
+                "restarts": self.restarts,
+            }
+
+    # --- calls ----------------------------------------------------------------
+
+    def submit(self, op: str, *args, **kwargs) -> Future:
+        """Run ``manager.<op>(*args, **kwargs)`` on a worker; at most one argument may be an ndarray"""
+        if op not in OPS:
+            raise ValueError(f"Unknown inference op {op!r}")
+        if sum(isinstance(arg, np.ndarray) for arg in args) > 1:
+            raise ValueError("At most one argument may be an ndarray: it travels in the worker's one slot")
+        future = Future()
+        call = _Call(op, args, kwargs, future)
+        with self._lock:
+            self._start_locked()
+            self._pending.append(call)
+            if self._idle:
+                self._send_next(self._idle.popleft())
+        return future
+
+    def _send_next(self, worker: _Worker):
+        # Called with the lock held. A running future can no longer be cancelled, so
+        # the collector may resolve it; calls cancelled while queued are dropped here
+        while self._pending:
+            call = self._pending.popleft()
+            if call.future is None or call.future.set_running_or_notify_cancel():
+                self._send(worker, call)
+                return
+        self._idle.append(worker)
+
+    def _send(self, worker: _Worker, call: _Call):
+        # Called with the lock held
+        args = []
+        for arg in call.args:
+            if isinstance(arg, np.ndarray):
+                arg = self._place(worker, call, arg)
+            args.append(arg)
+        worker.request_id = next(self._ids)
+        worker.call = call
+        call.sent_at = time.monotonic()
+        try:
+            worker.conn.send((worker.request_id, call.op, tuple(args), call.kwargs))
+        except (OSError, ValueError):
+            pass  # the collector sees the dead worker and fails the call
+
+    def _place(self, worker: _Worker, call: _Call, array: np.ndarray) -> _ArrayRef:
+        array = np.ascontiguousarray(array)
+        if array.nbytes <= self.slot_bytes:
+            segment, name = worker.slot, None
+        else:
+            call.segment = segment = SharedMemory(create=True, size=array.nbytes)
+            name = segment.name
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+        return _ArrayRef(name, array.shape, array.dtype.str)
+
+    def _ping(self, worker: _Worker):
+        self._send(worker, _Call("ping", (), {}, None))
+
+    # --- collector ------------------------------------------------------------
+
+    def _collect(self):
+        tick = min(1.0, self.health_interval / 4, self.timeout / 4)
+        while not self._closed:
+            with self._lock:
+                watched = {}
+                for worker in self._workers:
+                    watched[worker.conn] = worker
+                    watched[worker.process.sentinel] = worker
+            if not watched:
+                return
+            try:
+                ready = connection.wait(list(watched), timeout=tick)
+            except OSError:
+                continue  # a connection was closed under us (pool closing)
+            # Nothing may stop this thread: every pending and future call depends on it
+            for handle in ready:
+                worker = watched[handle]
+                try:
+                    if handle is worker.conn:
+                        self._receive(worker)
+                    elif worker.process.exitcode is not None:
+                        self._replace(worker, WorkerCrashed(f"Inference worker exited with code {worker.process.exitcode}"),
+                                      "crashed")
+                except Exception as e:
+                    logger.error(f"Inference pool failed to handle worker {worker.index}: {e}")
+            try:
+                self._check_workers()
+            except Exception as e:
+                logger.error(f"Inference pool health check failed: {e}")
+
+    def _receive(self, worker: _Worker):
+        try:
+            request_id, ok, result = worker.conn.recv()
+        except (EOFError, OSError):
+            return  # the sentinel reports the exit
+        with self._lock:
+            call = worker.call
+            if call is None or request_id != worker.request_id:
+                return
+            worker.call = None
+            worker.last_seen = time.monotonic()
+            self._release(call)
+            self._send_next(worker)
+        if call.future is not None and not call.future.done():
+            if ok:
+                call.future.set_result(result)
+            else:
+                call.future.set_exception(InferenceError(result))
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for worker in list(self._workers):
+            call = worker.call
+            if call is not None and now - call.sent_at > self.timeout:
+                if call.future is None:
+                    self._replace(worker, None, "unhealthy")
+                else:
+                    self._replace(worker, InferenceTimeout(f"{call.op} took longer than {self.timeout:g}s"), "timeout")
+            elif call is None and now - worker.last_seen > self.health_interval:
+                with self._lock:
+                    if worker.call is None and worker in self._idle:
+                        self._idle.remove(worker)
+                        self._ping(worker)
+
+    def _replace(self, worker: _Worker, error: Optional[Exception], event: str):
+        logger.warning(f"Restarting inference worker {worker.index} ({event})")
+        INFERENCE_WORKER_EVENTS.labels(event).inc()
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        with self._lock:
+            call, worker.call = worker.call, None
+            if worker in self._idle:
+                self._idle.remove(worker)
+            self.restarts += 1
+            if self._closed:
+                return
+            self._spawn(worker)
+            # _spawn queued it as idle; give it waiting work straight away
+            if self._pending:
+                self._idle.remove(worker)
+                self._send_next(worker)
+        if call is not None:
+            self._release(call)
+            if error is not None:
+                self._fail(call, error)
+
+    @staticmethod
+    def _release(call: _Call):
+        if call.segment is not None:
+            call.segment.close()
+            call.segment.unlink()
+            call.segment = None
+
+    @staticmethod
+    def _fail(call: _Call, error: Exception):
+        if call.future is not None and not call.future.done():
+            call.future.set_exception(error)
+
+
+class InferenceClient:
+    """
+    Inference for the views: on the pool when there is one, else on the
+    in-process manager returned by ``manager_getter`` (looked up per call).
+    """
+
+    def __init__(self, pool: Optional[InferencePool], manager_getter: Callable):
+        self.pool = pool
+        self.manager_getter = manager_getter
+
+    @classmethod
+    def from_settings(cls, manager_getter: Callable) -> "InferenceClient":
+        from django.conf import settings
+        pool = None
+        if settings.INFERENCE_POOL_WORKERS > 0:
+            pool = InferencePool(settings.INFERENCE_POOL_WORKERS, slot_bytes=settings.INFERENCE_POOL_SLOT_BYTES,
+                                 timeout=settings.INFERENCE_TIMEOUT, health_interval=settings.INFERENCE_HEALTH_INTERVAL)
+        return cls(pool, manager_getter)
+
+    def call(self, op: str, *args, **kwargs):
+        """``manager.<op>(*args, **kwargs)``, blocking the calling thread"""
+        if self.pool is None:
+            return getattr(self.manager_getter(), op)(*args, **kwargs)
+        return self.pool.submit(op, *args, **kwargs).result()
+
+    async def acall(self, op: str, *args, **kwargs):
+        """``manager.<op>(*args, **kwargs)`` without blocking the event loop"""
+        if self.pool is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, lambda: self.call(op, *args, **kwargs))
+        return await asyncio.wrap_future(self.pool.submit(op, *args, **kwargs))
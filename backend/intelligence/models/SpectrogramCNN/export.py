@@ -0,0 +1,59 @@
+"""
+Export a reference spectrogram CNN as a SavedModel (and optionally TFLite).
+
+The weights are random unless --weights points at a Keras weights file; the
+artifact exists to exercise and benchmark the serving path
+(intelligence.models.SpectrogramCNN.serving) until a trained model ships.
+
+Run from backend/:
+    python -m intelligence.models.SpectrogramCNN.export --out DIR [--tflite] [--weights FILE]
+"""
+import os
+import argparse
+import logging
+from typing import Optional, Sequence
+
+from intelligence.dataset import CLASSES
+
+logger = logging.getLogger(__name__)
+
+SPECTROGRAM_SHAPE = (128, 256, 4)
+
+
+def build_model(input_shape: Sequence[int] = SPECTROGRAM_SHAPE, n_classes: int = len(CLASSES), seed: int = 0):
+    """Small strided CNN: three conv blocks, global pooling and a softmax head"""
+    import keras
+    keras.utils.set_random_seed(seed)
+    inputs = keras.Input(tuple(input_shape))
+    x = inputs
+    for filters in (16, 32, 64):
+        x = keras.layers.Conv2D(filters, 3, strides=2, padding="same", activation="relu")(x)
+    x = keras.layers.GlobalAveragePooling2D()(x)
+    outputs = keras.layers.Dense(n_classes, activation="softmax")(x)
+    return keras.Model(inputs, outputs, name="spectrogram_cnn")
+
+
+def export(out_dir: str, tflite: bool = False, weights: Optional[str] = None,
+           input_shape: Sequence[int] = SPECTROGRAM_SHAPE) -> str:
+    """Write ``out_dir`` (SavedModel) and with ``tflite`` also ``out_dir``.tflite; returns the served path"""
+    import tensorflow as tf
+    model = build_model(input_shape)
+    if weights:
+        model.load_weights(weights)
+    model.export(out_dir, verbose=False)
+    if not tflite:
+        return out_dir
+    tflite_path = out_dir.rstrip(os.sep) + ".tflite"
+    with open(tflite_path, "wb") as f:
+        f.write(tf.lite.TFLiteConverter.from_saved_model(out_dir).convert())
+    return tflite_path
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export the reference spectrogram CNN")
+    parser.add_argument("--out", required=True, help="SavedModel directory; the .tflite goes next to it")
+    parser.add_argument("--tflite", action="store_true")
+    parser.add_argument("--weights", default=None)
+    args = parser.parse_args()
+    logger.info(f"Exported {export(args.out, args.tflite, args.weights)}")
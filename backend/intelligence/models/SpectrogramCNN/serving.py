@@ -0,0 +1,241 @@
+"""
+Batched CPU serving of a spectrogram classifier.
+
+SpectrogramModel loads a SavedModel directory or a .tflite file once and warms
+it up at every batch size it will run. Single requests from many threads go
+through a micro-batcher: requests arriving within ``batch_window`` seconds, up
+to ``max_batch``, run as one batch. Batches are zero-padded to the next bucket
+(powers of two up to ``max_batch``), so the graph only ever sees those shapes:
+no retracing, and one XLA compilation each with ``jit_compile``.
+
+The input shape comes from the model's signature, so a model over the
+(4, 48, 112) preprocessed tensors is served like one over (128, 256, 4)
+spectrograms. The model must output class probabilities in ``classes`` order.
+
+Export a reference model (random weights, for benchmarks and smoke tests):
+    python -m intelligence.models.SpectrogramCNN.export --out DIR [--tflite]
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from intelligence.dataset import CLASSES
+from intelligence.storage import as_float32, load_array
+
+try:
+    from ai_edge_litert.interpreter import Interpreter as LiteInterpreter
+except ImportError:  # optional: fall back to TensorFlow's bundled interpreter
+    LiteInterpreter = None
+
+logger = logging.getLogger(__name__)
+
+MAX_BUCKET = 256
+
+
+def configure_threads(intra_op_threads: int = 0, inter_op_threads: int = 0):
+    """
+    Size TensorFlow's CPU thread pools (0 keeps TensorFlow's choice). Only
+    possible before the runtime starts, so it is done once, at model load.
+    """
+    import tensorflow as tf
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        logger.warning(f"TensorFlow thread pools already initialized, keeping them: {e}")
+
+
+class _SavedModelBackend:
+    def __init__(self, path: str, jit_compile: bool):
+        import tensorflow as tf
+        self._loaded = tf.saved_model.load(path)
+        signature = self._loaded.signatures["serving_default"]
+        (input_name, spec), = signature.structured_input_signature[1].items()
+        output_name = sorted(signature.structured_outputs)[0]
+        self.input_shape = tuple(spec.shape[1:])
+        self._fn = tf.function(lambda x: signature(**{input_name: x})[output_name],
+                               input_signature=[tf.TensorSpec((None,) + self.input_shape, tf.float32)],
+                               jit_compile=jit_compile)
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        return self._fn(batch).numpy()
+
+
+class _TFLiteBackend:
+    """One interpreter per batch size, each allocated once for that size"""
+
+    def __init__(self, path: str, threads: int):
+        self._path = path
+        self._threads = threads or None
+        detail = self._new().get_input_details()[0]
+        self.input_shape = tuple(int(d) for d in detail["shape"][1:])
+        self._interpreters = {}
+
+    def _new(self):
+        if LiteInterpreter is not None:
+            return LiteInterpreter(model_path=self._path, num_threads=self._threads)
+        import tensorflow as tf
+        return tf.lite.Interpreter(model_path=self._path, num_threads=self._threads)
+
+    def run(self, batch: np.ndarray) -> np.ndarray:
+        interpreter = self._interpreters.get(len(batch))
+        if interpreter is None:
+            interpreter = self._new()
+            interpreter.resize_tensor_input(interpreter.get_input_details()[0]["index"], batch.shape)
+            interpreter.allocate_tensors()
+            self._interpreters[len(batch)] = interpreter
+        interpreter.set_tensor(interpreter.get_input_details()[0]["index"], batch)
+        interpreter.invoke()
+        return interpreter.get_tensor(interpreter.get_output_details()[0]["index"]).copy()
+
+
+class SpectrogramModel:
+    """Spectrogram classifier served from a SavedModel or TFLite artifact; see the module docstring"""
+
+    def __init__(self, path: str, classes: Sequence[str] = CLASSES, max_batch: int = 16,
+                 batch_window: float = 0.002, intra_op_threads: int = 0, inter_op_threads: int = 0,
+                 jit_compile: bool = False, warmup: bool = True):
+        if not 0 < max_batch <= MAX_BUCKET:
+            raise ValueError(f"max_batch must be in 1..{MAX_BUCKET}")
+        start = time.perf_counter()
+        configure_threads(intra_op_threads, inter_op_threads)
+        if path.endswith(".tflite"):
+            self.backend = _TFLiteBackend(path, intra_op_threads)
+        else:
+            self.backend = _SavedModelBackend(path, jit_compile)
+        self.path = path
+        self.classes = list(classes)
+        self.input_shape = self.backend.input_shape
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.buckets = sorted({min(2 ** i, max_batch) for i in range(max_batch.bit_length() + 1)})
+        self._run_lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        logger.info(f"Loaded spectrogram model {path} (input {self.input_shape}) "
+                    f"in {time.perf_counter() - start:.2f}s")
+        if warmup:
+            self.warmup()
+
+    @classmethod
+    def from_settings(cls) -> Optional["SpectrogramModel"]:
+        """The model at settings.SPEC_MODEL_PATH, loaded and warmed up; None if unset or unloadable"""
+        from django.conf import settings
+        if not settings.SPEC_MODEL_PATH:
+            return None
+        try:
+            return cls(settings.SPEC_MODEL_PATH, max_batch=settings.SPEC_MODEL_MAX_BATCH,
+                       batch_window=settings.SPEC_MODEL_BATCH_WINDOW,
+                       intra_op_threads=settings.SPEC_MODEL_INTRA_OP_THREADS,
+                       inter_op_threads=settings.SPEC_MODEL_INTER_OP_THREADS,
+                       jit_compile=settings.SPEC_MODEL_JIT_COMPILE)
+        except Exception as e:
+            logger.error(f"Error loading spectrogram model {settings.SPEC_MODEL_PATH}: {e}")
+            return None
+
+    def warmup(self):
+        """Run every bucket once, so tracing and allocation happen before the first request"""
+        start = time.perf_counter()
+        for size in self.buckets:
+            self._run(np.zeros((size,) + self.input_shape, dtype=np.float32))
+        logger.info(f"Warmed up batch sizes {self.buckets} in {time.perf_counter() - start:.2f}s")
+
+    def _run(self, batch: np.ndarray) -> np.ndarray:
+        """Probabilities for a batch of at most max_batch inputs, padded to its bucket"""
+        n = len(batch)
+        size = next(b for b in self.buckets if b >= n)
+        if size != n:
+            batch = np.concatenate([batch, np.zeros((size - n,) + self.input_shape, dtype=np.float32)])
+        with self._run_lock:
+            return self.backend.run(batch)[:n]
+
+    def _check(self, spectrogram) -> np.ndarray:
+        spectrogram = as_float32(spectrogram)
+        if spectrogram.shape != self.input_shape:
+            raise ValueError(f"Expected input of shape {self.input_shape}, got {spectrogram.shape}")
+        return spectrogram
+
+    def predict_batch(self, spectrograms) -> np.ndarray:
+        """(n, classes) probabilities for a stack of inputs, run directly in max_batch slices"""
+        spectrograms = as_float32(spectrograms)
+        if spectrograms.shape[1:] != self.input_shape:
+            raise ValueError(f"Expected inputs of shape (n,) + {self.input_shape}, got {spectrograms.shape}")
+        parts = [self._run(spectrograms[i:i + self.max_batch]) for i in range(0, len(spectrograms), self.max_batch)]
+        return np.concatenate(parts) if parts else np.empty((0, len(self.classes)), dtype=np.float32)
+
+    # -- micro-batching --------------------------------------------------
+
+    def submit(self, spectrogram) -> Future:
+        """Queue one input for the next batch; the future resolves to its probabilities"""
+        future = Future()
+        self._queue.put((self._check(spectrogram), future))
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._serve, name="spectrogram-batcher", daemon=True)
+                    self._thread.start()
+        return future
+
+    def _serve(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            items = [item]
+            deadline = time.perf_counter() + self.batch_window
+            while len(items) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # finish this batch, then stop
+                    break
+                items.append(item)
+            live = [(x, f) for x, f in items if f.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                probabilities = self._run(np.stack([x for x, _ in live]))
+            except Exception as e:
+                for _, future in live:
+                    future.set_exception(e)
+                continue
+            for (_, future), row in zip(live, probabilities):
+                future.set_result(row)
+
+    def close(self):
+        """Stop the batcher thread after the queued requests"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    # -- request API -----------------------------------------------------
+
+    def result(self, probabilities: np.ndarray, input_type: str) -> Dict:
+        """Prediction dict in the shape XGBoostModelManager returns"""
+        index = int(np.argmax(probabilities))
+        return {
+            "predicted_class": self.classes[index],
+            "confidence": float(probabilities[index]),
+            "probabilities": {name: float(p) for name, p in zip(self.classes, probabilities)},
+            "input_type": input_type,
+        }
+
+    def predict(self, spectrogram, input_type: str = "spectrogram", timeout: Optional[float] = None) -> Dict:
+        """Classify one input, batched with concurrent requests"""
+        return self.result(self.submit(spectrogram).result(timeout), input_type)
+
+    def predict_file(self, path: str, timeout: Optional[float] = None) -> Dict:
+        """Classify a stored spectrogram (spec store .npy, either storage format)"""
+        return self.predict(load_array(path, mmap=True), input_type="spec_store", timeout=timeout)
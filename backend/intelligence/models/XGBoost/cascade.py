@@ -0,0 +1,130 @@
+"""
+Calibration and measurement of the cascade in XGBoostModelManager.predict.
+
+The screening stage runs the first ``rounds`` boosting rounds on the features
+those trees split on, and answers when its top probability reaches
+``threshold``; everything else goes to the full model. For each candidate
+number of rounds this picks the lowest threshold whose overall agreement with
+the full model (screened answers that match it, plus every escalated one) is
+at least --agreement. It then times predict per recording with that cascade
+and with the full model.
+
+Run from backend/:
+    python -m intelligence.models.XGBoost.cascade [--eeg-dir DIR] [--limit 2000] [--rounds 5 10 20 50]
+                                                  [--agreement 0.995] [--write]
+
+--write stores the fastest setting that meets the target as
+training_config.pkl['cascade']. The server uses it when XGBOOST_CASCADE=1.
+"""
+import os
+import argparse
+import logging
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import xgboost as xgb
+
+from intelligence.dataset import EEG_DIR, list_ids
+from intelligence.storage import load_array
+from .train import MODEL_DIR, _dump
+from .xgboost import XGBoostModelManager, compile_feature_plan
+
+logger = logging.getLogger(__name__)
+
+NEVER = 1.01  # a threshold no probability reaches: always escalate
+
+
+def calibrate(screen_probs: np.ndarray, full_classes: np.ndarray, agreement: float) -> Tuple[float, float, float]:
+    """
+    Lowest threshold on the screen's top probability whose overall agreement
+    with ``full_classes`` is at least ``agreement``. Returns (threshold,
+    fraction screened, overall agreement).
+    """
+    n = len(full_classes)
+    confidence = screen_probs.max(axis=1)
+    wrong = screen_probs.argmax(axis=1) != full_classes
+    order = np.argsort(-confidence, kind="stable")
+    confidence, wrong = confidence[order], wrong[order]
+    errors = np.cumsum(wrong)  # disagreements if the first m + 1 are screened
+    allowed = np.floor((1 - agreement) * n + 1e-9)
+    # "confidence >= t" screens every tie, so only cut between distinct values
+    cut = np.append(confidence[1:] != confidence[:-1], True)
+    ok = np.flatnonzero(cut & (errors <= allowed))
+    if not len(ok):
+        return NEVER, 0.0, 1.0
+    m = ok[-1] + 1
+    return float(confidence[m - 1]), m / n, float(1 - errors[m - 1] / n)
+
+
+def time_predict(manager: XGBoostModelManager, recordings: Sequence[np.ndarray], cascade) -> float:
+    """Mean seconds per manager.predict over ``recordings`` with the given cascade setting"""
+    previous, manager.cascade = manager.cascade, cascade
+    try:
+        manager.predict(recordings[0])
+        start = time.perf_counter()
+        for eeg in recordings:
+            manager.predict(eeg)
+        return (time.perf_counter() - start) / len(recordings)
+    finally:
+        manager.cascade = previous
+
+
+def evaluate(manager: XGBoostModelManager, recordings: Sequence[np.ndarray], rounds: Sequence[int],
+             agreement: float = 0.995, timed: int = 200) -> List[Dict]:
+    """One row per candidate number of screening rounds; see the module docstring"""
+    features = np.stack([manager.extract_features(eeg) for eeg in recordings])
+    dmatrix = xgb.DMatrix(features)
+    full_classes = manager.model.predict(dmatrix).argmax(axis=1)
+    sample = list(recordings[:timed])
+    full_time = time_predict(manager, sample, None)
+    total_rounds = manager.model.num_boosted_rounds()
+
+    rows = []
+    for k in rounds:
+        if not 0 < k < total_rounds:
+            continue
+        screen = manager.model.predict(dmatrix, iteration_range=(0, k))
+        threshold, screened, agreed = calibrate(screen, full_classes, agreement)
+        cascade = {'rounds': k, 'threshold': threshold}
+        cascade_time = time_predict(manager, sample, cascade)
+        features_used = len(compile_feature_plan(manager.model[:k]))
+        rows.append({**cascade, 'features': features_used, 'screened': screened, 'agreement': agreed, 'cascade_ms': cascade_time * 1e3,
+                     'full_ms': full_time * 1e3, 'speedup': full_time / cascade_time})
+    return rows
+
+
+def print_rows(rows: List[Dict], total_rounds: int):
+    print(f"{'rounds':>7}{'features':>9}{'threshold':>11}{'screened':>10}{'agreement':>11}{'cascade ms':>12}{'full ms':>9}"
+          f"{'speedup':>9}   (of {total_rounds} rounds)")
+    for row in rows:
+        print(f"{row['rounds']:>7}{row['features']:>9}{row['threshold']:>11.4f}{row['screened']:>10.1%}{row['agreement']:>11.2%}"
+              f"{row['cascade_ms']:>12.3f}{row['full_ms']:>9.3f}{row['speedup']:>8.2f}x")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Calibrate the XGBoost prediction cascade")
+    parser.add_argument("--eeg-dir", default=EEG_DIR)
+    parser.add_argument("--limit", type=int, default=2000, help="recordings to calibrate on")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[5, 10, 20, 50])
+    parser.add_argument("--agreement", type=float, default=0.995, help="required agreement with the full model")
+    parser.add_argument("--write", action="store_true", help="store the fastest passing setting in the config")
+    args = parser.parse_args()
+
+    manager = XGBoostModelManager()
+    if not manager.is_loaded:
+        raise SystemExit("xgboost_model.pkl could not be loaded")
+    ids = list_ids(("eeg",), {"eeg": args.eeg_dir})[:args.limit]
+    recordings = [load_array(os.path.join(args.eeg_dir, f"{i}.npy")) for i in ids]
+    rows = evaluate(manager, recordings, args.rounds, args.agreement)
+    print_rows(rows, manager.model.num_boosted_rounds())
+
+    best = max((r for r in rows if r['screened'] > 0), key=lambda r: r['speedup'], default=None)
+    if args.write:
+        if best is None or best['speedup'] <= 1:
+            raise SystemExit("No cascade setting is faster than the full model; config left unchanged")
+        config = {**manager.config, 'cascade': {'rounds': best['rounds'], 'threshold': best['threshold'],
+                                               'agreement': best['agreement'], 'screened': best['screened']}}
+        _dump(config, os.path.join(MODEL_DIR, 'training_config.pkl'))
+        logger.info(f"Stored cascade {config['cascade']}; enable it with XGBOOST_CASCADE=1")
@@ -0,0 +1,231 @@
+"""
+Reproducible, out-of-core training for the XGBoost EEG classifier.
+
+Run from backend/:
+    python -m intelligence.models.XGBoost.train --labels train.csv [--rounds 300] [--continue]
+
+Features come from the feature store (filled in parallel for any recording that
+is missing or stale), and are streamed to XGBoost in batches through a
+``DataIter``, so only one batch of features is ever resident; XGBoost keeps its
+quantized pages in an on-disk cache. Expert votes are used as soft labels: each
+recording contributes one row per voted class, weighted by that class's vote
+share, which makes mlogloss the cross-entropy against the vote distribution.
+
+Writes xgboost_model.pkl, label_encoder.pkl and training_config.pkl in the
+layout XGBoostModelManager.load_model reads. The new config has no cascade,
+since the old one was calibrated for the previous booster; run cascade.py
+--write to calibrate one for the new model.
+"""
+import os
+import argparse
+import logging
+import pickle
+import resource
+import shutil
+import tempfile
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import xgboost as xgb
+
+from intelligence.dataset import CLASSES, EEG_DIR, list_ids, load_vote_labels
+from intelligence.feature_store import DEFAULT_ROOT, FeatureStore
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.path.dirname(__file__)
+
+
+class FeatureStoreIter(xgb.DataIter):
+    """Feeds (features, class, vote weight) batches from a FeatureStore to XGBoost"""
+
+    def __init__(self, store: FeatureStore, ids: Sequence[str], labels: Dict[str, np.ndarray],
+                 class_index: np.ndarray, batch_size: int, cache_prefix: str):
+        self.store = store
+        self.ids = list(ids)
+        self.labels = labels
+        self.class_index = class_index
+        self.batch_size = batch_size
+        self._position = 0
+        self.n_rows = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data) -> bool:
+        while self._position < len(self.ids):
+            batch_ids = self.ids[self._position:self._position + self.batch_size]
+            self._position += self.batch_size
+            X, found = self.store.get_many(batch_ids)
+            if not found.any():
+                continue
+            X = X[found]
+            votes = np.stack([self.labels[i] for i, ok in zip(batch_ids, found) if ok])
+
+            # One row per (recording, voted class), weighted by the vote share
+            rec, cls = np.nonzero(votes)
+            input_data(data=X[rec], label=self.class_index[cls].astype(np.float32), weight=votes[rec, cls])
+            self.n_rows += len(rec)
+            return True
+        return False
+
+    def reset(self):
+        self._position = 0
+        self.n_rows = 0
+
+
+def _quantile_matrix(iterator: FeatureStoreIter, max_bin: int, ref=None):
+    if hasattr(xgb, "ExtMemQuantileDMatrix"):
+        return xgb.ExtMemQuantileDMatrix(iterator, max_bin=max_bin, ref=ref)
+    # xgboost < 3.0: page-based external memory DMatrix
+    return xgb.DMatrix(iterator)
+
+
+def _evaluate(booster, store: FeatureStore, ids: Sequence[str], labels: Dict[str, np.ndarray],
+              class_index: np.ndarray, batch_size: int) -> Dict[str, float]:
+    """Accuracy against the majority vote and mean KL(votes || prediction)"""
+    correct, kl_sum, count = 0, 0.0, 0
+    for start in range(0, len(ids), batch_size):
+        batch_ids = ids[start:start + batch_size]
+        X, found = store.get_many(batch_ids)
+        if not found.any():
+            continue
+        probs = booster.predict(xgb.DMatrix(X[found]))
+        votes = np.stack([labels[i] for i, ok in zip(batch_ids, found) if ok])
+        # Reorder vote columns into the model's (label encoder) class order
+        target = np.zeros_like(probs)
+        target[:, class_index] = votes
+        correct += int(np.sum(probs.argmax(axis=1) == target.argmax(axis=1)))
+        mask = target > 0
+        kl_sum += float(np.sum(target[mask] * np.log(target[mask] / np.clip(probs[mask], 1e-15, 1))))
+        count += len(probs)
+    if not count:
+        return {"accuracy": float("nan"), "kl_divergence": float("nan")}
+    return {"accuracy": correct / count, "kl_divergence": kl_sum / count}
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident set of this process and its (feature-extraction) children, in MB"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024  # ru_maxrss is in KiB on Linux
+
+
+def _dump(obj, path):
+    """Pickle atomically so a running server never loads a half-written artifact"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def train(labels_csv: str, store_dir: str = DEFAULT_ROOT, eeg_dir: str = EEG_DIR,
+          output_dir: str = MODEL_DIR, rounds: int = 300, continue_training: bool = False,
+          batch_size: int = 4096, val_fraction: float = 0.2, seed: int = 42,
+          workers: Optional[int] = None, max_bin: int = 256) -> Dict:
+    """Train (or continue training) the booster and write its artifacts; returns the run report"""
+    start = time.perf_counter()
+
+    with open(os.path.join(MODEL_DIR, 'label_encoder.pkl'), 'rb') as f:
+        label_encoder = pickle.load(f)
+    with open(os.path.join(MODEL_DIR, 'training_config.pkl'), 'rb') as f:
+        config = pickle.load(f)
+    # Vote columns are in CLASSES order; the booster's outputs follow the label encoder
+    class_index = label_encoder.transform(CLASSES)
+
+    labels = load_vote_labels(labels_csv)
+    ids = [i for i in list_ids(("eeg",), {"eeg": eeg_dir}) if i in labels]
+    store = FeatureStore(store_dir)
+    store.populate(ids, eeg_dir=eeg_dir, workers=workers)
+    feature_time = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(ids))
+    n_val = int(len(ids) * val_fraction)
+    val_ids = [ids[i] for i in order[:n_val]]
+    train_ids = [ids[i] for i in order[n_val:]]
+
+    params = dict(config['model_params'])
+    params['tree_method'] = 'hist'
+    params['nthread'] = os.cpu_count() if params.get('nthread', -1) in (None, -1) else params['nthread']
+    params['seed'] = params.pop('random_state', seed)
+
+    init_model = None
+    model_path = os.path.join(output_dir, 'xgboost_model.pkl')
+    if continue_training:
+        with open(model_path, 'rb') as f:
+            init_model = pickle.load(f)
+        logger.info(f"Continuing from booster with {init_model.num_boosted_rounds()} rounds")
+
+    cache_dir = tempfile.mkdtemp(prefix="xgb-extmem-")
+    try:
+        train_iter = FeatureStoreIter(store, train_ids, labels, class_index, batch_size,
+                                      os.path.join(cache_dir, "train"))
+        dtrain = _quantile_matrix(train_iter, max_bin)
+        evals = [(dtrain, "train")]
+        if val_ids:
+            val_iter = FeatureStoreIter(store, val_ids, labels, class_index, batch_size,
+                                        os.path.join(cache_dir, "val"))
+            dval = _quantile_matrix(val_iter, max_bin, ref=dtrain)
+            evals.append((dval, "val"))
+
+        booster = xgb.train(params, dtrain, num_boost_round=rounds, evals=evals,
+                            xgb_model=init_model, verbose_eval=25)
+    finally:
+        # Matrices delete their cache pages when freed, so free them before the directory goes
+        evals = dtrain = dval = None
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    train_metrics = _evaluate(booster, store, train_ids, labels, class_index, batch_size)
+    val_metrics = _evaluate(booster, store, val_ids, labels, class_index, batch_size)
+
+    os.makedirs(output_dir, exist_ok=True)
+    if config.pop('cascade', None) is not None:
+        # Calibrated against the previous booster; rerun cascade.py --write for this one
+        logger.info("Dropping the cascade calibrated for the previous booster")
+    config = {
+        **config,
+        'train_accuracy': train_metrics['accuracy'],
+        'val_accuracy': val_metrics['accuracy'],
+        'val_kl_divergence': val_metrics['kl_divergence'],
+        'n_train_samples': len(train_ids),
+        'n_val_samples': len(val_ids),
+        'num_boosted_rounds': booster.num_boosted_rounds(),
+    }
+    _dump(booster, model_path)
+    _dump(label_encoder, os.path.join(output_dir, 'label_encoder.pkl'))
+    _dump(config, os.path.join(output_dir, 'training_config.pkl'))
+
+    report = {
+        "wall_time_s": time.perf_counter() - start,
+        "feature_time_s": feature_time,
+        "peak_rss_mb": _peak_rss_mb(),
+        "rounds": booster.num_boosted_rounds(),
+        "train": train_metrics,
+        "val": val_metrics,
+    }
+    logger.info(f"Training report: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Train the XGBoost EEG classifier from the feature store")
+    parser.add_argument("--labels", required=True, help="CSV with eeg_id and *_vote columns (HMS train.csv)")
+    parser.add_argument("--store", default=DEFAULT_ROOT)
+    parser.add_argument("--eeg-dir", default=EEG_DIR)
+    parser.add_argument("--output-dir", default=MODEL_DIR)
+    parser.add_argument("--rounds", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=None, help="feature extraction processes")
+    parser.add_argument("--continue", dest="continue_training", action="store_true",
+                        help="add rounds on top of the xgboost_model.pkl in --output-dir")
+    args = parser.parse_args()
+
+    report = train(args.labels, store_dir=args.store, eeg_dir=args.eeg_dir, output_dir=args.output_dir,
+                   rounds=args.rounds, continue_training=args.continue_training,
+                   batch_size=args.batch_size, val_fraction=args.val_fraction, workers=args.workers)
+    print(f"Wall time: {report['wall_time_s']:.1f}s (features {report['feature_time_s']:.1f}s)")
+    print(f"Peak RSS: {report['peak_rss_mb']:.0f} MB")
+    print(f"Rounds: {report['rounds']}  val accuracy: {report['val']['accuracy']:.4f}  "
+          f"val KL: {report['val']['kl_divergence']:.4f}")
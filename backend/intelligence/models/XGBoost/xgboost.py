@@ -1,24 +1,112 @@
 import pickle
 import numpy as np
 import pandas as pd
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 import logging
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 import os
+import time
 from scipy.stats import entropy
+from intelligence.storage import load_array
+from hms_backend.metrics import PREDICT_CASCADE, PREDICT_STAGE_SECONDS
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever extract_features changes its output; cached feature rows
+# written under an older version are treated as stale and recomputed.
+FEATURE_EXTRACTOR_VERSION = 2
+
+# Bound once: labels() is a dict lookup that the predict path need not repeat
+_STAGE_LOAD = PREDICT_STAGE_SECONDS.labels("load")
+_STAGE_FEATURES = PREDICT_STAGE_SECONDS.labels("features")
+_STAGE_DMATRIX = PREDICT_STAGE_SECONDS.labels("dmatrix")
+_STAGE_BOOSTER = PREDICT_STAGE_SECONDS.labels("booster")
+_CASCADE_SCREEN = PREDICT_CASCADE.labels("screen")
+_CASCADE_FULL = PREDICT_CASCADE.labels("full")
+
+# extract_features output layout: stat-major per-channel statistics
+# (CHANNEL_STATS[s] of channel ch is feature s * 19 + ch), then the global ones
+CHANNEL_STATS = ['mean', 'std', 'var', 'median', 'min', 'max', 'q25', 'q75',
+                 'sum_abs', 'sum_sq', 'abs_mean', 'rms', 'entropy']
+GLOBAL_FEATURES = ['global_mean', 'global_std', 'global_var', 'mean_corr']
+N_CHANNELS = 19
+
+
+class FeaturePlan:
+    """
+    The subset of extract_features outputs to compute, by feature index:
+    which statistics and which channels. Global features need every channel.
+    """
+
+    def __init__(self, indices: Optional[Sequence[int]] = None):
+        n_channel_features = len(CHANNEL_STATS) * N_CHANNELS
+        used = np.zeros(n_channel_features + len(GLOBAL_FEATURES), dtype=bool)
+        used[slice(None) if indices is None else list(indices)] = True
+        self.indices = np.flatnonzero(used)
+        per_channel = used[:n_channel_features].reshape(len(CHANNEL_STATS), N_CHANNELS)
+        self._needed = {stat for stat, row in zip(CHANNEL_STATS, per_channel) if row.any()}
+        self._needed.update(name for name, u in zip(GLOBAL_FEATURES, used[n_channel_features:]) if u)
+        if used[n_channel_features:].any() or per_channel.any(axis=0).all():
+            self.rows = None  # every channel, no row selection
+            self.channels = np.arange(N_CHANNELS)
+        else:
+            self.rows = self.channels = np.flatnonzero(per_channel.any(axis=0))
+        self.is_full = bool(used.all())
+
+    def needs(self, *names: str) -> bool:
+        return not self._needed.isdisjoint(names)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+FULL_PLAN = FeaturePlan()
+
+
+def compile_feature_plan(model) -> FeaturePlan:
+    """
+    Plan for the features ``model``'s trees split on, read from the booster's
+    split counts; the full plan if they cannot be read.
+    """
+    try:
+        booster = model.get_booster() if hasattr(model, "get_booster") else model
+        n_features = len(CHANNEL_STATS) * N_CHANNELS + len(GLOBAL_FEATURES)
+        if booster.num_features() != n_features:
+            return FULL_PLAN
+        names = booster.feature_names or [f"f{i}" for i in range(n_features)]
+        position = {name: i for i, name in enumerate(names)}
+        return FeaturePlan([position[name] for name in booster.get_score(importance_type="weight")])
+    except Exception as e:
+        logger.warning(f"Could not read the features the model splits on, computing all of them: {e}")
+        return FULL_PLAN
+
+
+def cascade_enabled() -> bool:
+    """settings.XGBOOST_CASCADE; off when Django is not configured (offline tools)"""
+    try:
+        return settings.XGBOOST_CASCADE
+    except ImproperlyConfigured:
+        return False
+
+
 class XGBoostModelManager:
     """Manages XGBoost model loading and predictions"""
     
-    def __init__(self):
+    def __init__(self, load: bool = True):
         self.model = None
         self.label_encoder = None
         self.config = None
-        self.feature_names = None
+        # Size and mtime of the loaded model file, for caches of its predictions
+        self.version: Optional[str] = None
+        self.feature_names = self._generate_feature_names()
         self.is_loaded = False
-        self.load_model()
+        self._plan, self._plan_model = FULL_PLAN, None
+        # {"rounds": screening trees per class, "threshold": confidence to answer early}
+        self.cascade: Optional[Dict] = None
+        self._screen_plans, self._screen_model, self._screen_rounds = (FULL_PLAN, FeaturePlan([])), None, None
+        if load:
+            self.load_model()
     
     def load_model(self):
         """Load the trained XGBoost model and associated files"""
@@ -29,6 +117,8 @@ class XGBoostModelManager:
             model_path = os.path.join(model_dir, 'xgboost_model.pkl')
             with open(model_path, 'rb') as f:
                 self.model = pickle.load(f)
+                st = os.fstat(f.fileno())
+            self.version = f"{st.st_size}:{st.st_mtime_ns}"
             
             # Load label encoder
             encoder_path = os.path.join(model_dir, 'label_encoder.pkl')
@@ -42,6 +132,7 @@ class XGBoostModelManager:
             
             # Generate feature names
             self.feature_names = self._generate_feature_names()
+            self.cascade = self.config.get('cascade') if cascade_enabled() else None
             
             self.is_loaded = True
             logger.info("XGBoost model loaded successfully")
@@ -53,16 +144,14 @@ class XGBoostModelManager:
     def _generate_feature_names(self) -> List[str]:
         """Generate feature names matching the training process"""
         names = []
-        stats = ['mean', 'std', 'var', 'median', 'min', 'max', 'q25', 'q75', 
-                'sum_abs', 'sum_sq', 'abs_mean', 'rms', 'entropy']
         
         # Channel-specific features (19 channels)
-        for ch in range(19):
-            for stat in stats:
+        for ch in range(N_CHANNELS):
+            for stat in CHANNEL_STATS:
                 names.append(f'ch{ch}_{stat}')
         
         # Global features
-        names.extend(['global_mean', 'global_std', 'global_var', 'mean_corr'])
+        names.extend(GLOBAL_FEATURES)
         return names
     
     def predict_from_single_values(self, eeg_values: np.ndarray) -> Dict:
@@ -81,25 +170,29 @@ class XGBoostModelManager:
             
             # For single values, we need to create meaningful features
             # Since we don't have time series, we'll create features based on the values themselves
+            start = time.perf_counter()
             features = self.extract_features_from_single_values(eeg_values)
+            _STAGE_FEATURES.observe(time.perf_counter() - start)
             
             if features is None:
                 return {"error": "Feature extraction failed"}
             
             # Make prediction
             import xgboost as xgb
+            start = time.perf_counter()
             dtest = xgb.DMatrix(features.reshape(1, -1))
+            built = time.perf_counter()
             probabilities = self.model.predict(dtest)[0]
+            _STAGE_DMATRIX.observe(built - start)
+            _STAGE_BOOSTER.observe(time.perf_counter() - built)
             
             # Get predicted class
             predicted_class_idx = np.argmax(probabilities)
-            print("Probabilities:", probabilities)
-            print("Argmax index:", np.argmax(probabilities))
-            print("Predicted:", predicted_class)
-            print("Expected (manual max):", max(class_probabilities, key=class_probabilities.get))
-
             predicted_class = self.label_encoder.inverse_transform([predicted_class_idx])[0]
-            print("Inverse transform classes:", self.label_encoder.classes_)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Probabilities: {probabilities}, argmax index: {predicted_class_idx}, "
+                             f"predicted: {predicted_class}, encoder classes: {self.label_encoder.classes_}")
+            
             # Format results
             class_probabilities = {}
             for i, class_name in enumerate(self.config['classes']):
@@ -168,61 +261,143 @@ class XGBoostModelManager:
             logger.error(f"Error extracting features from single values: {e}")
             return None
     
-    def extract_features(self, eeg_data: np.ndarray) -> Optional[np.ndarray]:
-        """Extract features from EEG data (same as training)"""
+    def extract_features(self, eeg_data: np.ndarray, dtype=np.float32,
+                         plan: Optional["FeaturePlan"] = None) -> Optional[np.ndarray]:
+        """
+        Extract features from EEG data (same as training)
+        
+        Standardization and the moment features (means, variances, energies)
+        stay in float64: after standardization the means are pure rounding
+        residue (~1e-17) that the model was trained on, and float32 would
+        inflate it to ~1e-8. The sort-based statistics, entropy and the
+        correlation matrix run in ``dtype`` (float32 by default).
+        
+        With a ``plan`` only the planned statistics are computed, on the
+        planned channels; the other entries are NaN placeholders. Every row
+        reduction is per channel, so computed values are bit-identical to the
+        full extraction.
+        """
         try:
             # Validate input
             if eeg_data.shape[0] != 19:
                 raise ValueError(f"Expected 19 channels, got {eeg_data.shape[0]}")
+            plan = FULL_PLAN if plan is None else plan
+            
+            # Private working copy: cleaning and standardization happen in place
+            acc = np.float64
+            standardized = np.array(eeg_data if plan.rows is None else eeg_data[plan.rows], dtype=acc)
             
             # Handle NaN/Inf values
-            if np.any(~np.isfinite(eeg_data)):
-                eeg_data = self._clean_data(eeg_data)
+            if not np.isfinite(standardized).all():
+                standardized = self._clean_data(standardized)
             
             # Standardize each channel
-            channel_means = np.mean(eeg_data, axis=1, keepdims=True)
-            channel_stds = np.std(eeg_data, axis=1, keepdims=True) + 1e-7
-            eeg_data = (eeg_data - channel_means) / channel_stds
-            
-            # Extract features (same as training)
-            features = []
+            channel_means = np.mean(standardized, axis=1, keepdims=True)
+            channel_stds = np.std(standardized, axis=1, keepdims=True) + 1e-7
+            standardized -= channel_means
+            standardized /= channel_stds
+            eeg_data = standardized.astype(dtype, copy=False)
+            
+            # Extract features (same as training), stat-major: feature s * 19 + ch
+            features = np.full(len(self.feature_names), np.nan, dtype=np.float32)
+            channels = plan.channels
+            
+            def put(stat, values):
+                features[CHANNEL_STATS.index(stat) * 19 + channels] = values
+            
+            n_samples = standardized.shape[1]
+            if plan.needs('mean', 'abs_mean'):
+                channel_mean = np.mean(standardized, axis=1)
+            if plan.needs('sum_sq', 'rms'):
+                sum_sq = np.einsum('ij,ij->i', standardized, standardized)
+            
+            # One sort per channel serves median, min, max and both quartiles
+            # (np.percentile on sorted rows returns the same values, cheaply)
+            if plan.needs('median', 'min', 'max', 'q25', 'q75'):
+                sorted_data = np.sort(eeg_data, axis=1)
+                half = n_samples // 2
+                if plan.needs('median'):
+                    if n_samples % 2:
+                        put('median', sorted_data[:, half])
+                    else:
+                        put('median', (sorted_data[:, half - 1] + sorted_data[:, half]) / 2)
+                if plan.needs('min'):
+                    put('min', sorted_data[:, 0])
+                if plan.needs('max'):
+                    put('max', sorted_data[:, -1])
+                if plan.needs('q25', 'q75'):
+                    q25, q75 = np.percentile(sorted_data, [25, 75], axis=1)
+                    put('q25', q25)
+                    put('q75', q75)
             
             # Time domain features
-            features.extend(np.mean(eeg_data, axis=1))
-            features.extend(np.std(eeg_data, axis=1))
-            features.extend(np.var(eeg_data, axis=1))
-            features.extend(np.median(eeg_data, axis=1))
-            features.extend(np.min(eeg_data, axis=1))
-            features.extend(np.max(eeg_data, axis=1))
-            features.extend(np.percentile(eeg_data, 25, axis=1))
-            features.extend(np.percentile(eeg_data, 75, axis=1))
-            features.extend(np.sum(np.abs(eeg_data), axis=1))
-            features.extend(np.sum(eeg_data**2, axis=1))
-            features.extend(np.abs(np.mean(eeg_data, axis=1)))
-            features.extend(np.sqrt(np.mean(eeg_data**2, axis=1)))
+            if plan.needs('mean'):
+                put('mean', channel_mean)
+            if plan.needs('std'):
+                put('std', np.std(standardized, axis=1))
+            if plan.needs('var'):
+                put('var', np.var(standardized, axis=1))
+            if plan.needs('sum_abs', 'entropy'):
+                abs_data = np.abs(eeg_data)
+                if plan.needs('sum_abs'):
+                    put('sum_abs', np.sum(abs_data, axis=1, dtype=acc))
+            if plan.needs('sum_sq'):
+                put('sum_sq', sum_sq)
+            if plan.needs('abs_mean'):
+                put('abs_mean', np.abs(channel_mean))
+            if plan.needs('rms'):
+                put('rms', np.sqrt(sum_sq / n_samples))
             
             # Entropy features
-            for ch in range(19):
+            if plan.needs('entropy'):
                 try:
-                    channel_data = np.abs(eeg_data[ch, :]) + 1e-10
-                    features.append(entropy(channel_data))
+                    abs_data += dtype(1e-10)
+                    put('entropy', entropy(abs_data, axis=1))
                 except:
-                    features.append(0.0)
+                    put('entropy', 0.0)
             
-            # Cross-channel features
-            features.extend([
-                np.mean(eeg_data),
-                np.std(eeg_data),
-                np.var(eeg_data),
-                np.mean(np.corrcoef(eeg_data))
-            ])
+            # Cross-channel features (the plan keeps every channel for these)
+            n_channel_features = len(CHANNEL_STATS) * 19
+            if plan.needs('global_mean'):
+                features[n_channel_features] = np.mean(standardized)
+            if plan.needs('global_std'):
+                features[n_channel_features + 1] = np.std(standardized)
+            if plan.needs('global_var'):
+                features[n_channel_features + 2] = np.var(standardized)
+            if plan.needs('mean_corr'):
+                features[n_channel_features + 3] = np.mean(np.corrcoef(eeg_data, dtype=dtype), dtype=acc)
             
-            return np.array(features, dtype=np.float32)
+            return features
             
         except Exception as e:
             logger.error(f"Error extracting features: {e}")
             return None
     
+    def feature_plan(self) -> FeaturePlan:
+        """Plan for the features the current model uses, compiled once per model object"""
+        if self._plan_model is not self.model:
+            self._plan = compile_feature_plan(self.model) if self.model is not None else FULL_PLAN
+            self._plan_model = self.model
+            logger.info(f"Feature plan: {len(self._plan)}/{len(self.feature_names)} features")
+        return self._plan
+    
+    def screen_plans(self) -> Tuple[FeaturePlan, FeaturePlan]:
+        """
+        Plans for the cascade: the features its screening rounds use, and the
+        rest of the full model's features, computed only on escalation
+        """
+        rounds = self.cascade['rounds']
+        if self._screen_model is not self.model or self._screen_rounds != rounds:
+            try:
+                screen = compile_feature_plan(self.model[:rounds])
+            except Exception as e:
+                logger.warning(f"Could not slice the booster for the cascade, screening with all features: {e}")
+                screen = FULL_PLAN
+            rest = FeaturePlan(np.setdiff1d(self.feature_plan().indices, screen.indices))
+            self._screen_plans = (screen, rest)
+            self._screen_model, self._screen_rounds = self.model, rounds
+        return self._screen_plans
+    
     def _clean_data(self, eeg_data: np.ndarray) -> np.ndarray:
         """Clean NaN/Inf values"""
         for ch in range(eeg_data.shape[0]):
@@ -246,18 +421,77 @@ class XGBoostModelManager:
             if eeg_data.ndim == 1 and len(eeg_data) == 19:
                 return self.predict_from_single_values(eeg_data)
             
-            # Extract features from time series data
-            features = self.extract_features(eeg_data)
+            if self.cascade:
+                return self._predict_cascade(eeg_data)
+            
+            # Extract features from time series data, only those the model splits on
+            start = time.perf_counter()
+            features = self.extract_features(eeg_data, plan=self.feature_plan())
+            _STAGE_FEATURES.observe(time.perf_counter() - start)
             if features is None:
                 return {"error": "Feature extraction failed"}
             
+            return self.predict_features(features, input_type="time_series")
+            
+        except Exception as e:
+            logger.error(f"Prediction error: {e}")
+            return {"error": str(e)}
+    
+    def _predict_cascade(self, eeg_data: np.ndarray) -> Dict:
+        """
+        Screen with the first ``rounds`` trees on the features they use; answer
+        if the screen is confident enough, else compute the remaining features
+        and run the full model. The result carries ``stage``: "screen" or "full".
+        """
+        screen_plan, rest_plan = self.screen_plans()
+        start = time.perf_counter()
+        features = self.extract_features(eeg_data, plan=screen_plan)
+        _STAGE_FEATURES.observe(time.perf_counter() - start)
+        if features is None:
+            return {"error": "Feature extraction failed"}
+        result = self.predict_features(features, input_type="time_series",
+                                       iteration_range=(0, self.cascade['rounds']))
+        if "error" in result:
+            return result
+        if result["confidence"] >= self.cascade['threshold']:
+            _CASCADE_SCREEN.inc()
+            return {**result, "stage": "screen"}
+        
+        if len(rest_plan):
+            # Planned values are bit-identical, so the screen's features are reused as they are
+            start = time.perf_counter()
+            rest = self.extract_features(eeg_data, plan=rest_plan)
+            _STAGE_FEATURES.observe(time.perf_counter() - start)
+            if rest is None:
+                return {"error": "Feature extraction failed"}
+            features[rest_plan.indices] = rest[rest_plan.indices]
+        _CASCADE_FULL.inc()
+        return {**self.predict_features(features, input_type="time_series"), "stage": "full"}
+    
+    def predict_features(self, features: np.ndarray, input_type: str = "features",
+                         iteration_range: Tuple[int, int] = (0, 0)) -> Dict:
+        """
+        Make prediction from an already extracted feature vector; a non-default
+        ``iteration_range`` uses only those boosting rounds
+        """
+        if not self.is_loaded:
+            return {"error": "Model not loaded"}
+        
+        try:
             # Reshape for prediction
-            features = features.reshape(1, -1)
+            features = np.asarray(features).reshape(1, -1)
             
             # Make prediction
             import xgboost as xgb
+            start = time.perf_counter()
             dtest = xgb.DMatrix(features)
-            probabilities = self.model.predict(dtest)[0]
+            built = time.perf_counter()
+            if iteration_range == (0, 0):
+                probabilities = self.model.predict(dtest)[0]
+            else:
+                probabilities = self.model.predict(dtest, iteration_range=iteration_range)[0]
+            _STAGE_DMATRIX.observe(built - start)
+            _STAGE_BOOSTER.observe(time.perf_counter() - built)
             
             # Get predicted class
             predicted_class_idx = np.argmax(probabilities)
@@ -273,7 +507,7 @@ class XGBoostModelManager:
                 "confidence": float(probabilities[predicted_class_idx]),
                 "probabilities": class_probabilities,
                 "feature_count": len(features[0]),
-                "input_type": "time_series"
+                "input_type": input_type
             }
             
         except Exception as e:
@@ -283,7 +517,9 @@ class XGBoostModelManager:
     def predict_from_file(self, file_path: str) -> Dict:
         """Make prediction from uploaded .npy file"""
         try:
-            eeg_data = np.load(file_path)
+            start = time.perf_counter()
+            eeg_data = load_array(file_path)
+            _STAGE_LOAD.observe(time.perf_counter() - start)
             return self.predict(eeg_data)
         except Exception as e:
             logger.error(f"Error loading file {file_path}: {e}")
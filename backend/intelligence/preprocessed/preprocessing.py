@@ -93,8 +93,10 @@ def compute_eeg_chain(df):
     rl = [pair(eeg[1], eeg[8]), pair(eeg[8], eeg[14]), pair(eeg[14], eeg[16]), pair(eeg[16], eeg[18])]
     mid = [pair(eeg[2], eeg[3]), pair(eeg[3], eeg[4])]
 
-    chains = np.stack([ll, lp, rp, rl])
-    mid = np.stack(mid)
+    # Filtering runs in float64 (IIR precision); everything downstream is float32
+    chains = np.stack([ll, lp, rp, rl]).astype(np.float32)
+    mid = np.stack(mid).astype(np.float32)
+    ekg = ekg.astype(np.float32)
     
     return chains, mid, ekg
 def proc_eeg(eeg, mid, ekg):
@@ -190,72 +192,74 @@ import os
 import numpy as np
 from tqdm import tqdm
 import polars as pl
+from intelligence.storage import save_array
 
-# Config
-SAVE_DIR = os.path.join(BASE_PATH, "\preprocessed")
-BATCH_SIZE = 100  # Change this to control batch size
+if __name__ == "__main__":
+    # Config
+    SAVE_DIR = os.path.join(BASE_PATH, "\preprocessed")
+    BATCH_SIZE = 100  # Change this to control batch size
 
-# Create output directories
-os.makedirs(os.path.join(SAVE_DIR, "eeg"), exist_ok=True)
-os.makedirs(os.path.join(SAVE_DIR, "spec"), exist_ok=True)
+    # Create output directories
+    os.makedirs(os.path.join(SAVE_DIR, "eeg"), exist_ok=True)
+    os.makedirs(os.path.join(SAVE_DIR, "spec"), exist_ok=True)
 
-# Input EEG directory
-eeg_dir = os.path.join(BASE_PATH, "train_eegs")
-eeg_files = sorted(f for f in os.listdir(eeg_dir) if f.endswith(".parquet"))
+    # Input EEG directory
+    eeg_dir = os.path.join(BASE_PATH, "train_eegs")
+    eeg_files = sorted(f for f in os.listdir(eeg_dir) if f.endswith(".parquet"))
 
-# Skip already processed files (resumable batches)
-already_processed = set(f.replace(".npy", "") for f in os.listdir(os.path.join(SAVE_DIR, "eeg")))
-eeg_files = [f for f in eeg_files if f.replace(".parquet", "") not in already_processed]
+    # Skip already processed files (resumable batches)
+    already_processed = set(f.replace(".npy", "") for f in os.listdir(os.path.join(SAVE_DIR, "eeg")))
+    eeg_files = [f for f in eeg_files if f.replace(".parquet", "") not in already_processed]
 
-# Tracking
-failed_files = []
-success_files = []
-partial_success_files = []
-for i in range(0, len(eeg_files), BATCH_SIZE):
-    batch = eeg_files[i:i + BATCH_SIZE]
-    print(f"\n🔄 Processing batch {i // BATCH_SIZE + 1} / {(len(eeg_files) - 1) // BATCH_SIZE + 1}")
+    # Tracking
+    failed_files = []
+    success_files = []
+    partial_success_files = []
+    for i in range(0, len(eeg_files), BATCH_SIZE):
+        batch = eeg_files[i:i + BATCH_SIZE]
+        print(f"\n🔄 Processing batch {i // BATCH_SIZE + 1} / {(len(eeg_files) - 1) // BATCH_SIZE + 1}")
 
-    for fname in tqdm(batch, desc="Processing EEGs"):
-        eeg_id = fname.replace(".parquet", "")
-        path = os.path.join(eeg_dir, fname)
+        for fname in tqdm(batch, desc="Processing EEGs"):
+            eeg_id = fname.replace(".parquet", "")
+            path = os.path.join(eeg_dir, fname)
 
-        try:
-            df = pl.read_parquet(path).fill_null(0)
-            eeg_success, spec_success = False, False
-
-            # EEG Processing
-            try:
-                eeg, mid, ekg = compute_eeg_chain(df)
-                eeg_processed = proc_eeg(eeg, mid, ekg)
-                np.save(os.path.join(SAVE_DIR, "eeg", f"{eeg_id}.npy"), eeg_processed)
-                eeg_success = True
-            except Exception as e:
-                print(f"[EEG FAIL] {eeg_id}: {e}")
-                failed_files.append((eeg_id, "eeg"))
             try:
-                spec = compute_spec_chain(df)
-                spec_processed = proc_kspec(spec)
-                np.save(os.path.join(SAVE_DIR, "spec", f"{eeg_id}.npy"), spec_processed)
-                spec_success = True
-            except Exception as e:
-                print(f"[SPEC FAIL] {eeg_id}: {e}")
-                failed_files.append((eeg_id, "spec"))
+                df = pl.read_parquet(path).fill_null(0)
+                eeg_success, spec_success = False, False
+
+                # EEG Processing
+                try:
+                    eeg, mid, ekg = compute_eeg_chain(df)
+                    eeg_processed = proc_eeg(eeg, mid, ekg)
+                    save_array(os.path.join(SAVE_DIR, "eeg", f"{eeg_id}.npy"), eeg_processed)
+                    eeg_success = True
+                except Exception as e:
+                    print(f"[EEG FAIL] {eeg_id}: {e}")
+                    failed_files.append((eeg_id, "eeg"))
+                try:
+                    spec = compute_spec_chain(df)
+                    spec_processed = proc_kspec(spec)
+                    save_array(os.path.join(SAVE_DIR, "spec", f"{eeg_id}.npy"), spec_processed)
+                    spec_success = True
+                except Exception as e:
+                    print(f"[SPEC FAIL] {eeg_id}: {e}")
+                    failed_files.append((eeg_id, "spec"))
 
-            # Logging result
-            if eeg_success and spec_success:
-                success_files.append(eeg_id)
-            elif eeg_success or spec_success:
-                partial_success_files.append(eeg_id)
+                # Logging result
+                if eeg_success and spec_success:
+                    success_files.append(eeg_id)
+                elif eeg_success or spec_success:
+                    partial_success_files.append(eeg_id)
 
-        except Exception as e:
-            print(f"[FILE FAIL] {eeg_id}: {e}")
-            failed_files.append((eeg_id, "file"))
+            except Exception as e:
+                print(f"[FILE FAIL] {eeg_id}: {e}")
+                failed_files.append((eeg_id, "file"))
 
-# Summary
-print(f"\n✅ Fully preprocessed files: {len(success_files)}")
-print(f"⚠  Partially preprocessed files: {len(partial_success_files)}")
-print(f"❌ Total failed files: {len(failed_files)}")
+    # Summary
+    print(f"\n✅ Fully preprocessed files: {len(success_files)}")
+    print(f"⚠  Partially preprocessed files: {len(partial_success_files)}")
+    print(f"❌ Total failed files: {len(failed_files)}")
 
-pd.DataFrame(success_files, columns=["eeg_id"]).to_csv(os.path.join(SAVE_DIR, "success.csv"), index=False)
-pd.DataFrame(partial_success_files, columns=["eeg_id"]).to_csv(os.path.join(SAVE_DIR, "partial_success.csv"), index=False)
-pd.DataFrame(failed_files, columns=["eeg_id", "fail_type"]).to_csv(os.path.join(SAVE_DIR, "failures.csv"), index=False)
\ No newline at end of file
+    pd.DataFrame(success_files, columns=["eeg_id"]).to_csv(os.path.join(SAVE_DIR, "success.csv"), index=False)
+    pd.DataFrame(partial_success_files, columns=["eeg_id"]).to_csv(os.path.join(SAVE_DIR, "partial_success.csv"), index=False)
+    pd.DataFrame(failed_files, columns=["eeg_id", "fail_type"]).to_csv(os.path.join(SAVE_DIR, "failures.csv"), index=False)
\ No newline at end of file
@@ -0,0 +1,199 @@
+import math
+
+import numpy as np
+import cv2
+
+SPEC_LOG_MIN = np.exp(-4)
+SPEC_LOG_MAX = np.exp(7)
+SPEC_RESIZE = (96, 224)  # height, width of the albumentations Resize in preprocessing.py
+
+
+class EEGPreprocessor:
+    """
+    Reusable, buffer-owning counterpart of ``proc_eeg``, ``safe_reshape_eeg``,
+    ``proc_kspec`` and ``proc_eeg_spec`` from preprocessing.py.
+
+    Results are bit-identical to the module functions, but every temporary
+    (NaN masks, MAD scratch, padded/concatenated output, resized image) lives
+    in a buffer that is allocated once and reused on later calls. Robust
+    statistics use in-place ``ndarray.partition`` on scratch copies instead of
+    ``np.median``, which copies its input on every call.
+
+    The arrays returned by each method are views into the preprocessor's own
+    buffers: they stay valid only until the next call of the same method, so
+    copy them if they need to outlive it. One instance per thread.
+    """
+
+    def __init__(self, target_shape=(19, 2500)):
+        self.target_shape = tuple(target_shape)
+        self._buffers = {}
+
+    def _buffer(self, name, shape, dtype):
+        """Return a view of shape ``shape`` on a grow-only flat buffer"""
+        dtype = np.dtype(dtype)
+        size = math.prod(shape)
+        buf = self._buffers.get(name)
+        if buf is None or buf.dtype != dtype or buf.size < size:
+            buf = np.empty(size, dtype=dtype)
+            self._buffers[name] = buf
+        return buf[:size].reshape(shape)
+
+    def _zero_nonfinite(self, x, fill=0):
+        """In-place equivalent of ``x[np.isnan(x) | np.isinf(x)] = fill``"""
+        mask = self._buffer("mask", x.shape, np.bool_)
+        np.isfinite(x, out=mask)
+        if not mask.all():
+            np.logical_not(mask, out=mask)
+            np.copyto(x, fill, where=mask)
+        return x
+
+    def _median_rows(self, scratch, out):
+        """
+        Median along the last axis of a 2-D ``scratch`` array into ``out``
+        (shape ``(rows, 1)``). ``scratch`` is reordered in place. Matches
+        ``np.median`` exactly: the mean of the two middle values is taken as
+        their sum divided by two, as ``np.mean`` does.
+        """
+        n = scratch.shape[-1]
+        half = n // 2
+        if n % 2:
+            scratch.partition(half, axis=-1)
+            np.copyto(out[:, 0], scratch[:, half])
+        else:
+            scratch.partition((half - 1, half), axis=-1)
+            np.add(scratch[:, half - 1], scratch[:, half], out=out[:, 0])
+            np.true_divide(out, 2, out=out)
+        return out
+
+    def _mad_rows(self, x, name):
+        """``MAD(x, axis=-1)`` for a 2-D array, shape ``(rows, 1)``"""
+        rows = x.shape[0]
+        scratch = self._buffer("scratch", x.shape, x.dtype)
+        median = self._buffer(f"{name}_median", (rows, 1), x.dtype)
+        mad = self._buffer(f"{name}_mad", (rows, 1), x.dtype)
+
+        np.copyto(scratch, x)
+        self._median_rows(scratch, median)
+        np.subtract(x, median, out=scratch)
+        np.abs(scratch, out=scratch)
+        self._median_rows(scratch, mad)
+        np.multiply(mad, 1.4826, out=mad)
+        return mad
+
+    def _check_target(self, length):
+        rows, target_length = self.target_shape
+        if length < target_length:
+            # safe_reshape_eeg pads the flat size difference onto the time
+            # axis, which can never reshape back for a full-height input.
+            padded = length + rows * (target_length - length)
+            raise ValueError(
+                f"cannot reshape array of size {rows * padded} into shape ({rows},{target_length})"
+            )
+
+    def proc_eeg(self, eeg, mid, ekg):
+        """
+        Same as ``proc_eeg``: ``eeg`` (4, 4, T), ``mid`` (2, T) and ``ekg`` (1, T)
+        are cleaned and centered in place, then scaled into the (19, 2500) output.
+        """
+        self._zero_nonfinite(eeg)
+        self._zero_nonfinite(mid)
+        self._zero_nonfinite(ekg)
+
+        eeg_rows = eeg.reshape(-1, eeg.shape[-1])
+        length = eeg_rows.shape[-1]
+        self._check_target(length)
+
+        eeg_mean = self._buffer("eeg_mean", (eeg_rows.shape[0], 1), eeg.dtype)
+        mid_mean = self._buffer("mid_mean", (mid.shape[0], 1), mid.dtype)
+        np.mean(eeg_rows, axis=-1, keepdims=True, out=eeg_mean)
+        np.mean(mid, axis=-1, keepdims=True, out=mid_mean)
+        np.subtract(eeg_rows, eeg_mean, out=eeg_rows)
+        np.subtract(mid, mid_mean, out=mid)
+
+        # np.median over the per-row MADs
+        eeg_mad = self._mad_rows(eeg_rows, "eeg")
+        mad_row = self._buffer("mad_row", (1, eeg_mad.shape[0]), eeg_mad.dtype)
+        np.copyto(mad_row[0], eeg_mad[:, 0])
+        std = self._median_rows(mad_row, self._buffer("std", (1, 1), eeg_mad.dtype))[0, 0] + 1e-5
+        ekg_scale = self._mad_rows(ekg, "ekg").mean() + 1e-5
+
+        rows, target_length = self.target_shape
+        out_dtype = np.result_type(eeg_rows, mid, ekg)
+        out = self._buffer("eeg_out", self.target_shape, out_dtype)
+        n_eeg, n_mid = eeg_rows.shape[0], mid.shape[0]
+        chains = out[:n_eeg]
+        mids = out[n_eeg:n_eeg + n_mid]
+
+        np.true_divide(eeg_rows[:, :target_length], std, out=chains)
+        np.clip(chains, -10, 10, out=chains)
+        np.true_divide(mid[:, :target_length], std, out=mids)
+        np.clip(mids, -10, 10, out=mids)
+        np.true_divide(ekg[:, :target_length], ekg_scale, out=out[n_eeg + n_mid:])
+        return out
+
+    def safe_reshape_eeg(self, eeg, target_shape=None):
+        """Same as ``safe_reshape_eeg``, written into a reused output buffer"""
+        target_shape = tuple(target_shape or self.target_shape)
+        expected_size = target_shape[0] * target_shape[1]
+        current_size = eeg.shape[0] * eeg.shape[1]
+
+        if current_size > expected_size:
+            eeg = eeg[:, :expected_size // eeg.shape[0]]
+        elif current_size < expected_size:
+            length = eeg.shape[1]
+            padded = length + expected_size - current_size
+            if eeg.shape[0] * padded != expected_size:
+                raise ValueError(
+                    f"cannot reshape array of size {eeg.shape[0] * padded} into shape ({target_shape[0]},{target_shape[1]})"
+                )
+            out = self._buffer("reshape_out", (eeg.shape[0], padded), eeg.dtype)
+            out[:, :length] = eeg
+            # np.pad(mode="reflect") mirrors around the edge without repeating it
+            period = 2 * (length - 1)
+            idx = np.arange(length, padded) % period if period else np.zeros(padded - length, dtype=np.intp)
+            idx = np.where(idx >= length, period - idx, idx)
+            np.take(eeg, idx, axis=1, out=out[:, length:])
+            return out.reshape(target_shape)
+
+        out = self._buffer("reshape_out", eeg.shape, eeg.dtype)
+        np.copyto(out, eeg)
+        return out.reshape(target_shape)
+
+    def proc_kspec(self, x):
+        """Same as ``proc_kspec``; non-finite values in ``x[:, 2:98]`` are zeroed in place"""
+        x = self._zero_nonfinite(x[:, 2:98])
+
+        work_dtype = np.result_type(x, SPEC_LOG_MIN)
+        work = self._buffer("kspec_work", x.shape, work_dtype)
+        dev = self._buffer("kspec_dev", x.shape, work_dtype)
+        mean = self._buffer("kspec_mean", (x.shape[0], 1), work_dtype)
+        std = self._buffer("kspec_std", (x.shape[0], 1), work_dtype)
+
+        np.clip(x, SPEC_LOG_MIN, SPEC_LOG_MAX, out=work)
+        np.log(work, out=work)
+
+        # (x - mean) / (std + 1e-5), with std evaluated the way np.std does
+        n = work.shape[1]
+        np.add.reduce(work, axis=1, keepdims=True, out=mean)
+        np.true_divide(mean, n, out=mean)
+        np.subtract(work, mean, out=work)
+        np.multiply(work, work, out=dev)
+        np.add.reduce(dev, axis=1, keepdims=True, out=std)
+        np.true_divide(std, n, out=std)
+        np.sqrt(std, out=std)
+        np.add(std, 1e-5, out=std)
+        np.true_divide(work, std, out=work)
+
+        height, width = SPEC_RESIZE
+        out = self._buffer("kspec_out", (height, width), work_dtype)
+        cv2.resize(work, (width, height), dst=out, interpolation=cv2.INTER_CUBIC)
+        return out.reshape(4, 48, 112)
+
+    def proc_eeg_spec(self, x):
+        """Same as ``proc_eeg_spec``; ``x`` is left untouched"""
+        x = x[:, :, 2:-2]
+        out = self._buffer("eeg_spec_out", x.shape, x.dtype)
+        np.add(x, 1, out=out)
+        # NaN/Inf stay non-finite after the shift; the original zeroes them first
+        self._zero_nonfinite(out, fill=1)
+        return out.reshape(4, 96, 224)
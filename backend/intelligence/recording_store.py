@@ -0,0 +1,375 @@
+"""
+Append-only on-disk recordings of live EEG streams.
+
+Layout of a patient directory under the store root:
+    seg-<first seq>.f32   (n, 19) little-endian float32, sample-major
+    index.log             append-only "seq,n,segment,offset,time" lines
+
+RecordingWriter.append copies a chunk into the patient's pending list and
+returns: socket handlers never touch the disk. A background thread writes the
+pending chunks every ``flush_interval``, coalescing consecutive ones into one
+write on the patient's open segment. Every ``fsync_interval`` it fsyncs all the
+segments written since the last sync, and only then appends their index lines
+(and fsyncs the index). The index therefore never points at samples that are
+not durable, at the cost of recordings becoming readable up to one sync after
+they arrive; the live ring buffers cover that span. A segment holds at most
+``segment_samples`` samples, then the writer rotates to a new one.
+
+Each index line is a run of consecutive samples: seq..seq+n-1 stored in
+``segment`` from sample ``offset``, the first received at ``time`` (epoch
+seconds, later samples following at the sample rate). A jump in seq between
+runs is a gap in the stream. Samples written past the last index line (a
+crash between write and sync) are truncated when the writer reopens the
+patient.
+
+RecordingReader memory-maps the segments and reads any seq or time range. A
+range inside one run is a (19, n) view of the map; others are assembled with
+NaN in the gaps.
+
+Export a range for the preprocessing pipeline, from backend/:
+    python -m intelligence.recording_store --root DIR --patient ID [--start EPOCH] [--end EPOCH] --out FILE
+(.parquet: the channel columns preprocessing.py reads; .npy: (19, n) float32)
+"""
+import os
+import argparse
+import atexit
+import bisect
+import logging
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from hms_backend.metrics import RECORDING_SAMPLES
+
+logger = logging.getLogger(__name__)
+
+N_CHANNELS = 19
+SAMPLE_DTYPE = np.dtype("<f4")
+CHANNELS = ["Fp1", "Fp2", "Fz", "Cz", "Pz", "F3", "F4", "F7", "F8", "C3", "C4", "P3", "P4", "T3", "T4", "T5", "T6", "O1", "O2"]
+
+_WRITTEN = RECORDING_SAMPLES.labels("written")
+_DROPPED = RECORDING_SAMPLES.labels("dropped")
+
+
+class Run(NamedTuple):
+    seq: int
+    n: int
+    segment: str
+    offset: int
+    time: float
+
+
+def check_patient_id(patient_id: str) -> str:
+    """``patient_id``, if it is one plain path component; ValueError otherwise"""
+    if patient_id in ("", ".", "..") or os.path.basename(patient_id) != patient_id or "\0" in patient_id:
+        raise ValueError(f"Invalid patient id {patient_id!r}")
+    return patient_id
+
+
+def patient_directory(root: str, patient_id: str) -> str:
+    """The patient's directory under ``root``; ValueError unless the id is one plain path component"""
+    return os.path.join(root, check_patient_id(patient_id))
+
+
+def segment_name(first_seq: int) -> str:
+    return f"seg-{first_seq:012d}.f32"
+
+
+def read_index(path: str, offset: int = 0) -> Tuple[List[Run], int]:
+    """Runs in the index lines from byte ``offset`` on, and the offset after the last complete line"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read()
+    except OSError:
+        return [], offset
+    end = chunk.rfind(b"\n") + 1
+    runs = []
+    for line in chunk[:end].decode().splitlines():
+        seq, n, segment, start, stamp = line.split(",")
+        runs.append(Run(int(seq), int(n), segment, int(start), float(stamp)))
+    return runs, offset + end
+
+
+class _Patient:
+    """Writer state of one patient's recording"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.log")
+        self.file = None
+        self.segment = None
+        self.segment_samples = 0  # samples in the open segment
+        self.next_seq = None  # seq that would continue the last run
+        self.unsynced: List[Run] = []  # written, not yet fsynced and indexed
+        self.dirty = False
+
+    def recover(self):
+        """Reopen after a restart: continue the last indexed segment, dropping unindexed samples"""
+        os.makedirs(self.directory, exist_ok=True)
+        runs, _ = read_index(self.index_path)
+        indexed = {run.segment for run in runs}
+        for name in os.listdir(self.directory):
+            if name.startswith("seg-") and name not in indexed:
+                os.unlink(os.path.join(self.directory, name))
+        if runs:
+            last = runs[-1]
+            self.segment = last.segment
+            self.segment_samples = last.offset + last.n
+            self.next_seq = last.seq + last.n
+            self.file = open(os.path.join(self.directory, last.segment), "r+b")
+            self.file.truncate(self.segment_samples * N_CHANNELS * SAMPLE_DTYPE.itemsize)
+            self.file.seek(0, os.SEEK_END)
+
+
+class RecordingWriter:
+    def __init__(self, root: str, sample_rate: int = 200, segment_samples: int = 200 * 600,
+                 flush_interval: float = 0.5, fsync_interval: float = 2.0, max_pending_bytes: int = 256 * 2 ** 20):
+        self.root = root
+        self.sample_rate = sample_rate
+        self.segment_samples = segment_samples
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_pending_bytes = max_pending_bytes
+        self.fsyncs = 0
+        self._pending: Dict[str, List[Tuple[int, np.ndarray, float]]] = {}
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()  # flush/sync: the background thread, or close()
+        self._patients: Dict[str, _Patient] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_sync = time.monotonic()
+
+    def append(self, patient_id: str, seq: int, samples: np.ndarray, timestamp: Optional[float] = None) -> bool:
+        """
+        Queue (19, n) ``samples`` starting at ``seq`` for the patient's recording;
+        False (and the chunk dropped) if the writer is too far behind.
+        ValueError if ``patient_id`` cannot name a directory under the root.
+        """
+        patient_directory(self.root, patient_id)
+        samples = np.array(samples, dtype=SAMPLE_DTYPE)  # the caller's buffer will be reused
+        with self._lock:
+            if self._pending_bytes + samples.nbytes > self.max_pending_bytes:
+                _DROPPED.inc(samples.shape[1])
+                return False
+            self._pending.setdefault(patient_id, []).append(
+                (seq, samples, time.time() if timestamp is None else timestamp))
+            self._pending_bytes += samples.nbytes
+        if self._thread is None:
+            self.start()
+        return True
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="recording-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self.sync()
+            except Exception as e:
+                logger.error(f"Recording writer error: {e}")
+
+    def flush(self):
+        """Write all pending chunks to their segments (page cache; see sync)"""
+        with self._lock:
+            pending, self._pending, self._pending_bytes = self._pending, {}, 0
+        with self._io_lock:
+            for patient_id, chunks in pending.items():
+                patient = self._patient(patient_id)
+                for seq, samples, stamp in chunks:
+                    self._write(patient, seq, samples, stamp)
+                if patient.file is not None:
+                    patient.file.flush()
+
+    def _patient(self, patient_id: str) -> _Patient:
+        patient = self._patients.get(patient_id)
+        if patient is None:
+            patient = self._patients[patient_id] = _Patient(patient_directory(self.root, patient_id))
+            patient.recover()
+        return patient
+
+    def _write(self, patient: _Patient, seq: int, samples: np.ndarray, stamp: float):
+        if patient.next_seq is not None and seq < patient.next_seq:
+            samples = samples[:, patient.next_seq - seq:]  # already recorded
+            stamp += (patient.next_seq - seq) / self.sample_rate
+            seq = patient.next_seq
+        while samples.shape[1]:
+            if patient.file is None or patient.segment_samples == self.segment_samples:
+                self._rotate(patient, seq)
+            n = min(samples.shape[1], self.segment_samples - patient.segment_samples)
+            patient.file.write(np.ascontiguousarray(samples[:, :n].T).data)
+            last = patient.unsynced[-1] if patient.unsynced else None
+            if last is not None and seq == patient.next_seq and last.segment == patient.segment:
+                patient.unsynced[-1] = last._replace(n=last.n + n)
+            else:
+                patient.unsynced.append(Run(seq, n, patient.segment, patient.segment_samples, stamp))
+            patient.segment_samples += n
+            patient.next_seq = seq + n
+            patient.dirty = True
+            _WRITTEN.inc(n)
+            samples, seq, stamp = samples[:, n:], seq + n, stamp + n / self.sample_rate
+
+    def _rotate(self, patient: _Patient, seq: int):
+        if patient.file is not None:
+            self._sync_patient(patient)
+            patient.file.close()
+        patient.segment = segment_name(seq)
+        patient.file = open(os.path.join(patient.directory, patient.segment), "ab")
+        patient.segment_samples = 0
+
+    def _sync_patient(self, patient: _Patient):
+        if patient.dirty:
+            patient.file.flush()
+            os.fsync(patient.file.fileno())
+            self.fsyncs += 1
+            patient.dirty = False
+        if patient.unsynced:
+            lines = "".join(f"{r.seq},{r.n},{r.segment},{r.offset},{r.time:.6f}\n" for r in patient.unsynced)
+            with open(patient.index_path, "a") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self.fsyncs += 1
+            patient.unsynced = []
+
+    def sync(self):
+        """fsync every segment written since the last sync, then index what it holds"""
+        with self._io_lock:
+            for patient in self._patients.values():
+                self._sync_patient(patient)
+            self._last_sync = time.monotonic()
+
+    def close(self):
+        """Stop the background thread and make everything appended so far durable and indexed"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+        self.sync()
+        with self._io_lock:
+            for patient in self._patients.values():
+                if patient.file is not None:
+                    patient.file.close()
+                    patient.file = None
+            self._patients.clear()
+
+
+class RecordingReader:
+    """Reads a patient's recording by seq or time range; see the module docstring"""
+
+    def __init__(self, root: str, patient_id: str, sample_rate: int = 200):
+        self.directory = patient_directory(root, patient_id)
+        self.index_path = os.path.join(self.directory, "index.log")
+        self.sample_rate = sample_rate
+        self.runs: List[Run] = []
+        self._starts: List[int] = []
+        self._index_offset = 0
+        self._maps: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _sync_index(self):
+        runs, self._index_offset = read_index(self.index_path, self._index_offset)
+        for run in runs:
+            last = self.runs[-1] if self.runs else None
+            if last is not None and run.seq == last.seq + last.n and run.segment == last.segment \
+                    and run.offset == last.offset + last.n:
+                self.runs[-1] = last._replace(n=last.n + run.n)  # contiguous: one run
+            else:
+                self.runs.append(run)
+                self._starts.append(run.seq)
+
+    def _segment(self, name: str, samples: int) -> np.ndarray:
+        mapped = self._maps.get(name)
+        if mapped is None or mapped.shape[0] < samples:
+            path = os.path.join(self.directory, name)
+            rows = os.path.getsize(path) // (N_CHANNELS * SAMPLE_DTYPE.itemsize)
+            mapped = self._maps[name] = np.memmap(path, dtype=SAMPLE_DTYPE, mode="r", shape=(rows, N_CHANNELS))
+        return mapped
+
+    def extent(self) -> Tuple[int, int]:
+        """(first seq, one past the last seq) recorded; (0, 0) if nothing is"""
+        with self._lock:
+            self._sync_index()
+            if not self.runs:
+                return 0, 0
+            return self.runs[0].seq, self.runs[-1].seq + self.runs[-1].n
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """(19, stop - start) float32 samples; a read-only view when the range is one stored run"""
+        if stop < start:
+            raise ValueError("stop before start")
+        with self._lock:
+            self._sync_index()
+            i = max(bisect.bisect_right(self._starts, start) - 1, 0)
+            if i < len(self.runs):
+                run = self.runs[i]
+                if run.seq <= start and stop <= run.seq + run.n:
+                    offset = run.offset + start - run.seq
+                    return self._segment(run.segment, offset + stop - start)[offset:offset + stop - start].T
+            out = np.full((N_CHANNELS, stop - start), np.nan, dtype=SAMPLE_DTYPE)
+            for run in self.runs[i:]:
+                if run.seq >= stop:
+                    break
+                lo, hi = max(start, run.seq), min(stop, run.seq + run.n)
+                if lo < hi:
+                    offset = run.offset + lo - run.seq
+                    out[:, lo - start:hi - start] = self._segment(run.segment, offset + hi - lo)[offset:offset + hi - lo].T
+            return out
+
+    def seq_at(self, timestamp: float) -> int:
+        """Seq of the sample recorded at ``timestamp`` (epoch seconds), clamped to the recording"""
+        with self._lock:
+            self._sync_index()
+            if not self.runs:
+                return 0
+            i = bisect.bisect_right([run.time for run in self.runs], timestamp) - 1
+            if i < 0:
+                return self.runs[0].seq
+            run = self.runs[i]
+            return run.seq + min(max(int((timestamp - run.time) * self.sample_rate), 0), run.n)
+
+    def read_time(self, start: float, end: float) -> Tuple[np.ndarray, int]:
+        """Samples recorded from ``start`` to ``end`` (epoch seconds) and the seq of the first"""
+        first = self.seq_at(start)
+        return self.read(first, max(self.seq_at(end), first)), first
+
+    def read_frame(self, start: int, stop: int):
+        """
+        Samples as a polars DataFrame with the columns preprocessing.py reads.
+        Gateways send no EKG, so EKG is zero, as preprocessing fills nulls;
+        gaps (NaN) are zero for the same reason.
+        """
+        import polars as pl
+        samples = np.nan_to_num(self.read(start, stop))
+        return pl.DataFrame({**{name: samples[i] for i, name in enumerate(CHANNELS)},
+                             "EKG": np.zeros(samples.shape[1], dtype=SAMPLE_DTYPE)})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export a range of a live EEG recording")
+    parser.add_argument("--root", required=True)
+    parser.add_argument("--patient", required=True)
+    parser.add_argument("--start", type=float, default=None, help="epoch seconds (default: start of recording)")
+    parser.add_argument("--end", type=float, default=None, help="epoch seconds (default: end of recording)")
+    parser.add_argument("--out", required=True, help=".parquet or .npy")
+    args = parser.parse_args()
+
+    reader = RecordingReader(args.root, args.patient)
+    first, last = reader.extent()
+    start = first if args.start is None else reader.seq_at(args.start)
+    stop = last if args.end is None else reader.seq_at(args.end)
+    if args.out.endswith(".parquet"):
+        reader.read_frame(start, stop).write_parquet(args.out)
+    else:
+        np.save(args.out, np.ascontiguousarray(reader.read(start, stop)))
+    logger.info(f"Exported samples {start}..{stop} of patient {args.patient} to {args.out}")
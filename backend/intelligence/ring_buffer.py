@@ -0,0 +1,108 @@
+"""
+Fixed-size ring buffer for live multichannel EEG.
+
+EEGRingBuffer preallocates a (channels, 2 * capacity) float32 array once and
+writes every sample twice, at column p and p + capacity. The newest n samples
+(n <= capacity) are then always one contiguous column range, so readers get a
+(channels, n) view of the buffer, never a copy, and writing never reallocates.
+
+Samples are addressed by an absolute sequence number counted from the start
+of the stream. A write that starts past the newest sample leaves a gap, filled
+with NaN (which the spectrogram and XGBoost code treat as missing). A write that
+starts before it only contributes the samples that are new.
+
+A view aliases memory the writer keeps overwriting. ``read`` therefore runs
+the caller's function on the view and then checks that no sample in the window
+was overwritten meanwhile; if one was, it retries on the newer window.
+"""
+import threading
+from typing import Callable, Tuple, TypeVar
+
+import numpy as np
+
+T = TypeVar("T")
+
+
+class WindowOverwritten(RuntimeError):
+    """The writer overtook a reader on every attempt"""
+
+
+class EEGRingBuffer:
+    def __init__(self, capacity: int, channels: int = 19):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.channels = channels
+        self._data = np.full((channels, 2 * capacity), np.nan, dtype=np.float32)
+        self.start_seq = None  # sequence number of the first sample received
+        self.end_seq = 0  # one past the newest complete sample
+        self._reserved = 0  # one past the newest sample being written; >= end_seq
+        self._write_lock = threading.Lock()
+        self.gap_samples = 0
+        self.duplicate_samples = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    @property
+    def available(self) -> int:
+        """Number of samples a window can currently cover"""
+        return 0 if self.start_seq is None else min(self.end_seq - self.start_seq, self.capacity)
+
+    def write(self, seq: int, samples: np.ndarray) -> int:
+        """Store (channels, n) ``samples`` starting at sequence number ``seq``; returns the new samples stored"""
+        if samples.ndim != 2 or samples.shape[0] != self.channels:
+            raise ValueError(f"Expected ({self.channels}, n) samples, got {samples.shape}")
+        with self._write_lock:
+            if self.start_seq is None:
+                self.start_seq = self.end_seq = self._reserved = seq
+            n = samples.shape[1]
+            if seq + n <= self.end_seq:
+                self.duplicate_samples += n
+                return 0
+            if seq < self.end_seq:
+                self.duplicate_samples += self.end_seq - seq
+                samples = samples[:, self.end_seq - seq:]
+                seq = self.end_seq
+            gap = seq - self.end_seq
+            if gap:
+                self.gap_samples += gap
+                self._put(np.broadcast_to(np.float32(np.nan), (self.channels, min(gap, self.capacity))),
+                          gap)
+            self._put(samples, samples.shape[1])
+            return samples.shape[1]
+
+    def _put(self, samples: np.ndarray, n: int):
+        """Append ``n`` samples, of which ``samples`` holds the last (all of them unless n > capacity)"""
+        samples = samples[:, -self.capacity:]
+        end = self.end_seq + n
+        self._reserved = end  # before any column is touched, so readers can tell
+        pos = (end - samples.shape[1]) % self.capacity
+        first = min(samples.shape[1], self.capacity - pos)
+        for offset in (0, self.capacity):
+            self._data[:, offset + pos:offset + pos + first] = samples[:, :first]
+            self._data[:, offset:offset + samples.shape[1] - first] = samples[:, first:]
+        self.end_seq = end
+
+    def _window(self, end: int, n: int) -> np.ndarray:
+        stop = end % self.capacity + self.capacity
+        view = self._data[:, stop - n:stop]
+        view.flags.writeable = False
+        return view
+
+    def read(self, n: int, fn: Callable[[np.ndarray], T], retries: int = 3) -> Tuple[T, int]:
+        """
+        ``(fn(window), end_seq)`` for a read-only view of the newest ``n``
+        samples (fewer if the buffer holds fewer) ending before ``end_seq``.
+        The view is only valid during ``fn``.
+        """
+        for _ in range(retries):
+            end = self.end_seq
+            n_read = min(n, self.available)
+            if not n_read:
+                raise LookupError("No samples buffered yet")
+            result = fn(self._window(end, n_read))
+            if self._reserved - self.capacity <= end - n_read:
+                return result, end
+        raise WindowOverwritten(f"Window of {n} samples overwritten {retries} times while reading")
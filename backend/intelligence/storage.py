@@ -0,0 +1,85 @@
+"""
+Loading and saving of stored EEG / spectrogram arrays.
+
+Everything on disk and in memory is float32: that is all the precision the
+signals carry, it halves I/O and memory against float64, and it keeps NumPy,
+SciPy and XGBoost on their single-precision kernels. Code that needs more
+precision (long sums, IIR filters) upcasts locally and casts back.
+
+EEG recordings may also be stored with the int16 chunked codec of
+``intelligence.eeg_codec`` under the same file names; the loaders here tell
+the formats apart by their first bytes and decode transparently.
+"""
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import numpy as np
+
+from intelligence import eeg_codec
+
+STORAGE_DTYPE = np.float32
+
+
+def as_float32(array) -> np.ndarray:
+    """View ``array`` as float32, copying only when the dtype differs"""
+    return np.asarray(array, dtype=STORAGE_DTYPE)
+
+
+def load_array(path: str, mmap: bool = False) -> np.ndarray:
+    """
+    Load a stored array as float32. With ``mmap`` a float32 .npy stays
+    memory-mapped; other dtypes and encoded files are decoded into memory.
+    """
+    with open(path, "rb") as f:
+        compressed = f.read(len(eeg_codec.MAGIC)) == eeg_codec.MAGIC
+        if not compressed and not mmap:
+            f.seek(0)
+            array = np.load(f)
+    if compressed:
+        return eeg_codec.CompressedArray(path).read()
+    if mmap:
+        array = np.load(path, mmap_mode="r")
+    if array.dtype != STORAGE_DTYPE:
+        array = array.astype(STORAGE_DTYPE)
+    return array
+
+
+def array_shape(path: str) -> Tuple[int, ...]:
+    """Shape of a stored array, read from its header without loading the data"""
+    if eeg_codec.is_compressed(path):
+        return eeg_codec.CompressedArray(path).shape
+    return np.load(path, mmap_mode="r").shape
+
+
+def load_range(path: str, start: int, stop: Optional[int] = None) -> np.ndarray:
+    """
+    Samples [start, stop) of a stored (channels, samples) recording as float32.
+    Reads only the pages (.npy, memory-mapped) or chunks (encoded) that overlap.
+    """
+    if eeg_codec.is_compressed(path):
+        return eeg_codec.CompressedArray(path).read(start, stop)
+    return np.array(np.load(path, mmap_mode="r")[:, start:stop], dtype=STORAGE_DTYPE)
+
+
+def save_array(path: str, array: np.ndarray, compress: bool = False, **codec_options):
+    """
+    Save ``array`` as float32, creating the parent directory if needed. The
+    file is replaced atomically, so concurrent readers never see a partial
+    array. With ``compress`` a (channels, samples) recording is written with
+    the int16 chunked codec instead; ``codec_options`` go to
+    ``eeg_codec.save_compressed``.
+    """
+    if compress:
+        eeg_codec.save_compressed(path, array, **codec_options)
+        return
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, as_float32(array))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise